@@ -144,6 +144,8 @@ before_uninstall = "lending.install.before_uninstall"
 doc_events = {
 	"Company": {
 		"validate": "lending.overrides.company.validate_loan_tables",
+		"on_update": "lending.loan_management.lending_config.clear_lending_config",
+		"on_trash": "lending.loan_management.lending_config.clear_lending_config",
 	},
 	"Sales Invoice": {
 		"on_submit": [
@@ -181,6 +183,7 @@ repost_allowed_doctypes = [
 scheduler_events = {
 	"daily_long": [
 		"lending.loan_management.doctype.process_loan_interest_accrual.process_loan_interest_accrual.schedule_accrual",
+		"lending.loan_management.doctype.loan_interest_accrual.utils.post_summarized_accrual_entries",
 		"lending.loan_management.doctype.process_loan_demand.process_loan_demand.process_daily_loan_demands",
 		"lending.loan_management.doctype.process_loan_security_shortfall.process_loan_security_shortfall.create_process_loan_security_shortfall",
 		"lending.loan_management.doctype.process_loan_classification.process_loan_classification.create_process_loan_classification",
@@ -84,10 +84,40 @@ LOAN_CUSTOM_FIELDS = {
 			"options": "Daily\nWeekly\nMonthly",
 			"insert_after": "min_days_bw_disbursement_first_repayment",
 		},
+		{
+			"fieldname": "enable_bulk_interest_accrual",
+			"label": "Enable Bulk Interest Accrual",
+			"fieldtype": "Check",
+			"insert_after": "loan_accrual_frequency",
+		},
+		{
+			"fieldname": "aggregate_penal_interest_entries",
+			"label": "Aggregate Penal Interest Entries",
+			"fieldtype": "Check",
+			"insert_after": "enable_bulk_interest_accrual",
+		},
+		{
+			"fieldname": "defer_repayment_follow_ups",
+			"label": "Defer Repayment Follow Ups",
+			"fieldtype": "Check",
+			"insert_after": "aggregate_penal_interest_entries",
+		},
+		{
+			"fieldname": "enable_bulk_demand_generation",
+			"label": "Enable Bulk Demand Generation",
+			"fieldtype": "Check",
+			"insert_after": "defer_repayment_follow_ups",
+		},
+		{
+			"fieldname": "summarize_accrual_gl_entries",
+			"label": "Summarize Accrual GL Entries",
+			"fieldtype": "Check",
+			"insert_after": "enable_bulk_demand_generation",
+		},
 		{
 			"fieldname": "loan_column_break",
 			"fieldtype": "Column Break",
-			"insert_after": "loan_accrual_frequency",
+			"insert_after": "summarize_accrual_gl_entries",
 		},
 		{
 			"fieldname": "enable_loan_accounting",
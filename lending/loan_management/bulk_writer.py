@@ -0,0 +1,450 @@
+import frappe
+from frappe import _
+from frappe.model.naming import parse_naming_series, set_new_name
+from frappe.query_builder import DocType
+from frappe.utils import cint, flt, getdate, now_datetime
+
+from erpnext.accounts.general_ledger import process_gl_map
+
+from lending.loan_management.lending_config import get_currency_precision
+
+SERIES_PLACEHOLDER = "\0"
+
+
+class BulkDocumentWriter:
+	"""Writes submitted documents of one doctype, along with their child rows and GL entries,
+	with multi-row inserts.
+
+	Payloads are validated as a set, named from blocks reserved on the naming series and
+	inserted chunk by chunk, each chunk in its own transaction. Document hooks are not run,
+	so the values a document sets in `validate` and through `fetch_from` must already be
+	in the payloads. Doctype specific checks go in `validate`, GL entries come from
+	`get_gl_map` and side effects of `on_submit` go in `after_insert`, all of which are
+	called with a list of documents.
+	"""
+
+	def __init__(
+		self,
+		doctype,
+		validate=None,
+		get_gl_map=None,
+		after_insert=None,
+		chunk_size=500,
+		commit=False,
+		merge_gl_entries=False,
+	):
+		self.doctype = doctype
+		self.meta = frappe.get_meta(doctype)
+		self.validate_set = validate
+		self.get_gl_map = get_gl_map
+		self.after_insert = after_insert
+		self.chunk_size = chunk_size
+		self.commit = commit
+		self.merge_gl_entries = merge_gl_entries
+
+		self.written = []
+		self.failed = []
+
+	def write(self, payloads, raise_exception=True):
+		"""Insert the payloads as submitted documents and return the documents written.
+
+		If `raise_exception` is not set, a chunk that fails is rolled back and logged, its
+		documents are kept in `failed` and the remaining chunks are still written.
+		"""
+		docs = [self.get_doc(payload) for payload in payloads]
+
+		if not docs:
+			return []
+
+		self.validate(docs)
+
+		for chunk in get_chunks(docs, self.chunk_size):
+			savepoint = None if self.commit else "bulk_writer_" + frappe.generate_hash(length=8)
+
+			try:
+				if savepoint:
+					frappe.db.savepoint(savepoint)
+
+				self.insert_chunk(chunk)
+
+				if self.commit:
+					frappe.db.commit()
+			except Exception:
+				if savepoint:
+					frappe.db.rollback(save_point=savepoint)
+				else:
+					frappe.db.rollback()
+
+				if raise_exception:
+					raise
+
+				frappe.log_error(title=f"Bulk {self.doctype} Error", message=frappe.get_traceback())
+				self.failed.extend(chunk)
+				continue
+
+			self.written.extend(chunk)
+
+		return self.written
+
+	def get_doc(self, payload):
+		if isinstance(payload, dict):
+			payload = dict(payload)
+			payload["doctype"] = self.doctype
+
+		return frappe.get_doc(payload)
+
+	def validate(self, docs):
+		self.validate_mandatory(docs)
+		self.validate_links(docs)
+
+		if self.validate_set:
+			self.validate_set(docs)
+
+	def validate_mandatory(self, docs):
+		for doc in docs:
+			missing = doc._get_missing_mandatory_fields()
+			if missing:
+				frappe.throw(
+					"\n".join(msg for _fieldname, msg in missing),
+					frappe.MandatoryError,
+					title=_("Missing Values Required"),
+				)
+
+	def validate_links(self, docs):
+		"""Check that linked documents exist, with one query per linked doctype."""
+		link_values = {}
+
+		for df in self.meta.get_link_fields():
+			if not df.options:
+				continue
+
+			values = {doc.get(df.fieldname) for doc in docs if doc.get(df.fieldname)}
+			if values:
+				link_values.setdefault(df.options, set()).update(values)
+
+		for doctype, values in link_values.items():
+			existing = set(
+				frappe.get_all(doctype, filters={"name": ("in", list(values))}, pluck="name")
+			)
+			missing = values - existing
+
+			if missing:
+				frappe.throw(
+					_("Could not find {0}: {1}").format(_(doctype), ", ".join(sorted(missing))),
+					frappe.LinkValidationError,
+				)
+
+	def insert_chunk(self, docs):
+		timestamp = now_datetime()
+
+		set_names_in_bulk(docs)
+
+		children = {}
+		for doc in docs:
+			set_submitted_values(doc, timestamp)
+
+			for df in self.meta.get_table_fields():
+				for idx, child in enumerate(doc.get(df.fieldname), start=1):
+					child.parent = doc.name
+					child.parenttype = doc.doctype
+					child.parentfield = df.fieldname
+					child.idx = idx
+					set_new_name(child)
+					set_submitted_values(child, timestamp)
+					children.setdefault(child.doctype, []).append(child)
+
+		insert_docs_in_bulk(docs)
+
+		for child_docs in children.values():
+			insert_docs_in_bulk(child_docs)
+
+		if self.get_gl_map:
+			self.make_gl_entries(docs, timestamp)
+
+		if self.after_insert:
+			self.after_insert(docs)
+
+	def make_gl_entries(self, docs, timestamp):
+		"""Make the GL entries of the documents with the same checks and payment ledger
+		entries as `make_gl_entries` of erpnext, run once for the whole set."""
+		from erpnext.accounts.general_ledger import (
+			check_freezing_date,
+			validate_accounting_period,
+			validate_disabled_accounts,
+		)
+		from erpnext.accounts.utils import create_payment_ledger_entry
+
+		gl_entries = []
+
+		for doc in docs:
+			gl_map = self.get_gl_map(doc)
+			if gl_map:
+				gl_map = process_gl_map(gl_map, merge_entries=self.merge_gl_entries)
+				validate_gl_map_balance(doc, gl_map)
+				gl_entries.extend(gl_map)
+
+		if not gl_entries:
+			return
+
+		# The accounting period is looked up from the first entry of a map, so one entry per
+		# company, date and voucher type covers the set
+		period_entries = {}
+		for entry in gl_entries:
+			period_entries.setdefault((entry.company, entry.posting_date, entry.voucher_type), entry)
+
+		for entry in period_entries.values():
+			validate_accounting_period([entry])
+
+		validate_disabled_accounts(gl_entries)
+		check_freezing_date(min(getdate(entry.posting_date) for entry in gl_entries))
+
+		gl_entry_docs = []
+		for gl_entry in gl_entries:
+			gl_entry_doc = frappe.new_doc("GL Entry")
+			gl_entry_doc.update(gl_entry)
+			gl_entry_doc.flags.ignore_permissions = 1
+			gl_entry_doc.validate()
+			set_new_name(gl_entry_doc)
+			set_submitted_values(gl_entry_doc, timestamp)
+			gl_entry_docs.append(gl_entry_doc)
+
+		create_payment_ledger_entry(gl_entry_docs)
+		insert_docs_in_bulk(gl_entry_docs)
+
+
+def set_names_in_bulk(docs):
+	"""Name the documents, reserving one block of numbers per naming series prefix
+	instead of updating the series counter once per document.
+	"""
+	series_wise_docs = {}
+	naming_rule_exists = has_naming_rule(docs[0].doctype) if docs else False
+
+	for doc in docs:
+		if doc.name:
+			continue
+
+		series = None if naming_rule_exists else get_naming_series(doc)
+		if not series:
+			set_new_name(doc)
+			continue
+
+		key, digits, template = get_series_template(series, doc)
+		if not key:
+			set_new_name(doc)
+			continue
+
+		series_wise_docs.setdefault((key, digits), []).append((doc, template))
+
+	for (key, digits), series_docs in series_wise_docs.items():
+		current = reserve_series_block(key, len(series_docs))
+
+		for count, (doc, template) in enumerate(series_docs, start=current + 1):
+			doc.name = template.replace(SERIES_PLACEHOLDER, ("%0" + str(digits) + "d") % count)
+
+
+def get_naming_series(doc):
+	if callable(getattr(doc, "autoname", None)):
+		return
+
+	autoname = doc.meta.autoname or ""
+
+	if autoname.startswith("naming_series:"):
+		return doc.naming_series
+
+	if "#" in autoname and not autoname.startswith(("field:", "format:")):
+		return autoname
+
+
+def has_naming_rule(doctype):
+	return frappe.db.exists("Document Naming Rule", {"document_type": doctype, "disabled": 0})
+
+
+def get_series_template(series, doc):
+	"""Return the counter key, the number of digits and the name with a placeholder for
+	the counter, as `parse_naming_series` would build it for the document.
+	"""
+	series_key = {}
+
+	def number_generator(key, digits):
+		series_key.update(key=key, digits=digits)
+		return SERIES_PLACEHOLDER
+
+	template = parse_naming_series(series, doc=doc, number_generator=number_generator)
+
+	return series_key.get("key"), series_key.get("digits"), template
+
+
+def reserve_series_block(key, count):
+	"""Move the series counter ahead by `count` and return its value before the move."""
+	Series = DocType("Series")
+
+	current = (
+		frappe.qb.from_(Series).select(Series.current).where(Series.name == key).for_update().run()
+	)
+
+	if current and current[0][0] is not None:
+		current = cint(current[0][0])
+		frappe.qb.update(Series).set(Series.current, current + count).where(Series.name == key).run()
+	else:
+		current = 0
+		frappe.qb.into(Series).insert(key, count).columns("name", "current").run()
+
+	return current
+
+
+def validate_gl_map_balance(doc, gl_map):
+	precision = get_currency_precision()
+
+	debit = sum(flt(entry.debit, precision) for entry in gl_map)
+	credit = sum(flt(entry.credit, precision) for entry in gl_map)
+
+	if flt(debit - credit, precision):
+		frappe.throw(
+			_("Debit and Credit not equal for {0} {1}. Difference is {2}.").format(
+				doc.doctype, doc.name, flt(debit - credit, precision)
+			)
+		)
+
+
+def set_submitted_values(doc, timestamp):
+	doc.docstatus = 1
+	doc.owner = doc.modified_by = frappe.session.user
+	doc.creation = doc.modified = timestamp
+
+
+def insert_docs_in_bulk(docs):
+	if not docs:
+		return
+
+	rows = [doc.get_valid_dict(convert_dates_to_str=True) for doc in docs]
+	fields = list(rows[0])
+
+	frappe.db.bulk_insert(
+		docs[0].doctype, fields, [[row.get(field) for field in fields] for row in rows]
+	)
+
+
+def cancel_docs_in_bulk(doctype, names):
+	"""Mark submitted documents of one doctype as cancelled with one update.
+
+	Same as with `BulkDocumentWriter`, document hooks are not run. GL entries are reversed
+	with `make_reverse_gl_entries_in_bulk` and the callers take care of any other side
+	effect of `on_cancel`.
+	"""
+	if not names:
+		return
+
+	Table = DocType(doctype)
+	(
+		frappe.qb.update(Table)
+		.set(Table.docstatus, 2)
+		.set(Table.modified, now_datetime())
+		.set(Table.modified_by, frappe.session.user)
+		.where((Table.name.isin(names)) & (Table.docstatus == 1))
+	).run()
+
+
+def make_reverse_gl_entries_in_bulk(voucher_type, voucher_nos):
+	"""Reverse the GL entries of a set of vouchers of one voucher type.
+
+	Follows `make_reverse_gl_entries` of erpnext for each voucher, but the entries are
+	loaded and marked cancelled with one query each and the reversing entries are written
+	with multi-row inserts. Returns the GL entries that were reversed.
+	"""
+	from erpnext.accounts.general_ledger import (
+		check_freezing_date,
+		validate_accounting_period,
+		validate_against_pcv,
+	)
+	from erpnext.accounts.utils import create_payment_ledger_entry, is_immutable_ledger_enabled
+
+	if not voucher_nos:
+		return []
+
+	GLEntry = DocType("GL Entry")
+	gl_entries = (
+		frappe.qb.from_(GLEntry)
+		.select("*")
+		.where(
+			(GLEntry.voucher_type == voucher_type)
+			& (GLEntry.voucher_no.isin(voucher_nos))
+			& (GLEntry.is_cancelled == 0)
+		)
+		.for_update()
+	).run(as_dict=1)
+
+	if not gl_entries:
+		return []
+
+	# The checks run against the dates the entries were posted on, the accounting period
+	# is looked up from the first entry of a map, so one entry per company, date and voucher
+	# covers the set
+	period_entries = {}
+	company_wise_entries = {}
+	for entry in gl_entries:
+		period_entries.setdefault((entry.company, entry.posting_date, entry.voucher_no), entry)
+		company_wise_entries.setdefault(entry.company, []).append(entry)
+
+	create_payment_ledger_entry(gl_entries, cancel=1)
+
+	for entry in period_entries.values():
+		validate_accounting_period([entry])
+
+	check_freezing_date(min(getdate(entry.posting_date) for entry in gl_entries))
+
+	for company, entries in company_wise_entries.items():
+		validate_against_pcv(
+			any(entry.get("is_opening") == "Yes" for entry in entries),
+			min(getdate(entry.posting_date) for entry in entries),
+			company,
+		)
+
+	timestamp = now_datetime()
+	immutable_ledger_enabled = is_immutable_ledger_enabled()
+	reverse_gl_entries = []
+
+	for entry in gl_entries:
+		if not flt(entry.debit) and not flt(entry.credit):
+			continue
+
+		reverse_gl_entry = frappe.new_doc("GL Entry")
+		reverse_gl_entry.update(entry)
+		reverse_gl_entry.update(
+			{
+				"name": None,
+				"debit": entry.credit,
+				"credit": entry.debit,
+				"debit_in_account_currency": entry.credit_in_account_currency,
+				"credit_in_account_currency": entry.debit_in_account_currency,
+				"debit_in_transaction_currency": entry.get("credit_in_transaction_currency"),
+				"credit_in_transaction_currency": entry.get("debit_in_transaction_currency"),
+				"remarks": "On cancellation of " + entry.voucher_no,
+				"is_cancelled": 1,
+			}
+		)
+
+		if immutable_ledger_enabled:
+			reverse_gl_entry.is_cancelled = 0
+			reverse_gl_entry.posting_date = frappe.form_dict.get("posting_date") or getdate()
+
+		set_new_name(reverse_gl_entry)
+		set_submitted_values(reverse_gl_entry, timestamp)
+		reverse_gl_entries.append(reverse_gl_entry)
+
+	(
+		frappe.qb.update(GLEntry)
+		.set(GLEntry.is_cancelled, 1)
+		.set(GLEntry.modified, timestamp)
+		.set(GLEntry.modified_by, frappe.session.user)
+		.where(GLEntry.name.isin([entry.name for entry in gl_entries]))
+	).run()
+
+	for chunk in get_chunks(reverse_gl_entries, 500):
+		insert_docs_in_bulk(chunk)
+
+	return gl_entries
+
+
+def get_chunks(docs, chunk_size):
+	for i in range(0, len(docs), chunk_size):
+		yield docs[i : i + chunk_size]
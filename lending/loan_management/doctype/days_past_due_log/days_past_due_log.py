@@ -1,8 +1,23 @@
 # Copyright (c) 2023, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
+from frappe.query_builder import DocType
+from frappe.utils import getdate, now_datetime
+
+DPD_LOG_FIELDS = [
+	"name",
+	"creation",
+	"modified",
+	"owner",
+	"modified_by",
+	"loan",
+	"loan_disbursement",
+	"posting_date",
+	"days_past_due",
+	"process_loan_classification",
+]
 
 
 class DaysPastDueLog(Document):
@@ -22,3 +37,96 @@ class DaysPastDueLog(Document):
 	# end: auto-generated types
 
 	pass
+
+
+def upsert_days_past_due_logs(records, process_loan_classification=None, chunk_size=1000):
+	"""Write a list of (loan, loan_disbursement, posting_date, days_past_due) tuples to the
+	Days Past Due Log with one multi-row upsert per chunk.
+
+	Existing logs are matched by the unique index on loan, loan disbursement and posting
+	date. The index does not match NULLs, so logs without a disbursement are looked up first
+	and upserted on their name.
+	"""
+	if not records:
+		return
+
+	# Last value wins when the same day is passed more than once
+	rows = {}
+	for loan, loan_disbursement, posting_date, days_past_due in records:
+		rows[(loan, loan_disbursement or None, getdate(posting_date))] = days_past_due
+
+	timestamp = now_datetime()
+	user = frappe.session.user
+
+	existing_logs = get_logs_without_disbursement([key for key in rows if not key[1]])
+	values = {True: [], False: []}
+
+	for key, days_past_due in rows.items():
+		values[bool(key[1])].append(
+			[
+				existing_logs.get(key) or frappe.generate_hash(length=10),
+				timestamp,
+				timestamp,
+				user,
+				user,
+				*key,
+				days_past_due,
+				process_loan_classification,
+			]
+		)
+
+	for has_disbursement, chunk_values in values.items():
+		conflict_fields = ["loan", "loan_disbursement", "posting_date"] if has_disbursement else ["name"]
+		for start in range(0, len(chunk_values), chunk_size):
+			upsert_chunk(chunk_values[start : start + chunk_size], conflict_fields)
+
+
+def upsert_chunk(values, conflict_fields):
+	update_fields = ["days_past_due", "process_loan_classification", "modified", "modified_by"]
+	placeholders = ", ".join(["(" + ", ".join(["%s"] * len(DPD_LOG_FIELDS)) + ")"] * len(values))
+
+	if frappe.db.db_type == "postgres":
+		columns = ", ".join(f'"{field}"' for field in DPD_LOG_FIELDS)
+		conflict_clause = "on conflict ({}) do update set {}".format(
+			", ".join(f'"{field}"' for field in conflict_fields),
+			", ".join(f'"{field}" = excluded."{field}"' for field in update_fields),
+		)
+		table = '"tabDays Past Due Log"'
+	else:
+		columns = ", ".join(f"`{field}`" for field in DPD_LOG_FIELDS)
+		conflict_clause = "on duplicate key update " + ", ".join(
+			f"`{field}` = values(`{field}`)" for field in update_fields
+		)
+		table = "`tabDays Past Due Log`"
+
+	frappe.db.sql(
+		f"insert into {table} ({columns}) values {placeholders} {conflict_clause}",
+		[value for row in values for value in row],
+	)
+
+
+def get_logs_without_disbursement(keys):
+	if not keys:
+		return {}
+
+	DaysPastDueLog = DocType("Days Past Due Log")
+
+	logs = (
+		frappe.qb.from_(DaysPastDueLog)
+		.select(DaysPastDueLog.name, DaysPastDueLog.loan, DaysPastDueLog.posting_date)
+		.where(
+			(DaysPastDueLog.loan.isin(list({key[0] for key in keys})))
+			& (DaysPastDueLog.posting_date.isin(list({key[2] for key in keys})))
+			& (DaysPastDueLog.loan_disbursement.isnull() | (DaysPastDueLog.loan_disbursement == ""))
+		)
+	).run()
+
+	return {(loan, None, getdate(posting_date)): name for name, loan, posting_date in logs}
+
+
+def on_doctype_update():
+	frappe.db.add_unique(
+		"Days Past Due Log",
+		["loan", "loan_disbursement", "posting_date"],
+		constraint_name="unique_loan_disbursement_posting_date",
+	)
@@ -3,6 +3,8 @@
 
 
 import json
+from collections import deque
+from itertools import islice
 
 import frappe
 from frappe import _
@@ -26,12 +28,16 @@ import erpnext
 from erpnext.accounts.doctype.journal_entry.journal_entry import get_payment_entry
 from erpnext.controllers.accounts_controller import AccountsController
 
+from lending.loan_management.doctype.days_past_due_log.days_past_due_log import (
+	upsert_days_past_due_logs,
+)
 from lending.loan_management.doctype.loan_limit_change_log.loan_limit_change_log import (
 	create_loan_limit_change_log,
 )
 from lending.loan_management.doctype.loan_security_release.loan_security_release import (
 	get_pledged_security_qty,
 )
+from lending.loan_management.lending_config import get_currency_precision, get_lending_config
 from lending.loan_management.utils import loan_accounting_enabled
 from lending.utils import daterange
 
@@ -557,7 +563,7 @@ def get_sanctioned_amount_limit(applicant_type, applicant, company):
 def request_loan_closure(loan, posting_date=None, auto_close=0):
 	from lending.loan_management.doctype.loan_repayment.loan_repayment import calculate_amounts
 
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 	if not posting_date:
 		posting_date = getdate()
 
@@ -995,11 +1001,185 @@ def update_days_past_due_in_loans(
 			create_dpd_record(loan_name, disbursement, posting_date, 0, process_loan_classification)
 
 
+def update_days_past_due_in_bulk(
+	loans,
+	posting_date,
+	loan_product=None,
+	process_loan_classification=None,
+	loan_disbursement=None,
+	force_update_dpd_in_loan=0,
+):
+	"""Incremental version of `update_days_past_due_in_loans` for a batch of loans.
+
+	The oldest unpaid EMI demand of every loan and disbursement is looked up in one grouped
+	query. DPD, classification and the Days Past Due Log are then updated in bulk for the
+	loans whose NPA status does not change. Returns the loans that still need the per loan
+	path: the ones whose NPA status changes, that cross the auto write off threshold, that
+	are frozen or settled, or lines of credit run for a single disbursement.
+	"""
+	posting_date = getdate(posting_date)
+	yesterday = add_days(getdate(), -1)
+
+	# Backdated runs repost the DPD log loan by loan
+	if posting_date < yesterday and not force_update_dpd_in_loan:
+		return loans
+
+	update_status = posting_date == yesterday or force_update_dpd_in_loan
+
+	loan_details = frappe.get_all(
+		"Loan",
+		filters={"name": ("in", loans)},
+		fields=[
+			"name",
+			"company",
+			"loan_product",
+			"status",
+			"is_npa",
+			"unmark_npa",
+			"freeze_date",
+			"days_past_due",
+			"repayment_schedule_type",
+		],
+	)
+
+	schedule_filters = {"loan": ("in", loans), "status": ("in", ["Active", "Closed"]), "docstatus": 1}
+	if loan_disbursement:
+		schedule_filters["loan_disbursement"] = loan_disbursement
+
+	loan_wise_disbursements = {}
+	for schedule in frappe.get_all(
+		"Loan Repayment Schedule", filters=schedule_filters, fields=["loan", "loan_disbursement"]
+	):
+		loan_wise_disbursements.setdefault(schedule.loan, []).append(schedule.loan_disbursement)
+
+	oldest_demand_dates = get_oldest_unpaid_emi_demand_dates(
+		loans, posting_date, loan_product=loan_product, loan_disbursement=loan_disbursement
+	)
+
+	threshold_map = get_dpd_threshold_map()
+	threshold_write_off_map = get_dpd_threshold_write_off_map()
+	classifications = {}
+
+	full_path_loans = []
+	loan_updates = {}
+	disbursement_updates = {}
+	dpd_records = []
+
+	for loan in loan_details:
+		disbursements = loan_wise_disbursements.get(loan.name)
+		if not disbursements:
+			continue
+
+		is_loc = loan.repayment_schedule_type == "Line of Credit"
+
+		# The DPD of a line of credit is the highest of all its disbursements, so a run for
+		# one disbursement goes through the per loan path
+		if (
+			loan.status == "Settled"
+			or loan.freeze_date
+			or (is_loc and (not update_status or loan_disbursement))
+			or (not is_loc and len(disbursements) > 1)
+		):
+			full_path_loans.append(loan.name)
+			continue
+
+		disbursement_dpds = {}
+		for disbursement in disbursements:
+			oldest_demand_date = oldest_demand_dates.get((loan.name, disbursement))
+			disbursement_dpds[disbursement] = (
+				max(date_diff(posting_date, getdate(oldest_demand_date)) + 1, 0) if oldest_demand_date else 0
+			)
+
+		days_past_due = max(disbursement_dpds.values())
+		is_overdue = any(oldest_demand_dates.get((loan.name, d)) for d in disbursements)
+		update_loan = update_status or not is_overdue
+
+		threshold = threshold_map.get(loan.loan_product, 0)
+		is_npa = 0 if cint(loan.unmark_npa) else cint(bool(threshold and days_past_due > threshold))
+		npa_changes = cint(loan.is_npa) != is_npa or (is_npa and not loan.days_past_due)
+
+		write_off_threshold = threshold_write_off_map.get(loan.company, 0)
+		crosses_write_off_threshold = (
+			write_off_threshold and days_past_due > write_off_threshold and loan.status != "Written Off"
+		)
+
+		if (update_loan and npa_changes) or crosses_write_off_threshold:
+			full_path_loans.append(loan.name)
+			continue
+
+		if update_loan:
+			key = (days_past_due, loan.company, cint(loan.status == "Written Off"))
+			if key not in classifications:
+				classifications[key] = get_classification_code_and_name(
+					days_past_due, loan.company, is_written_off=key[2]
+				)
+
+			loan_updates.setdefault((days_past_due, *classifications[key]), []).append(loan.name)
+
+			if is_loc:
+				for disbursement, dpd in disbursement_dpds.items():
+					disbursement_updates.setdefault(dpd, []).append(disbursement)
+
+		for disbursement, dpd in disbursement_dpds.items():
+			dpd_records.append((loan.name, disbursement, posting_date, dpd))
+
+	Loan = DocType("Loan")
+	for (days_past_due, classification_code, classification_name), names in loan_updates.items():
+		(
+			frappe.qb.update(Loan)
+			.set(Loan.days_past_due, days_past_due)
+			.set(Loan.classification_code, classification_code)
+			.set(Loan.classification_name, classification_name)
+			.where(Loan.name.isin(names))
+		).run()
+
+	LoanDisbursement = DocType("Loan Disbursement")
+	for days_past_due, names in disbursement_updates.items():
+		(
+			frappe.qb.update(LoanDisbursement)
+			.set(LoanDisbursement.days_past_due, days_past_due)
+			.where(LoanDisbursement.name.isin(names))
+		).run()
+
+	upsert_days_past_due_logs(dpd_records, process_loan_classification)
+
+	return full_path_loans
+
+
+def get_oldest_unpaid_emi_demand_dates(loans, posting_date, loan_product=None, loan_disbursement=None):
+	"""Demand date of the oldest unpaid EMI demand per loan and disbursement, the same demand
+	`get_unpaid_demands` returns first.
+	"""
+	precision = get_currency_precision()
+
+	LoanDemand = DocType("Loan Demand")
+	query = (
+		frappe.qb.from_(LoanDemand)
+		.select(LoanDemand.loan, LoanDemand.loan_disbursement, fn.Min(LoanDemand.demand_date))
+		.where(
+			(LoanDemand.loan.isin(loans))
+			& (LoanDemand.docstatus == 1)
+			& (LoanDemand.demand_type == "EMI")
+			& (LoanDemand.demand_date <= posting_date)
+			& (fn.Round(LoanDemand.outstanding_amount, precision) > 0)
+		)
+		.groupby(LoanDemand.loan, LoanDemand.loan_disbursement)
+	)
+
+	if loan_product:
+		query = query.where(LoanDemand.loan_product == loan_product)
+
+	if loan_disbursement:
+		query = query.where(LoanDemand.loan_disbursement == loan_disbursement)
+
+	return {(loan, disbursement): demand_date for loan, disbursement, demand_date in query.run()}
+
+
 def repost_days_past_due_log(
 	loan, posting_date, loan_product, loan_disbursement, process_loan_classification
 ):
 	"""Get outstanding demands for a loan"""
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 
 	LoanDemand = DocType("Loan Demand")
 	LoanRepayment = DocType("Loan Repayment")
@@ -1051,55 +1231,90 @@ def repost_days_past_due_log(
 
 		payment_against_demand = payment_query.run(as_dict=True)
 
-		for idx, payment in enumerate(payment_against_demand):
-			next_payment_date = (
-				payment_against_demand[idx + 1].value_date
-				if idx + 1 < len(payment_against_demand)
-				else getdate()
-			)
-			for demand in demands:
-				if getdate(demand.demand_date) <= getdate(payment.value_date):
-					if demand.demand_subtype == "Interest" and flt(payment.total_interest_paid, precision) > 0:
-						paid_interest = min(
-							flt(payment.total_interest_paid, precision), flt(demand.demand_amount, precision)
-						)
-						demand.demand_amount -= paid_interest
-						payment.total_interest_paid -= paid_interest
-
-					if demand.demand_subtype == "Principal" and flt(payment.total_principal_paid, precision) > 0:
-						paid_principal = min(
-							flt(payment.total_principal_paid, precision), flt(demand.demand_amount, precision)
-						)
-						demand.demand_amount -= paid_principal
-						payment.total_principal_paid -= paid_principal
-
-			start_date = getdate(payment.value_date)
-			end_date = getdate(next_payment_date)
-
-			for current_date in daterange(start_date, end_date):
-				final_dpd = 0
-				if current_date >= getdate(posting_date):
-					matching_demand_found = False
-					for d in demands:
-						demand_amount = flt(d.demand_amount, precision)
-						if getdate(d.demand_date) <= current_date and demand_amount > 0:
-							dpd_counter = date_diff(current_date, d.demand_date) + 1
-							create_dpd_record(
-								loan, demand.loan_disbursement, current_date, dpd_counter, process_loan_classification
-							)
-							final_dpd = dpd_counter
-							matching_demand_found = True
-							break
-
-					if not matching_demand_found:
-						final_dpd = 0
-						create_dpd_record(
-							loan, demand.loan_disbursement, current_date, 0, process_loan_classification
-						)
+		days_past_due_series, final_dpd = get_days_past_due_series(
+			demands, payment_against_demand, posting_date, getdate(), precision
+		)
 
+		if payment_against_demand:
+			disbursement = demands[-1].loan_disbursement
+			upsert_days_past_due_logs(
+				[(loan, disbursement, date, dpd) for date, dpd in days_past_due_series],
+				process_loan_classification,
+			)
 			frappe.db.set_value("Loan", loan, "days_past_due", final_dpd)
 
 
+def get_days_past_due_series(demands, payments, posting_date, to_date, precision):
+	"""DPD for every day from the first payment till `to_date`, skipping days before
+	`posting_date`, as a list of (date, days_past_due) along with the DPD on the last day.
+
+	Demands and payments are both sorted by date, so they are swept once. Demands due by a
+	payment are queued by subtype and the payment is allocated to the oldest ones first.
+	Between two payments the unpaid demands do not change, so the DPD of a day only needs
+	the oldest of them, or the next demand that falls due if none are left.
+	"""
+	posting_date = getdate(posting_date)
+	unpaid_demands = {}
+	next_demand = 0
+	series = []
+	final_dpd = 0
+
+	for idx, payment in enumerate(payments):
+		start_date = getdate(payment.value_date)
+		end_date = getdate(payments[idx + 1].value_date) if idx + 1 < len(payments) else getdate(to_date)
+
+		while next_demand < len(demands) and getdate(demands[next_demand].demand_date) <= start_date:
+			demand = demands[next_demand]
+			unpaid_demands.setdefault(demand.demand_subtype, deque()).append(demand)
+			next_demand += 1
+
+		allocate_payment_to_demands(
+			unpaid_demands.get("Interest"), payment.total_interest_paid, precision
+		)
+		allocate_payment_to_demands(
+			unpaid_demands.get("Principal"), payment.total_principal_paid, precision
+		)
+
+		oldest_demand_date = None
+		for queue in unpaid_demands.values():
+			while queue and flt(queue[0].demand_amount, precision) <= 0:
+				queue.popleft()
+
+			if queue and (not oldest_demand_date or getdate(queue[0].demand_date) < oldest_demand_date):
+				oldest_demand_date = getdate(queue[0].demand_date)
+
+		if not oldest_demand_date:
+			oldest_demand_date = next(
+				(
+					getdate(demand.demand_date)
+					for demand in islice(demands, next_demand, None)
+					if flt(demand.demand_amount, precision) > 0
+				),
+				None,
+			)
+
+		for current_date in daterange(start_date, end_date):
+			final_dpd = 0
+			if current_date >= posting_date:
+				if oldest_demand_date and oldest_demand_date <= current_date:
+					final_dpd = date_diff(current_date, oldest_demand_date) + 1
+
+				series.append((current_date, final_dpd))
+
+	return series, final_dpd
+
+
+def allocate_payment_to_demands(demands, paid_amount, precision):
+	while demands and flt(paid_amount, precision) > 0:
+		demand = demands[0]
+		allocated_amount = min(flt(paid_amount, precision), flt(demand.demand_amount, precision))
+		demand.demand_amount -= allocated_amount
+		paid_amount -= allocated_amount
+
+		if flt(demand.demand_amount, precision) <= 0:
+			demands.popleft()
+
+
 def create_loan_write_off(loan, posting_date):
 	if frappe.db.get_value("Loan", loan, "status") != "Written Off":
 		loan_write_off = frappe.new_doc("Loan Write Off")
@@ -1111,25 +1326,9 @@ def create_loan_write_off(loan, posting_date):
 def create_dpd_record(
 	loan, loan_disbursement, posting_date, days_past_due, process_loan_classification=None
 ):
-	existing_log = frappe.db.get_value(
-		"Days Past Due Log",
-		{"loan": loan, "posting_date": posting_date, "loan_disbursement": loan_disbursement},
-	)
-	if existing_log:
-		doc = frappe.get_doc("Days Past Due Log", existing_log)
-	else:
-		doc = frappe.new_doc("Days Past Due Log")
-
-	doc.update(
-		{
-			"loan": loan,
-			"loan_disbursement": loan_disbursement,
-			"posting_date": posting_date,
-			"days_past_due": days_past_due,
-			"process_loan_classification": process_loan_classification,
-		}
+	upsert_days_past_due_logs(
+		[(loan, loan_disbursement, posting_date, days_past_due)], process_loan_classification
 	)
-	doc.save(ignore_permissions=True)
 
 
 def update_loan_and_customer_status(
@@ -1416,22 +1615,7 @@ def move_unpaid_interest_to_suspense_ledger(loan, posting_date=None, value_date=
 
 	unbooked_interest = get_unbooked_interest(loan, posting_date, last_demand_date=last_demand_date)
 
-	accounts = frappe.db.get_value(
-		"Loan Product",
-		loan_product,
-		[
-			"interest_income_account",
-			"interest_receivable_account",
-			"penalty_receivable_account",
-			"additional_interest_income",
-			"additional_interest_receivable",
-			"penalty_income_account",
-			"suspense_interest_income",
-			"penalty_suspense_account",
-			"additional_interest_suspense",
-		],
-		as_dict=1,
-	)
+	accounts = get_lending_config().get_loan_product(loan_product)
 
 	GL = DocType("GL Entry")
 
@@ -1471,7 +1655,7 @@ def move_unpaid_interest_to_suspense_ledger(loan, posting_date=None, value_date=
 	if abs(amounts.get(accounts.interest_receivable_account, 0)) > 0 or unbooked_interest > 0:
 		amount = abs(amounts.get(accounts.interest_receivable_account, 0)) + unbooked_interest
 		debit_account = accounts.interest_income_account
-		credit_account = accounts.get("suspense_interest_income")
+		credit_account = accounts.suspense_interest_income
 		make_journal_entry(
 			posting_date,
 			value_date,
@@ -1486,7 +1670,7 @@ def move_unpaid_interest_to_suspense_ledger(loan, posting_date=None, value_date=
 	if abs(amounts.get(accounts.penalty_receivable_account, 0)) > 0:
 		amount = abs(amounts.get(accounts.penalty_receivable_account, 0))
 		debit_account = accounts.penalty_income_account
-		credit_account = accounts.get("penalty_suspense_account")
+		credit_account = accounts.penalty_suspense_account
 		make_journal_entry(
 			posting_date,
 			value_date,
@@ -1501,7 +1685,7 @@ def move_unpaid_interest_to_suspense_ledger(loan, posting_date=None, value_date=
 	if abs(amounts.get(accounts.additional_interest_receivable, 0)) > 0:
 		amount = abs(amounts.get(accounts.additional_interest_receivable, 0))
 		debit_account = accounts.additional_interest_income
-		credit_account = accounts.get("additional_interest_suspense")
+		credit_account = accounts.additional_interest_suspense
 		make_journal_entry(
 			posting_date,
 			value_date,
@@ -1661,7 +1845,7 @@ def make_journal_entry(
 	is_reverse=0,
 	remark=None,
 ):
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 
 	if not flt(amount, precision):
 		return
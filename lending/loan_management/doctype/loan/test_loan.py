@@ -1,6 +1,8 @@
 # Copyright (c) 2019, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
+from unittest.mock import patch
+
 import frappe
 from frappe.query_builder import DocType
 from frappe.query_builder import functions as fn
@@ -18,17 +20,34 @@ from frappe.utils import (
 
 from erpnext.selling.doctype.customer.test_customer import get_customer_dict
 
-from lending.loan_management.doctype.loan.loan import request_loan_closure, unpledge_security
+from lending.loan_management.doctype.days_past_due_log.days_past_due_log import (
+	upsert_days_past_due_logs,
+)
+from lending.loan_management.doctype.loan.loan import (
+	get_days_past_due_series,
+	request_loan_closure,
+	unpledge_security,
+	update_days_past_due_in_bulk,
+	update_days_past_due_in_loans,
+)
 from lending.loan_management.doctype.loan_application.loan_application import (
 	create_loan_security_assignment,
 )
+from lending.loan_management.doctype.loan_demand.utils import (
+	UnpaidDemandSnapshot,
+	clear_unpaid_demand_snapshot,
+	prefetch_unpaid_demands,
+)
 from lending.loan_management.doctype.loan_disbursement.loan_disbursement import (
 	get_disbursal_amount,
 )
 from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
 	days_in_year,
 )
-from lending.loan_management.doctype.loan_repayment.loan_repayment import calculate_amounts
+from lending.loan_management.doctype.loan_repayment.loan_repayment import (
+	calculate_amounts,
+	get_unpaid_demands,
+)
 from lending.loan_management.doctype.loan_security_release.loan_security_release import (
 	get_pledged_security_qty,
 )
@@ -44,6 +63,11 @@ from lending.loan_management.doctype.process_loan_interest_accrual.process_loan_
 from lending.loan_management.doctype.process_loan_security_shortfall.process_loan_security_shortfall import (
 	create_process_loan_security_shortfall,
 )
+from lending.tests.benchmark_days_past_due import (
+	START_DATE,
+	get_days_past_due_series_by_scan,
+	make_long_tenure_loan_events,
+)
 from lending.tests.test_utils import (
 	add_or_update_loan_charges,
 	create_demand_loan,
@@ -617,6 +641,13 @@ class TestLoan(IntegrationTestCase):
 		self.assertEqual(flt(loan_security_shortfall.security_value, 2), 800000.00)
 		self.assertEqual(flt(loan_security_shortfall.shortfall_amount, 2), 600000.00)
 
+		# An unchanged shortfall is not written again
+		create_process_loan_security_shortfall()
+		self.assertEqual(
+			frappe.db.get_value("Loan Security Shortfall", loan_security_shortfall.name, "modified"),
+			loan_security_shortfall.modified,
+		)
+
 		frappe.db.sql(
 			""" UPDATE `tabLoan Security Price` SET loan_security_price = 250
 			where loan_security='Test Security 2'"""
@@ -627,6 +658,108 @@ class TestLoan(IntegrationTestCase):
 		self.assertEqual(loan_security_shortfall.status, "Completed")
 		self.assertEqual(loan_security_shortfall.shortfall_amount, 0)
 
+	def test_lending_config_refreshed_on_save(self):
+		from lending.loan_management.lending_config import get_lending_config
+
+		loan_product = frappe.get_doc("Loan Product", "Term Loan Product 4")
+		grace_period_in_days = loan_product.grace_period_in_days or 0
+		self.addCleanup(
+			frappe.db.set_value,
+			"Loan Product",
+			loan_product.name,
+			"grace_period_in_days",
+			grace_period_in_days,
+		)
+
+		config = get_lending_config()
+		self.assertEqual(
+			config.get_loan_product(loan_product.name).grace_period_in_days, grace_period_in_days
+		)
+		self.assertIs(get_lending_config(), config)
+
+		loan_product.grace_period_in_days = grace_period_in_days + 3
+		loan_product.save()
+
+		self.assertIsNot(get_lending_config(), config)
+		self.assertEqual(
+			get_lending_config().get_loan_product(loan_product.name).grace_period_in_days,
+			grace_period_in_days + 3,
+		)
+
+	def test_lending_config_cached_per_site(self):
+		from lending.loan_management.lending_config import LendingConfig, _settings_cache
+
+		site_settings = LendingConfig().get_loan_product("Term Loan Product 4")
+
+		# A worker serving another site with a loan product of the same name reads its own
+		with patch.object(frappe.local, "site", "_other_test_site"):
+			other_site_settings = LendingConfig().get_loan_product("Term Loan Product 4")
+
+		self.addCleanup(_settings_cache.pop, ("_other_test_site", "Loan Product", "Term Loan Product 4"))
+
+		self.assertIsNot(other_site_settings, site_settings)
+		self.assertIs(LendingConfig().get_loan_product("Term Loan Product 4"), site_settings)
+
+	def test_price_triggered_security_shortfall(self):
+		from lending.loan_management.doctype.loan_security_shortfall.loan_security_shortfall import (
+			process_pending_price_updates,
+			queue_shortfall_check_for_price_update,
+		)
+
+		frappe.db.sql(
+			"""UPDATE `tabLoan Security Price` SET loan_security_price = 250
+			where loan_security='Test Security 2'"""
+		)
+		pledges = [{"loan_security": "Test Security 2", "qty": 8000.00, "haircut": 50}]
+
+		loan_application = create_loan_application(
+			"_Test Company", self.applicant2, "Stock Loan", pledges, "Repay Over Number of Periods", 12
+		)
+		create_loan_security_assignment(loan_application)
+
+		loan = create_loan_with_security(
+			self.applicant2, "Stock Loan", "Repay Over Number of Periods", 12, loan_application
+		)
+		loan.submit()
+		make_loan_disbursement_entry(loan.name, loan.loan_amount)
+
+		frappe.db.sql(
+			"""UPDATE `tabLoan Security Price` SET loan_security_price = 100
+			where loan_security='Test Security 2'"""
+		)
+		self.addCleanup(
+			frappe.db.sql,
+			"""UPDATE `tabLoan Security Price` SET loan_security_price = 250
+			where loan_security='Test Security 2'""",
+		)
+
+		def process_price_updates(*loan_securities):
+			for loan_security in loan_securities:
+				queue_shortfall_check_for_price_update(loan_security)
+
+			# Keep the job from committing the test data
+			with patch.object(frappe.db, "commit"):
+				process_pending_price_updates()
+
+		# A price update of a security the loan does not pledge leaves it alone
+		processes = frappe.db.count("Process Loan Security Shortfall")
+		process_price_updates("Test Security 1")
+		self.assertEqual(frappe.db.count("Process Loan Security Shortfall"), processes + 1)
+		self.assertFalse(frappe.db.exists("Loan Security Shortfall", {"loan": loan.name}))
+
+		# Bursts of updates for a security are checked once
+		process_price_updates("Test Security 2", "Test Security 2")
+		self.assertEqual(frappe.db.count("Process Loan Security Shortfall"), processes + 2)
+
+		shortfalls = frappe.get_all(
+			"Loan Security Shortfall",
+			filters={"loan": loan.name},
+			fields=["status", "shortfall_amount"],
+		)
+		self.assertEqual(len(shortfalls), 1)
+		self.assertEqual(shortfalls[0].status, "Pending")
+		self.assertEqual(flt(shortfalls[0].shortfall_amount, 2), 600000.00)
+
 	def test_loan_security_release(self):
 		pledge = [{"loan_security": "Test Security 1", "qty": 4000.00}]
 
@@ -2375,6 +2508,188 @@ class TestLoan(IntegrationTestCase):
 		dpd_in_loan = frappe.db.get_value("Loan", loan.name, "days_past_due")
 		self.assertEqual(dpd_in_loan, 0)
 
+	def test_incremental_dpd_matches_per_loan_dpd(self):
+		loans = []
+		for _i in range(2):
+			loan = create_loan(
+				"_Test Customer 1",
+				"Term Loan Product 4",
+				100000,
+				"Repay Over Number of Periods",
+				30,
+				repayment_start_date="2024-10-05",
+				posting_date="2024-09-15",
+				rate_of_interest=10,
+				applicant_type="Customer",
+			)
+			loan.submit()
+			make_loan_disbursement_entry(
+				loan.name, loan.loan_amount, disbursement_date="2024-09-15", repayment_start_date="2024-10-05"
+			)
+			process_daily_loan_demands(posting_date="2024-10-05", loan=loan.name)
+			loans.append(loan.name)
+
+		update_days_past_due_in_loans(loans[0], posting_date="2024-10-08", force_update_dpd_in_loan=1)
+
+		full_path_loans = update_days_past_due_in_bulk(
+			[loans[1]], "2024-10-08", force_update_dpd_in_loan=1
+		)
+		for loan in full_path_loans:
+			update_days_past_due_in_loans(loan, posting_date="2024-10-08", force_update_dpd_in_loan=1)
+
+		fields = ["days_past_due", "classification_code", "classification_name", "is_npa"]
+		self.assertEqual(
+			frappe.db.get_value("Loan", loans[0], fields), frappe.db.get_value("Loan", loans[1], fields)
+		)
+		self.assertEqual(frappe.db.get_value("Loan", loans[1], "days_past_due"), 4)
+
+		for loan in loans:
+			self.assertEqual(
+				frappe.db.get_value(
+					"Days Past Due Log", {"loan": loan, "posting_date": "2024-10-08"}, "days_past_due"
+				),
+				4,
+			)
+
+	def test_days_past_due_log_upsert(self):
+		loan = create_loan(
+			"_Test Customer 1",
+			"Term Loan Product 4",
+			100000,
+			"Repay Over Number of Periods",
+			30,
+			repayment_start_date="2024-10-05",
+			posting_date="2024-09-15",
+			rate_of_interest=10,
+			applicant_type="Customer",
+		)
+		loan.submit()
+		disbursement = make_loan_disbursement_entry(
+			loan.name, loan.loan_amount, disbursement_date="2024-09-15", repayment_start_date="2024-10-05"
+		).name
+
+		upsert_days_past_due_logs(
+			[(loan.name, disbursement, add_days("2024-10-05", i), i + 1) for i in range(3)]
+		)
+		upsert_days_past_due_logs([(loan.name, disbursement, "2024-10-06", 10)])
+
+		logs = frappe.get_all(
+			"Days Past Due Log",
+			filters={"loan": loan.name, "loan_disbursement": disbursement},
+			fields=["posting_date", "days_past_due"],
+			order_by="posting_date",
+		)
+
+		self.assertEqual([log.days_past_due for log in logs], [1, 10, 3])
+
+	def test_days_past_due_series_for_long_tenure_loan(self):
+		# 20 year loan with monthly demands and irregular payments, checked against a day by
+		# day scan of the unpaid demands
+		demands, payments, to_date = make_long_tenure_loan_events(years=20)
+		expected = get_days_past_due_series_by_scan(demands, payments, to_date)
+
+		series, final_dpd = get_days_past_due_series(demands, payments, START_DATE, to_date, 2)
+
+		self.assertEqual(series, expected)
+		self.assertEqual(final_dpd, expected[-1][1])
+
+	def test_unpaid_demand_snapshot(self):
+		loan = create_loan(
+			"_Test Customer 1",
+			"Term Loan Product 4",
+			100000,
+			"Repay Over Number of Periods",
+			30,
+			repayment_start_date="2024-10-05",
+			posting_date="2024-09-15",
+			rate_of_interest=10,
+			applicant_type="Customer",
+		)
+		loan.submit()
+		make_loan_disbursement_entry(
+			loan.name, loan.loan_amount, disbursement_date="2024-09-15", repayment_start_date="2024-10-05"
+		)
+		process_daily_loan_demands(posting_date="2024-11-05", loan=loan.name)
+
+		def get_expected_demands(posting_date, **filters):
+			return frappe.get_all(
+				"Loan Demand",
+				filters={
+					"loan": loan.name,
+					"docstatus": 1,
+					"demand_date": ("<=", posting_date),
+					"outstanding_amount": (">", 0),
+					**filters,
+				},
+				pluck="name",
+			)
+
+		all_demands = get_unpaid_demands(loan.name, "2024-11-05")
+		self.assertTrue(all_demands)
+		self.assertEqual(
+			[d.demand_date for d in all_demands], sorted(d.demand_date for d in all_demands)
+		)
+		self.assertCountEqual([d.name for d in all_demands], get_expected_demands("2024-11-05"))
+		self.assertCountEqual(
+			[d.name for d in get_unpaid_demands(loan.name, "2024-10-05")],
+			get_expected_demands("2024-10-05"),
+		)
+		self.assertCountEqual(
+			[d.name for d in get_unpaid_demands(loan.name, "2024-11-05", demand_subtype="Interest")],
+			get_expected_demands("2024-11-05", demand_subtype="Interest"),
+		)
+		self.assertEqual(
+			get_unpaid_demands(loan.name, "2024-11-05", limit=1)[0].name, all_demands[0].name
+		)
+
+		emi_demands = get_unpaid_demands(loan.name, "2024-11-05", emi_wise=True)
+		self.assertEqual(
+			flt(sum(d.pending_amount for d in emi_demands), 2),
+			flt(sum(d.outstanding_amount for d in all_demands if d.demand_type == "EMI"), 2),
+		)
+
+		# Locking reads go to the database but return the same demands in the same order
+		self.assertEqual(
+			[d.name for d in get_unpaid_demands(loan.name, "2024-11-05", for_update=True)],
+			[d.name for d in all_demands],
+		)
+		self.assertEqual(
+			[
+				d.name
+				for d in get_unpaid_demands(
+					loan.name, "2024-11-05", demand_subtype="Interest", for_update=True
+				)
+			],
+			[d.name for d in get_unpaid_demands(loan.name, "2024-11-05", demand_subtype="Interest")],
+		)
+		self.assertEqual(
+			{
+				d.repayment_schedule_detail: flt(d.pending_amount, 2)
+				for d in get_unpaid_demands(loan.name, "2024-11-05", emi_wise=True, for_update=True)
+			},
+			{d.repayment_schedule_detail: flt(d.pending_amount, 2) for d in emi_demands},
+		)
+
+		# Loans prefetched for a batch are answered without loading them again
+		clear_unpaid_demand_snapshot()
+		prefetch_unpaid_demands([loan.name])
+
+		with patch.object(UnpaidDemandSnapshot, "load") as load:
+			self.assertEqual(
+				[d.name for d in get_unpaid_demands(loan.name, "2024-11-05")],
+				[d.name for d in all_demands],
+			)
+
+		load.assert_not_called()
+
+		# A repayment updates the demands and drops the loan from the snapshot
+		create_repayment_entry(loan.name, "2024-10-05", all_demands[0].outstanding_amount).submit()
+
+		self.assertCountEqual(
+			[d.name for d in get_unpaid_demands(loan.name, "2024-11-05")],
+			get_expected_demands("2024-11-05"),
+		)
+
 	def test_dpd_calculation_for_loc_loan(self):
 		loan = create_loan(
 			"_Test Customer 1",
@@ -3554,3 +3869,129 @@ class TestLoan(IntegrationTestCase):
 				flt(expected_total, 2),
 				msg=f"Total amount mismatch at index {idx}",
 			)
+
+	def test_bulk_term_loan_demand_generation(self):
+		def make_loan_with_demands():
+			loan = create_loan(
+				self.applicant2,
+				"Term Loan Product 1",
+				12000,
+				"Repay Over Number of Periods",
+				12,
+				"Customer",
+				repayment_start_date="2024-11-01",
+				posting_date="2024-10-15",
+				rate_of_interest=10,
+			)
+			loan.submit()
+			make_loan_disbursement_entry(
+				loan.name, loan.loan_amount, disbursement_date="2024-10-15", repayment_start_date="2024-11-01"
+			)
+			process_daily_loan_demands(posting_date="2025-02-01", loan=loan.name)
+
+			demands = frappe.get_all(
+				"Loan Demand",
+				filters={"loan": loan.name, "docstatus": 1},
+				fields=[
+					"demand_date",
+					"demand_type",
+					"demand_subtype",
+					"demand_amount",
+					"outstanding_amount",
+				],
+				order_by="demand_date, demand_subtype",
+			)
+			schedule = frappe.db.get_value(
+				"Loan Repayment Schedule",
+				{"loan": loan.name, "docstatus": 1, "status": "Active"},
+				[
+					"name",
+					"total_installments_raised",
+					"total_installments_paid",
+					"total_installments_overdue",
+				],
+				as_dict=1,
+			)
+			demand_generated = frappe.get_all(
+				"Repayment Schedule",
+				filters={"parent": schedule.pop("name"), "payment_date": ("<=", "2025-02-01")},
+				pluck="demand_generated",
+			)
+			payment_ledger_entries = frappe.get_all(
+				"Payment Ledger Entry",
+				filters={
+					"voucher_type": "Loan Demand",
+					"voucher_no": (
+						"in",
+						frappe.get_all("Loan Demand", {"loan": loan.name, "docstatus": 1}, pluck="name"),
+					),
+					"delinked": 0,
+				},
+				fields=["posting_date", "account_type", "amount"],
+				order_by="posting_date, amount",
+			)
+
+			return demands, schedule, demand_generated, payment_ledger_entries
+
+		document_demands, document_schedule, _, document_ledger = make_loan_with_demands()
+
+		frappe.db.set_value("Company", "_Test Company", "enable_bulk_demand_generation", 1)
+		self.addCleanup(
+			frappe.db.set_value, "Company", "_Test Company", "enable_bulk_demand_generation", 0
+		)
+
+		bulk_demands, bulk_schedule, demand_generated, bulk_ledger = make_loan_with_demands()
+
+		self.assertTrue(bulk_demands)
+		self.assertEqual(bulk_demands, document_demands)
+		self.assertEqual(bulk_ledger, document_ledger)
+		self.assertEqual(bulk_schedule, document_schedule)
+		self.assertEqual(bulk_schedule.total_installments_raised, 4)
+		self.assertTrue(all(demand_generated))
+
+	def test_bulk_demand_loan_demand_generation(self):
+		frappe.db.set_value("Company", "_Test Company", "enable_bulk_demand_generation", 1)
+		self.addCleanup(
+			frappe.db.set_value, "Company", "_Test Company", "enable_bulk_demand_generation", 0
+		)
+
+		pledge = [{"loan_security": "Test Security 1", "qty": 4000.00}]
+		loan_application = create_loan_application(
+			"_Test Company", self.applicant2, "Demand Loan", pledge
+		)
+		create_loan_security_assignment(loan_application)
+		loan = create_demand_loan(
+			self.applicant2, "Demand Loan", loan_application, posting_date="2019-10-01"
+		)
+		loan.submit()
+
+		make_loan_disbursement_entry(loan.name, loan.loan_amount, disbursement_date="2019-10-01")
+		process_loan_interest_accrual_for_loans(
+			posting_date="2019-10-30", loan=loan.name, company="_Test Company"
+		)
+
+		LoanInterestAccrual = DocType("Loan Interest Accrual")
+		accrued_interest = (
+			frappe.qb.from_(LoanInterestAccrual)
+			.select(fn.Sum(LoanInterestAccrual.interest_amount))
+			.where((LoanInterestAccrual.loan == loan.name) & (LoanInterestAccrual.docstatus == 1))
+		).run()[0][0]
+
+		def get_demands():
+			return frappe.get_all(
+				"Loan Demand",
+				filters={"loan": loan.name, "docstatus": 1, "demand_type": "Normal"},
+				fields=["demand_subtype", "demand_amount", "outstanding_amount"],
+			)
+
+		process_daily_loan_demands(posting_date="2019-10-31", loan=loan.name)
+		demands = get_demands()
+
+		self.assertEqual(len(demands), 1)
+		self.assertEqual(demands[0].demand_subtype, "Interest")
+		self.assertEqual(demands[0].demand_amount, flt(accrued_interest, 2))
+		self.assertEqual(demands[0].outstanding_amount, demands[0].demand_amount)
+
+		# Nothing accrued after the last demand, so no empty demand is made
+		process_daily_loan_demands(posting_date="2019-10-31", loan=loan.name)
+		self.assertEqual(len(get_demands()), 1)
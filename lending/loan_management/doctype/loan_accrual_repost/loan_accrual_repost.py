@@ -43,6 +43,10 @@ class LoanAccrualRepost(Document):
 				if written_off_date:
 					interest_accruals = self.get_interest_accrual_entries(loan.loan)
 					for entry in interest_accruals:
+						# Posted in the summarized accrual journals, not by the accrual itself
+						if entry.summarized_gl_entry:
+							continue
+
 						gl_exists = frappe.db.exists(
 							"GL Entry",
 							{"voucher_no": entry.name, "voucher_type": "Loan Interest Accrual", "is_cancelled": 0},
@@ -86,6 +90,9 @@ class LoanAccrualRepost(Document):
 			elif loan_status in ("Disbursed", "Active"):
 				interest_accruals = self.get_interest_accrual_entries(loan.loan)
 				for entry in interest_accruals:
+					if entry.summarized_gl_entry:
+						continue
+
 					gl_exists = frappe.db.exists(
 						"GL Entry",
 						{"voucher_no": entry.name, "voucher_type": "Loan Interest Accrual", "is_cancelled": 0},
@@ -103,7 +110,7 @@ class LoanAccrualRepost(Document):
 				"posting_date": ["between", [self.from_date, self.to_date]],
 				"interest_type": "Normal Interest",
 			},
-			fields=["name", "posting_date", "docstatus", "loan_product"],
+			fields=["name", "posting_date", "docstatus", "loan_product", "summarized_gl_entry"],
 		)
 
 		return interest_accruals
@@ -3,12 +3,31 @@
 
 import frappe
 from frappe import _
+from frappe.query_builder.functions import Max, Sum
 from frappe.utils import add_days, cint, flt, get_datetime, getdate
 
 from lending.loan_management.controllers.loan_controller import LoanController
-from lending.loan_management.doctype.loan_repayment.loan_repayment import update_installment_counts
+from lending.loan_management.doctype.loan_demand.utils import invalidate_unpaid_demands
+from lending.loan_management.doctype.loan_repayment.loan_repayment import (
+	update_installment_counts,
+	update_installment_counts_in_bulk,
+)
+from lending.loan_management.lending_config import get_currency_precision
 from lending.loan_management.utils import loan_accounting_enabled
 
+# Loan fields copied on to every demand of the loan
+LOAN_FIELDS_FOR_DEMAND = (
+	"applicant_type",
+	"applicant",
+	"company",
+	"loan_product",
+	"is_term_loan",
+	"cost_center",
+	"loan_partner",
+)
+
+TERM_LOAN_DEMAND_CHUNK_SIZE = 100
+
 
 class LoanDemand(LoanController):
 	# begin: auto-generated types
@@ -72,6 +91,8 @@ class LoanDemand(LoanController):
 			process_loan_interest_accrual_for_loans,
 		)
 
+		invalidate_unpaid_demands([self.loan])
+
 		if self.demand_subtype in ("Principal", "Interest", "Penalty", "Additional Interest"):
 			self.make_gl_entries()
 
@@ -98,6 +119,7 @@ class LoanDemand(LoanController):
 			)
 
 	def on_cancel(self):
+		invalidate_unpaid_demands([self.loan])
 		self.ignore_linked_doctypes = ["GL Entry", "Payment Ledger Entry"]
 		self.make_gl_entries(cancel=1)
 		self.update_repayment_schedule(cancel=1)
@@ -121,17 +143,28 @@ class LoanDemand(LoanController):
 		if not loan_accounting_enabled(self.company):
 			return
 
+		gl_entries = self.get_gl_map()
+
+		if gl_entries:
+			super().make_gl_entries(gl_entries, cancel=cancel, merge_entries=False, adv_adj=0)
+
+	def get_gl_map(self, loan_status=None, account_details=None):
 		gl_entries = []
 
 		if self.demand_subtype == "Principal":
-			return
+			return gl_entries
 
 		if self.demand_type == "Charges":
-			return
+			return gl_entries
+
+		if not loan_status:
+			loan_status = frappe.db.get_value("Loan", self.loan, "status", cache=True)
 
-		loan_status = frappe.db.get_value("Loan", self.loan, "status", cache=True)
 		if loan_status == "Written Off":
-			return
+			return gl_entries
+
+		if not account_details:
+			account_details = get_demand_account_details(self.loan_product)
 
 		party_type = ""
 		party = ""
@@ -147,9 +180,7 @@ class LoanDemand(LoanController):
 		elif self.demand_subtype == "Additional Interest":
 			fields = ["additional_interest_accrued", "additional_interest_receivable"]
 
-		accrual_account, receivable_account = frappe.db.get_value(
-			"Loan Product", self.loan_product, fields
-		)
+		accrual_account, receivable_account = (account_details.get(field) for field in fields)
 
 		if not accrual_account:
 			frappe.throw(
@@ -170,20 +201,19 @@ class LoanDemand(LoanController):
 		)
 
 		if self.demand_type == "BPI":
-			receivable_account, accrual_account = frappe.db.get_value(
-				"Loan Product", self.loan_product, ["interest_receivable_account", "interest_accrued_account"]
-			)
+			receivable_account = account_details.interest_receivable_account
+			accrual_account = account_details.interest_accrued_account
 
 			gl_entries = self.add_gl_entries(
 				gl_entries, receivable_account, accrual_account, party_type, party
 			)
 
-		super().make_gl_entries(gl_entries, cancel=cancel, merge_entries=False, adv_adj=0)
+		return gl_entries
 
 	def add_gl_entries(
 		self, gl_entries, receivable_account, accrual_account, party_type=None, party=None
 	):
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		if flt(self.demand_amount, precision):
 			gl_entries.append(
@@ -221,6 +251,23 @@ class LoanDemand(LoanController):
 		return gl_entries
 
 
+def get_demand_account_details(loan_product):
+	return frappe.db.get_value(
+		"Loan Product",
+		loan_product,
+		[
+			"interest_receivable_account",
+			"broken_period_interest_recovery_account",
+			"interest_accrued_account",
+			"penalty_accrued_account",
+			"penalty_receivable_account",
+			"additional_interest_accrued",
+			"additional_interest_receivable",
+		],
+		as_dict=1,
+	)
+
+
 def make_loan_demand_for_term_loans(
 	posting_date,
 	loan_product=None,
@@ -228,7 +275,7 @@ def make_loan_demand_for_term_loans(
 	process_loan_demand=None,
 	loan_disbursement=None,
 ):
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 
 	open_loans = get_open_loans(is_term_loan=1, loan_product=loan_product, loan=loan)
 
@@ -308,21 +355,34 @@ def process_term_loan_batch(
 
 	emi_rows = query.run(as_dict=True)
 
+	bulk_loans = get_bulk_demand_loans(loans)
+
+	if bulk_loans:
+		failed_loans = make_term_loan_demands_in_bulk(
+			[row for row in emi_rows if loan_repayment_schedule_map.get(row.parent) in bulk_loans],
+			{schedule.name: schedule for schedule in loan_repayment_schedules},
+			bulk_loans,
+			freeze_dates,
+			process_loan_demand,
+			precision,
+			commit=len(loans) > 1,
+		)
+
+		# Loans of a failed chunk go through the document path, row by row
+		emi_rows = [
+			row
+			for row in emi_rows
+			if loan_repayment_schedule_map.get(row.parent) not in bulk_loans
+			or loan_repayment_schedule_map.get(row.parent) in failed_loans
+		]
+
 	for row in emi_rows:
 		try:
 			freeze_date = freeze_dates.get(loan_repayment_schedule_map.get(row.parent))
 			if freeze_date and getdate(freeze_date) <= getdate(row.payment_date):
 				continue
 
-			paid_amount = 0
-
-			if not row.principal_amount and getdate(row.payment_date) < getdate(
-				start_date_map.get(row.parent)
-			):
-				demand_type = "BPI"
-				paid_amount = row.interest_amount
-			else:
-				demand_type = "EMI"
+			demand_type, paid_amount = get_term_loan_demand_type(row, start_date_map.get(row.parent))
 
 			if row.interest_amount:
 				create_loan_demand(
@@ -373,6 +433,103 @@ def process_term_loan_batch(
 				frappe.db.rollback()
 
 
+def get_term_loan_demand_type(row, repayment_start_date):
+	"""Returns the demand type and paid amount for the demands of a repayment schedule row"""
+	if not row.principal_amount and getdate(row.payment_date) < getdate(repayment_start_date):
+		return "BPI", row.interest_amount
+
+	return "EMI", 0
+
+
+def get_bulk_demand_loans(loans):
+	"""Returns the details of the loans whose company has bulk demand generation enabled"""
+	companies = frappe.get_all("Company", filters={"enable_bulk_demand_generation": 1}, pluck="name")
+
+	if not companies:
+		return {}
+
+	return {
+		loan.name: loan
+		for loan in frappe.get_all(
+			"Loan",
+			filters={"name": ("in", loans), "company": ("in", companies)},
+			fields=["name", "status", *LOAN_FIELDS_FOR_DEMAND],
+		)
+	}
+
+
+def make_term_loan_demands_in_bulk(
+	emi_rows,
+	schedules,
+	loans,
+	freeze_dates,
+	process_loan_demand,
+	precision,
+	commit=False,
+):
+	"""Make the EMI and BPI demands of due repayment schedule rows with multi-row inserts.
+
+	Loans are written in chunks, and each chunk commits once its demands and installment
+	counts are written. Without `commit` the first error is raised, else the chunk is rolled
+	back and its loans are returned so that they can go through the document path.
+	"""
+	loan_wise_demands = {}
+
+	for row in emi_rows:
+		schedule = schedules[row.parent]
+
+		freeze_date = freeze_dates.get(schedule.loan)
+		if freeze_date and getdate(freeze_date) <= getdate(row.payment_date):
+			continue
+
+		demand_type, paid_amount = get_term_loan_demand_type(row, schedule.repayment_start_date)
+
+		for demand_subtype, amount in (
+			("Interest", row.interest_amount),
+			("Principal", row.principal_amount),
+		):
+			if not amount:
+				continue
+
+			loan_wise_demands.setdefault(schedule.loan, []).append(
+				{
+					"loan": schedule.loan,
+					"loan_repayment_schedule": row.parent,
+					"loan_disbursement": schedule.loan_disbursement,
+					"repayment_schedule_detail": row.name,
+					"demand_date": row.payment_date,
+					"demand_type": demand_type,
+					"demand_subtype": demand_subtype,
+					"demand_amount": flt(amount, precision),
+					"process_loan_demand": process_loan_demand,
+					"paid_amount": paid_amount,
+				}
+			)
+
+	failed_loans = set()
+
+	for chunk in get_batches(list(loan_wise_demands), TERM_LOAN_DEMAND_CHUNK_SIZE):
+		try:
+			make_loan_demands_in_bulk(
+				[demand for loan in chunk for demand in loan_wise_demands[loan]], loans=loans
+			)
+			update_installment_counts_in_bulk(chunk)
+
+			if commit:
+				frappe.db.commit()
+		except Exception:
+			if not commit:
+				raise
+
+			frappe.db.rollback()
+			frappe.log_error(
+				title="Bulk Term Loan Demand Generation Error", message=frappe.get_traceback()
+			)
+			failed_loans.update(chunk)
+
+	return failed_loans
+
+
 def make_loan_demand_for_demand_loans(
 	posting_date,
 	loan_product=None,
@@ -399,6 +556,16 @@ def make_loan_demand_for_demand_loans(
 
 
 def process_demand_loan_batch(loans, posting_date, process_loan_demand):
+	bulk_loans = get_bulk_demand_loans(loans)
+
+	if bulk_loans:
+		failed_loans = make_demand_loan_demands_in_bulk(
+			bulk_loans, posting_date, process_loan_demand, commit=len(loans) > 1
+		)
+
+		# Loans of a failed chunk go through the document path, one by one
+		loans = [loan for loan in loans if loan not in bulk_loans or loan in failed_loans]
+
 	for loan in loans:
 		try:
 			make_loan_demand_for_demand_loan(posting_date, loan, process_loan_demand)
@@ -446,6 +613,10 @@ def make_loan_demand_for_demand_loan(posting_date, loan, process_loan_demand):
 	else:
 		total_pending_interest = 0
 
+	precision = get_currency_precision()
+	if flt(total_pending_interest, precision) <= 0:
+		return
+
 	create_loan_demand(
 		loan,
 		posting_date,
@@ -456,6 +627,86 @@ def make_loan_demand_for_demand_loan(posting_date, loan, process_loan_demand):
 	)
 
 
+def get_pending_interest_map(loans, posting_date):
+	"""Returns the interest accrued after the last demand on or before the posting date,
+	for a set of loans.
+
+	Loans are grouped on their last demand date, which is the same for most loans in a
+	batch, so that the accrued interest is summed with one grouped query per date.
+	"""
+	if not loans:
+		return {}
+
+	loan_demands = frappe.qb.DocType("Loan Demand")
+	last_demand_dates = frappe._dict(
+		(
+			frappe.qb.from_(loan_demands)
+			.select(loan_demands.loan, Max(loan_demands.demand_date))
+			.where(loan_demands.docstatus == 1)
+			.where(loan_demands.loan.isin(loans))
+			.where(loan_demands.demand_date <= posting_date)
+			.groupby(loan_demands.loan)
+		).run()
+	)
+
+	date_wise_loans = {}
+	for loan in loans:
+		date_wise_loans.setdefault(last_demand_dates.get(loan), []).append(loan)
+
+	pending_interest_map = frappe._dict()
+	interest_accruals = frappe.qb.DocType("Loan Interest Accrual")
+
+	for last_demand_date, date_loans in date_wise_loans.items():
+		query = (
+			frappe.qb.from_(interest_accruals)
+			.select(interest_accruals.loan, Sum(interest_accruals.interest_amount))
+			.where(interest_accruals.docstatus == 1)
+			.where(interest_accruals.loan.isin(date_loans))
+			.groupby(interest_accruals.loan)
+		)
+		if last_demand_date:
+			query = query.where(interest_accruals.posting_date > last_demand_date)
+
+		pending_interest_map.update(query.run())
+
+	return pending_interest_map
+
+
+def make_demand_loan_demands_in_bulk(loans, posting_date, process_loan_demand, commit=False):
+	"""Make the interest demands of demand loans with multi-row inserts.
+
+	`loans` maps loan names to loan details. Loans without pending interest are skipped.
+	Returns the loans whose demands could not be written.
+	"""
+	precision = get_currency_precision()
+	pending_interest_map = get_pending_interest_map(list(loans), posting_date)
+
+	demands = [
+		{
+			"loan": loan,
+			"demand_date": posting_date,
+			"demand_type": "Normal",
+			"demand_subtype": "Interest",
+			"demand_amount": flt(pending_interest, precision),
+			"process_loan_demand": process_loan_demand,
+		}
+		for loan, pending_interest in pending_interest_map.items()
+		if flt(pending_interest, precision) > 0
+	]
+
+	try:
+		writer = make_loan_demands_in_bulk(demands, loans=loans, commit=commit, raise_exception=False)
+		return {demand.loan for demand in writer.failed}
+	except Exception:
+		if commit:
+			frappe.db.rollback()
+
+		frappe.log_error(
+			title="Bulk Demand Loan Demand Generation Error", message=frappe.get_traceback()
+		)
+		return {demand["loan"] for demand in demands}
+
+
 def get_batches(open_loans, batch_size):
 	for i in range(0, len(open_loans), batch_size):
 		yield open_loans[i : i + batch_size]
@@ -502,7 +753,7 @@ def create_loan_demand(
 	posting_date=None,
 	loan_repayment=None,
 ):
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 	if amount:
 		demand = frappe.new_doc("Loan Demand")
 		demand.loan = loan
@@ -522,6 +773,171 @@ def create_loan_demand(
 		demand.submit()
 
 
+def make_loan_demands_in_bulk(demands, loans=None, commit=False, raise_exception=True):
+	"""Submit Loan Demands for a list of payloads with multi-row inserts.
+
+	Each payload carries the arguments of `create_loan_demand`, with the amount as
+	`demand_amount`. `loans` maps loan names to loan details, loans that are not in it
+	are fetched in one query. Returns the writer, which holds the written and the failed
+	documents.
+	"""
+	from lending.loan_management.bulk_writer import BulkDocumentWriter
+
+	precision = get_currency_precision()
+
+	demands = [frappe._dict(demand) for demand in demands]
+	demands = [demand for demand in demands if demand.demand_amount]
+
+	loans = frappe._dict(loans or {})
+	missing_loans = list({demand.loan for demand in demands} - set(loans))
+
+	if missing_loans:
+		for loan in frappe.get_all(
+			"Loan",
+			filters={"name": ("in", missing_loans)},
+			fields=["name", "status", *LOAN_FIELDS_FOR_DEMAND],
+		):
+			loans[loan.name] = loan
+
+	schedule_dates = get_linked_posting_date_map(
+		"Loan Repayment Schedule", [demand.loan_repayment_schedule for demand in demands]
+	)
+	invoice_dates = get_linked_posting_date_map(
+		"Sales Invoice", [demand.sales_invoice for demand in demands]
+	)
+
+	for demand in demands:
+		loan = loans[demand.loan]
+
+		for fieldname in LOAN_FIELDS_FOR_DEMAND:
+			demand.setdefault(fieldname, loan.get(fieldname))
+
+		demand.demand_amount = flt(demand.demand_amount, precision)
+		demand.paid_amount = flt(demand.paid_amount)
+		demand.disbursement_date = schedule_dates.get(demand.loan_repayment_schedule)
+		demand.invoice_date = invoice_dates.get(demand.sales_invoice)
+
+		# Values set in LoanDemand.validate
+		demand.outstanding_amount = demand.demand_amount - demand.paid_amount
+		demand.partner_share_allocated = 0
+		demand.posting_date = getdate()
+
+	set_partner_shares(demands)
+
+	account_details_map = {}
+
+	def get_gl_map(doc):
+		if not loan_accounting_enabled(doc.company):
+			return
+
+		if doc.loan_product not in account_details_map:
+			account_details_map[doc.loan_product] = get_demand_account_details(doc.loan_product)
+
+		return doc.get_gl_map(
+			loan_status=loans[doc.loan].status, account_details=account_details_map[doc.loan_product]
+		)
+
+	writer = BulkDocumentWriter(
+		"Loan Demand",
+		get_gl_map=get_gl_map,
+		after_insert=after_bulk_demand_insert,
+		commit=commit,
+	)
+	writer.write(demands, raise_exception=raise_exception)
+
+	# The failed chunks were rolled back to a savepoint after the snapshot may have reloaded
+	invalidate_unpaid_demands({demand.loan for demand in writer.failed})
+
+	return writer
+
+
+def get_linked_posting_date_map(doctype, names):
+	names = list({name for name in names if name})
+
+	if not names:
+		return {}
+
+	return frappe._dict(
+		frappe.get_all(
+			doctype, filters={"name": ("in", names)}, fields=["name", "posting_date"], as_list=1
+		)
+	)
+
+
+def set_partner_shares(demands):
+	co_lent_demands = [
+		demand
+		for demand in demands
+		if demand.loan_partner
+		and demand.demand_type == "EMI"
+		and demand.demand_subtype in ("Principal", "Interest")
+	]
+
+	if not co_lent_demands:
+		return
+
+	partner_shares = {}
+	for row in frappe.get_all(
+		"Co-Lender Schedule",
+		filters={"parent": ("in", list({demand.loan_repayment_schedule for demand in co_lent_demands}))},
+		fields=["parent", "payment_date", "principal_amount", "interest_amount"],
+	):
+		partner_shares.setdefault((row.parent, getdate(row.payment_date)), row)
+
+	for demand in co_lent_demands:
+		partner_share = partner_shares.get((demand.loan_repayment_schedule, getdate(demand.demand_date)))
+
+		if partner_share:
+			if demand.demand_subtype == "Principal":
+				demand.partner_share = partner_share.principal_amount
+			else:
+				demand.partner_share = partner_share.interest_amount
+
+
+def after_bulk_demand_insert(demands):
+	"""What `LoanDemand.on_submit` does after the GL entries, for a set of demands."""
+	from lending.loan_management.doctype.process_loan_interest_accrual.process_loan_interest_accrual import (
+		process_loan_interest_accrual_for_loans,
+	)
+
+	invalidate_unpaid_demands({demand.loan for demand in demands})
+
+	repayment_schedule_details = list(
+		{demand.repayment_schedule_detail for demand in demands if demand.repayment_schedule_detail}
+	)
+
+	if repayment_schedule_details:
+		RepaymentSchedule = frappe.qb.DocType("Repayment Schedule")
+		(
+			frappe.qb.update(RepaymentSchedule)
+			.set(RepaymentSchedule.demand_generated, 1)
+			.where(RepaymentSchedule.name.isin(repayment_schedule_details))
+		).run()
+
+	if frappe.flags.on_repost:
+		return
+
+	accruals = {}
+	for demand in demands:
+		if (
+			demand.demand_type in ("EMI", "Normal")
+			and demand.demand_subtype == "Interest"
+			and demand.process_loan_demand
+		):
+			accruals.setdefault(
+				(demand.loan, getdate(demand.demand_date), demand.loan_disbursement), demand.company
+			)
+
+	for (loan, demand_date, loan_disbursement), company in accruals.items():
+		process_loan_interest_accrual_for_loans(
+			posting_date=add_days(demand_date, -1),
+			loan=loan,
+			company=company,
+			from_demand=True,
+			loan_disbursement=loan_disbursement,
+		)
+
+
 def reverse_demands(
 	loan,
 	posting_date,
@@ -564,10 +980,77 @@ def reverse_demands(
 	if loan_disbursement:
 		filters["loan_disbursement"] = loan_disbursement
 
-	for demand in frappe.get_all("Loan Demand", filters=filters, or_filters=or_filters):
-		doc = frappe.get_doc("Loan Demand", demand.name)
-		doc.flags.ignore_links = True
-		doc.cancel()
+	demands = frappe.get_all(
+		"Loan Demand",
+		filters=filters,
+		or_filters=or_filters,
+		fields=["name", "loan", "company", "demand_date", "demand_type", "repayment_schedule_detail"],
+		for_update=True,
+	)
+
+	cancel_loan_demands_in_bulk(demands)
+
+	return demands
+
+
+def cancel_loan_demands_in_bulk(demands):
+	"""Cancel a set of demands and reverse their GL entries with set wide queries.
+
+	Charges demands go through the document, as cancelling them makes a credit note
+	against the sales invoice. The GL entries of written off loans are left as they are,
+	the same as when the demand is cancelled through the document.
+	"""
+	from lending.loan_management.bulk_writer import (
+		cancel_docs_in_bulk,
+		make_reverse_gl_entries_in_bulk,
+	)
+
+	bulk_demands = []
+
+	for demand in demands:
+		if demand.demand_type == "Charges":
+			doc = frappe.get_doc("Loan Demand", demand.name)
+			doc.flags.ignore_links = True
+			doc.cancel()
+		else:
+			bulk_demands.append(demand)
+
+	if not bulk_demands:
+		return
+
+	loans = list({demand.loan for demand in bulk_demands})
+	invalidate_unpaid_demands(loans)
+
+	# Demands of written off loans post no GL entries, see `LoanDemand.get_gl_map`
+	written_off_loans = set(
+		frappe.get_all(
+			"Loan", filters={"name": ("in", loans), "status": "Written Off"}, pluck="name"
+		)
+	)
+
+	make_reverse_gl_entries_in_bulk(
+		"Loan Demand",
+		[
+			demand.name
+			for demand in bulk_demands
+			if loan_accounting_enabled(demand.company) and demand.loan not in written_off_loans
+		],
+	)
+	cancel_docs_in_bulk("Loan Demand", [demand.name for demand in bulk_demands])
+
+	repayment_schedule_details = [
+		demand.repayment_schedule_detail
+		for demand in bulk_demands
+		if demand.repayment_schedule_detail
+	]
+
+	if repayment_schedule_details:
+		RepaymentSchedule = frappe.qb.DocType("Repayment Schedule")
+		(
+			frappe.qb.update(RepaymentSchedule)
+			.set(RepaymentSchedule.demand_generated, 0)
+			.where(RepaymentSchedule.name.isin(repayment_schedule_details))
+		).run()
 
 
 def make_credit_note(
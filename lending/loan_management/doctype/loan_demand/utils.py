@@ -0,0 +1,319 @@
+import frappe
+from frappe.query_builder.functions import Round
+from frappe.utils import flt, getdate
+
+from lending.loan_management.lending_config import get_currency_precision
+
+DEMAND_FIELDS = (
+	"name",
+	"loan",
+	"demand_date",
+	"sales_invoice",
+	"loan_repayment_schedule",
+	"loan_disbursement",
+	"loan_product",
+	"company",
+	"loan_partner",
+	"outstanding_amount",
+	"partner_outstanding",
+	"demand_subtype",
+	"demand_type",
+)
+
+PENALTY_DEMAND_TYPES = ("Penalty", "Additional Interest")
+
+# Loans whose unpaid demands batch jobs load together, in one transaction
+UNPAID_DEMAND_PREFETCH_SIZE = 50
+
+
+class UnpaidDemandSnapshot:
+	"""Unpaid demands of the loans touched in a transaction, loaded once and held in memory.
+
+	Every submitted demand of a loan with an outstanding amount is loaded, whatever its
+	date or type, so that the filters of `get_unpaid_demands` can be answered without going
+	back to the database. Anything that changes the outstanding amount of a demand drops the
+	loan through `invalidate_unpaid_demands`, and a commit or rollback drops the whole
+	snapshot, so demands changed by other transactions are never served.
+
+	Batch jobs load the demands of a chunk of loans at once with `prefetch_unpaid_demands`
+	and commit once per chunk.
+	"""
+
+	max_loans = 5000
+
+	def __init__(self):
+		self.demands = {}
+		self.clears_on_commit = False
+
+	def get_demands(self, loan):
+		if loan not in self.demands:
+			self.load([loan])
+
+		return self.demands[loan]
+
+	def load(self, loans):
+		from lending.loan_management.doctype.loan_repayment.loan_repayment import get_demand_query
+
+		if not loans:
+			return
+
+		precision = get_currency_precision()
+
+		loan_demand = frappe.qb.DocType("Loan Demand")
+		query = (
+			get_demand_query()
+			.select(
+				loan_demand.disbursement_date,
+				loan_demand.repayment_schedule_detail,
+				loan_demand.invoice_date,
+				loan_demand.creation,
+			)
+			.where(
+				(loan_demand.loan.isin(loans))
+				& (loan_demand.docstatus == 1)
+				& (Round(loan_demand.outstanding_amount, precision) > 0)
+			)
+		)
+
+		if not self.clears_on_commit:
+			frappe.db.after_commit.add(clear_unpaid_demand_snapshot)
+			frappe.db.after_rollback.add(clear_unpaid_demand_snapshot)
+			self.clears_on_commit = True
+
+		# Keep the snapshot bounded in long transactions
+		while self.demands and len(self.demands) + len(loans) > self.max_loans:
+			self.invalidate([next(iter(self.demands))])
+
+		for loan in loans:
+			self.demands[loan] = []
+
+		for demand in query.run(as_dict=1):
+			self.demands[demand.loan].append(demand)
+
+		for loan in loans:
+			self.demands[loan].sort(key=get_demand_sort_key)
+
+	def invalidate(self, loans):
+		for loan in loans:
+			self.demands.pop(loan, None)
+
+
+def get_unpaid_demand_snapshot():
+	if not frappe.flags.unpaid_demand_snapshot:
+		frappe.flags.unpaid_demand_snapshot = UnpaidDemandSnapshot()
+
+	return frappe.flags.unpaid_demand_snapshot
+
+
+def prefetch_unpaid_demands(loans):
+	"""Load the unpaid demands of a batch of loans in one query."""
+	snapshot = get_unpaid_demand_snapshot()
+	snapshot.load([loan for loan in loans if loan not in snapshot.demands])
+
+
+def process_loans_with_prefetched_demands(loans, process, error_title, get_loan_name=None):
+	"""Call `process` for each loan of a batch with the unpaid demands of a chunk of loans
+	loaded in one query, and return the loans that failed.
+
+	The snapshot only lives for a transaction, so each chunk is committed once. A loan that
+	fails is rolled back to a savepoint taken before it and logged, and the rest of the
+	chunk still goes through.
+	"""
+	failed_loans = []
+
+	for i in range(0, len(loans), UNPAID_DEMAND_PREFETCH_SIZE):
+		chunk = loans[i : i + UNPAID_DEMAND_PREFETCH_SIZE]
+		prefetch_unpaid_demands([get_loan_name(loan) if get_loan_name else loan for loan in chunk])
+
+		for loan in chunk:
+			loan_name = get_loan_name(loan) if get_loan_name else loan
+			savepoint = "loan_" + frappe.generate_hash(length=8)
+			frappe.db.savepoint(savepoint)
+
+			try:
+				process(loan)
+			except Exception:
+				frappe.db.rollback(save_point=savepoint)
+				invalidate_unpaid_demands([loan_name])
+				frappe.log_error(
+					title=error_title,
+					message=frappe.get_traceback(),
+					reference_doctype="Loan",
+					reference_name=loan_name,
+				)
+				failed_loans.append(loan)
+
+		frappe.db.commit()
+
+	return failed_loans
+
+
+def invalidate_unpaid_demands(loans):
+	if frappe.flags.unpaid_demand_snapshot:
+		frappe.flags.unpaid_demand_snapshot.invalidate(loans)
+
+
+def clear_unpaid_demand_snapshot():
+	frappe.flags.unpaid_demand_snapshot = None
+
+
+def get_unpaid_demand_conditions(
+	posting_date,
+	loan_product=None,
+	demand_type=None,
+	demand_subtype=None,
+	charges=None,
+	loan_disbursement=None,
+	emi_wise=False,
+	sales_invoice=None,
+):
+	"""Filters of `get_unpaid_demands` as (fieldname, operator, value). They are applied to
+	the snapshot by `filter_unpaid_demands` and to the locking query by
+	`get_unpaid_demand_criterion`."""
+	conditions = [("demand_date", "<=", getdate(posting_date))]
+
+	if loan_product:
+		conditions.append(("loan_product", "=", loan_product))
+
+	if demand_type and demand_type != "Penalty":
+		conditions.append(("demand_type", "=", demand_type))
+
+	if charges:
+		conditions.append(("demand_subtype", "in", tuple(charges)))
+
+	if sales_invoice:
+		conditions.append(("sales_invoice", "=", sales_invoice))
+
+	if demand_subtype:
+		if demand_subtype != "Penalty":
+			conditions.append(("demand_subtype", "=", demand_subtype))
+		else:
+			conditions.append(("demand_type", "in", PENALTY_DEMAND_TYPES))
+			conditions.append(("demand_subtype", "in", PENALTY_DEMAND_TYPES))
+
+	if loan_disbursement:
+		conditions.append(("loan_disbursement", "=", loan_disbursement))
+
+	if emi_wise:
+		conditions.append(("demand_type", "=", "EMI"))
+		conditions.append(("repayment_schedule_detail", "is", "set"))
+
+	return conditions
+
+
+def matches_conditions(demand, conditions):
+	for fieldname, operator, value in conditions:
+		demand_value = demand.get(fieldname)
+
+		if operator == "<=":
+			matches = getdate(demand_value) <= value
+		elif operator == "in":
+			matches = demand_value in value
+		elif operator == "is":
+			matches = bool(demand_value)
+		else:
+			matches = demand_value == value
+
+		if not matches:
+			return False
+
+	return True
+
+
+def get_unpaid_demand_criterion(loan_demand, conditions):
+	criterion = None
+
+	for fieldname, operator, value in conditions:
+		column = loan_demand[fieldname]
+
+		if operator == "<=":
+			condition = column <= value
+		elif operator == "in":
+			condition = column.isin(value)
+		elif operator == "is":
+			condition = column.isnotnull() & (column != "")
+		else:
+			condition = column == value
+
+		criterion = condition if criterion is None else criterion & condition
+
+	return criterion
+
+
+def filter_unpaid_demands(
+	demands,
+	posting_date,
+	loan_product=None,
+	demand_type=None,
+	demand_subtype=None,
+	limit=0,
+	charges=None,
+	loan_disbursement=None,
+	emi_wise=False,
+	sales_invoice=None,
+):
+	"""Apply the filters of `get_unpaid_demands` to the demands of a loan from the snapshot"""
+	conditions = get_unpaid_demand_conditions(
+		posting_date,
+		loan_product=loan_product,
+		demand_type=demand_type,
+		demand_subtype=demand_subtype,
+		charges=charges,
+		loan_disbursement=loan_disbursement,
+		emi_wise=emi_wise,
+		sales_invoice=sales_invoice,
+	)
+	filtered_demands = [demand for demand in demands if matches_conditions(demand, conditions)]
+
+	if demand_subtype == "Charges":
+		filtered_demands.sort(key=lambda demand: get_demand_sort_key(demand, charges=True))
+
+	if emi_wise:
+		filtered_demands = group_demands_by_emi(filtered_demands)
+	else:
+		filtered_demands = [
+			frappe._dict({field: demand.get(field) for field in DEMAND_FIELDS})
+			for demand in filtered_demands
+		]
+
+	if limit:
+		filtered_demands = filtered_demands[:limit]
+
+	return filtered_demands
+
+
+def group_demands_by_emi(demands):
+	emi_demands = {}
+
+	for demand in demands:
+		if demand.repayment_schedule_detail not in emi_demands:
+			emi_demand = frappe._dict({field: demand.get(field) for field in DEMAND_FIELDS})
+			emi_demand.update(
+				{"pending_amount": 0, "repayment_schedule_detail": demand.repayment_schedule_detail}
+			)
+			emi_demands[demand.repayment_schedule_detail] = emi_demand
+
+		emi_demands[demand.repayment_schedule_detail].pending_amount += flt(demand.outstanding_amount)
+
+	return list(emi_demands.values())
+
+
+def get_demand_sort_key(demand, charges=False):
+	# Same order as the demand query, with nulls first as in MariaDB
+	fields = [
+		"demand_date",
+		"disbursement_date",
+		"repayment_schedule_detail",
+		"demand_type",
+		"creation",
+		"invoice_date" if charges else "demand_subtype",
+	]
+
+	return [get_sort_value(demand.get(field)) for field in fields]
+
+
+def get_sort_value(value):
+	if isinstance(value, str):
+		value = value.casefold()
+
+	return (value is not None, value)
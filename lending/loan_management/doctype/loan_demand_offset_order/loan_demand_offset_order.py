@@ -4,6 +4,9 @@
 # import frappe
 from frappe.model.document import Document
 
+from lending.loan_management.doctype.loan_repayment.allocation_engine import clear_allocation_plan
+from lending.loan_management.lending_config import clear_lending_config
+
 
 class LoanDemandOffsetOrder(Document):
 	# begin: auto-generated types
@@ -31,3 +34,11 @@ class LoanDemandOffsetOrder(Document):
 			self.append("components", {
 				"demand_type": "Interest",
 			})
+
+	def on_update(self):
+		clear_allocation_plan(self.name)
+		clear_lending_config(self)
+
+	def on_trash(self):
+		clear_allocation_plan(self.name)
+		clear_lending_config(self)
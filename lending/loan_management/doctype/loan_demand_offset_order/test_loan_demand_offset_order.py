@@ -1,9 +1,54 @@
 # Copyright (c) 2023, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from lending.loan_management.doctype.loan_repayment.allocation_engine import (
+	COMPONENT_STEPS,
+	DemandAllocator,
+	get_allocation_plan,
+)
+
 
 class TestLoanDemandOffsetOrder(FrappeTestCase):
-	pass
+	def test_allocation_plan_recompiled_on_save(self):
+		order = frappe.new_doc("Loan Demand Offset Order")
+		order.title = "Test Allocation Plan Offset Order"
+		order.append("components", {"demand_type": "Penalty"})
+		order.insert()
+
+		self.assertEqual(get_allocation_plan(order.name), [COMPONENT_STEPS["Penalty"]])
+
+		order.append("components", {"demand_type": "Charges"})
+		order.save()
+
+		self.assertEqual(
+			get_allocation_plan(order.name), [COMPONENT_STEPS["Penalty"], COMPONENT_STEPS["Charges"]]
+		)
+
+	def test_demand_allocation_follows_plan(self):
+		demands = [
+			frappe._dict(
+				name=name,
+				demand_type=demand_type,
+				demand_subtype=demand_subtype,
+				outstanding_amount=outstanding_amount,
+			)
+			for name, demand_type, demand_subtype, outstanding_amount in (
+				("D1", "EMI", "Interest", 100),
+				("D2", "EMI", "Principal", 400),
+				("D3", "Penalty", "Penalty", 50),
+				("D4", "EMI", "Interest", 100),
+			)
+		]
+		plan = [COMPONENT_STEPS["Penalty"], COMPONENT_STEPS["Normal"], COMPONENT_STEPS["Principal"]]
+
+		allocator = DemandAllocator(demands, is_term_loan=True, precision=2)
+		pending_amount = allocator.allocate(plan, 500)
+
+		self.assertEqual(pending_amount, 0)
+		self.assertEqual(
+			[(d["loan_demand"], d["paid_amount"]) for d in allocator.allocations],
+			[("D3", 50), ("D1", 100), ("D4", 100), ("D2", 250)],
+		)
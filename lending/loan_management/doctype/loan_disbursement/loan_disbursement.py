@@ -40,6 +40,7 @@ from lending.loan_management.doctype.loan_security_release.loan_security_release
 from lending.loan_management.doctype.process_loan_interest_accrual.process_loan_interest_accrual import (
 	process_loan_interest_accrual_for_loans,
 )
+from lending.loan_management.lending_config import get_currency_precision, get_lending_config
 from lending.loan_management.utils import loan_accounting_enabled
 
 
@@ -142,7 +143,7 @@ class LoanDisbursement(LoanController):
 		return draft_schedule
 
 	def make_update_draft_schedule(self):
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 		draft_schedule = self.get_draft_schedule()
 		loan_product = frappe.db.get_value("Loan", self.against_loan, "loan_product")
 		loan_details = frappe.db.get_value(
@@ -530,7 +531,7 @@ class LoanDisbursement(LoanController):
 		)
 
 	def get_values_on_submit(self, loan_details):
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 		disbursed_amount = self.disbursed_amount + loan_details.disbursed_amount
 
 		if loan_details.repayment_schedule_type == "Line of Credit":
@@ -646,7 +647,7 @@ class LoanDisbursement(LoanController):
 		gle_map = []
 		remarks = _("Disbursement against loan:") + self.against_loan
 
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		if self.get("refund_account") and cancel:
 			bank_account = self.refund_account
@@ -668,14 +669,13 @@ class LoanDisbursement(LoanController):
 				remarks,
 			)
 
-		bpi_recovery_method = frappe.db.get_value(
-			"Loan Product", self.loan_product, "bpi_recovery_method"
-		)
+		loan_product_config = get_lending_config().get_loan_product(self.loan_product)
+		bpi_recovery_method = loan_product_config.bpi_recovery_method
 
 		if bpi_recovery_method == "Upfront Deduction":
 			if self.broken_period_interest:
-				broken_period_interest_account = frappe.db.get_value(
-					"Loan Product", self.loan_product, "broken_period_interest_recovery_account"
+				broken_period_interest_account = (
+					loan_product_config.broken_period_interest_recovery_account
 				)
 
 				if not broken_period_interest_account:
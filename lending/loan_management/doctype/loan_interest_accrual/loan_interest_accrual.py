@@ -22,6 +22,9 @@ from frappe.utils import (
 
 from lending.loan_management.controllers.loan_controller import LoanController
 from lending.loan_management.doctype.loan_demand.loan_demand import create_loan_demand
+from lending.loan_management.doctype.loan_demand.utils import process_loans_with_prefetched_demands
+from lending.loan_management.doctype.loan_interest_accrual.utils import RepaymentScheduleBalances
+from lending.loan_management.lending_config import get_currency_precision, get_lending_config
 from lending.loan_management.utils import loan_accounting_enabled
 from lending.utils import daterange
 
@@ -36,6 +39,8 @@ class LoanInterestAccrual(LoanController):
 		from frappe.types import DF
 
 		accrual_date: DF.Date | None
+		accrual_journal_entry: DF.Link | None
+		accrual_journal_posted: DF.Check
 		accrual_type: DF.Literal[
 			"Regular", "Repayment", "Disbursement", "Credit Adjustment", "Debit Adjustment", "Refund"
 		]
@@ -63,6 +68,7 @@ class LoanInterestAccrual(LoanController):
 		process_loan_interest_accrual: DF.Link | None
 		rate_of_interest: DF.Float
 		start_date: DF.Datetime | None
+		summarized_gl_entry: DF.Check
 		unmark_npa: DF.Check
 	# end: auto-generated types
 
@@ -164,7 +170,10 @@ class LoanInterestAccrual(LoanController):
 		if not loan_accounting_enabled(self.company):
 			return
 
-		gle_map = []
+		if cancel and self.summarized_gl_entry:
+			self.reverse_summarized_gl_entries(adv_adj=adv_adj)
+			return
+
 		loan_status = frappe.db.get_value("Loan", self.loan, "status")
 
 		if loan_status == "Written Off":
@@ -178,22 +187,42 @@ class LoanInterestAccrual(LoanController):
 			if write_off_date and getdate(self.posting_date) >= write_off_date:
 				return
 
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
-
-		cost_center = frappe.db.get_value("Loan", self.loan, "cost_center")
-		account_details = frappe.db.get_value(
-			"Loan Product",
-			self.loan_product,
-			[
-				"interest_accrued_account",
-				"interest_income_account",
-				"penalty_accrued_account",
-				"penalty_income_account",
-				"additional_interest_income",
-				"additional_interest_accrued",
-			],
-			as_dict=1,
-		)
+		if not cancel and summarize_accrual_gl_entries(self.company):
+			# Posted along with the other accruals of the day by `post_summarized_accrual_entries`
+			self.db_set("summarized_gl_entry", 1)
+			return
+
+		gle_map = self.get_gl_map()
+
+		if gle_map:
+			super().make_gl_entries(gle_map, cancel=cancel, adv_adj=adv_adj, merge_entries=False)
+
+	def reverse_summarized_gl_entries(self, adv_adj=0):
+		# Accruals not in a journal yet are left out of it once cancelled
+		if not self.accrual_journal_posted:
+			return
+
+		gle_map = self.get_gl_map()
+
+		for gle in gle_map:
+			gle.debit, gle.credit = gle.get("credit"), gle.get("debit")
+			gle.debit_in_account_currency, gle.credit_in_account_currency = (
+				gle.get("credit_in_account_currency"),
+				gle.get("debit_in_account_currency"),
+			)
+
+		if gle_map:
+			super().make_gl_entries(gle_map, adv_adj=adv_adj, merge_entries=False)
+
+	def get_gl_map(self, cost_center=None, account_details=None):
+		precision = get_currency_precision()
+		gle_map = []
+
+		if not cost_center:
+			cost_center = frappe.db.get_value("Loan", self.loan, "cost_center")
+
+		if not account_details:
+			account_details = get_accrual_account_details(self.loan_product)
 
 		if self.interest_type == "Normal Interest":
 			receivable_account = account_details.interest_accrued_account
@@ -313,8 +342,27 @@ class LoanInterestAccrual(LoanController):
 				)
 			)
 
-		if gle_map:
-			super().make_gl_entries(gle_map, cancel=cancel, adv_adj=adv_adj, merge_entries=False)
+		return gle_map
+
+
+def summarize_accrual_gl_entries(company):
+	return cint(get_lending_config().get_company(company).summarize_accrual_gl_entries)
+
+
+def get_accrual_account_details(loan_product):
+	return frappe.db.get_value(
+		"Loan Product",
+		loan_product,
+		[
+			"interest_accrued_account",
+			"interest_income_account",
+			"penalty_accrued_account",
+			"penalty_income_account",
+			"additional_interest_income",
+			"additional_interest_accrued",
+		],
+		as_dict=1,
+	)
 
 
 # For Eg: If Loan disbursement date is '01-09-2019' and disbursed amount is 1000000 and
@@ -329,6 +377,7 @@ def calculate_accrual_amount_for_loans(
 	accrual_date=None,
 	loan_disbursement=None,
 	loan_accrual_frequency=None,
+	context=None,
 ):
 	from lending.loan_management.doctype.loan_repayment.loan_repayment import (
 		get_pending_principal_amount,
@@ -348,6 +397,7 @@ def calculate_accrual_amount_for_loans(
 			posting_date,
 			loan_accrual_frequency,
 			loan_disbursement=loan_disbursement,
+			context=context,
 		)
 
 		total_payable_interest = process_loan_interest_accrual_per_schedule(
@@ -357,10 +407,15 @@ def calculate_accrual_amount_for_loans(
 			is_future_accrual=is_future_accrual,
 			process_loan_interest=process_loan_interest,
 			accrual_type=accrual_type,
+			context=context,
 		)
 	else:
 		last_accrual_date = get_last_accrual_date(
-			loan.name, posting_date, "Normal Interest", loan_disbursement=loan_disbursement
+			loan.name,
+			posting_date,
+			"Normal Interest",
+			loan_disbursement=loan_disbursement,
+			context=context,
 		)
 
 		no_of_days = date_diff(posting_date or nowdate(), last_accrual_date)
@@ -388,6 +443,7 @@ def calculate_accrual_amount_for_loans(
 				accrual_type,
 				"Normal Interest",
 				loan.rate_of_interest,
+				context=context,
 			)
 
 	if is_future_accrual:
@@ -429,14 +485,24 @@ def process_loan_interest_accrual_per_schedule(
 	is_future_accrual=False,
 	process_loan_interest=None,
 	accrual_type=None,
+	context=None,
 ):
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 	total_payable_interest = 0
 
+	# Principal for every break date is looked up from the schedule rows loaded once here
+	if context:
+		schedule_balances = context.schedule_balances
+	else:
+		break_dates = [getdate(date) for dates in parent_wise_schedules.values() for date in dates]
+		schedule_balances = RepaymentScheduleBalances(
+			list(parent_wise_schedules), to_date=max(break_dates) if break_dates else None
+		)
+
 	for parent in parent_wise_schedules:
 		for payment_date in parent_wise_schedules[parent]:
 			last_accrual_date_for_schedule = last_accrual_date_map.get(parent)
-			pending_principal_amount = get_principal_amount_for_term_loan(parent, payment_date)
+			pending_principal_amount = schedule_balances.get_principal_amount(parent, payment_date)
 			payable_interest = get_interest_for_term(
 				loan.company,
 				loan.rate_of_interest,
@@ -460,6 +526,7 @@ def process_loan_interest_accrual_per_schedule(
 						loan.rate_of_interest,
 						loan_repayment_schedule=parent,
 						accrual_date=payment_date,
+						context=context,
 					)
 
 				last_accrual_date_map[parent] = add_days(payment_date, 1)
@@ -511,9 +578,30 @@ def make_loan_interest_accrual_entry(
 	accrual_date=None,
 	loan_repayment_schedule_detail=None,
 	loan_disbursement=None,
+	context=None,
 ):
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 	if flt(interest_amount, precision) > 0:
+		if context:
+			# Bulk mode, the accrual is written along with the rest of the batch
+			context.add_accrual(
+				loan,
+				base_amount=flt(base_amount, precision),
+				interest_amount=flt(interest_amount, precision),
+				process_loan_interest_accrual=process_loan_interest,
+				start_date=start_date,
+				posting_date=posting_date or nowdate(),
+				accrual_type=accrual_type,
+				interest_type=interest_type,
+				rate_of_interest=rate_of_interest,
+				loan_demand=loan_demand,
+				loan_repayment_schedule=loan_repayment_schedule,
+				additional_interest_amount=additional_interest,
+				loan_repayment_schedule_detail=loan_repayment_schedule_detail,
+				loan_disbursement=loan_disbursement,
+			)
+			return
+
 		loan_interest_accrual = frappe.new_doc("Loan Interest Accrual")
 		loan_interest_accrual.loan = loan
 		loan_interest_accrual.interest_amount = flt(interest_amount, precision)
@@ -535,9 +623,262 @@ def make_loan_interest_accrual_entry(
 		loan_interest_accrual.submit()
 
 
-def get_overlapping_dates(loan, posting_date, loan_accrual_frequency, loan_disbursement=None):
+def make_loan_interest_accruals_in_bulk(accruals, loans=None, commit=False, raise_exception=True):
+	"""Submit Loan Interest Accruals for a list of payloads with multi-row inserts.
+
+	Each payload carries the values `make_loan_interest_accrual_entry` sets on the document.
+	`loans` maps loan names to loan details, loans that are not in it are fetched in one
+	query. Returns the writer, which holds the written and the failed documents.
+	"""
+	from lending.loan_management.bulk_writer import BulkDocumentWriter
+
+	loans = frappe._dict(loans or {})
+	missing_loans = list({accrual["loan"] for accrual in accruals} - set(loans))
+
+	if missing_loans:
+		for loan in frappe.get_all(
+			"Loan",
+			filters={"name": ("in", missing_loans)},
+			fields=[
+				"name",
+				"status",
+				"applicant_type",
+				"applicant",
+				"company",
+				"loan_product",
+				"is_term_loan",
+				"is_npa",
+				"unmark_npa",
+				"cost_center",
+			],
+		):
+			loans[loan.name] = loan
+
+	schedule_disbursements = get_schedule_disbursement_map(accruals)
+	last_posting_dates = {}
+	payloads = []
+
+	for accrual in accruals:
+		accrual = frappe._dict(accrual)
+		loan = loans[accrual.loan]
+
+		if accrual.loan_repayment_schedule and not accrual.loan_disbursement:
+			accrual.loan_disbursement = schedule_disbursements.get(accrual.loan_repayment_schedule)
+
+		accrual.posting_date = accrual.posting_date or nowdate()
+		accrual.accrual_date = nowdate()
+
+		# Accruals earlier in the set are not in the database yet
+		key = (accrual.loan, accrual.interest_type, accrual.loan_disbursement)
+		if not accrual.last_accrual_date:
+			if key in last_posting_dates:
+				accrual.last_accrual_date = last_posting_dates[key]
+			else:
+				accrual.last_accrual_date = get_last_accrual_date(
+					accrual.loan,
+					accrual.posting_date,
+					accrual.interest_type,
+					loan_disbursement=accrual.loan_disbursement,
+				)
+		last_posting_dates[key] = accrual.posting_date
+
+		for fieldname in (
+			"applicant_type",
+			"applicant",
+			"company",
+			"loan_product",
+			"is_term_loan",
+			"is_npa",
+			"unmark_npa",
+			"cost_center",
+		):
+			accrual.setdefault(fieldname, loan.get(fieldname))
+
+		payloads.append(accrual)
+
+	account_details_map = {}
+	write_off_dates = {}
+	summarized_accruals = []
+
+	def get_gl_map(doc):
+		if not loan_accounting_enabled(doc.company):
+			return
+
+		if loans[doc.loan].status == "Written Off":
+			if doc.loan not in write_off_dates:
+				write_off_dates[doc.loan] = frappe.db.get_value(
+					"Loan Write Off",
+					{"loan": doc.loan, "docstatus": 1},
+					"value_date",
+					order_by="value_date desc",
+				)
+
+			if write_off_dates[doc.loan] and getdate(doc.posting_date) >= write_off_dates[doc.loan]:
+				return
+
+		if summarize_accrual_gl_entries(doc.company):
+			summarized_accruals.append(doc.name)
+			return
+
+		if doc.loan_product not in account_details_map:
+			account_details_map[doc.loan_product] = get_accrual_account_details(doc.loan_product)
+
+		return doc.get_gl_map(
+			cost_center=loans[doc.loan].cost_center,
+			account_details=account_details_map[doc.loan_product],
+		)
+
+	def after_insert(docs):
+		if summarized_accruals:
+			set_summarized_gl_entry(summarized_accruals)
+			summarized_accruals.clear()
+
+		for doc in docs:
+			if doc.is_npa and not doc.unmark_npa and loans[doc.loan].status != "Written Off":
+				make_suspense_entries_for_accrual(doc)
+
+	writer = BulkDocumentWriter(
+		"Loan Interest Accrual",
+		validate=validate_accruals_in_bulk,
+		get_gl_map=get_gl_map,
+		after_insert=after_insert,
+		commit=commit,
+	)
+	writer.write(payloads, raise_exception=raise_exception)
+
+	return writer
+
+
+def set_summarized_gl_entry(accruals):
+	LoanInterestAccrual = DocType("Loan Interest Accrual")
+	(
+		frappe.qb.update(LoanInterestAccrual)
+		.set(LoanInterestAccrual.summarized_gl_entry, 1)
+		.where(LoanInterestAccrual.name.isin(accruals))
+	).run()
+
+
+def get_schedule_disbursement_map(accruals):
+	schedules = list(
+		{
+			accrual.get("loan_repayment_schedule")
+			for accrual in accruals
+			if accrual.get("loan_repayment_schedule") and not accrual.get("loan_disbursement")
+		}
+	)
+
+	if not schedules:
+		return {}
+
+	return frappe._dict(
+		frappe.get_all(
+			"Loan Repayment Schedule",
+			filters={"name": ("in", schedules)},
+			fields=["name", "loan_disbursement"],
+			as_list=1,
+		)
+	)
+
+
+def make_suspense_entries_for_accrual(doc):
+	from lending.loan_management.doctype.loan.loan import make_suspense_journal_entry
+
+	normal_interest_jv, additional_interest_jv = make_suspense_journal_entry(
+		doc.loan,
+		doc.company,
+		doc.loan_product,
+		doc.interest_amount,
+		doc.accrual_date,
+		doc.posting_date,
+		is_penal=doc.interest_type != "Normal Interest",
+		additional_interest=doc.additional_interest_amount,
+	)
+
+	if normal_interest_jv or additional_interest_jv:
+		frappe.db.set_value(
+			"Loan Interest Accrual",
+			doc.name,
+			{
+				"normal_interest_journal_entry": normal_interest_jv,
+				"additional_interest_suspense_entry": additional_interest_jv,
+			},
+			update_modified=False,
+		)
+
+
+def validate_accruals_in_bulk(docs):
+	"""Set wide version of `LoanInterestAccrual.validate`, overlapping normal interest
+	accruals are looked up for all the loans in one query.
+	"""
+	for doc in docs:
+		if not doc.interest_amount:
+			frappe.throw(_("Interest Amount is mandatory"))
+
+	accruals = {}
+	for doc in docs:
+		if doc.interest_type == "Normal Interest":
+			accruals.setdefault((doc.loan, doc.loan_disbursement), []).append(doc)
+
+	if not accruals:
+		return
+
+	existing_accruals = {}
+	min_start_date = min(getdate(doc.start_date) for d in accruals.values() for doc in d)
+
+	LoanInterestAccrual = DocType("Loan Interest Accrual")
+	for row in (
+		frappe.qb.from_(LoanInterestAccrual)
+		.select(
+			LoanInterestAccrual.name,
+			LoanInterestAccrual.loan,
+			LoanInterestAccrual.loan_disbursement,
+			LoanInterestAccrual.start_date,
+			LoanInterestAccrual.posting_date,
+		)
+		.where(
+			(LoanInterestAccrual.docstatus == 1)
+			& (LoanInterestAccrual.loan.isin(list({loan for loan, _disbursement in accruals})))
+			& (LoanInterestAccrual.interest_type == "Normal Interest")
+			& (Cast(LoanInterestAccrual.posting_date, "date") >= min_start_date)
+		)
+		.run(as_dict=True)
+	):
+		# Same as the document, which matches on loan_disbursement and so never on a null one
+		if row.loan_disbursement:
+			existing_accruals.setdefault((row.loan, row.loan_disbursement), []).append(
+				[row.name, row.start_date, row.posting_date]
+			)
+
+	for key, key_docs in accruals.items():
+		overlapping_accruals = existing_accruals.get(key, [])
+
+		for doc in sorted(key_docs, key=lambda d: getdate(d.start_date)):
+			overlaps = [
+				accrual
+				for accrual in overlapping_accruals
+				if getdate(accrual[2]) >= getdate(doc.start_date)
+				and getdate(accrual[1]) <= getdate(doc.posting_date)
+			]
+
+			if overlaps:
+				frappe.throw(
+					_(
+						"There are overlapping accruals here {}, the current acrrual date gets accrued from {} to {}"
+					).format(overlaps, doc.start_date, doc.posting_date)
+				)
+
+			overlapping_accruals.append([doc.name, doc.start_date, doc.posting_date])
+
+
+def get_overlapping_dates(
+	loan, posting_date, loan_accrual_frequency, loan_disbursement=None, context=None
+):
 	parent_wise_schedules, maturity_map, accrual_schedule_map = get_parent_wise_dates(
-		loan, posting_date, loan_accrual_frequency, loan_disbursement=loan_disbursement
+		loan,
+		posting_date,
+		loan_accrual_frequency,
+		loan_disbursement=loan_disbursement,
+		context=context,
 	)
 
 	# Merge accrual_frequency_breaks into repayment_schedule breaks and get all unique dates
@@ -561,22 +902,6 @@ def get_overlapping_dates(loan, posting_date, loan_accrual_frequency, loan_disbu
 	return parent_wise_schedules, accrual_schedule_map
 
 
-def get_principal_amount_for_term_loan(repayment_schedule, date):
-	principal_amount = frappe.db.get_value(
-		"Repayment Schedule",
-		{"parent": repayment_schedule, "payment_date": ("<=", date)},
-		"balance_loan_amount",
-		order_by="payment_date DESC",
-	)
-
-	if not principal_amount:
-		principal_amount = frappe.db.get_value(
-			"Loan Repayment Schedule", repayment_schedule, "current_principal_amount", cache=True
-		)
-
-	return principal_amount
-
-
 def get_term_loan_payment_date(loan_repayment_schedule, date):
 	payment_date = frappe.db.get_value(
 		"Repayment Schedule",
@@ -594,135 +919,281 @@ def calculate_penal_interest_for_loans(
 	accrual_type=None,
 	is_future_accrual=0,
 	loan_disbursement=None,
+	aggregate=None,
 ):
 	from lending.loan_management.doctype.loan_repayment.loan_repayment import get_unpaid_demands
 
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 
 	loan_product = loan.loan_product
 	freeze_date = loan.freeze_date
 	loan_status = loan.status
 	penal_interest_rate = loan.penalty_charges_rate
 
+	loan_product_config = get_lending_config().get_loan_product(loan_product)
+
 	if not penal_interest_rate:
-		penal_interest_rate = frappe.get_value(
-			"Loan Product", loan_product, "penalty_interest_rate", cache=True
-		)
+		penal_interest_rate = loan_product_config.penalty_interest_rate
 
 	if flt(penal_interest_rate, precision) <= 0:
 		return 0
 
 	demands = get_unpaid_demands(loan.name, posting_date, emi_wise=True)
 
-	grace_period_days = cint(
-		frappe.get_value("Loan Product", loan_product, "grace_period_in_days", cache=True)
-	)
-	total_penal_interest = 0
+	grace_period_days = cint(loan_product_config.grace_period_in_days)
 
 	if freeze_date and getdate(freeze_date) < getdate(posting_date):
 		posting_date = freeze_date
 
-	for demand in demands:
-		penal_interest_amount = 0
-		additional_interest = 0
-		on_migrate = False
+	total_penal_interest, penal_interest_rows = get_penal_interest_breakup(
+		loan,
+		demands,
+		posting_date,
+		penal_interest_rate,
+		grace_period_days,
+		loan_disbursement=loan_disbursement,
+	)
 
-		if getdate(posting_date) >= add_days(getdate(demand.demand_date), grace_period_days):
-			last_accrual_date = get_last_accrual_date(
-				loan.name,
-				posting_date,
-				"Penal Interest",
-				repayment_schedule_detail=demand.repayment_schedule_detail,
-				loan_disbursement=loan_disbursement,
-			)
+	if is_future_accrual:
+		return total_penal_interest
+
+	if aggregate is None:
+		company_config = get_lending_config().get_company(loan.company)
+		aggregate = cint(company_config.aggregate_penal_interest_entries)
+
+	if aggregate:
+		penal_interest_rows = aggregate_penal_interest_rows(penal_interest_rows)
+
+	for row in penal_interest_rows:
+		demand = row.demand
+		make_loan_interest_accrual_entry(
+			loan.name,
+			demand.pending_amount,
+			row.penal_interest_amount,
+			process_loan_interest,
+			row.from_date,
+			row.to_date,
+			accrual_type,
+			"Penal Interest",
+			penal_interest_rate,
+			loan_demand=demand.name,
+			additional_interest=row.additional_interest,
+			loan_disbursement=demand.loan_disbursement,
+			loan_repayment_schedule_detail=demand.repayment_schedule_detail,
+		)
 
-			if not last_accrual_date:
-				last_accrual_date = get_last_accrual_date(
+		if loan_status != "Written Off":
+			if row.penal_interest_amount > row.additional_interest:
+				create_loan_demand(
 					loan.name,
-					posting_date,
-					"Penal Interest",
-					demand=demand.name,
+					add_days(row.to_date, 1),
+					"Penalty",
+					"Penalty",
+					row.penal_interest_amount - row.additional_interest,
+					loan_repayment_schedule=demand.loan_repayment_schedule,
+					loan_disbursement=demand.loan_disbursement,
 				)
-				on_migrate = True
-
-			if not last_accrual_date:
-				from_date = demand.demand_date
-			elif on_migrate:
-				from_date = last_accrual_date
-				if getdate(from_date) <= getdate(demand.demand_date):
-					from_date = demand.demand_date
-			else:
-				from_date = add_days(last_accrual_date, 1)
 
-			for current_date in daterange(getdate(from_date), getdate(posting_date)):
+			if flt(row.additional_interest, precision) > 0:
+				create_loan_demand(
+					loan.name,
+					add_days(row.to_date, 1),
+					"Additional Interest",
+					"Additional Interest",
+					row.additional_interest,
+					loan_repayment_schedule=demand.loan_repayment_schedule,
+					loan_disbursement=demand.loan_disbursement,
+				)
 
-				penal_interest_amount = flt(demand.pending_amount) * penal_interest_rate / 36500
 
-				if flt(penal_interest_amount, precision) > 0:
-					total_penal_interest += penal_interest_amount
+def get_penal_interest_breakup(
+	loan, demands, posting_date, penal_interest_rate, grace_period_days, loan_disbursement=None
+):
+	"""Returns the total penal interest and the per day penal and additional interest for
+	every overdue EMI demand of the loan, computed in one pass over the demand set.
 
-					principal_amount = frappe.db.get_value(
-						"Loan Demand",
-						{
-							"loan": loan.name,
-							"repayment_schedule_detail": demand.repayment_schedule_detail,
-							"demand_type": "EMI",
-							"demand_subtype": "Principal",
-						},
-						"outstanding_amount",
-					)
+	Days for which the EMI has no principal demand count towards the total but get no row,
+	same as the entries that were skipped when this was computed day by day.
+	"""
+	precision = get_currency_precision()
+	posting_date = getdate(posting_date)
 
-					if not principal_amount:
-						continue
+	overdue_demands = [
+		demand
+		for demand in demands
+		if posting_date >= add_days(getdate(demand.demand_date), grace_period_days)
+	]
+
+	if not overdue_demands:
+		return 0, []
+
+	schedule_details = [demand.repayment_schedule_detail for demand in overdue_demands]
+	last_accrual_dates, last_demand_accrual_dates = get_last_penal_accrual_date_maps(
+		loan.name,
+		schedule_details,
+		[demand.name for demand in overdue_demands],
+		loan_disbursement=loan_disbursement,
+	)
+	principal_amounts = get_emi_principal_outstanding_map(loan.name, schedule_details)
 
-					per_day_interest = get_per_day_interest(
-						principal_amount, loan.rate_of_interest, loan.company, current_date
-					)
-					additional_interest = flt(per_day_interest, precision)
-
-					if not is_future_accrual:
-						if flt(penal_interest_amount, precision) > 0:
-							make_loan_interest_accrual_entry(
-								loan.name,
-								demand.pending_amount,
-								penal_interest_amount,
-								process_loan_interest,
-								current_date,
-								current_date,
-								accrual_type,
-								"Penal Interest",
-								penal_interest_rate,
-								loan_demand=demand.name,
-								additional_interest=additional_interest,
-								loan_disbursement=demand.loan_disbursement,
-								loan_repayment_schedule_detail=demand.repayment_schedule_detail,
-							)
-
-						if loan_status != "Written Off":
-							if penal_interest_amount > additional_interest:
-								create_loan_demand(
-									loan.name,
-									add_days(current_date, 1),
-									"Penalty",
-									"Penalty",
-									penal_interest_amount - additional_interest,
-									loan_repayment_schedule=demand.loan_repayment_schedule,
-									loan_disbursement=demand.loan_disbursement,
-								)
-
-							if flt(additional_interest, precision) > 0:
-								create_loan_demand(
-									loan.name,
-									add_days(current_date, 1),
-									"Additional Interest",
-									"Additional Interest",
-									additional_interest,
-									loan_repayment_schedule=demand.loan_repayment_schedule,
-									loan_disbursement=demand.loan_disbursement,
-								)
+	interest_day_count_convention = (
+		get_lending_config().get_company(loan.company).interest_day_count_convention
+	)
 
-	if is_future_accrual:
-		return total_penal_interest
+	total_penal_interest = 0
+	rows = []
+
+	for demand in overdue_demands:
+		from_date = get_penal_interest_from_date(
+			demand,
+			last_accrual_dates.get(demand.repayment_schedule_detail),
+			last_demand_accrual_dates.get(demand.name),
+		)
+
+		# Penal interest on a demand does not change day to day, only the number of days does
+		penal_interest_amount = flt(demand.pending_amount) * penal_interest_rate / 36500
+		if flt(penal_interest_amount, precision) <= 0:
+			continue
+
+		principal_amount = principal_amounts.get(demand.repayment_schedule_detail)
+		per_day_interest_by_year = {}
+
+		for current_date in daterange(getdate(from_date), posting_date):
+			total_penal_interest += penal_interest_amount
+
+			if not principal_amount:
+				continue
+
+			if current_date.year not in per_day_interest_by_year:
+				per_day_interest_by_year[current_date.year] = flt(
+					get_per_day_interest(
+						principal_amount,
+						loan.rate_of_interest,
+						loan.company,
+						current_date,
+						interest_day_count_convention=interest_day_count_convention,
+					),
+					precision,
+				)
+
+			rows.append(
+				frappe._dict(
+					demand=demand,
+					from_date=current_date,
+					to_date=current_date,
+					penal_interest_amount=penal_interest_amount,
+					additional_interest=per_day_interest_by_year[current_date.year],
+				)
+			)
+
+	return total_penal_interest, rows
+
+
+def aggregate_penal_interest_rows(rows):
+	"""Rolls the per day penal interest of every demand into a single row covering the
+	whole period, so that one accrual and one demand per type is posted per run.
+	"""
+	precision = get_currency_precision()
+	aggregated_rows = {}
+
+	for row in rows:
+		key = row.demand.repayment_schedule_detail
+		if key not in aggregated_rows:
+			aggregated_rows[key] = frappe._dict(
+				demand=row.demand,
+				from_date=row.from_date,
+				to_date=row.to_date,
+				penal_interest_amount=0,
+				additional_interest=0,
+			)
+
+		aggregated_row = aggregated_rows[key]
+		aggregated_row.to_date = row.to_date
+		aggregated_row.penal_interest_amount += row.penal_interest_amount
+		aggregated_row.additional_interest += row.additional_interest
+
+	for row in aggregated_rows.values():
+		row.penal_interest_amount = flt(row.penal_interest_amount, precision)
+		row.additional_interest = flt(row.additional_interest, precision)
+
+	return list(aggregated_rows.values())
+
+
+def get_penal_interest_from_date(demand, last_accrual_date, last_demand_accrual_date):
+	if last_accrual_date:
+		return add_days(last_accrual_date, 1)
+
+	# Accruals made before penal interest was tracked per EMI are linked to the demand
+	if last_demand_accrual_date:
+		if getdate(last_demand_accrual_date) <= getdate(demand.demand_date):
+			return demand.demand_date
+		return last_demand_accrual_date
+
+	return demand.demand_date
+
+
+def get_last_penal_accrual_date_maps(
+	loan, repayment_schedule_details, loan_demands, loan_disbursement=None
+):
+	LoanInterestAccrual = DocType("Loan Interest Accrual")
+
+	query = (
+		frappe.qb.from_(LoanInterestAccrual)
+		.select(
+			LoanInterestAccrual.loan_repayment_schedule_detail,
+			fn.Max(LoanInterestAccrual.posting_date),
+		)
+		.where(
+			(LoanInterestAccrual.loan == loan)
+			& (LoanInterestAccrual.docstatus == 1)
+			& (LoanInterestAccrual.interest_type == "Penal Interest")
+			& (LoanInterestAccrual.loan_repayment_schedule_detail.isin(repayment_schedule_details))
+		)
+		.groupby(LoanInterestAccrual.loan_repayment_schedule_detail)
+		.for_update()
+	)
+
+	if loan_disbursement:
+		query = query.where(LoanInterestAccrual.loan_disbursement == loan_disbursement)
+
+	last_accrual_dates = frappe._dict(query.run())
+
+	query = (
+		frappe.qb.from_(LoanInterestAccrual)
+		.select(LoanInterestAccrual.loan_demand, fn.Max(LoanInterestAccrual.posting_date))
+		.where(
+			(LoanInterestAccrual.loan == loan)
+			& (LoanInterestAccrual.docstatus == 1)
+			& (LoanInterestAccrual.interest_type == "Penal Interest")
+			& (LoanInterestAccrual.loan_demand.isin(loan_demands))
+		)
+		.groupby(LoanInterestAccrual.loan_demand)
+		.for_update()
+	)
+
+	last_demand_accrual_dates = frappe._dict(query.run())
+
+	return last_accrual_dates, last_demand_accrual_dates
+
+
+def get_emi_principal_outstanding_map(loan, repayment_schedule_details):
+	principal_amounts = {}
+
+	for demand in frappe.get_all(
+		"Loan Demand",
+		filters={
+			"loan": loan,
+			"repayment_schedule_detail": ("in", repayment_schedule_details),
+			"demand_type": "EMI",
+			"demand_subtype": "Principal",
+			"docstatus": 1,
+		},
+		fields=["repayment_schedule_detail", "outstanding_amount"],
+		order_by="demand_date desc, creation desc",
+	):
+		principal_amounts.setdefault(demand.repayment_schedule_detail, demand.outstanding_amount)
+
+	return principal_amounts
 
 
 def make_accrual_interest_entry_for_loans(
@@ -736,8 +1207,54 @@ def make_accrual_interest_entry_for_loans(
 	company=None,
 	from_demand=False,
 	loan_disbursement=None,
+	bulk=None,
 ):
+	open_loans = get_open_loans_for_accrual(
+		loan=loan, loan_product=loan_product, company=company, limit=limit
+	)
 
+	if loan:
+		process_interest_accrual_batch(
+			open_loans,
+			posting_date,
+			process_loan_interest,
+			accrual_type,
+			accrual_date,
+			from_demand=from_demand,
+			loan_disbursement=loan_disbursement,
+		)
+	else:
+		if bulk is None:
+			bulk = bool(
+				company and frappe.get_cached_value("Company", company, "enable_bulk_interest_accrual")
+			)
+
+		if process_loan_interest:
+			from lending.loan_management.doctype.process_loan_interest_accrual.process_loan_interest_accrual import (
+				enqueue_accrual_shards,
+			)
+
+			enqueue_accrual_shards(process_loan_interest, open_loans, bulk=bulk)
+			return
+
+		BATCH_SIZE = 3000
+		batch_list = list(get_batches(open_loans, BATCH_SIZE))
+		for batch in batch_list:
+			frappe.enqueue(
+				process_interest_accrual_batch,
+				loans=batch,
+				posting_date=posting_date,
+				process_loan_interest=process_loan_interest,
+				accrual_type=accrual_type,
+				accrual_date=accrual_date,
+				queue="long",
+				enqueue_after_commit=True,
+				loan_disbursement=loan_disbursement,
+				bulk=bulk,
+			)
+
+
+def get_open_loans_for_accrual(loan=None, loan_product=None, company=None, limit=0, loans=None):
 	loan_doc = frappe.qb.DocType("Loan")
 
 	query = (
@@ -770,6 +1287,9 @@ def make_accrual_interest_entry_for_loans(
 			loan_doc.loan_product,
 			loan_doc.penalty_charges_rate,
 			loan_doc.repayment_schedule_type,
+			loan_doc.cost_center,
+			loan_doc.is_npa,
+			loan_doc.unmark_npa,
 		)
 		.where(loan_doc.docstatus == 1)
 		.where(loan_doc.status.isin(["Disbursed", "Partially Disbursed", "Active", "Written Off"]))
@@ -782,6 +1302,9 @@ def make_accrual_interest_entry_for_loans(
 	if loan:
 		query = query.where(loan_doc.name == loan)
 
+	if loans:
+		query = query.where(loan_doc.name.isin(loans))
+
 	if loan_product:
 		query = query.where(loan_doc.loan_product == loan_product)
 
@@ -791,32 +1314,7 @@ def make_accrual_interest_entry_for_loans(
 	if limit:
 		query = query.limit(limit)
 
-	open_loans = query.run(as_dict=1)
-	if loan:
-		process_interest_accrual_batch(
-			open_loans,
-			posting_date,
-			process_loan_interest,
-			accrual_type,
-			accrual_date,
-			from_demand=from_demand,
-			loan_disbursement=loan_disbursement,
-		)
-	else:
-		BATCH_SIZE = 3000
-		batch_list = list(get_batches(open_loans, BATCH_SIZE))
-		for batch in batch_list:
-			frappe.enqueue(
-				process_interest_accrual_batch,
-				loans=batch,
-				posting_date=posting_date,
-				process_loan_interest=process_loan_interest,
-				accrual_type=accrual_type,
-				accrual_date=accrual_date,
-				queue="long",
-				enqueue_after_commit=True,
-				loan_disbursement=loan_disbursement,
-			)
+	return query.run(as_dict=1)
 
 
 def get_batches(open_loans, batch_size):
@@ -832,43 +1330,52 @@ def process_interest_accrual_batch(
 	accrual_date,
 	from_demand=False,
 	loan_disbursement=None,
+	bulk=False,
 ):
-	for loan in loans:
-		loan_accrual_frequency = get_loan_accrual_frequency(loan.company)
-
-		try:
-			if not from_demand:
-				calculate_penal_interest_for_loans(
-					loan,
-					loan.freeze_date or posting_date,
-					process_loan_interest=process_loan_interest,
-					accrual_type=accrual_type,
-					loan_disbursement=loan_disbursement,
-				)
-			calculate_accrual_amount_for_loans(
+	"""Accrue interest for a batch of loans and return the names of the loans that failed."""
+	if bulk:
+		from lending.loan_management.doctype.loan_interest_accrual.utils import (
+			process_interest_accrual_batch_in_bulk,
+		)
+
+		return process_interest_accrual_batch_in_bulk(
+			loans,
+			posting_date,
+			process_loan_interest,
+			accrual_type,
+			accrual_date,
+			from_demand=from_demand,
+			loan_disbursement=loan_disbursement,
+		)
+
+	def accrue_interest(loan):
+		if not from_demand:
+			calculate_penal_interest_for_loans(
 				loan,
 				loan.freeze_date or posting_date,
 				process_loan_interest=process_loan_interest,
 				accrual_type=accrual_type,
-				accrual_date=accrual_date,
-				loan_accrual_frequency=loan_accrual_frequency,
 				loan_disbursement=loan_disbursement,
 			)
+		calculate_accrual_amount_for_loans(
+			loan,
+			loan.freeze_date or posting_date,
+			process_loan_interest=process_loan_interest,
+			accrual_type=accrual_type,
+			accrual_date=accrual_date,
+			loan_accrual_frequency=get_loan_accrual_frequency(loan.company),
+			loan_disbursement=loan_disbursement,
+		)
 
-			if len(loans) > 1:
-				frappe.db.commit()
+	if len(loans) == 1:
+		accrue_interest(loans[0])
+		return []
 
-		except Exception as e:
-			if len(loans) > 1:
-				frappe.log_error(
-					title="Loan Interest Accrual Error",
-					message=frappe.get_traceback(),
-					reference_doctype="Loan",
-					reference_name=loan.name,
-				)
-				frappe.db.rollback()
-			else:
-				raise e
+	failed_loans = process_loans_with_prefetched_demands(
+		loans, accrue_interest, "Loan Interest Accrual Error", get_loan_name=lambda loan: loan.name
+	)
+
+	return [loan.name for loan in failed_loans]
 
 
 def get_last_accrual_date(
@@ -880,46 +1387,56 @@ def get_last_accrual_date(
 	is_future_accrual=0,
 	repayment_schedule_detail=None,
 	loan_disbursement=None,
+	context=None,
 ):
-	LoanInterestAccrual = DocType("Loan Interest Accrual")
+	# context carries the latest accrual per loan, interest type and disbursement
+	if context and not (demand or repayment_schedule_detail or is_future_accrual):
+		last_interest_accrual_date = context.get_last_accrual_date(
+			loan, interest_type, loan_disbursement=loan_disbursement
+		)
+	else:
+		LoanInterestAccrual = DocType("Loan Interest Accrual")
 
-	query = (
-		frappe.qb.from_(LoanInterestAccrual)
-		.select(fn.Max(LoanInterestAccrual.posting_date))
-		.where(
-			(LoanInterestAccrual.loan == loan)
-			& (LoanInterestAccrual.docstatus == 1)
-			& (LoanInterestAccrual.interest_type == interest_type)
+		query = (
+			frappe.qb.from_(LoanInterestAccrual)
+			.select(fn.Max(LoanInterestAccrual.posting_date))
+			.where(
+				(LoanInterestAccrual.loan == loan)
+				& (LoanInterestAccrual.docstatus == 1)
+				& (LoanInterestAccrual.interest_type == interest_type)
+			)
+			.for_update()
 		)
-		.for_update()
-	)
 
-	if demand:
-		query = query.where(LoanInterestAccrual.loan_demand == demand)
+		if demand:
+			query = query.where(LoanInterestAccrual.loan_demand == demand)
 
-	if repayment_schedule_detail:
-		query = query.where(
-			LoanInterestAccrual.loan_repayment_schedule_detail == repayment_schedule_detail
-		)
+		if repayment_schedule_detail:
+			query = query.where(
+				LoanInterestAccrual.loan_repayment_schedule_detail == repayment_schedule_detail
+			)
 
-	if is_future_accrual:
-		query = query.where(LoanInterestAccrual.posting_date <= posting_date)
+		if is_future_accrual:
+			query = query.where(LoanInterestAccrual.posting_date <= posting_date)
 
-	if loan_disbursement:
-		query = query.where(LoanInterestAccrual.loan_disbursement == loan_disbursement)
+		if loan_disbursement:
+			query = query.where(LoanInterestAccrual.loan_disbursement == loan_disbursement)
 
-	last_interest_accrual_date = query.run()[0][0]
+		last_interest_accrual_date = query.run()[0][0]
 
 	if loan_repayment_schedule:
 		if last_interest_accrual_date:
 			return add_days(last_interest_accrual_date, 1)
 		else:
-			dates = frappe.db.get_value(
-				"Loan Repayment Schedule",
-				loan_repayment_schedule,
-				["moratorium_end_date", "posting_date", "moratorium_type"],
-				as_dict=1,
-			)
+			if context:
+				dates = context.schedules[loan_repayment_schedule]
+			else:
+				dates = frappe.db.get_value(
+					"Loan Repayment Schedule",
+					loan_repayment_schedule,
+					["moratorium_end_date", "posting_date", "moratorium_type"],
+					as_dict=1,
+				)
 
 			if dates.moratorium_type == "EMI" and dates.moratorium_end_date:
 				final_date = dates.moratorium_end_date
@@ -928,9 +1445,12 @@ def get_last_accrual_date(
 
 			return final_date
 
-	last_disbursement_date = get_last_disbursement_date(
-		loan, posting_date, loan_disbursement=loan_disbursement
-	)
+	if context:
+		last_disbursement_date = context.get_last_disbursement_date(loan, posting_date)
+	else:
+		last_disbursement_date = get_last_disbursement_date(
+			loan, posting_date, loan_disbursement=loan_disbursement
+		)
 
 	if interest_type == "Penal Interest":
 		return last_interest_accrual_date
@@ -943,12 +1463,22 @@ def get_last_accrual_date(
 
 		return last_interest_accrual_date
 	else:
-		moratorium_details = frappe.db.get_value(
-			"Loan Repayment Schedule",
-			{"loan": loan, "docstatus": 1, "status": "Active"},
-			["moratorium_end_date", "moratorium_type"],
-			as_dict=1,
-		)
+		if context:
+			moratorium_details = context.get_active_schedule(
+				loan, loan_disbursement=loan_disbursement
+			)
+		else:
+			filters = {"loan": loan, "docstatus": 1, "status": "Active"}
+			if loan_disbursement:
+				filters["loan_disbursement"] = loan_disbursement
+
+			moratorium_details = frappe.db.get_value(
+				"Loan Repayment Schedule",
+				filters,
+				["moratorium_end_date", "moratorium_type"],
+				order_by="creation desc",
+				as_dict=1,
+			)
 
 		if (
 			moratorium_details
@@ -1007,8 +1537,8 @@ def get_per_day_interest(
 		posting_date = getdate()
 
 	if not interest_day_count_convention:
-		interest_day_count_convention = frappe.get_cached_value(
-			"Company", company, "interest_day_count_convention"
+		interest_day_count_convention = (
+			get_lending_config().get_company(company).interest_day_count_convention
 		)
 
 	if interest_day_count_convention == "Actual/365" or interest_day_count_convention == "30/365":
@@ -1030,8 +1560,8 @@ def get_interest_amount(
 	posting_date=None,
 	interest_per_day=None,
 ):
-	interest_day_count_convention = frappe.get_cached_value(
-		"Company", company, "interest_day_count_convention"
+	interest_day_count_convention = (
+		get_lending_config().get_company(company).interest_day_count_convention
 	)
 
 	if not interest_per_day:
@@ -1097,27 +1627,95 @@ def reverse_loan_interest_accruals(
 def cancel_accruals(filters, or_filters):
 	accruals = (
 		frappe.get_all(
-			"Loan Interest Accrual", filters=filters, fields=["name", "posting_date"], or_filters=or_filters
+			"Loan Interest Accrual",
+			filters=filters,
+			fields=[
+				"name",
+				"loan",
+				"posting_date",
+				"company",
+				"accrual_journal_posted",
+				"normal_interest_journal_entry",
+				"additional_interest_suspense_entry",
+			],
+			or_filters=or_filters,
+			for_update=True,
 		)
 		or []
 	)
+
+	cancel_loan_interest_accruals_in_bulk(accruals)
+
+	return accruals
+
+
+def cancel_loan_interest_accruals_in_bulk(accruals):
+	"""Cancel a set of accruals and reverse their GL entries with set wide queries.
+
+	Accruals with suspense journal entries, or posted in a summarized accrual journal, go
+	through the document so that their journal entries are cancelled or reversed.
+	"""
+	from lending.loan_management.bulk_writer import (
+		cancel_docs_in_bulk,
+		make_reverse_gl_entries_in_bulk,
+	)
+
+	bulk_accruals = []
+
 	for accrual in accruals:
-		accrual_doc = frappe.get_doc("Loan Interest Accrual", accrual.name, for_update=True)
-		if accrual_doc.docstatus == 1:
+		if (
+			accrual.accrual_journal_posted
+			or accrual.normal_interest_journal_entry
+			or accrual.additional_interest_suspense_entry
+		):
+			accrual_doc = frappe.get_doc("Loan Interest Accrual", accrual.name)
 			accrual_doc.flags.ignore_links = True
 			accrual_doc.cancel()
+		else:
+			bulk_accruals.append(accrual)
 
-	return accruals
+	write_off_dates = get_write_off_dates({accrual.loan for accrual in bulk_accruals})
 
+	make_reverse_gl_entries_in_bulk(
+		"Loan Interest Accrual",
+		[
+			accrual.name
+			for accrual in bulk_accruals
+			if loan_accounting_enabled(accrual.company)
+			and not (
+				accrual.loan in write_off_dates
+				and getdate(accrual.posting_date) >= write_off_dates[accrual.loan]
+			)
+		],
+	)
+	cancel_docs_in_bulk("Loan Interest Accrual", [accrual.name for accrual in bulk_accruals])
 
-def get_loan_accrual_frequency(company):
-	company_doc = frappe.qb.DocType("Company")
-	query = (
-		frappe.qb.from_(company_doc)
-		.select(company_doc.loan_accrual_frequency)
-		.where(company_doc.name == company)
+
+def get_write_off_dates(loans):
+	"""Returns the latest write off date of the written off loans, accruals posted from then
+	on have no GL entries, see `LoanInterestAccrual.make_gl_entries`"""
+	written_off_loans = frappe.get_all(
+		"Loan", filters={"name": ("in", list(loans)), "status": "Written Off"}, pluck="name"
 	)
-	loan_accrual_frequency = query.run(as_dict=True)[0]["loan_accrual_frequency"]
+
+	if not written_off_loans:
+		return {}
+
+	LoanWriteOff = frappe.qb.DocType("Loan Write Off")
+	return {
+		loan: getdate(value_date)
+		for loan, value_date in (
+			frappe.qb.from_(LoanWriteOff)
+			.select(LoanWriteOff.loan, fn.Max(LoanWriteOff.value_date))
+			.where((LoanWriteOff.loan.isin(written_off_loans)) & (LoanWriteOff.docstatus == 1))
+			.groupby(LoanWriteOff.loan)
+		).run()
+		if value_date
+	}
+
+
+def get_loan_accrual_frequency(company):
+	loan_accrual_frequency = get_lending_config().get_company(company).loan_accrual_frequency
 
 	if not loan_accrual_frequency:
 		frappe.throw(_("Loan Accrual Frequency not set for company {0}").format(frappe.bold(company)))
@@ -1125,15 +1723,25 @@ def get_loan_accrual_frequency(company):
 	return loan_accrual_frequency
 
 
-def get_parent_wise_dates(loan, posting_date, loan_accrual_frequency, loan_disbursement=None):
-	filters = {"loan": loan, "docstatus": 1, "status": "Active", "posting_date": ("<=", posting_date)}
+def get_parent_wise_dates(
+	loan, posting_date, loan_accrual_frequency, loan_disbursement=None, context=None
+):
+	if context:
+		schedules_details = context.get_schedules_for_accrual(loan, posting_date)
+	else:
+		filters = {
+			"loan": loan,
+			"docstatus": 1,
+			"status": "Active",
+			"posting_date": ("<=", posting_date),
+		}
 
-	if loan_disbursement:
-		filters["loan_disbursement"] = loan_disbursement
+		if loan_disbursement:
+			filters["loan_disbursement"] = loan_disbursement
 
-	schedules_details = frappe.db.get_all(
-		"Loan Repayment Schedule", filters=filters, fields=["name", "maturity_date"], order_by=None
-	)
+		schedules_details = frappe.db.get_all(
+			"Loan Repayment Schedule", filters=filters, fields=["name", "maturity_date"], order_by=None
+		)
 
 	schedules = [d.name for d in schedules_details]
 	schedule_dates = []
@@ -1141,7 +1749,11 @@ def get_parent_wise_dates(loan, posting_date, loan_accrual_frequency, loan_disbu
 	accrual_schedule_map = {}
 	parent_wise_schedules = frappe._dict()
 
-	freeze_date = frappe.db.get_value("Loan", loan, "freeze_date")
+	if context:
+		freeze_date = context.loans[loan].freeze_date
+	else:
+		freeze_date = frappe.db.get_value("Loan", loan, "freeze_date")
+
 	if freeze_date and getdate(freeze_date) < getdate(posting_date):
 		posting_date = freeze_date
 
@@ -1156,6 +1768,7 @@ def get_parent_wise_dates(loan, posting_date, loan_accrual_frequency, loan_disbu
 			"Normal Interest",
 			loan_repayment_schedule=schedule,
 			loan_disbursement=loan_disbursement,
+			context=context,
 		)
 
 		accrual_schedule_map[schedule] = last_accrual_date
@@ -1168,20 +1781,25 @@ def get_parent_wise_dates(loan, posting_date, loan_accrual_frequency, loan_disbu
 		):
 			parent_wise_schedules[schedule].append(getdate(last_accrual_date))
 
-		schedule_filters = {
-			"parent": schedule,
-			"payment_date": ("between", [last_accrual_date, posting_date]),
-		}
-
-		schedule_dates.extend(
-			frappe.db.get_all(
-				"Repayment Schedule",
-				filters=schedule_filters,
-				fields=["payment_date", "parent"],
-				order_by="payment_date",
+		if context:
+			schedule_dates.extend(
+				context.get_payment_dates(schedule, last_accrual_date, posting_date)
+			)
+		else:
+			schedule_filters = {
+				"parent": schedule,
+				"payment_date": ("between", [last_accrual_date, posting_date]),
+			}
+
+			schedule_dates.extend(
+				frappe.db.get_all(
+					"Repayment Schedule",
+					filters=schedule_filters,
+					fields=["payment_date", "parent"],
+					order_by="payment_date",
+				)
+				or []
 			)
-			or []
-		)
 
 	for schedule_date in schedule_dates:
 		parent_wise_schedules.setdefault(schedule_date.parent, [])
@@ -1220,3 +1838,4 @@ def on_doctype_update():
 		"Loan Interest Accrual",
 		["loan", "docstatus", "interest_type", "posting_date"],
 	)
+	frappe.db.add_index("Loan Interest Accrual", ["summarized_gl_entry", "accrual_journal_posted"])
@@ -1,20 +1,37 @@
+from unittest.mock import patch
+
 import frappe
 from frappe.query_builder import DocType
 from frappe.query_builder import functions as fn
 from frappe.tests import IntegrationTestCase
 from frappe.utils import add_days, date_diff, flt, getdate
 
+from lending.loan_management.doctype.loan_interest_accrual import loan_interest_accrual
 from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
+	calculate_penal_interest_for_loans,
+	get_last_accrual_date,
+	make_loan_interest_accruals_in_bulk,
 	process_interest_accrual_batch,
+	reverse_loan_interest_accruals,
+)
+from lending.loan_management.doctype.loan_interest_accrual.utils import (
+	AccrualBatchContext,
+	RepaymentScheduleBalances,
+	post_summarized_accrual_entries,
 )
 from lending.loan_management.doctype.loan_repayment.loan_repayment import calculate_amounts
 from lending.loan_management.doctype.process_loan_demand.process_loan_demand import (
 	process_daily_loan_demands,
 )
+from lending.loan_management.doctype.process_loan_interest_accrual import (
+	process_loan_interest_accrual,
+)
 from lending.loan_management.doctype.process_loan_interest_accrual.process_loan_interest_accrual import (
+	process_accrual_shard,
 	process_loan_interest_accrual_for_loans,
 )
 from lending.tests.test_utils import (
+	create_disbursed_loan,
 	create_loan,
 	init_customers,
 	init_loan_products,
@@ -98,6 +115,411 @@ class TestLoanInterestAccrual(IntegrationTestCase):
 		self.assertEqual(getdate(last_accrual_date_a), getdate("2024-04-10"))
 		self.assertEqual(getdate(last_accrual_date_b), getdate("2024-04-20"))
 
+	def test_bulk_accrual_matches_document_accrual(self):
+		set_loan_accrual_frequency("Daily")
+
+		posting_date = "2024-04-05"
+		repayment_start_date = "2024-05-05"
+
+		loans = []
+		for _i in range(2):
+			loan, _disbursement = create_disbursed_loan(
+				self.applicant2,
+				1000000,
+				6,
+				posting_date,
+				repayment_start_date,
+				rate_of_interest=23,
+			)
+			loans.append(loan.name)
+
+		loan_a, loan_b = frappe.get_all(
+			"Loan", filters={"name": ("in", loans)}, fields=["*"], order_by="name"
+		)
+
+		for loan, bulk in ((loan_a, False), (loan_b, True)):
+			process_interest_accrual_batch(
+				loans=[loan],
+				posting_date="2024-06-20",
+				process_loan_interest="",
+				accrual_type="Regular",
+				accrual_date="2024-06-20",
+				bulk=bulk,
+			)
+
+		accruals_a = get_accrual_rows(loan_a.name)
+		accruals_b = get_accrual_rows(loan_b.name)
+
+		self.assertTrue(accruals_a)
+		self.assertEqual(accruals_a, accruals_b)
+		self.assertEqual(get_accrual_gl_totals(loan_a.name), get_accrual_gl_totals(loan_b.name))
+
+	def test_schedule_balance_lookup(self):
+		loan, _disbursement = create_disbursed_loan(
+			self.applicant2,
+			1000000,
+			6,
+			"2024-04-05",
+			"2024-05-05",
+			rate_of_interest=23,
+		)
+
+		schedule = frappe.db.get_value(
+			"Loan Repayment Schedule", {"loan": loan.name, "docstatus": 1}, "name"
+		)
+		schedule_balances = RepaymentScheduleBalances([schedule])
+		current_principal_amount = frappe.db.get_value(
+			"Loan Repayment Schedule", schedule, "current_principal_amount"
+		)
+		rows = frappe.get_all(
+			"Repayment Schedule",
+			{"parent": schedule},
+			["payment_date", "balance_loan_amount"],
+			order_by="payment_date",
+		)
+
+		for days in range(0, 200, 7):
+			date = getdate(add_days("2024-04-05", days))
+			balances = [row.balance_loan_amount for row in rows if getdate(row.payment_date) <= date]
+			expected = (balances[-1] if balances else None) or current_principal_amount
+
+			self.assertEqual(schedule_balances.get_principal_amount(schedule, date), expected)
+
+	def test_accrual_batch_context_lookups(self):
+		set_loan_accrual_frequency("Daily")
+
+		loan, disbursement = create_disbursed_loan(
+			self.applicant2,
+			1000000,
+			6,
+			"2024-04-05",
+			"2024-05-05",
+			rate_of_interest=23,
+		)
+		process_loan_interest_accrual_for_loans(posting_date="2024-05-20", loan=loan.name)
+
+		loan = frappe.get_all("Loan", filters={"name": loan.name}, fields=["*"])[0]
+		context = AccrualBatchContext([loan], "2024-06-20")
+
+		for interest_type in ("Normal Interest", "Penal Interest"):
+			for loan_disbursement in (None, disbursement.name):
+				self.assertEqual(
+					get_last_accrual_date(
+						loan.name,
+						"2024-06-20",
+						interest_type,
+						loan_disbursement=loan_disbursement,
+						context=context,
+					),
+					get_last_accrual_date(
+						loan.name, "2024-06-20", interest_type, loan_disbursement=loan_disbursement
+					),
+					msg=f"{interest_type} {loan_disbursement}",
+				)
+
+		self.assertEqual(
+			context.get_active_schedule(loan.name, loan_disbursement=disbursement.name).name,
+			frappe.db.get_value(
+				"Loan Repayment Schedule",
+				{"loan": loan.name, "loan_disbursement": disbursement.name, "status": "Active"},
+			),
+		)
+		self.assertIsNone(context.get_active_schedule(loan.name, loan_disbursement="_Test Other"))
+
+	def test_aggregated_penal_interest_entries(self):
+		set_loan_accrual_frequency("Daily")
+
+		loans = []
+		for _i in range(2):
+			loan, _disbursement = create_disbursed_loan(
+				self.applicant2,
+				500000,
+				12,
+				"2024-04-01",
+				"2024-05-05",
+				penalty_charges_rate=25,
+			)
+			process_daily_loan_demands(posting_date="2024-07-06", loan=loan.name)
+			loans.append(loan.name)
+
+		loan_a, loan_b = frappe.get_all(
+			"Loan", filters={"name": ("in", loans)}, fields=["*"], order_by="name"
+		)
+
+		calculate_penal_interest_for_loans(loan_a, "2024-07-06", aggregate=False)
+		calculate_penal_interest_for_loans(loan_b, "2024-07-06", aggregate=True)
+
+		penal_accruals_a = get_penal_accruals(loan_a.name)
+		penal_accruals_b = get_penal_accruals(loan_b.name)
+
+		emi_count = frappe.db.count(
+			"Loan Demand",
+			{"loan": loan_b.name, "demand_type": "EMI", "demand_subtype": "Principal", "docstatus": 1},
+		)
+
+		self.assertEqual(len(penal_accruals_b), emi_count)
+		self.assertGreater(len(penal_accruals_a), len(penal_accruals_b))
+		self.assertAlmostEqual(
+			sum(d.interest_amount for d in penal_accruals_a),
+			sum(d.interest_amount for d in penal_accruals_b),
+			delta=0.01 * len(penal_accruals_a),
+		)
+
+	def test_bulk_written_accruals(self):
+		loan, disbursement = create_disbursed_loan(
+			self.applicant2,
+			1000000,
+			6,
+			"2024-04-05",
+			"2024-05-05",
+		)
+
+		accruals = [
+			{
+				"loan": loan.name,
+				"base_amount": 1000000,
+				"interest_amount": 100,
+				"start_date": start_date,
+				"posting_date": posting_date,
+				"accrual_type": "Regular",
+				"interest_type": "Normal Interest",
+				"rate_of_interest": loan.rate_of_interest,
+				"loan_disbursement": disbursement.name,
+			}
+			for start_date, posting_date in (
+				("2024-04-05", "2024-04-06"),
+				("2024-04-07", "2024-04-08"),
+			)
+		]
+
+		writer = make_loan_interest_accruals_in_bulk(accruals)
+		names = [doc.name for doc in writer.written]
+
+		self.assertEqual(len(names), 2)
+		self.assertEqual(int(names[1].rsplit("-", 1)[1]), int(names[0].rsplit("-", 1)[1]) + 1)
+		self.assertEqual(writer.written[1].last_accrual_date, "2024-04-06")
+
+		for name in names:
+			doc = frappe.get_doc("Loan Interest Accrual", name)
+			self.assertEqual(doc.docstatus, 1)
+			self.assertEqual(doc.company, loan.company)
+
+		gl_entries = frappe.get_all(
+			"GL Entry",
+			filters={"voucher_type": "Loan Interest Accrual", "voucher_no": ("in", names)},
+			fields=["sum(debit) as debit", "sum(credit) as credit"],
+		)
+		self.assertEqual(flt(gl_entries[0].debit), 200)
+		self.assertEqual(flt(gl_entries[0].credit), 200)
+
+		self.assertRaises(frappe.ValidationError, make_loan_interest_accruals_in_bulk, accruals[:1])
+
+	def test_bulk_accrual_reversal(self):
+		loan, disbursement = create_disbursed_loan(
+			self.applicant2,
+			1000000,
+			6,
+			"2024-04-05",
+			"2024-05-05",
+		)
+
+		writer = make_loan_interest_accruals_in_bulk(
+			[
+				{
+					"loan": loan.name,
+					"base_amount": 1000000,
+					"interest_amount": 100,
+					"start_date": start_date,
+					"posting_date": posting_date,
+					"accrual_type": "Regular",
+					"interest_type": "Normal Interest",
+					"rate_of_interest": loan.rate_of_interest,
+					"loan_disbursement": disbursement.name,
+				}
+				for start_date, posting_date in (
+					("2024-04-05", "2024-04-06"),
+					("2024-04-07", "2024-04-08"),
+				)
+			]
+		)
+		names = [doc.name for doc in writer.written]
+
+		accruals = reverse_loan_interest_accruals(loan.name, "2024-04-06")
+
+		self.assertEqual({accrual.name for accrual in accruals}, set(names))
+		self.assertEqual(
+			max(getdate(accrual.posting_date) for accrual in accruals), getdate("2024-04-08")
+		)
+
+		for name in names:
+			self.assertEqual(frappe.db.get_value("Loan Interest Accrual", name, "docstatus"), 2)
+
+		gl_entries = frappe.get_all(
+			"GL Entry",
+			filters={"voucher_type": "Loan Interest Accrual", "voucher_no": ("in", names)},
+			fields=[
+				"sum(debit) as debit",
+				"sum(credit) as credit",
+				"min(is_cancelled) as is_cancelled",
+			],
+		)
+		self.assertEqual(flt(gl_entries[0].debit), 400)
+		self.assertEqual(flt(gl_entries[0].credit), 400)
+		self.assertEqual(gl_entries[0].is_cancelled, 1)
+
+	def make_summarized_accruals(self, interest_amounts):
+		from lending.loan_management.lending_config import clear_lending_config
+
+		frappe.db.set_value("Company", "_Test Company", "summarize_accrual_gl_entries", 1)
+		clear_lending_config()
+		self.addCleanup(clear_lending_config)
+		self.addCleanup(
+			frappe.db.set_value, "Company", "_Test Company", "summarize_accrual_gl_entries", 0
+		)
+
+		accruals = []
+		for interest_amount in interest_amounts:
+			loan, disbursement = create_disbursed_loan(
+				self.applicant2,
+				1000000,
+				6,
+				"2024-04-05",
+				"2024-05-05",
+			)
+			accruals.append(
+				{
+					"loan": loan.name,
+					"base_amount": 1000000,
+					"interest_amount": interest_amount,
+					"start_date": "2024-04-05",
+					"posting_date": "2024-04-06",
+					"accrual_type": "Regular",
+					"interest_type": "Normal Interest",
+					"rate_of_interest": loan.rate_of_interest,
+					"loan_disbursement": disbursement.name,
+				}
+			)
+
+		writer = make_loan_interest_accruals_in_bulk(accruals)
+		return [doc.name for doc in writer.written]
+
+	def post_summarized_accrual_entries(self):
+		# Keep the job from committing the test data
+		with patch.object(frappe.db, "commit"):
+			post_summarized_accrual_entries(company="_Test Company")
+
+	def test_summarized_accrual_gl_entries(self):
+		names = self.make_summarized_accruals([100, 100])
+
+		self.assertFalse(
+			frappe.db.exists(
+				"GL Entry", {"voucher_type": "Loan Interest Accrual", "voucher_no": ("in", names)}
+			)
+		)
+
+		self.post_summarized_accrual_entries()
+
+		journal_entries = set(
+			frappe.get_all(
+				"Loan Interest Accrual", {"name": ("in", names)}, pluck="accrual_journal_entry"
+			)
+		)
+		self.assertEqual(len(journal_entries), 1)
+
+		journal_entry = frappe.get_doc("Journal Entry", journal_entries.pop())
+		self.assertEqual(flt(journal_entry.total_debit), 200)
+		self.assertEqual(flt(journal_entry.total_credit), 200)
+
+		gl_entries = frappe.get_all(
+			"GL Entry",
+			filters={"voucher_type": "Journal Entry", "voucher_no": journal_entry.name},
+			fields=["sum(debit) as debit", "sum(credit) as credit"],
+		)
+		self.assertEqual(flt(gl_entries[0].debit), 200)
+		self.assertEqual(flt(gl_entries[0].credit), 200)
+
+	def test_netted_summarized_accruals(self):
+		names = self.make_summarized_accruals([100, -100])
+		journal_entries = frappe.db.count("Journal Entry")
+
+		# Accruals that net to zero post no journal and are not picked up again
+		for _i in range(2):
+			self.post_summarized_accrual_entries()
+
+			self.assertEqual(frappe.db.count("Journal Entry"), journal_entries)
+			self.assertEqual(
+				frappe.get_all(
+					"Loan Interest Accrual",
+					{"name": ("in", names)},
+					["accrual_journal_posted", "accrual_journal_entry"],
+				),
+				[{"accrual_journal_posted": 1, "accrual_journal_entry": None}] * 2,
+			)
+
+	def test_sharded_accrual(self):
+		set_loan_accrual_frequency("Daily")
+
+		loans = []
+		for _i in range(2):
+			loan, _disbursement = create_disbursed_loan(
+				self.applicant2,
+				1000000,
+				6,
+				"2024-04-05",
+				"2024-05-05",
+			)
+			loans.append(loan)
+
+		process = frappe.get_doc(
+			{
+				"doctype": "Process Loan Interest Accrual",
+				"posting_date": "2024-04-10",
+				"company": loans[0].company,
+				"accrual_type": "Regular",
+				"shard_size": 1,
+				"max_parallel_shards": 1,
+				"from_demand": 1,
+			}
+		)
+
+		# Shard only the loans of this test
+		with patch.object(
+			loan_interest_accrual,
+			"get_open_loans_for_accrual",
+			return_value=[get_loan_object(loan.load_from_db()) for loan in loans],
+		):
+			process.submit()
+
+		shards = get_shards(process.name)
+		self.assertEqual([shard.status for shard in shards], ["Queued", "Pending"])
+		self.assertEqual([shard.docstatus for shard in shards], [1, 1])
+		self.assertEqual(sorted(shard.loans for shard in shards), sorted(loan.name for loan in loans))
+
+		with patch.object(
+			process_loan_interest_accrual,
+			"process_interest_accrual_batch",
+			wraps=process_interest_accrual_batch,
+		) as accrual_batch:
+			process_accrual_shard(process.name, shards[0].name)
+
+		self.assertTrue(accrual_batch.call_args.kwargs["from_demand"])
+		self.assertEqual([shard.status for shard in get_shards(process.name)], ["Completed", "Queued"])
+
+		process_accrual_shard(process.name, shards[1].name)
+		shards = get_shards(process.name)
+		self.assertEqual([shard.status for shard in shards], ["Completed", "Completed"])
+		self.assertEqual(
+			frappe.db.get_value("Process Loan Interest Accrual", process.name, "status"), "Completed"
+		)
+
+		for loan in loans:
+			self.assertTrue(
+				frappe.db.exists(
+					"Loan Interest Accrual",
+					{"loan": loan.name, "process_loan_interest_accrual": process.name, "docstatus": 1},
+				)
+			)
+
 	def test_loc_loan_interest_accrual(self):
 		set_loan_accrual_frequency("Daily")
 		loan = create_loan(
@@ -337,3 +759,54 @@ def get_loan_object(loan_doc):
 			"freeze_date": loan_doc.freeze_date,
 		}
 	)
+
+
+def get_accrual_rows(loan):
+	return frappe.get_all(
+		"Loan Interest Accrual",
+		filters={"loan": loan, "docstatus": 1},
+		fields=[
+			"posting_date",
+			"start_date",
+			"last_accrual_date",
+			"interest_type",
+			"interest_amount",
+			"base_amount",
+			"rate_of_interest",
+			"is_term_loan",
+		],
+		order_by="posting_date, interest_type",
+		as_list=1,
+	)
+
+
+def get_accrual_gl_totals(loan):
+	return frappe.get_all(
+		"GL Entry",
+		filters={
+			"voucher_type": "Loan Interest Accrual",
+			"against_voucher": loan,
+			"is_cancelled": 0,
+		},
+		fields=["account", "sum(debit) as debit", "sum(credit) as credit"],
+		group_by="account",
+		order_by="account",
+		as_list=1,
+	)
+
+
+def get_penal_accruals(loan):
+	return frappe.get_all(
+		"Loan Interest Accrual",
+		filters={"loan": loan, "docstatus": 1, "interest_type": "Penal Interest"},
+		fields=["interest_amount", "start_date", "posting_date"],
+	)
+
+
+def get_shards(process_loan_interest):
+	return frappe.get_all(
+		"Loan Interest Accrual Shard",
+		filters={"parent": process_loan_interest},
+		fields=["name", "status", "docstatus", "loans", "failed_count"],
+		order_by="idx",
+	)
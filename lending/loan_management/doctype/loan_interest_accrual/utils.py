@@ -0,0 +1,608 @@
+from bisect import bisect_left, bisect_right
+
+import frappe
+from frappe import _
+from frappe.query_builder import DocType
+from frappe.query_builder import functions as fn
+from frappe.utils import flt, get_datetime, getdate, nowdate
+
+import erpnext
+
+from lending.loan_management.lending_config import get_currency_precision
+
+# Accruals are summarized per these fields and the accounting dimensions
+ACCRUAL_SUMMARY_FIELDS = ("company", "loan_product", "cost_center", "accrual_date")
+
+
+class RepaymentScheduleBalances:
+	"""Balance loan amounts of repayment schedules, loaded once and kept sorted by
+	payment date so that the principal outstanding on any date is a bisect away.
+	"""
+
+	def __init__(self, schedules, to_date=None, current_principal_amounts=None):
+		self.payment_dates = {}
+		self.balances = {}
+		self.current_principal_amounts = current_principal_amounts
+
+		if not schedules:
+			return
+
+		RepaymentSchedule = DocType("Repayment Schedule")
+
+		query = (
+			frappe.qb.from_(RepaymentSchedule)
+			.select(
+				RepaymentSchedule.parent,
+				RepaymentSchedule.payment_date,
+				RepaymentSchedule.balance_loan_amount,
+			)
+			.where(RepaymentSchedule.parent.isin(schedules))
+			.orderby(RepaymentSchedule.parent)
+			.orderby(RepaymentSchedule.payment_date)
+		)
+
+		if to_date:
+			query = query.where(RepaymentSchedule.payment_date <= getdate(to_date))
+
+		for parent, payment_date, balance_loan_amount in query.run():
+			self.payment_dates.setdefault(parent, []).append(getdate(payment_date))
+			self.balances.setdefault(parent, []).append(balance_loan_amount)
+
+	def get_balance_loan_amount(self, schedule, date):
+		index = bisect_right(self.payment_dates.get(schedule, []), getdate(date))
+
+		return self.balances[schedule][index - 1] if index else None
+
+	def get_principal_amount(self, schedule, date):
+		principal_amount = self.get_balance_loan_amount(schedule, date)
+
+		if not principal_amount:
+			if self.current_principal_amounts is not None:
+				principal_amount = self.current_principal_amounts.get(schedule)
+			else:
+				principal_amount = frappe.db.get_value(
+					"Loan Repayment Schedule", schedule, "current_principal_amount", cache=True
+				)
+
+		return principal_amount
+
+	def get_payment_dates(self, schedule, from_date, to_date):
+		payment_dates = self.payment_dates.get(schedule, [])
+		start = bisect_left(payment_dates, getdate(from_date))
+		end = bisect_right(payment_dates, getdate(to_date))
+
+		return payment_dates[start:end]
+
+
+class AccrualBatchContext:
+	"""Batch wide lookups for interest accrual.
+
+	Loads the last accrual dates, disbursement dates, repayment schedules and schedule
+	balances for a batch of loans in a handful of grouped queries. The accrual functions
+	read from it instead of querying loan by loan, and collect the accruals here so that
+	they can be written in bulk.
+	"""
+
+	def __init__(self, loans, posting_date, loan_disbursement=None):
+		self.loans = {loan.name: loan for loan in loans}
+		self.loan_disbursement = loan_disbursement
+		self.accruals = {}
+
+		loan_names = list(self.loans)
+		posting_dates = [getdate(loan.freeze_date or posting_date) for loan in loans]
+		max_posting_date = max(posting_dates) if posting_dates else getdate(posting_date)
+
+		self.last_accrual_dates = self.get_last_accrual_date_map(loan_names)
+		self.disbursement_dates = self.get_disbursement_date_map(loan_names)
+		self.schedules, self.loan_wise_schedules = self.get_schedule_map(loan_names)
+		self.schedule_balances = RepaymentScheduleBalances(
+			list(self.schedules),
+			to_date=max_posting_date,
+			current_principal_amounts={
+				name: schedule.current_principal_amount for name, schedule in self.schedules.items()
+			},
+		)
+
+	def get_last_accrual_date_map(self, loans):
+		if not loans:
+			return {}
+
+		LoanInterestAccrual = DocType("Loan Interest Accrual")
+
+		last_accrual_dates = {}
+
+		for loan, interest_type, loan_disbursement, posting_date in (
+			frappe.qb.from_(LoanInterestAccrual)
+			.select(
+				LoanInterestAccrual.loan,
+				LoanInterestAccrual.interest_type,
+				LoanInterestAccrual.loan_disbursement,
+				fn.Max(LoanInterestAccrual.posting_date),
+			)
+			.where((LoanInterestAccrual.loan.isin(loans)) & (LoanInterestAccrual.docstatus == 1))
+			.groupby(
+				LoanInterestAccrual.loan,
+				LoanInterestAccrual.interest_type,
+				LoanInterestAccrual.loan_disbursement,
+			)
+			.for_update()
+			.run()
+		):
+			last_accrual_dates.setdefault((loan, interest_type), {})[loan_disbursement] = getdate(
+				posting_date
+			)
+
+		return last_accrual_dates
+
+	def get_disbursement_date_map(self, loans):
+		disbursement_dates = {}
+
+		if not loans:
+			return disbursement_dates
+
+		filters = {"against_loan": ("in", loans), "docstatus": 1}
+		if self.loan_disbursement:
+			filters["name"] = self.loan_disbursement
+
+		for row in frappe.get_all(
+			"Loan Disbursement",
+			filters=filters,
+			fields=["against_loan", "disbursement_date"],
+			order_by="disbursement_date",
+		):
+			disbursement_dates.setdefault(row.against_loan, []).append(getdate(row.disbursement_date))
+
+		return disbursement_dates
+
+	def get_schedule_map(self, loans):
+		schedules = frappe._dict()
+		loan_wise_schedules = {}
+
+		if not loans:
+			return schedules, loan_wise_schedules
+
+		filters = {"loan": ("in", loans), "docstatus": 1, "status": "Active"}
+		if self.loan_disbursement:
+			filters["loan_disbursement"] = self.loan_disbursement
+
+		for schedule in frappe.get_all(
+			"Loan Repayment Schedule",
+			filters=filters,
+			fields=[
+				"name",
+				"loan",
+				"loan_disbursement",
+				"posting_date",
+				"maturity_date",
+				"moratorium_end_date",
+				"moratorium_type",
+				"current_principal_amount",
+				"creation",
+			],
+			order_by=None,
+		):
+			schedules[schedule.name] = schedule
+			loan_wise_schedules.setdefault(schedule.loan, []).append(schedule)
+
+		return schedules, loan_wise_schedules
+
+	def get_schedules_for_accrual(self, loan, posting_date):
+		return [
+			frappe._dict(name=schedule.name, maturity_date=schedule.maturity_date)
+			for schedule in self.loan_wise_schedules.get(loan, [])
+			if get_datetime(schedule.posting_date) <= get_datetime(posting_date)
+		]
+
+	def get_last_accrual_date(self, loan, interest_type, loan_disbursement=None):
+		dates = self.last_accrual_dates.get((loan, interest_type), {})
+
+		if loan_disbursement:
+			return dates.get(loan_disbursement)
+
+		return max(dates.values(), default=None)
+
+	def get_active_schedule(self, loan, loan_disbursement=None):
+		schedules = [
+			schedule
+			for schedule in self.loan_wise_schedules.get(loan, [])
+			if not loan_disbursement or schedule.loan_disbursement == loan_disbursement
+		]
+
+		# Latest first, the order the document path reads it in
+		return max(schedules, key=lambda schedule: schedule.creation, default=None)
+
+	def get_payment_dates(self, schedule, from_date, to_date):
+		return [
+			frappe._dict(payment_date=payment_date, parent=schedule)
+			for payment_date in self.schedule_balances.get_payment_dates(schedule, from_date, to_date)
+		]
+
+	def get_last_disbursement_date(self, loan, posting_date):
+		dates = [d for d in self.disbursement_dates.get(loan, []) if d <= getdate(posting_date)]
+
+		if not dates:
+			return None
+
+		if self.loans[loan].repayment_schedule_type == "Line of Credit":
+			return dates[0]
+
+		return dates[-1]
+
+	def add_accrual(self, loan, **kwargs):
+		from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
+			get_last_accrual_date,
+		)
+
+		loan_details = self.loans[loan]
+		accrual = frappe._dict(kwargs)
+
+		if accrual.loan_repayment_schedule:
+			accrual.loan_disbursement = self.schedules[accrual.loan_repayment_schedule].loan_disbursement
+
+		# Same values the document would set in validate and through fetch_from
+		accrual.update(
+			{
+				"doctype": "Loan Interest Accrual",
+				"loan": loan,
+				"accrual_date": nowdate(),
+				"last_accrual_date": get_last_accrual_date(
+					loan,
+					accrual.posting_date,
+					accrual.interest_type,
+					loan_disbursement=accrual.loan_disbursement,
+					context=self,
+				),
+				"applicant_type": loan_details.applicant_type,
+				"applicant": loan_details.applicant,
+				"company": loan_details.company,
+				"loan_product": loan_details.loan_product,
+				"is_term_loan": loan_details.is_term_loan,
+				"is_npa": loan_details.is_npa,
+				"unmark_npa": loan_details.unmark_npa,
+				"cost_center": loan_details.cost_center,
+			}
+		)
+
+		# Later accruals of the loan in the batch start after this one, as they would once
+		# it is submitted
+		dates = self.last_accrual_dates.setdefault((loan, accrual.interest_type), {})
+		last_accrual_date = dates.get(accrual.loan_disbursement)
+		if not last_accrual_date or getdate(accrual.posting_date) > last_accrual_date:
+			dates[accrual.loan_disbursement] = getdate(accrual.posting_date)
+
+		self.accruals.setdefault(loan, []).append(accrual)
+
+	def discard_accruals(self, loan):
+		self.accruals.pop(loan, None)
+
+	def get_accruals(self):
+		return [accrual for accruals in self.accruals.values() for accrual in accruals]
+
+
+def process_interest_accrual_batch_in_bulk(
+	loans,
+	posting_date,
+	process_loan_interest,
+	accrual_type,
+	accrual_date,
+	from_demand=False,
+	loan_disbursement=None,
+):
+	"""Same as `process_interest_accrual_batch` but normal interest is computed for the
+	whole batch in memory and the accruals are written with multi-row inserts.
+
+	NPA and written off loans post suspense entries and write off checks per accrual,
+	so they still go through the document path.
+	"""
+	from lending.loan_management.doctype.loan_demand.utils import (
+		process_loans_with_prefetched_demands,
+	)
+	from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
+		calculate_accrual_amount_for_loans,
+		calculate_penal_interest_for_loans,
+		get_loan_accrual_frequency,
+		make_loan_interest_accruals_in_bulk,
+	)
+
+	bulk_loans = []
+	document_loans = []
+	failed_loans = []
+
+	for loan in loans:
+		if loan.status == "Written Off" or (loan.is_npa and not loan.unmark_npa):
+			document_loans.append(loan)
+		else:
+			bulk_loans.append(loan)
+
+	if document_loans:
+		failed_loans += process_loans_in_document_path(
+			document_loans,
+			posting_date,
+			process_loan_interest,
+			accrual_type,
+			accrual_date,
+			from_demand=from_demand,
+			loan_disbursement=loan_disbursement,
+		)
+
+	if not bulk_loans:
+		return failed_loans
+
+	def accrue_penal_interest(loan):
+		calculate_penal_interest_for_loans(
+			loan,
+			loan.freeze_date or posting_date,
+			process_loan_interest=process_loan_interest,
+			accrual_type=accrual_type,
+			loan_disbursement=loan_disbursement,
+		)
+
+	if not from_demand:
+		failed_loans += [
+			loan.name
+			for loan in process_loans_with_prefetched_demands(
+				bulk_loans,
+				accrue_penal_interest,
+				"Loan Interest Accrual Error",
+				get_loan_name=lambda loan: loan.name,
+			)
+		]
+
+	context = AccrualBatchContext(bulk_loans, posting_date, loan_disbursement=loan_disbursement)
+	accrual_frequency_map = {}
+
+	for loan in bulk_loans:
+		try:
+			if loan.company not in accrual_frequency_map:
+				accrual_frequency_map[loan.company] = get_loan_accrual_frequency(loan.company)
+
+			calculate_accrual_amount_for_loans(
+				loan,
+				loan.freeze_date or posting_date,
+				process_loan_interest=process_loan_interest,
+				accrual_type=accrual_type,
+				accrual_date=accrual_date,
+				loan_accrual_frequency=accrual_frequency_map[loan.company],
+				loan_disbursement=loan_disbursement,
+				context=context,
+			)
+		except Exception:
+			context.discard_accruals(loan.name)
+			log_accrual_error(loan.name)
+			failed_loans.append(loan.name)
+
+	try:
+		writer = make_loan_interest_accruals_in_bulk(
+			context.get_accruals(), context.loans, commit=True, raise_exception=False
+		)
+		fallback_loans = {doc.loan for doc in writer.failed}
+	except Exception:
+		frappe.db.rollback()
+		frappe.log_error(title="Bulk Loan Interest Accrual Error", message=frappe.get_traceback())
+		fallback_loans = set(context.accruals)
+
+	if fallback_loans:
+		# Fall back to the document path so that one bad loan does not hold back the batch
+		failed_loans += process_loans_in_document_path(
+			[context.loans[loan] for loan in fallback_loans],
+			posting_date,
+			process_loan_interest,
+			accrual_type,
+			accrual_date,
+			from_demand=True,
+			loan_disbursement=loan_disbursement,
+		)
+
+	# A loan can fail in more than one step, but is only to be processed again once
+	return list(dict.fromkeys(failed_loans))
+
+
+def process_loans_in_document_path(loans, *args, **kwargs):
+	from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
+		process_interest_accrual_batch,
+	)
+
+	try:
+		return process_interest_accrual_batch(loans, *args, **kwargs)
+	except Exception:
+		# A batch of one loan raises instead of logging the error
+		frappe.db.rollback()
+		log_accrual_error(loans[0].name)
+		return [loans[0].name]
+
+
+def log_accrual_error(loan):
+	frappe.log_error(
+		title="Loan Interest Accrual Error",
+		message=frappe.get_traceback(),
+		reference_doctype="Loan",
+		reference_name=loan,
+	)
+
+
+def post_summarized_accrual_entries(company=None, to_date=None):
+	"""Post the accruals of companies that summarize accrual GL entries as one Journal Entry
+	per company, loan product, cost center, accounting dimensions and accrual date.
+
+	The per loan amounts stay on the accruals, which are linked to the journal they were
+	posted in. Each journal is committed along with the links, so a failed group is picked
+	up again on the next run. A group that nets to zero posts no journal and its accruals
+	are only marked as posted.
+	"""
+	LoanInterestAccrual = DocType("Loan Interest Accrual")
+	summary_fields = get_accrual_summary_fields()
+
+	query = (
+		frappe.qb.from_(LoanInterestAccrual)
+		.select(*[LoanInterestAccrual[fieldname] for fieldname in summary_fields])
+		.where(
+			(LoanInterestAccrual.docstatus == 1)
+			& (LoanInterestAccrual.summarized_gl_entry == 1)
+			& (LoanInterestAccrual.accrual_journal_posted == 0)
+			& (LoanInterestAccrual.accrual_date <= getdate(to_date or nowdate()))
+		)
+		.groupby(*[LoanInterestAccrual[fieldname] for fieldname in summary_fields])
+	)
+
+	if company:
+		query = query.where(LoanInterestAccrual.company == company)
+
+	for summary_key in query.run(as_dict=1):
+		try:
+			accruals = get_accruals_for_summary(summary_key)
+			journal_entry = make_accrual_journal_entry(summary_key, accruals)
+
+			if accruals:
+				(
+					frappe.qb.update(LoanInterestAccrual)
+					.set(LoanInterestAccrual.accrual_journal_posted, 1)
+					.set(LoanInterestAccrual.accrual_journal_entry, journal_entry)
+					.where(LoanInterestAccrual.name.isin([accrual.name for accrual in accruals]))
+				).run()
+
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(
+				title="Accrual Journal Entry Error",
+				message=frappe.get_traceback(),
+				reference_doctype="Loan Product",
+				reference_name=summary_key.loan_product,
+			)
+
+
+def get_accrual_summary_fields():
+	from erpnext.accounts.doctype.accounting_dimension.accounting_dimension import (
+		get_accounting_dimensions,
+	)
+
+	meta = frappe.get_meta("Loan Interest Accrual")
+	dimensions = [
+		dimension for dimension in get_accounting_dimensions() if meta.has_field(dimension)
+	]
+
+	return [*ACCRUAL_SUMMARY_FIELDS, *dimensions]
+
+
+def get_accruals_for_summary(summary_key):
+	LoanInterestAccrual = DocType("Loan Interest Accrual")
+
+	query = (
+		frappe.qb.from_(LoanInterestAccrual)
+		.select(
+			LoanInterestAccrual.name,
+			LoanInterestAccrual.interest_type,
+			LoanInterestAccrual.interest_amount,
+			LoanInterestAccrual.additional_interest_amount,
+		)
+		.where(
+			(LoanInterestAccrual.docstatus == 1)
+			& (LoanInterestAccrual.summarized_gl_entry == 1)
+			& (LoanInterestAccrual.accrual_journal_posted == 0)
+		)
+		# Cancellations wait till the accruals are linked to the journal
+		.for_update()
+	)
+
+	for fieldname, value in summary_key.items():
+		if value is None:
+			query = query.where(LoanInterestAccrual[fieldname].isnull())
+		else:
+			query = query.where(LoanInterestAccrual[fieldname] == value)
+
+	return query.run(as_dict=1)
+
+
+def make_accrual_journal_entry(summary_key, accruals):
+	from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
+		get_accrual_account_details,
+	)
+
+	precision = get_currency_precision()
+	account_details = get_accrual_account_details(summary_key.loan_product)
+	amounts = {}
+
+	for accrual in accruals:
+		if accrual.interest_type == "Normal Interest":
+			accounts = (account_details.interest_accrued_account, account_details.interest_income_account)
+		else:
+			accounts = (account_details.penalty_accrued_account, account_details.penalty_income_account)
+
+		amounts[accounts] = amounts.get(accounts, 0) + flt(accrual.interest_amount) - flt(
+			accrual.additional_interest_amount
+		)
+
+		if flt(accrual.additional_interest_amount, precision):
+			accounts = (
+				account_details.additional_interest_accrued,
+				account_details.additional_interest_income,
+			)
+			amounts[accounts] = amounts.get(accounts, 0) + flt(accrual.additional_interest_amount)
+
+	dimensions = {
+		fieldname: value
+		for fieldname, value in summary_key.items()
+		if fieldname not in ACCRUAL_SUMMARY_FIELDS
+	}
+	cost_center = summary_key.cost_center or erpnext.get_default_cost_center(summary_key.company)
+	rows = []
+
+	for (receivable_account, income_account), amount in amounts.items():
+		amount = flt(amount, precision)
+		if not amount:
+			continue
+
+		# Reversals outweighing the accruals of the day
+		if amount < 0:
+			receivable_account, income_account = income_account, receivable_account
+			amount = abs(amount)
+
+		if not receivable_account or not income_account:
+			frappe.throw(
+				_("Please set the accrued and income accounts in Loan Product {0}").format(
+					summary_key.loan_product
+				)
+			)
+
+		rows.append(
+			{
+				"account": receivable_account,
+				"debit_in_account_currency": amount,
+				"debit": amount,
+				"cost_center": cost_center,
+				**dimensions,
+			}
+		)
+		rows.append(
+			{
+				"account": income_account,
+				"credit_in_account_currency": amount,
+				"credit": amount,
+				"cost_center": cost_center,
+				**dimensions,
+			}
+		)
+
+	if not rows:
+		return
+
+	total_amount = flt(sum(row.get("debit", 0) for row in rows), precision)
+
+	jv = frappe.get_doc(
+		{
+			"doctype": "Journal Entry",
+			"voucher_type": "Journal Entry",
+			"posting_date": summary_key.accrual_date,
+			"company": summary_key.company,
+			"accounts": rows,
+			"total_debit": total_amount,
+			"total_credit": total_amount,
+			"remarks": _("Interest accrued on {0} for {1} accruals of Loan Product {2}").format(
+				summary_key.accrual_date, len(accruals), summary_key.loan_product
+			),
+		}
+	)
+
+	jv.submit()
+
+	return jv.name
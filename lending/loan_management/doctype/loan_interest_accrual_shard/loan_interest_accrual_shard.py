@@ -0,0 +1,31 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+# import frappe
+from frappe.model.document import Document
+
+
+class LoanInterestAccrualShard(Document):
+	# begin: auto-generated types
+	# This code is auto-generated. Do not modify anything in this block.
+
+	from typing import TYPE_CHECKING
+
+	if TYPE_CHECKING:
+		from frappe.types import DF
+
+		completed_on: DF.Datetime | None
+		duration: DF.Float
+		failed_count: DF.Int
+		failed_loans: DF.LongText | None
+		loan_count: DF.Int
+		loans: DF.LongText | None
+		parent: DF.Data
+		parentfield: DF.Data
+		parenttype: DF.Data
+		shard: DF.Int
+		started_on: DF.Datetime | None
+		status: DF.Literal["Pending", "Queued", "In Progress", "Completed", "Partially Failed", "Failed"]
+	# end: auto-generated types
+
+	pass
@@ -0,0 +1,448 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.query_builder import DocType
+from frappe.query_builder import functions as fn
+from frappe.utils import add_days, flt, formatdate, getdate, now_datetime
+
+from lending.loan_management.lending_config import get_currency_precision
+
+SNAPSHOT_LOAN_STATUSES = ("Disbursed", "Partially Disbursed", "Active", "Written Off", "Settled")
+
+SNAPSHOT_FIELDS = [
+	"loan",
+	"loan_disbursement",
+	"posting_date",
+	"company",
+	"loan_product",
+	"applicant_type",
+	"applicant",
+	"status",
+	"principal_outstanding",
+	"principal_overdue",
+	"interest_overdue",
+	"penalty_overdue",
+	"charges_overdue",
+	"total_overdue",
+	"accrued_interest",
+	"days_past_due",
+	"classification_code",
+	"classification_name",
+	"is_npa",
+]
+
+# Demand subtypes summed into each overdue field
+OVERDUE_FIELDS = {
+	"Principal": "principal_overdue",
+	"Interest": "interest_overdue",
+	"Penalty": "penalty_overdue",
+	"Additional Interest": "penalty_overdue",
+	"Charges": "charges_overdue",
+}
+
+
+class LoanPositionSnapshot(Document):
+	# begin: auto-generated types
+	# This code is auto-generated. Do not modify anything in this block.
+
+	from typing import TYPE_CHECKING
+
+	if TYPE_CHECKING:
+		from frappe.types import DF
+
+		accrued_interest: DF.Currency
+		applicant: DF.DynamicLink | None
+		applicant_type: DF.Literal["Customer", "Employee"]
+		charges_overdue: DF.Currency
+		classification_code: DF.Link | None
+		classification_name: DF.Data | None
+		company: DF.Link | None
+		days_past_due: DF.Int
+		interest_overdue: DF.Currency
+		is_npa: DF.Check
+		loan: DF.Link | None
+		loan_disbursement: DF.Link | None
+		loan_product: DF.Link | None
+		penalty_overdue: DF.Currency
+		posting_date: DF.Date | None
+		principal_outstanding: DF.Currency
+		principal_overdue: DF.Currency
+		status: DF.Data | None
+		total_overdue: DF.Currency
+	# end: auto-generated types
+
+	pass
+
+
+def create_loan_position_snapshots(posting_date=None, loan_product=None, loan=None):
+	"""Snapshot the position of every open loan as on yesterday.
+
+	The positions are read from the current state of the loans, so only yesterday can be built,
+	right after the accrual and classification jobs for it. Loan classification builds the
+	snapshots of each batch it has classified, this can be used to build them again.
+	"""
+	posting_date = getdate(posting_date or add_days(getdate(), -1))
+	validate_snapshot_date(posting_date)
+
+	filters = {"docstatus": 1, "status": ("in", SNAPSHOT_LOAN_STATUSES)}
+
+	if loan:
+		filters["name"] = loan
+	if loan_product:
+		filters["loan_product"] = loan_product
+
+	open_loans = frappe.get_all("Loan", filters=filters, pluck="name", order_by="name")
+
+	if loan:
+		make_loan_position_snapshots(open_loans, posting_date)
+	else:
+		BATCH_SIZE = 5000
+		for i in range(0, len(open_loans), BATCH_SIZE):
+			frappe.enqueue(
+				make_loan_position_snapshot_batch,
+				loans=open_loans[i : i + BATCH_SIZE],
+				posting_date=posting_date,
+				queue="long",
+				enqueue_after_commit=True,
+			)
+
+
+def make_loan_position_snapshot_batch(loans, posting_date, chunk_size=1000):
+	for i in range(0, len(loans), chunk_size):
+		chunk = loans[i : i + chunk_size]
+		try:
+			make_loan_position_snapshots(chunk, posting_date)
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(title="Loan Position Snapshot Error", message=frappe.get_traceback())
+
+
+def make_loan_position_snapshots(loans, posting_date):
+	"""Replace the snapshots of a set of loans for the posting date, with one multi-row insert.
+
+	Line of Credit loans get one row per disbursement, other loans one row for the loan.
+	"""
+	if not loans:
+		return
+
+	posting_date = getdate(posting_date)
+	validate_snapshot_date(posting_date)
+
+	positions = get_loan_positions(loans, posting_date)
+
+	LoanPositionSnapshot = DocType("Loan Position Snapshot")
+	(
+		frappe.qb.from_(LoanPositionSnapshot)
+		.delete()
+		.where(
+			(LoanPositionSnapshot.loan.isin(loans))
+			& (LoanPositionSnapshot.posting_date == posting_date)
+		)
+	).run()
+
+	if not positions:
+		return
+
+	timestamp = now_datetime()
+	user = frappe.session.user
+	fields = ["name", "creation", "modified", "owner", "modified_by", *SNAPSHOT_FIELDS]
+
+	frappe.db.bulk_insert(
+		"Loan Position Snapshot",
+		fields,
+		[
+			[
+				frappe.generate_hash(length=10),
+				timestamp,
+				timestamp,
+				user,
+				user,
+				*[position.get(field) for field in SNAPSHOT_FIELDS],
+			]
+			for position in positions
+		],
+	)
+
+
+def validate_snapshot_date(posting_date):
+	# Outstanding, overdue, days past due and classification are the current values of the loan
+	if getdate(posting_date) != add_days(getdate(), -1):
+		frappe.throw(
+			_("Loan Position Snapshots can only be built for {0}").format(
+				frappe.bold(formatdate(add_days(getdate(), -1)))
+			)
+		)
+
+
+def get_loan_positions(loans, posting_date):
+	precision = get_currency_precision()
+
+	loan_details = frappe.get_all(
+		"Loan",
+		filters={"name": ("in", loans)},
+		fields=[
+			"name",
+			"company",
+			"loan_product",
+			"applicant_type",
+			"applicant",
+			"status",
+			"repayment_schedule_type",
+			"total_payment",
+			"disbursed_amount",
+			"debit_adjustment_amount",
+			"credit_adjustment_amount",
+			"total_principal_paid",
+			"total_interest_payable",
+			"days_past_due",
+			"classification_code",
+			"classification_name",
+			"is_npa",
+		],
+	)
+
+	line_of_credit_loans = [
+		loan.name for loan in loan_details if loan.repayment_schedule_type == "Line of Credit"
+	]
+	disbursements = get_disbursement_map(line_of_credit_loans)
+	days_past_due_map = get_days_past_due_map(line_of_credit_loans, posting_date)
+	overdue_map = get_overdue_map(loans, posting_date)
+	accrued_interest_map = get_accrued_interest_map(loans, posting_date)
+
+	positions = []
+
+	for loan in loan_details:
+		if loan.repayment_schedule_type == "Line of Credit":
+			loan_disbursements = disbursements.get(loan.name, [])
+		else:
+			loan_disbursements = [None]
+
+		for disbursement in loan_disbursements:
+			loan_disbursement = disbursement.name if disbursement else None
+			position = frappe._dict(
+				{
+					"loan": loan.name,
+					"loan_disbursement": loan_disbursement,
+					"posting_date": posting_date,
+					"company": loan.company,
+					"loan_product": loan.loan_product,
+					"applicant_type": loan.applicant_type,
+					"applicant": loan.applicant,
+					"status": loan.status,
+					"principal_outstanding": flt(
+						get_principal_outstanding(loan, disbursement), precision
+					),
+					"principal_overdue": 0,
+					"interest_overdue": 0,
+					"penalty_overdue": 0,
+					"charges_overdue": 0,
+					"accrued_interest": flt(
+						max(accrued_interest_map.get((loan.name, loan_disbursement), 0), 0), precision
+					),
+					"days_past_due": days_past_due_map.get(
+						(loan.name, loan_disbursement), loan.days_past_due
+					),
+					"classification_code": loan.classification_code,
+					"classification_name": loan.classification_name,
+					"is_npa": loan.is_npa,
+				}
+			)
+
+			for fieldname, amount in overdue_map.get((loan.name, loan_disbursement), {}).items():
+				position[fieldname] = flt(amount, precision)
+
+			position.total_overdue = flt(
+				position.principal_overdue
+				+ position.interest_overdue
+				+ position.penalty_overdue
+				+ position.charges_overdue,
+				precision,
+			)
+
+			positions.append(position)
+
+	return positions
+
+
+def get_principal_outstanding(loan, disbursement=None):
+	# Same figures as the Loan Outstanding Report
+	if disbursement:
+		return flt(disbursement.disbursed_amount) - flt(disbursement.principal_amount_paid)
+
+	if loan.status in ("Disbursed", "Active", "Written Off", "Settled"):
+		return (
+			flt(loan.total_payment)
+			+ flt(loan.debit_adjustment_amount)
+			- flt(loan.credit_adjustment_amount)
+			- flt(loan.total_principal_paid)
+			- flt(loan.total_interest_payable)
+		)
+
+	return (
+		flt(loan.disbursed_amount)
+		+ flt(loan.debit_adjustment_amount)
+		- flt(loan.credit_adjustment_amount)
+		- flt(loan.total_principal_paid)
+	)
+
+
+def get_disbursement_map(loans):
+	disbursements = {}
+
+	if not loans:
+		return disbursements
+
+	for disbursement in frappe.get_all(
+		"Loan Disbursement",
+		filters={"against_loan": ("in", loans), "docstatus": 1},
+		fields=["name", "against_loan", "disbursed_amount", "principal_amount_paid"],
+		order_by="disbursement_date",
+	):
+		disbursements.setdefault(disbursement.against_loan, []).append(disbursement)
+
+	return disbursements
+
+
+def get_days_past_due_map(loans, posting_date):
+	if not loans:
+		return {}
+
+	DaysPastDueLog = DocType("Days Past Due Log")
+
+	return {
+		(loan, loan_disbursement): days_past_due
+		for loan, loan_disbursement, days_past_due in (
+			frappe.qb.from_(DaysPastDueLog)
+			.select(DaysPastDueLog.loan, DaysPastDueLog.loan_disbursement, DaysPastDueLog.days_past_due)
+			.where(
+				(DaysPastDueLog.loan.isin(loans))
+				& (DaysPastDueLog.posting_date == posting_date)
+				& (DaysPastDueLog.loan_disbursement.isnotnull())
+			)
+		).run()
+	}
+
+
+def get_overdue_map(loans, posting_date):
+	"""Returns the outstanding demands due on or before the posting date, by loan and
+	disbursement for Line of Credit loans and by loan for the others."""
+	LoanDemand = DocType("Loan Demand")
+	Loan = DocType("Loan")
+
+	overdues = (
+		frappe.qb.from_(LoanDemand)
+		.inner_join(Loan)
+		.on(Loan.name == LoanDemand.loan)
+		.select(
+			LoanDemand.loan,
+			LoanDemand.loan_disbursement,
+			Loan.repayment_schedule_type,
+			LoanDemand.demand_subtype,
+			fn.Sum(LoanDemand.outstanding_amount).as_("outstanding_amount"),
+		)
+		.where(
+			(LoanDemand.loan.isin(loans))
+			& (LoanDemand.docstatus == 1)
+			& (LoanDemand.demand_date <= posting_date)
+			& (LoanDemand.outstanding_amount > 0)
+		)
+		.groupby(LoanDemand.loan, LoanDemand.loan_disbursement, LoanDemand.demand_subtype)
+	).run(as_dict=1)
+
+	overdue_map = {}
+
+	for row in overdues:
+		fieldname = OVERDUE_FIELDS.get(row.demand_subtype)
+		if not fieldname:
+			continue
+
+		loan_disbursement = (
+			row.loan_disbursement if row.repayment_schedule_type == "Line of Credit" else None
+		)
+		amounts = overdue_map.setdefault((row.loan, loan_disbursement), {})
+		amounts[fieldname] = amounts.get(fieldname, 0) + flt(row.outstanding_amount)
+
+	return overdue_map
+
+
+def get_accrued_interest_map(loans, posting_date):
+	"""Returns the normal interest accrued till the posting date that is not demanded yet"""
+	LoanInterestAccrual = DocType("Loan Interest Accrual")
+	LoanDemand = DocType("Loan Demand")
+	Loan = DocType("Loan")
+
+	accrued_interest = (
+		frappe.qb.from_(LoanInterestAccrual)
+		.inner_join(Loan)
+		.on(Loan.name == LoanInterestAccrual.loan)
+		.select(
+			LoanInterestAccrual.loan,
+			LoanInterestAccrual.loan_disbursement,
+			Loan.repayment_schedule_type,
+			fn.Sum(LoanInterestAccrual.interest_amount),
+		)
+		.where(
+			(LoanInterestAccrual.loan.isin(loans))
+			& (LoanInterestAccrual.docstatus == 1)
+			& (LoanInterestAccrual.interest_type == "Normal Interest")
+			& (LoanInterestAccrual.posting_date <= posting_date)
+		)
+		.groupby(LoanInterestAccrual.loan, LoanInterestAccrual.loan_disbursement)
+	).run()
+
+	demanded_interest = (
+		frappe.qb.from_(LoanDemand)
+		.inner_join(Loan)
+		.on(Loan.name == LoanDemand.loan)
+		.select(
+			LoanDemand.loan,
+			LoanDemand.loan_disbursement,
+			Loan.repayment_schedule_type,
+			fn.Sum(LoanDemand.demand_amount),
+		)
+		.where(
+			(LoanDemand.loan.isin(loans))
+			& (LoanDemand.docstatus == 1)
+			& (LoanDemand.demand_subtype == "Interest")
+			& (LoanDemand.demand_type.isin(["EMI", "BPI", "Normal"]))
+			& (LoanDemand.demand_date <= posting_date)
+		)
+		.groupby(LoanDemand.loan, LoanDemand.loan_disbursement)
+	).run()
+
+	accrued_interest_map = {}
+
+	for rows, sign in ((accrued_interest, 1), (demanded_interest, -1)):
+		for loan, loan_disbursement, repayment_schedule_type, amount in rows:
+			if repayment_schedule_type != "Line of Credit":
+				loan_disbursement = None
+
+			key = (loan, loan_disbursement)
+			accrued_interest_map[key] = accrued_interest_map.get(key, 0) + sign * flt(amount)
+
+	return accrued_interest_map
+
+
+def get_loan_position_snapshots(posting_date, filters=None, fields=None):
+	"""Returns the snapshots of the loans as on a past date.
+
+	Reads one indexed date of the snapshot table, so reports can use it instead of summing
+	demands, accruals and repayments again.
+	"""
+	filters = dict(filters or {})
+	filters["posting_date"] = getdate(posting_date)
+
+	return frappe.get_all(
+		"Loan Position Snapshot",
+		filters=filters,
+		fields=fields or SNAPSHOT_FIELDS,
+		order_by="loan, loan_disbursement",
+	)
+
+
+def on_doctype_update():
+	frappe.db.add_index("Loan Position Snapshot", ["posting_date", "loan"])
@@ -0,0 +1,103 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests import IntegrationTestCase
+from frappe.utils import add_days, add_months, flt, getdate
+
+from lending.loan_management.doctype.loan_position_snapshot.loan_position_snapshot import (
+	create_loan_position_snapshots,
+	get_loan_position_snapshots,
+)
+from lending.loan_management.doctype.process_loan_classification.process_loan_classification import (
+	create_process_loan_classification,
+)
+from lending.loan_management.doctype.process_loan_demand.process_loan_demand import (
+	process_daily_loan_demands,
+)
+from lending.loan_management.doctype.process_loan_interest_accrual.process_loan_interest_accrual import (
+	process_loan_interest_accrual_for_loans,
+)
+from lending.tests.test_utils import (
+	create_loan,
+	init_customers,
+	init_loan_products,
+	make_loan_disbursement_entry,
+	master_init,
+)
+
+
+class TestLoanPositionSnapshot(IntegrationTestCase):
+	def setUp(self):
+		master_init()
+		init_loan_products()
+		init_customers()
+
+	def test_loan_position_snapshot(self):
+		posting_date = add_days(getdate(), -1)
+		disbursement_date = add_months(posting_date, -2)
+		repayment_start_date = add_months(posting_date, -1)
+
+		loan = create_loan(
+			"_Test Customer 1",
+			"Term Loan Product 4",
+			100000,
+			"Repay Over Number of Periods",
+			22,
+			repayment_start_date=repayment_start_date,
+			posting_date=disbursement_date,
+			rate_of_interest=8.5,
+			applicant_type="Customer",
+		)
+		loan.submit()
+
+		make_loan_disbursement_entry(
+			loan.name,
+			loan.loan_amount,
+			disbursement_date=disbursement_date,
+			repayment_start_date=repayment_start_date,
+		)
+		process_loan_interest_accrual_for_loans(
+			posting_date=add_days(repayment_start_date, -1), loan=loan.name, company="_Test Company"
+		)
+		process_daily_loan_demands(loan=loan.name, posting_date=repayment_start_date)
+		create_process_loan_classification(posting_date=posting_date, loan=loan.name)
+
+		def get_overdue(demand_subtype):
+			return flt(
+				sum(
+					frappe.get_all(
+						"Loan Demand",
+						filters={"loan": loan.name, "docstatus": 1, "demand_subtype": demand_subtype},
+						pluck="outstanding_amount",
+					)
+				),
+				2,
+			)
+
+		# Building the same date again replaces the snapshot
+		create_loan_position_snapshots(posting_date=posting_date, loan=loan.name)
+		create_loan_position_snapshots(posting_date=posting_date, loan=loan.name)
+
+		snapshots = get_loan_position_snapshots(posting_date, filters={"loan": loan.name})
+		self.assertEqual(len(snapshots), 1)
+
+		snapshot = snapshots[0]
+		loan.load_from_db()
+
+		self.assertEqual(snapshot.principal_overdue, get_overdue("Principal"))
+		self.assertEqual(snapshot.interest_overdue, get_overdue("Interest"))
+		self.assertTrue(snapshot.principal_overdue)
+		self.assertEqual(
+			snapshot.total_overdue, flt(snapshot.principal_overdue + snapshot.interest_overdue, 2)
+		)
+		self.assertEqual(snapshot.principal_outstanding, flt(loan.loan_amount, 2))
+		self.assertEqual(snapshot.days_past_due, loan.days_past_due)
+		self.assertTrue(snapshot.days_past_due)
+
+	def test_loan_position_snapshot_only_for_yesterday(self):
+		# Positions are read from the current state of the loans
+		for posting_date in (add_days(getdate(), -2), getdate()):
+			self.assertRaises(
+				frappe.ValidationError, create_loan_position_snapshots, posting_date=posting_date
+			)
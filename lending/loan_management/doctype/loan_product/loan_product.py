@@ -6,6 +6,7 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 
+from lending.loan_management.lending_config import clear_lending_config
 from lending.loan_management.utils import loan_accounting_enabled
 
 
@@ -87,6 +88,12 @@ class LoanProduct(Document):
 		self.validate_rates()
 		self.validate_demand_offset_sequences()
 
+	def on_update(self):
+		clear_lending_config(self)
+
+	def on_trash(self):
+		clear_lending_config(self)
+
 	def set_missing_values(self):
 		company_min_days_bw_disbursement_first_repayment = frappe.get_cached_value(
 			"Company", self.company, "min_days_bw_disbursement_first_repayment"
@@ -0,0 +1,153 @@
+import frappe
+from frappe.utils import flt
+
+from lending.loan_management.lending_config import get_currency_precision
+
+ALLOCATION_PLAN_CACHE_KEY = "loan_allocation_plan"
+
+# Marks the step that settles the principal which is not yet demanded
+SETTLEMENT_PRINCIPAL = "Settlement Principal"
+
+# Steps run for each component of a Loan Demand Offset Order, as
+# (demand type, demand subtype, only for term loans)
+COMPONENT_STEPS = {
+	"EMI (Principal + Interest)": (("BPI", None, False), ("EMI", None, True)),
+	"Principal": (
+		("Normal", None, False),
+		("EMI", "Principal", True),
+		(SETTLEMENT_PRINCIPAL, None, False),
+	),
+	"Normal": (("Normal", "Interest", False), ("EMI", "Interest", False)),
+	"Penalty": (("Penalty", None, False),),
+	"Additional Interest": (("Additional Interest", None, False),),
+	"Charges": (("Charges", None, False),),
+}
+
+
+def compile_allocation_plan(demand_types):
+	"""Turn the components of an offset order into the steps to run for each of them"""
+	return [
+		COMPONENT_STEPS[demand_type] for demand_type in demand_types if demand_type in COMPONENT_STEPS
+	]
+
+
+def get_allocation_plan(allocation_order):
+	"""Compiled plan of a Loan Demand Offset Order, cached till the order is saved again"""
+	plan = frappe.cache.hget(ALLOCATION_PLAN_CACHE_KEY, allocation_order)
+
+	if plan is None:
+		allocation_order_doc = frappe.get_doc("Loan Demand Offset Order", allocation_order)
+		plan = compile_allocation_plan([d.demand_type for d in allocation_order_doc.get("components")])
+		frappe.cache.hset(ALLOCATION_PLAN_CACHE_KEY, allocation_order, plan)
+
+	return plan
+
+
+def clear_allocation_plan(allocation_order):
+	frappe.cache.hdel(ALLOCATION_PLAN_CACHE_KEY, allocation_order)
+
+
+class DemandAllocator:
+	"""Allocates a paid amount to unpaid demands as per a compiled allocation plan.
+
+	Demands are bucketed by demand type and by demand type and subtype in one pass, in the
+	order they are passed in, so each step only goes through the demands it can pay.
+
+	Nothing here depends on the Loan Repayment document. The partner share, the settlement
+	of principal that is not yet demanded and what to do with each allocation are passed in
+	as callbacks, so bulk posting and repost can run the same allocation.
+	"""
+
+	def __init__(
+		self,
+		demands,
+		is_term_loan=False,
+		precision=None,
+		get_overall_partner_share=None,
+		get_partner_share_paid=None,
+		settle_principal=None,
+		on_allocate=None,
+	):
+		self.is_term_loan = is_term_loan
+		self.precision = precision or get_currency_precision()
+		self.get_overall_partner_share = get_overall_partner_share
+		self.get_partner_share_paid = get_partner_share_paid
+		self.settle_principal = settle_principal
+		self.on_allocate = on_allocate
+		self.allocations = []
+
+		self.type_wise_demands = {}
+		self.subtype_wise_demands = {}
+
+		for demand in demands or []:
+			self.type_wise_demands.setdefault(demand.demand_type, []).append(demand)
+			self.subtype_wise_demands.setdefault(
+				(demand.demand_type, demand.demand_subtype), []
+			).append(demand)
+
+	def allocate(self, plan, pending_amount):
+		for steps in plan:
+			if pending_amount <= 0:
+				continue
+
+			for demand_type, demand_subtype, term_loan_only in steps:
+				if term_loan_only and not self.is_term_loan:
+					continue
+
+				if demand_type == SETTLEMENT_PRINCIPAL:
+					if self.settle_principal:
+						pending_amount = self.settle_principal(pending_amount)
+				else:
+					pending_amount = self.adjust_component(pending_amount, demand_type, demand_subtype)
+
+		return pending_amount
+
+	def adjust_component(self, amount_to_adjust, demand_type, demand_subtype=None):
+		partner_share = 0
+		share_partner = demand_type == "EMI" and self.get_partner_share_paid
+
+		if self.get_overall_partner_share:
+			partner_share = self.get_overall_partner_share(amount_to_adjust) or 0
+
+		if demand_subtype:
+			demands = self.subtype_wise_demands.get((demand_type, demand_subtype), [])
+		else:
+			demands = self.type_wise_demands.get(demand_type, [])
+
+		for demand in demands:
+			if amount_to_adjust <= 0:
+				break
+
+			paid_amount = 0
+			partner_share_paid = 0
+
+			if amount_to_adjust >= demand.outstanding_amount:
+				paid_amount = flt(demand.outstanding_amount)
+				amount_to_adjust -= flt(demand.outstanding_amount)
+
+				if share_partner:
+					partner_share_paid = self.get_partner_share_paid(0, paid_amount, demand) or 0
+					partner_share -= partner_share_paid
+			else:
+				paid_amount = amount_to_adjust
+				amount_to_adjust = 0
+
+				if share_partner:
+					partner_share_paid = self.get_partner_share_paid(partner_share, paid_amount, demand) or 0
+					partner_share -= partner_share_paid
+
+			if flt(paid_amount, self.precision) > 0:
+				allocation = {
+					"loan_demand": demand.name,
+					"paid_amount": paid_amount,
+					"demand_type": demand.demand_type,
+					"demand_subtype": demand.demand_subtype,
+					"sales_invoice": demand.sales_invoice,
+					"partner_share": partner_share_paid,
+				}
+				self.allocations.append(allocation)
+
+				if self.on_allocate:
+					self.on_allocate(allocation)
+
+		return amount_to_adjust
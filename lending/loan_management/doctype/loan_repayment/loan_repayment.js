@@ -35,6 +35,20 @@ frappe.ui.form.on('Loan Repayment', {
 		}
 	},
 
+	refresh: function(frm) {
+		if (frm.doc.docstatus == 1 && frm.doc.follow_up_status == "Failed") {
+			frm.add_custom_button(__("Retry Follow Ups"), function() {
+				frappe.call({
+					"method": "retry_follow_ups",
+					"doc": frm.doc,
+					callback: function() {
+						frm.reload_doc();
+					}
+				});
+			});
+		}
+	},
+
 	value_date : function(frm) {
 		if (frm.doc.against_loan && frm.doc.value_date){
 			frm.trigger('calculate_repayment_amounts');
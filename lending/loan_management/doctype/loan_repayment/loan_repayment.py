@@ -9,7 +9,7 @@ from frappe import _
 from frappe.query_builder import DocType
 from frappe.query_builder import functions as fn
 from frappe.query_builder.functions import Coalesce, Max, Round, Sum
-from frappe.utils import add_days, cint, flt, get_datetime, getdate, random_string
+from frappe.utils import add_days, flt, get_datetime, getdate, random_string
 
 import erpnext
 from erpnext.accounts.general_ledger import make_reverse_gl_entries, process_gl_map
@@ -18,14 +18,22 @@ from lending.loan_management.controllers.loan_controller import LoanController
 from lending.loan_management.doctype.loan_limit_change_log.loan_limit_change_log import (
 	create_loan_limit_change_log,
 )
+from lending.loan_management.doctype.loan_repayment.allocation_engine import (
+	DemandAllocator,
+	get_allocation_plan,
+)
 from lending.loan_management.doctype.loan_security_assignment.loan_security_assignment import (
 	update_loan_securities_values,
 )
 from lending.loan_management.doctype.loan_security_shortfall.loan_security_shortfall import (
 	update_shortfall_status,
 )
+from lending.loan_management.lending_config import get_currency_precision, get_lending_config
 from lending.loan_management.utils import loan_accounting_enabled
 
+# Loans posted by one bulk payment job
+BULK_PAYMENT_LOANS_PER_JOB = 100
+
 
 class LoanRepayment(LoanController):
 	# begin: auto-generated types
@@ -59,6 +67,7 @@ class LoanRepayment(LoanController):
 		days_past_due: DF.Int
 		due_date: DF.Date | None
 		excess_amount: DF.Currency
+		follow_up_status: DF.Literal["", "Queued", "Completed", "Failed"]
 		interest_payable: DF.Currency
 		is_backdated: DF.Check
 		is_npa: DF.Check
@@ -91,6 +100,7 @@ class LoanRepayment(LoanController):
 		reference_number: DF.Data | None
 		repayment_details: DF.Table[LoanRepaymentDetail]
 		repayment_schedule_type: DF.Data | None
+		reversed_accrual_date: DF.Date | None
 		repayment_type: DF.Literal[
 			"Normal Repayment",
 			"Interest Waiver",
@@ -135,6 +145,9 @@ class LoanRepayment(LoanController):
 			else:
 				frappe.throw(_("Payable Charges can only be added if Charge Payment"))
 
+		if self.docstatus == 1:
+			self.run_pending_follow_ups()
+
 		amounts = calculate_amounts(
 			self.against_loan,
 			self.value_date,
@@ -169,7 +182,7 @@ class LoanRepayment(LoanController):
 
 		excess_amount = self.principal_amount_paid - self.pending_principal_amount
 
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 		if self.repayment_type in ("Advance Payment", "Pre Payment") and excess_amount < 0:
 			if flt(self.amount_paid, precision) > flt(self.payable_amount, precision):
 				create_update_loan_reschedule(
@@ -183,25 +196,12 @@ class LoanRepayment(LoanController):
 				)
 
 	def on_submit(self):
-		from lending.loan_management.doctype.loan_demand.loan_demand import reverse_demands
 		from lending.loan_management.doctype.loan_disbursement.loan_disbursement import (
 			make_sales_invoice_for_charge,
 		)
-		from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
-			reverse_loan_interest_accruals,
-		)
 		from lending.loan_management.doctype.loan_restructure.loan_restructure import (
 			create_update_loan_reschedule,
 		)
-		from lending.loan_management.doctype.process_loan_classification.process_loan_classification import (
-			create_process_loan_classification,
-		)
-		from lending.loan_management.doctype.process_loan_demand.process_loan_demand import (
-			process_daily_loan_demands,
-		)
-		from lending.loan_management.doctype.process_loan_interest_accrual.process_loan_interest_accrual import (
-			process_loan_interest_accrual_for_loans,
-		)
 
 		if self.flags.from_bulk_payment:
 			return
@@ -278,6 +278,81 @@ class LoanRepayment(LoanController):
 		self.create_loan_limit_change_log()
 		self.make_gl_entries()
 
+		if not self.flags.from_repost and frappe.get_cached_value(
+			"Company", self.company, "defer_repayment_follow_ups"
+		):
+			self.queue_follow_ups(reversed_accruals)
+		else:
+			self.run_follow_ups(reversed_accruals)
+
+	def queue_follow_ups(self, reversed_accruals):
+		"""Leave reclassification, re-accrual and demand regeneration to a background job so
+		that the submit only holds the allocation, demand updates and GL entries.
+		"""
+		dates = [getdate(d.get("posting_date")) for d in reversed_accruals]
+
+		self.db_set(
+			{
+				"follow_up_status": "Queued",
+				"reversed_accrual_date": max(dates) if dates else None,
+			}
+		)
+
+		frappe.enqueue(
+			process_repayment_follow_ups,
+			loan=self.against_loan,
+			queue="long",
+			job_id=f"loan_repayment_follow_up::{self.name}",
+			deduplicate=True,
+			enqueue_after_commit=True,
+		)
+
+	def run_pending_follow_ups(self):
+		"""Run the follow ups still queued for earlier repayments of the loan before this one
+		is allocated, since they reverse penal interest and penalty demands it would otherwise
+		pay. The loan row stays locked till the submit is done.
+		"""
+		while True:
+			pending = get_pending_follow_up(self.against_loan)
+
+			if not pending:
+				break
+
+			if pending.follow_up_status == "Failed":
+				frappe.throw(
+					_(
+						"Follow ups of Loan Repayment {0} have failed. Retry them before making another repayment against Loan {1}"
+					).format(frappe.bold(pending.name), frappe.bold(self.against_loan))
+				)
+
+			run_follow_up(pending)
+
+	@frappe.whitelist()
+	def retry_follow_ups(self):
+		if self.follow_up_status != "Failed":
+			frappe.throw(_("Only failed follow ups can be retried"))
+
+		self.queue_follow_ups(
+			[{"posting_date": self.reversed_accrual_date}] if self.reversed_accrual_date else []
+		)
+
+	def run_follow_ups(self, reversed_accruals):
+		from lending.loan_management.doctype.loan_demand.loan_demand import reverse_demands
+		from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
+			reverse_loan_interest_accruals,
+		)
+		from lending.loan_management.doctype.process_loan_classification.process_loan_classification import (
+			create_process_loan_classification,
+		)
+		from lending.loan_management.doctype.process_loan_demand.process_loan_demand import (
+			process_daily_loan_demands,
+		)
+		from lending.loan_management.doctype.process_loan_interest_accrual.process_loan_interest_accrual import (
+			process_loan_interest_accrual_for_loans,
+		)
+
+		reversed_accruals = list(reversed_accruals)
+
 		if (
 			self.is_term_loan
 			and self.repayment_type
@@ -491,7 +566,7 @@ class LoanRepayment(LoanController):
 		from lending.loan_management.doctype.loan_demand.loan_demand import create_loan_demand
 
 		overdue_principal_paid = 0
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		for d in self.get("repayment_details"):
 			if d.demand_subtype == "Principal":
@@ -781,7 +856,7 @@ class LoanRepayment(LoanController):
 			restructure.cancel()
 
 	def set_missing_values(self, amounts):
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		self.posting_date = get_datetime()
 
@@ -925,7 +1000,7 @@ class LoanRepayment(LoanController):
 				frappe.throw(_("Amount paid cannot be less than payable amount for loan closure"))
 
 		if self.repayment_type in ("Interest Waiver", "Penalty Waiver", "Charges Waiver"):
-			precision = cint(frappe.db.get_default("currency_precision")) or 2
+			precision = get_currency_precision()
 			payable_amount = self.get_waiver_amount(amounts)
 
 			if flt(self.amount_paid, precision) > flt(payable_amount, precision):
@@ -949,7 +1024,7 @@ class LoanRepayment(LoanController):
 			frappe.throw(_("The Loan Disbursement {0} has been closed.").format(self.loan_disbursement))
 
 	def get_waiver_amount(self, amounts):
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		if self.repayment_type == "Interest Waiver":
 			return flt(
@@ -966,7 +1041,7 @@ class LoanRepayment(LoanController):
 	def book_interest_accrued_not_demanded(self):
 		from lending.loan_management.doctype.loan_demand.loan_demand import create_loan_demand
 
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		if flt(self.unbooked_interest_paid, precision) > 0:
 			create_loan_demand(
@@ -1071,7 +1146,7 @@ class LoanRepayment(LoanController):
 		update_shortfall_status(self.against_loan, self.principal_amount_paid)
 
 	def handle_auto_demand_write_off(self):
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		overdue_principal_paid = sum(
 			d.paid_amount for d in self.get("repayment_details") if d.demand_subtype == "Principal"
@@ -1103,7 +1178,7 @@ class LoanRepayment(LoanController):
 			create_loan_repayment,
 		)
 
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		last_demand_date = get_last_demand_date(
 			self.against_loan, self.value_date, loan_disbursement=self.loan_disbursement
@@ -1201,7 +1276,7 @@ class LoanRepayment(LoanController):
 	def auto_close_loan(self):
 		self.flags.auto_close = False
 
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		auto_write_off_amount, excess_amount_limit = frappe.db.get_value(
 			"Loan Product",
@@ -1261,7 +1336,7 @@ class LoanRepayment(LoanController):
 		return self.flags.auto_close
 
 	def get_auto_waiver_type(self, amounts):
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		waiver_type = None
 
@@ -1291,7 +1366,7 @@ class LoanRepayment(LoanController):
 			if not waiver_type:
 				return
 
-			precision = cint(frappe.db.get_default("currency_precision")) or 2
+			precision = get_currency_precision()
 
 			key_map = {
 				"Interest Waiver": "interest_amount",
@@ -1390,6 +1465,10 @@ class LoanRepayment(LoanController):
 			query.run()
 
 	def update_demands(self, cancel=0):
+		from lending.loan_management.doctype.loan_demand.utils import invalidate_unpaid_demands
+
+		invalidate_unpaid_demands([self.against_loan])
+
 		loan_demand = frappe.qb.DocType("Loan Demand")
 		for payment in self.repayment_details:
 			paid_amount = payment.paid_amount
@@ -1457,7 +1536,7 @@ class LoanRepayment(LoanController):
 			get_write_off_waivers,
 		)
 
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 		loan_status = frappe.db.get_value("Loan", self.against_loan, "status")
 
 		if not on_submit:
@@ -1539,27 +1618,7 @@ class LoanRepayment(LoanController):
 		if self.repayment_type == "Charge Payment":
 			amount_paid = self.allocate_charges(amount_paid, amounts.get("unpaid_demands"))
 		else:
-			if loan_status == "Written Off":
-				allocation_order = self.get_allocation_order(
-					"Collection Offset Sequence for Written Off Asset"
-				)
-			elif self.repayment_type in (
-				"Partial Settlement",
-				"Full Settlement",
-				"Principal Adjustment",
-			) or (
-				loan_status == "Settled"
-				and self.repayment_type not in ("Interest Waiver", "Penalty Waiver", "Charges Waiver")
-			):
-				allocation_order = self.get_allocation_order(
-					"Collection Offset Sequence for Settlement Collection"
-				)
-			elif self.is_npa:
-				allocation_order = self.get_allocation_order(
-					"Collection Offset Sequence for Sub Standard Asset"
-				)
-			else:
-				allocation_order = self.get_allocation_order("Collection Offset Sequence for Standard Asset")
+			allocation_order = self.get_collection_allocation_order(loan_status)
 
 			if self.shortfall_amount:
 				if self.amount_paid > self.shortfall_amount:
@@ -1686,7 +1745,7 @@ class LoanRepayment(LoanController):
 
 	def set_partner_payment_ratio(self):
 		if self.get("loan_partner"):
-			precision = cint(frappe.db.get_default("currency_precision")) or 2
+			precision = get_currency_precision()
 
 			schedule_details = frappe.db.get_value(
 				"Loan Repayment Schedule",
@@ -1780,103 +1839,72 @@ class LoanRepayment(LoanController):
 
 		return amount_paid
 
+	def get_collection_allocation_order(self, loan_status):
+		if loan_status == "Written Off":
+			return self.get_allocation_order("Collection Offset Sequence for Written Off Asset")
+		elif self.repayment_type in (
+			"Partial Settlement",
+			"Full Settlement",
+			"Principal Adjustment",
+		) or (
+			loan_status == "Settled"
+			and self.repayment_type not in ("Interest Waiver", "Penalty Waiver", "Charges Waiver")
+		):
+			return self.get_allocation_order("Collection Offset Sequence for Settlement Collection")
+		elif self.is_npa:
+			return self.get_allocation_order("Collection Offset Sequence for Sub Standard Asset")
+		else:
+			return self.get_allocation_order("Collection Offset Sequence for Standard Asset")
+
 	def apply_allocation_order(self, allocation_order, pending_amount, demands, status=None):
 		"""Allocate amount based on allocation order"""
-		allocation_order_doc = frappe.get_doc("Loan Demand Offset Order", allocation_order)
-		for d in allocation_order_doc.get("components"):
-			if d.demand_type == "EMI (Principal + Interest)" and pending_amount > 0:
-				pending_amount = self.adjust_component(pending_amount, "BPI", demands)
-				if self.is_term_loan:
-					pending_amount = self.adjust_component(pending_amount, "EMI", demands)
-			if d.demand_type == "Principal" and pending_amount > 0:
-				pending_amount = self.adjust_component(pending_amount, "Normal", demands)
-				if self.is_term_loan:
-					pending_amount = self.adjust_component(
-						pending_amount, "EMI", demands, demand_subtype="Principal"
-					)
-				if (
-					self.repayment_type
-					in (
-						"Partial Settlement",
-						"Full Settlement",
-						"Write Off Recovery",
-						"Write Off Settlement",
-						"Principal Adjustment",
-					)
-					or status == "Settled"
-					and self.repayment_type not in ("Interest Waiver", "Penalty Waiver", "Charges Waiver")
-				):
-					principal_amount_paid = sum(
-						d.paid_amount for d in self.get("repayment_details") if d.demand_subtype == "Principal"
-					)
-					payable_principal_amount = self.pending_principal_amount - principal_amount_paid
-					if flt(pending_amount) >= payable_principal_amount:
-						self.principal_amount_paid += payable_principal_amount
-						pending_amount -= payable_principal_amount
-					else:
-						self.principal_amount_paid += pending_amount
-						pending_amount = 0
-
-			if d.demand_type == "Normal" and pending_amount > 0:
-				pending_amount = self.adjust_component(
-					pending_amount, "Normal", demands, demand_subtype="Interest"
-				)
-				pending_amount = self.adjust_component(
-					pending_amount, "EMI", demands, demand_subtype="Interest"
-				)
-			if d.demand_type == "Penalty" and pending_amount > 0:
-				pending_amount = self.adjust_component(pending_amount, "Penalty", demands)
-			if d.demand_type == "Additional Interest" and pending_amount > 0:
-				pending_amount = self.adjust_component(pending_amount, "Additional Interest", demands)
-			if d.demand_type == "Charges" and pending_amount > 0:
-				pending_amount = self.adjust_component(pending_amount, "Charges", demands)
-
-		return pending_amount
+		allocator = self.get_demand_allocator(
+			demands,
+			status=status,
+			on_allocate=lambda allocation: self.append("repayment_details", allocation),
+		)
+
+		return allocator.allocate(get_allocation_plan(allocation_order), pending_amount)
+
+	def get_demand_allocator(self, demands, status=None, on_allocate=None):
+		return DemandAllocator(
+			demands,
+			is_term_loan=self.is_term_loan,
+			get_overall_partner_share=self.get_overall_partner_share if self.get("loan_partner") else None,
+			get_partner_share_paid=self.get_loan_partner_share_paid if self.get("loan_partner") else None,
+			settle_principal=(
+				self.settle_undemanded_principal if self.is_settlement_allocation(status) else None
+			),
+			on_allocate=on_allocate,
+		)
 
-	def adjust_component(self, amount_to_adjust, demand_type, demands, demand_subtype=None):
-		partner_share = 0
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+	def is_settlement_allocation(self, status=None):
+		return (
+			self.repayment_type
+			in (
+				"Partial Settlement",
+				"Full Settlement",
+				"Write Off Recovery",
+				"Write Off Settlement",
+				"Principal Adjustment",
+			)
+			or status == "Settled"
+			and self.repayment_type not in ("Interest Waiver", "Penalty Waiver", "Charges Waiver")
+		)
 
-		if self.get("loan_partner"):
-			partner_share = self.get_overall_partner_share(amount_to_adjust) or 0
+	def settle_undemanded_principal(self, pending_amount):
+		principal_amount_paid = sum(
+			d.paid_amount for d in self.get("repayment_details") if d.demand_subtype == "Principal"
+		)
+		payable_principal_amount = self.pending_principal_amount - principal_amount_paid
+		if flt(pending_amount) >= payable_principal_amount:
+			self.principal_amount_paid += payable_principal_amount
+			pending_amount -= payable_principal_amount
+		else:
+			self.principal_amount_paid += pending_amount
+			pending_amount = 0
 
-		for demand in demands:
-			paid_amount = 0
-			partner_share_paid = 0
-
-			if demand.demand_type == demand_type:
-				if not demand_subtype or demand.demand_subtype == demand_subtype:
-					if amount_to_adjust >= demand.outstanding_amount:
-						paid_amount = flt(demand.outstanding_amount)
-						amount_to_adjust -= flt(demand.outstanding_amount)
-
-						if demand_type == "EMI" and self.get("loan_partner"):
-							partner_share_paid = self.get_loan_partner_share_paid(0, paid_amount, demand) or 0
-							partner_share -= partner_share_paid
-					elif amount_to_adjust > 0:
-						paid_amount = amount_to_adjust
-						amount_to_adjust = 0
-
-						if demand_type == "EMI" and self.get("loan_partner"):
-							partner_share_paid = (
-								self.get_loan_partner_share_paid(partner_share, paid_amount, demand) or 0
-							)
-							partner_share -= partner_share_paid
-
-					if flt(paid_amount, precision) > 0:
-						self.append(
-							"repayment_details",
-							{
-								"loan_demand": demand.name,
-								"paid_amount": paid_amount,
-								"demand_type": demand.demand_type,
-								"demand_subtype": demand.demand_subtype,
-								"sales_invoice": demand.sales_invoice,
-								"partner_share": partner_share_paid,
-							},
-						)
-
-		return amount_to_adjust
+		return pending_amount
 
 	def get_loan_partner_share_paid(self, amount_to_adjust, paid_amount, demand):
 		if self.loan_partner_repayment_schedule_type == "EMI (PMT) based":
@@ -1931,7 +1959,7 @@ class LoanRepayment(LoanController):
 		if not loan_accounting_enabled(self.company):
 			return
 
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 		gle_map = []
 		payment_account = self.get_payment_account()
 
@@ -2110,7 +2138,7 @@ class LoanRepayment(LoanController):
 		if self.repayment_type == "Penalty Waiver":
 			return
 
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		payment_account = self.get_payment_account()
 		total_payment_amount = sum(d.debit for d in gle_map if d.account == payment_account)
@@ -2126,7 +2154,7 @@ class LoanRepayment(LoanController):
 			self.add_gl_entry(payment_account, round_off_account, -1 * diff, gle_map, is_waiver_entry=True)
 
 	def add_loan_partner_gl_entries(self, gle_map):
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 		partner_details = frappe.db.get_value(
 			"Loan Partner",
 			self.loan_partner,
@@ -2308,9 +2336,9 @@ class LoanRepayment(LoanController):
 		}
 		offset_field = offset_mapping[offset_name]
 
-		allocation_order = frappe.db.get_value("Loan Product", self.loan_product, offset_field)
-		if not allocation_order:
-			allocation_order = frappe.db.get_value("Company", self.company, offset_field)
+		allocation_order = get_lending_config().get_offset_sequence(
+			self.loan_product, self.company, offset_field
+		)
 
 		if not allocation_order:
 			frappe.throw(_("Please set {0} in either Company or Loan Product").format(offset_name))
@@ -2429,21 +2457,88 @@ def get_unpaid_demands(
 	sales_invoice=None,
 	for_update=False,
 ):
+	"""Unpaid demands of a loan till the posting date, answered from the unpaid demand
+	snapshot of the transaction so that repeated calls with different filters share one
+	query. Locking reads go to the database and lock only the demands they return.
+	"""
+	from lending.loan_management.doctype.loan_demand.utils import (
+		filter_unpaid_demands,
+		get_unpaid_demand_snapshot,
+	)
+
 	if not posting_date:
 		posting_date = getdate()
 
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	if for_update:
+		return get_unpaid_demands_for_update(
+			against_loan,
+			posting_date,
+			loan_product=loan_product,
+			demand_type=demand_type,
+			demand_subtype=demand_subtype,
+			limit=limit,
+			charges=charges,
+			loan_disbursement=loan_disbursement,
+			emi_wise=emi_wise,
+			sales_invoice=sales_invoice,
+		)
+
+	demands = get_unpaid_demand_snapshot().get_demands(against_loan)
+
+	return filter_unpaid_demands(
+		demands,
+		posting_date,
+		loan_product=loan_product,
+		demand_type=demand_type,
+		demand_subtype=demand_subtype,
+		limit=limit,
+		charges=charges,
+		loan_disbursement=loan_disbursement,
+		emi_wise=emi_wise,
+		sales_invoice=sales_invoice,
+	)
+
+
+def get_unpaid_demands_for_update(
+	against_loan,
+	posting_date,
+	loan_product=None,
+	demand_type=None,
+	demand_subtype=None,
+	limit=0,
+	charges=None,
+	loan_disbursement=None,
+	emi_wise=False,
+	sales_invoice=None,
+):
+	from lending.loan_management.doctype.loan_demand.utils import (
+		get_unpaid_demand_conditions,
+		get_unpaid_demand_criterion,
+	)
+
+	precision = get_currency_precision()
 
 	loan_demand = frappe.qb.DocType("Loan Demand")
 	query = get_demand_query()
 
+	conditions = get_unpaid_demand_conditions(
+		posting_date,
+		loan_product=loan_product,
+		demand_type=demand_type,
+		demand_subtype=demand_subtype,
+		charges=charges,
+		loan_disbursement=loan_disbursement,
+		emi_wise=emi_wise,
+		sales_invoice=sales_invoice,
+	)
+
 	query = (
 		query.where(
 			(loan_demand.loan == against_loan)
 			& (loan_demand.docstatus == 1)
-			& (loan_demand.demand_date <= posting_date)
 			& (Round(loan_demand.outstanding_amount, precision) > 0)
 		)
+		.where(get_unpaid_demand_criterion(loan_demand, conditions))
 		.orderby(loan_demand.demand_date)
 		.orderby(loan_demand.disbursement_date)
 		.orderby(loan_demand.repayment_schedule_detail)
@@ -2456,44 +2551,15 @@ def get_unpaid_demands(
 	else:
 		query = query.orderby(loan_demand.demand_subtype)
 
-	if loan_product:
-		query = query.where(loan_demand.loan_product == loan_product)
-
-	if demand_type and demand_type != "Penalty":
-		query = query.where(loan_demand.demand_type == demand_type)
-
-	if charges:
-		query = query.where(loan_demand.demand_subtype.isin(charges))
-
-	if sales_invoice:
-		query = query.where(loan_demand.sales_invoice == sales_invoice)
-
-	if demand_subtype:
-		if demand_subtype != "Penalty":
-			query = query.where(loan_demand.demand_subtype == demand_subtype)
-		else:
-			query = query.where(loan_demand.demand_type.isin(["Penalty", "Additional Interest"]))
-			query = query.where(loan_demand.demand_subtype.isin(["Penalty", "Additional Interest"]))
-
 	if limit:
 		query = query.limit(limit)
 
-	if loan_disbursement:
-		query = query.where(loan_demand.loan_disbursement == loan_disbursement)
-
 	if emi_wise:
-		query = query.where(loan_demand.demand_type == "EMI")
-		query = query.where(loan_demand.repayment_schedule_detail.isnotnull())
 		query = query.select(Sum(loan_demand.outstanding_amount).as_("pending_amount"))
 		query = query.select(loan_demand.repayment_schedule_detail)
 		query = query.groupby(loan_demand.repayment_schedule_detail)
 
-	if for_update:
-		query = query.for_update()
-
-	loan_demands = query.run(as_dict=1)
-
-	return loan_demands
+	return query.for_update().run(as_dict=1)
 
 
 def get_demand_query():
@@ -2516,7 +2582,7 @@ def get_demand_query():
 
 
 def get_pending_principal_amount(loan, loan_disbursement=None):
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 
 	LoanDisbursement = DocType("Loan Disbursement")
 
@@ -2628,7 +2694,7 @@ def process_amount_for_loan(
 		calculate_accrual_amount_for_loans,
 	)
 
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 	total_pending_interest = 0
 	charges = 0
 	penalty_amount = 0
@@ -2801,7 +2867,7 @@ def get_bulk_due_details(loans, posting_date, consolidated=False):
 def get_all_demands(loans, posting_date):
 	loan_demand = frappe.qb.DocType("Loan Demand")
 
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 	query = get_demand_query()
 	query = (
 		query.where(loan_demand.docstatus == 1)
@@ -2892,7 +2958,7 @@ def init_amounts():
 
 
 def update_installment_counts(against_loan, loan_disbursement=None):
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 
 	loan_demand = frappe.qb.DocType("Loan Demand")
 	query = (
@@ -2951,6 +3017,63 @@ def update_installment_counts(against_loan, loan_disbursement=None):
 	)
 
 
+def update_installment_counts_in_bulk(loans):
+	"""Same as `update_installment_counts` for a set of loans, with one grouped query for the
+	demands and one for the schedules."""
+	precision = get_currency_precision()
+
+	loans = list(set(loans))
+	if not loans:
+		return
+
+	loan_demand = frappe.qb.DocType("Loan Demand")
+	loan_demands = (
+		frappe.qb.from_(loan_demand)
+		.select(
+			loan_demand.loan,
+			Sum(loan_demand.outstanding_amount).as_("total_outstanding_amount"),
+		)
+		.where(
+			(loan_demand.loan.isin(loans))
+			& (loan_demand.docstatus == 1)
+			& (loan_demand.demand_type == "EMI")
+			& (loan_demand.repayment_schedule_detail.isnotnull())
+		)
+		.groupby(
+			loan_demand.loan,
+			loan_demand.repayment_schedule_detail,
+			loan_demand.demand_date,
+		)
+	).run(as_dict=1)
+
+	installment_counts = {
+		loan: frappe._dict(
+			total_installments_raised=0, total_installments_paid=0, total_installments_overdue=0
+		)
+		for loan in loans
+	}
+
+	for demand in loan_demands:
+		counts = installment_counts[demand.loan]
+		counts.total_installments_raised += 1
+		if flt(demand.total_outstanding_amount, precision) <= 0:
+			counts.total_installments_paid += 1
+		else:
+			counts.total_installments_overdue += 1
+
+	schedules = {}
+	for schedule in frappe.get_all(
+		"Loan Repayment Schedule",
+		filters={"loan": ("in", loans), "docstatus": 1, "status": "Active"},
+		fields=["name", "loan"],
+	):
+		# First schedule of the loan, as picked by `frappe.db.get_value`
+		schedules.setdefault(schedule.loan, schedule.name)
+
+	for loan, schedule in schedules.items():
+		frappe.db.set_value("Loan Repayment Schedule", schedule, installment_counts[loan])
+
+
 def get_last_demand_date(
 	loan, posting_date, demand_subtype="Interest", loan_disbursement=None, status=None
 ):
@@ -3009,7 +3132,7 @@ def get_latest_accrual_date(
 
 
 def get_unbooked_interest(loan, posting_date, loan_disbursement=None, last_demand_date=None):
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 
 	accrued_interest = get_accrued_interest(
 		loan, posting_date, loan_disbursement=loan_disbursement, last_demand_date=last_demand_date
@@ -3099,7 +3222,7 @@ def get_net_paid_amount(loan):
 @frappe.whitelist(methods=["POST"])
 def post_bulk_payments(data):
 	# sort data by loan and value date
-	data = sorted(data, key=lambda x: (x["against_loan"], x["value_date"]))
+	data = sorted(data, key=lambda x: (x["against_loan"], get_datetime(x["value_date"])))
 
 	# check if the loans do exist in the system
 	given_loans = {i["against_loan"] for i in data}
@@ -3136,12 +3259,25 @@ def post_bulk_payments(data):
 	if frappe.flags.in_test:
 		bulk_repost(grouped_by_loan_and_loan_disbursement, trace_id)
 	else:
-		job = frappe.enqueue(
-			bulk_repost,
-			grouped_by_loan_and_loan_disbursement=grouped_by_loan_and_loan_disbursement,
-			trace_id=trace_id,
-		)
-		return {"job_id": job.id, "trace_id": trace_id}
+		# Loans are independent of each other, so they are spread across workers
+		jobs = [
+			frappe.enqueue(
+				bulk_repost,
+				grouped_by_loan_and_loan_disbursement=batch,
+				trace_id=trace_id,
+			)
+			for batch in get_loan_batches(grouped_by_loan_and_loan_disbursement)
+		]
+		return {"job_id": jobs[0].id, "job_ids": [job.id for job in jobs], "trace_id": trace_id}
+
+
+def get_loan_batches(grouped_by_loan_and_loan_disbursement):
+	loans = list(grouped_by_loan_and_loan_disbursement)
+	for i in range(0, len(loans), BULK_PAYMENT_LOANS_PER_JOB):
+		yield {
+			loan: grouped_by_loan_and_loan_disbursement[loan]
+			for loan in loans[i : i + BULK_PAYMENT_LOANS_PER_JOB]
+		}
 
 
 # grouping by disbursement because LoC loans exist
@@ -3168,6 +3304,8 @@ def bulk_repost(grouped_by_loan_and_loan_disbursement, trace_id):
 		# demands and accrual processing and reposting
 		from_date = None
 		to_date = None
+		posted_logs = []
+
 		for disbursement, rows in grouped_by_loan_disbursement.items():
 			current_from_date = getdate(rows[0]["value_date"])
 			current_to_date = getdate(rows[-1]["value_date"])
@@ -3178,7 +3316,7 @@ def bulk_repost(grouped_by_loan_and_loan_disbursement, trace_id):
 				from_date = current_from_date
 
 			if to_date:
-				to_date = min(current_to_date, to_date)
+				to_date = max(current_to_date, to_date)
 			else:
 				to_date = current_to_date
 
@@ -3201,6 +3339,7 @@ def bulk_repost(grouped_by_loan_and_loan_disbursement, trace_id):
 					raise e
 
 				bulk_repayment_log.status = "Success"
+				posted_logs.append(bulk_repayment_log.name)
 			except Exception:
 				frappe.db.rollback()
 				traceback_per_loan = traceback.format_exc()
@@ -3216,8 +3355,21 @@ def bulk_repost(grouped_by_loan_and_loan_disbursement, trace_id):
 			# instant logging and save entire job being sabotaged by 1 failed repayment
 			frappe.db.commit()  # nosemgrep
 
-		post_bulk_submit_actions(loan, to_date, from_date)
-		frappe.db.commit()  # nosemgrep
+		# Nothing to allocate if every row of the loan was rolled back
+		if not posted_logs:
+			continue
+
+		try:
+			post_bulk_submit_actions(loan, to_date, from_date, posted_logs)
+			frappe.db.commit()  # nosemgrep
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(
+				title="Bulk Repayment Allocation Error",
+				message=frappe.get_traceback(),
+				reference_doctype="Loan",
+				reference_name=loan,
+			)
 
 
 def loan_and_loan_disbursement_wise_submit(loan, disbursement, rows, bulk_repayment_log_name):
@@ -3237,7 +3389,14 @@ def loan_and_loan_disbursement_wise_submit(loan, disbursement, rows, bulk_repaym
 	return payment, None
 
 
-def post_bulk_submit_actions(loan, to_date, from_date):
+def post_bulk_submit_actions(loan, to_date, from_date, bulk_repayment_logs):
+	"""Allocate the repayments posted in bulk for a loan with one repost from the first
+	value date.
+
+	The repayments are submitted without paying their demands or making GL entries. The
+	repost allocates all of them in order of value date, in memory where it can, and
+	reverses the accruals and demands after the first of them once for the loan.
+	"""
 	from lending.loan_management.doctype.process_loan_demand.process_loan_demand import (
 		process_daily_loan_demands,
 	)
@@ -3245,6 +3404,7 @@ def post_bulk_submit_actions(loan, to_date, from_date):
 		process_loan_interest_accrual_for_loans,
 	)
 
+	# The repost allocates against the demands already made if it does not generate them again
 	process_daily_loan_demands(posting_date=to_date, loan=loan)
 	process_loan_interest_accrual_for_loans(posting_date=to_date, loan=loan)
 
@@ -3253,4 +3413,66 @@ def post_bulk_submit_actions(loan, to_date, from_date):
 	repost.repost_date = getdate(from_date)
 	repost.cancel_future_accruals_and_demands = True
 	repost.cancel_future_emi_demands = True
+	repost.flags.unapplied_repayments = frappe.get_all(
+		"Loan Repayment",
+		{"bulk_repayment_log": ("in", bulk_repayment_logs), "docstatus": 1},
+		pluck="name",
+	)
 	repost.submit()
+
+
+def process_repayment_follow_ups(loan):
+	"""Run the queued follow ups of a loan's repayments one by one, in the order the
+	repayments were submitted.
+
+	The loan row is locked around each repayment so that the follow ups of a loan never run
+	in parallel, and a repayment is only picked up while it is queued, so running this more
+	than once is harmless. A failed follow up holds back the later ones till it is retried.
+	"""
+	while True:
+		pending = get_pending_follow_up(loan)
+
+		if not pending or pending.follow_up_status == "Failed":
+			break
+
+		try:
+			run_follow_up(pending)
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(
+				title="Loan Repayment Follow Up Error",
+				message=frappe.get_traceback(),
+				reference_doctype="Loan Repayment",
+				reference_name=pending.name,
+			)
+			frappe.db.set_value("Loan Repayment", pending.name, "follow_up_status", "Failed")
+
+		frappe.db.commit()  # nosemgrep
+
+
+def get_pending_follow_up(loan):
+	"""Lock the loan row and return the first repayment of the loan with follow ups queued
+	or failed"""
+	frappe.db.get_value("Loan", loan, "name", for_update=True)
+
+	pending = frappe.get_all(
+		"Loan Repayment",
+		filters={
+			"against_loan": loan,
+			"docstatus": 1,
+			"follow_up_status": ("in", ["Queued", "Failed"]),
+		},
+		fields=["name", "follow_up_status", "reversed_accrual_date"],
+		order_by="creation",
+		limit=1,
+	)
+
+	return pending[0] if pending else None
+
+
+def run_follow_up(repayment):
+	doc = frappe.get_doc("Loan Repayment", repayment.name)
+	doc.run_follow_ups(
+		[{"posting_date": repayment.reversed_accrual_date}] if repayment.reversed_accrual_date else []
+	)
+	doc.db_set("follow_up_status", "Completed")
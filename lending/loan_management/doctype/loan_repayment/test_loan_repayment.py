@@ -1,6 +1,8 @@
 # Copyright (c) 2019, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
+from unittest.mock import patch
+
 import frappe
 from frappe.query_builder import DocType
 from frappe.query_builder import functions as fn
@@ -12,6 +14,11 @@ from lending.loan_management.doctype.loan_repayment.loan_repayment import (
 	get_amounts,
 	init_amounts,
 	post_bulk_payments,
+	process_repayment_follow_ups,
+)
+from lending.loan_management.doctype.loan_repayment_repost.replay_engine import RepaymentReplay
+from lending.loan_management.doctype.loan_repayment_repost.test_loan_repayment_repost import (
+	get_loan_state,
 )
 from lending.loan_management.doctype.process_loan_demand.process_loan_demand import (
 	process_daily_loan_demands,
@@ -20,6 +27,7 @@ from lending.loan_management.doctype.process_loan_interest_accrual.process_loan_
 	process_loan_interest_accrual_for_loans,
 )
 from lending.tests.test_utils import (
+	create_disbursed_loan,
 	create_loan,
 	create_loan_write_off,
 	create_repayment_entry,
@@ -258,6 +266,78 @@ class TestLoanRepayment(IntegrationTestCase):
 
 		self.assertEqual(penal_interest, None)
 
+	def test_deferred_repayment_follow_ups(self):
+		frappe.db.set_value("Company", "_Test Company", "defer_repayment_follow_ups", 1)
+		self.addCleanup(frappe.db.set_value, "Company", "_Test Company", "defer_repayment_follow_ups", 0)
+
+		loan = create_loan(
+			self.applicant2,
+			"Term Loan Product 4",
+			1000000,
+			"Repay Over Number of Periods",
+			6,
+			applicant_type="Customer",
+			repayment_start_date="2024-05-05",
+			posting_date="2024-04-18",
+			rate_of_interest=23,
+			penalty_charges_rate=12,
+		)
+		loan.submit()
+		make_loan_disbursement_entry(
+			loan.name,
+			loan.loan_amount,
+			disbursement_date="2024-04-18",
+			repayment_start_date="2024-05-05",
+		)
+		process_daily_loan_demands(loan=loan.name, posting_date="2024-05-05")
+		process_loan_interest_accrual_for_loans(
+			loan=loan.name, posting_date=add_days("2024-05-05", 6), company="_Test Company"
+		)
+
+		def get_penal_accruals():
+			return frappe.db.count(
+				"Loan Interest Accrual",
+				{"loan": loan.name, "interest_type": "Penal Interest", "docstatus": 1},
+			)
+
+		self.assertGreater(get_penal_accruals(), 0)
+
+		repayment = create_repayment_entry(loan=loan.name, value_date="2024-05-05", paid_amount=100000)
+		repayment.submit()
+
+		# Allocation is done on submit, the penal reversal waits for the follow ups
+		self.assertEqual(repayment.follow_up_status, "Queued")
+		self.assertGreater(repayment.total_interest_paid, 0)
+		self.assertGreater(get_penal_accruals(), 0)
+
+		# A later repayment is not allocated while earlier follow ups have failed
+		repayment.db_set("follow_up_status", "Failed")
+		self.assertRaises(
+			frappe.ValidationError,
+			create_repayment_entry(loan=loan.name, value_date="2024-05-05", paid_amount=78025).submit,
+		)
+
+		# and runs the queued ones before it is allocated
+		repayment.db_set("follow_up_status", "Queued")
+		later_repayment = create_repayment_entry(
+			loan=loan.name, value_date="2024-05-05", paid_amount=78025
+		)
+		later_repayment.submit()
+
+		self.assertEqual(
+			frappe.db.get_value("Loan Repayment", repayment.name, "follow_up_status"), "Completed"
+		)
+		self.assertEqual(get_penal_accruals(), 0)
+		self.assertEqual(later_repayment.follow_up_status, "Queued")
+
+		process_repayment_follow_ups(loan.name)
+		# Running it again does nothing
+		process_repayment_follow_ups(loan.name)
+
+		self.assertEqual(
+			frappe.db.get_value("Loan Repayment", later_repayment.name, "follow_up_status"), "Completed"
+		)
+
 	def test_demand_generation_upon_pre_payment(self):
 		loan = create_loan(
 			"_Test Customer 1",
@@ -896,6 +976,56 @@ class TestLoanRepayment(IntegrationTestCase):
 		self.assertEqual(successful_log.status, "Success")
 		self.assertEqual(failed_log.status, "Failure")
 
+	def test_bulk_payments_match_document_repayments(self):
+		posting_date = get_datetime("2024-04-18")
+		repayment_start_date = get_datetime("2024-05-05")
+
+		bulk_loan, fallback_loan, document_loan = [
+			make_term_loan_with_demands(self.applicant2, posting_date, repayment_start_date)
+			for i in range(3)
+		]
+
+		def get_rows(loan):
+			return [
+				{
+					"against_loan": loan,
+					"value_date": add_months(repayment_start_date, i),
+					"amount_paid": 178025,
+				}
+				for i in range(5)
+			]
+
+		post_bulk_payments(get_rows(bulk_loan))
+
+		with patch.object(RepaymentReplay, "replay", return_value=False):
+			post_bulk_payments(get_rows(fallback_loan))
+
+		for row in get_rows(document_loan):
+			create_repayment_entry(
+				loan=document_loan, value_date=row["value_date"], paid_amount=row["amount_paid"]
+			).submit()
+
+		# The bulk rows were allocated in memory, without reversing the demands
+		self.assertFalse(frappe.db.exists("Loan Demand", {"loan": bulk_loan, "docstatus": 2}))
+
+		last_value_date = getdate(add_months(repayment_start_date, 4))
+		expected = get_loan_state(document_loan)
+
+		for loan in (bulk_loan, fallback_loan):
+			state = get_loan_state(loan)
+
+			self.assertEqual(state["repayments"], expected["repayments"], msg=loan)
+			self.assertEqual(state["gl_entries"], expected["gl_entries"], msg=loan)
+			self.assertEqual(
+				[d for d in state["demands"] if d[0] <= last_value_date],
+				[d for d in expected["demands"] if d[0] <= last_value_date],
+				msg=loan,
+			)
+			for fieldname in ("total_principal_paid", "total_amount_paid"):
+				self.assertEqual(
+					flt(state["loan"][fieldname], 2), flt(expected["loan"][fieldname], 2), msg=loan
+				)
+
 	def test_loan_repayment_cancel_with_amount_overlimit(self):
 		frappe.db.set_value("Loan Product", "Term Loan Product 4", "excess_amount_acceptance_limit", 100)
 		set_loan_accrual_frequency(loan_accrual_frequency="Daily")
@@ -1754,3 +1884,15 @@ class TestLoanRepayment(IntegrationTestCase):
 		repayment_entry.load_from_db()
 		self.assertEqual(repayment_entry.total_charges_paid, 500)
 		self.assertEqual(repayment_entry.repayment_details[0].demand_subtype, "Processing Fee")
+
+
+def make_term_loan_with_demands(applicant, posting_date, repayment_start_date):
+	loan, _disbursement = create_disbursed_loan(
+		applicant, 1000000, 6, posting_date, repayment_start_date, rate_of_interest=23
+	)
+	process_loan_interest_accrual_for_loans(
+		loan=loan.name, posting_date=add_months(posting_date, 6), company="_Test Company"
+	)
+	process_daily_loan_demands(loan=loan.name, posting_date=add_months(repayment_start_date, 6))
+
+	return loan.name
@@ -1,11 +1,13 @@
 import frappe
 from frappe.query_builder import DocType
 from frappe.query_builder import functions as fn
-from frappe.utils import cint, flt
+from frappe.utils import flt
+
+from lending.loan_management.lending_config import get_currency_precision
 
 
 def get_pending_principal_amount_for_loans(loans, disbursement_map, consolidated=False):
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 
 	principal_amount_map = {}
 
@@ -76,7 +78,7 @@ def process_amount_for_bulk_loans(
 	available_security_deposit_map,
 ):
 
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 	total_pending_interest = 0
 	charges = 0
 	penalty_amount = 0
@@ -5,12 +5,15 @@ import frappe
 from frappe.model.document import Document
 from frappe.query_builder import DocType
 from frappe.query_builder import functions as fn
-from frappe.utils import add_days, cint, flt, getdate
+from frappe.utils import add_days, flt, getdate
 
+from lending.loan_management.doctype.loan_demand.utils import invalidate_unpaid_demands
 from lending.loan_management.doctype.loan_repayment.loan_repayment import (
 	calculate_amounts,
 	get_pending_principal_amount,
 )
+from lending.loan_management.doctype.loan_repayment_repost.replay_engine import RepaymentReplay
+from lending.loan_management.lending_config import get_currency_precision
 
 
 class LoanRepaymentRepost(Document):
@@ -69,6 +72,10 @@ class LoanRepaymentRepost(Document):
 			)
 
 	def on_submit(self):
+		if RepaymentReplay(self).replay():
+			self.process_accruals_and_demands_till_date()
+			return
+
 		if self.clear_demand_allocation_before_repost:
 			self.clear_demand_allocation()
 
@@ -135,6 +142,8 @@ class LoanRepaymentRepost(Document):
 				},
 			)
 
+		invalidate_unpaid_demands([self.loan])
+
 		for entry in self.get("repayment_entries"):
 			repayment_doc = frappe.get_doc("Loan Repayment", entry.loan_repayment)
 			for repayment_detail in repayment_doc.get("repayment_details"):
@@ -142,9 +151,15 @@ class LoanRepaymentRepost(Document):
 
 	def trigger_on_cancel_events(self):
 		entries_to_cancel = [d.loan_repayment for d in self.get("entries_to_cancel")]
+		unapplied_repayments = self.flags.unapplied_repayments or []
+
 		for entry in self.get("repayment_entries"):
 			repayment_doc = frappe.get_doc("Loan Repayment", entry.loan_repayment)
-			if entry.loan_repayment in entries_to_cancel:
+			if entry.loan_repayment in unapplied_repayments:
+				# Posted in bulk, so its demands were never paid and it has no GL entries
+				if repayment_doc.repayment_type in ("Advance Payment", "Pre Payment"):
+					repayment_doc.cancel_loan_restructure()
+			elif entry.loan_repayment in entries_to_cancel:
 				repayment_doc.flags.ignore_links = True
 				repayment_doc.flags.from_repost = True
 				repayment_doc.cancel()
@@ -174,50 +189,55 @@ class LoanRepaymentRepost(Document):
 					frappe.db.set_value("Loan", repayment_doc.against_loan, "status", "Disbursed")
 					repayment_doc.update_repayment_schedule_status(cancel=1)
 
-			LoanRepayment = DocType("Loan Repayment")
+		if not self.get("repayment_entries"):
+			return
+
+		# Repayments before the repost date are not touched by the repost, so the totals are
+		# set once from them
+		LoanRepayment = DocType("Loan Repayment")
 
-			totals = (
+		totals = (
+			frappe.qb.from_(LoanRepayment)
+			.select(
+				fn.Sum(LoanRepayment.principal_amount_paid).as_("total_principal_paid"),
+				fn.Sum(LoanRepayment.amount_paid).as_("total_amount_paid"),
+			)
+			.where(
+				(LoanRepayment.against_loan == self.loan)
+				& (LoanRepayment.docstatus == 1)
+				& (LoanRepayment.value_date < self.repost_date)
+			)
+		).run(as_dict=True)[0]
+
+		frappe.db.set_value(
+			"Loan",
+			self.loan,
+			{
+				"total_principal_paid": flt(totals.total_principal_paid),
+				"total_amount_paid": flt(totals.total_amount_paid),
+				"excess_amount_paid": 0,
+			},
+		)
+
+		if self.loan_disbursement:
+			total_principal_paid = (
 				frappe.qb.from_(LoanRepayment)
-				.select(
-					fn.Sum(LoanRepayment.principal_amount_paid).as_("total_principal_paid"),
-					fn.Sum(LoanRepayment.amount_paid).as_("total_amount_paid"),
-				)
+				.select(fn.Sum(LoanRepayment.principal_amount_paid))
 				.where(
 					(LoanRepayment.against_loan == self.loan)
+					& (LoanRepayment.loan_disbursement == self.loan_disbursement)
 					& (LoanRepayment.docstatus == 1)
 					& (LoanRepayment.value_date < self.repost_date)
 				)
-			).run(as_dict=True)[0]
+			).run()[0][0] or 0
 
 			frappe.db.set_value(
-				"Loan",
-				self.loan,
-				{
-					"total_principal_paid": flt(totals.total_principal_paid),
-					"total_amount_paid": flt(totals.total_amount_paid),
-					"excess_amount_paid": 0,
-				},
+				"Loan Disbursement",
+				self.loan_disbursement,
+				"principal_amount_paid",
+				flt(total_principal_paid),
 			)
 
-			if self.loan_disbursement:
-				total_principal_paid = (
-					frappe.qb.from_(LoanRepayment)
-					.select(fn.Sum(LoanRepayment.principal_amount_paid))
-					.where(
-						(LoanRepayment.against_loan == self.loan)
-						& (LoanRepayment.loan_disbursement == self.loan_disbursement)
-						& (LoanRepayment.docstatus == 1)
-						& (LoanRepayment.value_date < self.repost_date)
-					)
-				).run()[0][0] or 0
-
-				frappe.db.set_value(
-					"Loan Disbursement",
-					self.loan_disbursement,
-					"principal_amount_paid",
-					flt(total_principal_paid),
-				)
-
 	def trigger_on_submit_events(self):
 		from lending.loan_management.doctype.loan_repayment.loan_repayment import (
 			update_installment_counts,
@@ -225,13 +245,10 @@ class LoanRepaymentRepost(Document):
 		from lending.loan_management.doctype.loan_restructure.loan_restructure import (
 			create_update_loan_reschedule,
 		)
-		from lending.loan_management.doctype.process_loan_classification.process_loan_classification import (
-			create_process_loan_classification,
-		)
 
 		entries_to_cancel = [d.loan_repayment for d in self.get("entries_to_cancel")]
 
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		is_written_off = frappe.db.get_value(
 			"Loan Write Off",
@@ -424,6 +441,13 @@ class LoanRepaymentRepost(Document):
 				flt(total_principal_paid),
 			)
 
+		self.process_accruals_and_demands_till_date()
+
+	def process_accruals_and_demands_till_date(self):
+		from lending.loan_management.doctype.process_loan_classification.process_loan_classification import (
+			create_process_loan_classification,
+		)
+
 		frappe.get_doc(
 			{
 				"doctype": "Process Loan Interest Accrual",
@@ -0,0 +1,530 @@
+import frappe
+from frappe.utils import flt, getdate, now_datetime
+
+from lending.loan_management.bulk_writer import (
+	BulkDocumentWriter,
+	insert_docs_in_bulk,
+	make_reverse_gl_entries_in_bulk,
+	set_names_in_bulk,
+	set_submitted_values,
+)
+from lending.loan_management.doctype.loan_demand.utils import (
+	get_demand_sort_key,
+	invalidate_unpaid_demands,
+)
+from lending.loan_management.doctype.loan_repayment.allocation_engine import get_allocation_plan
+from lending.loan_management.doctype.loan_repayment.loan_repayment import (
+	get_demand_query,
+	update_installment_counts,
+)
+from lending.loan_management.lending_config import get_currency_precision, get_lending_config
+
+# Repayments whose whole effect on the loan comes from their allocation against demands
+REPLAY_REPAYMENT_TYPES = ("Normal Repayment",)
+
+REPLAY_LOAN_STATUSES = ("Disbursed", "Partially Disbursed", "Active")
+
+ALLOCATION_TOTAL_FIELDS = (
+	"principal_amount_paid",
+	"total_interest_paid",
+	"total_penalty_paid",
+	"total_charges_paid",
+	"total_partner_principal_share",
+	"total_partner_interest_share",
+)
+
+PAYABLE_FIELDS = (
+	"interest_payable",
+	"penalty_amount",
+	"payable_principal_amount",
+	"total_charges_payable",
+	"payable_amount",
+)
+
+# Amounts that are only set when a repayment pays more than its demands
+LEFTOVER_FIELDS = ("excess_amount", "unbooked_interest_paid", "unbooked_penalty_paid")
+
+
+class RepaymentReplay:
+	"""Repost of the repayments of a loan, recomputed in memory.
+
+	The demands of the loan and the reposted repayments with their stored allocation are
+	loaded once. The repayments are then allocated again in order of value date, against the
+	demands as they stood before the first of them, and only the repayments, demands and GL
+	entries whose amounts changed are written back.
+
+	Reposts of backdated repayments cancel the accruals and demands from the repost date and
+	generate them again before each repayment. For a loan that accrues no penal interest they
+	come back the same whatever the repayments paid, so they are kept as they are. Only
+	reposts which cancel no repayments are replayed, for term loans whose reposted
+	repayments are all plain repayments that are used up by their demands. `replay` returns
+	False for anything else before writing anything, and the repost then cancels and submits
+	each repayment again.
+
+	Repayments posted by `post_bulk_payments` are submitted without paying their demands or
+	making GL entries, and the repost of the loan that follows does both. The repost passes
+	them in `flags.unapplied_repayments`, and their stored allocation is not added back to the
+	demands or reversed.
+	"""
+
+	def __init__(self, repost):
+		self.repost = repost
+		self.loan = repost.loan
+		self.loan_status = None
+		self.unapplied = set(repost.flags.unapplied_repayments or [])
+		self.precision = get_currency_precision()
+		self.repayments = []
+		self.demands = {}
+		self.repayment_updates = {}
+		self.new_details = {}
+		self.principal_changes = {}
+		self.gl_changed = set()
+
+	def replay(self):
+		if not self.is_replayable():
+			return False
+
+		self.load()
+
+		if not self.repayments or not self.load_demands() or not self.allocate():
+			return False
+
+		self.persist()
+		return True
+
+	def is_replayable(self):
+		repost = self.repost
+
+		if repost.get("entries_to_cancel") or repost.clear_demand_allocation_before_repost:
+			return False
+
+		loan = frappe.db.get_value(
+			"Loan",
+			self.loan,
+			["status", "is_term_loan", "repayment_schedule_type", "loan_product", "penalty_charges_rate"],
+			as_dict=1,
+		)
+
+		if (
+			loan.status not in REPLAY_LOAN_STATUSES
+			or not loan.is_term_loan
+			or loan.repayment_schedule_type == "Line of Credit"
+		):
+			return False
+
+		# Penal interest is accrued on what the repayments left unpaid, so it has to be
+		# generated again between the repayments
+		if (
+			repost.cancel_future_emi_demands or repost.cancel_future_accruals_and_demands
+		) and accrues_penal_interest(loan):
+			return False
+
+		self.loan_status = loan.status
+
+		return not frappe.db.exists(
+			"Loan Write Off",
+			{"loan": self.loan, "docstatus": 1, "value_date": (">=", repost.repost_date)},
+		)
+
+	def load(self):
+		repayments = [
+			frappe.get_doc("Loan Repayment", entry.loan_repayment)
+			for entry in self.repost.get("repayment_entries")
+		]
+
+		self.repayments = sorted(repayments, key=lambda d: (getdate(d.value_date), d.creation))
+
+	def load_demands(self):
+		"""Load the demands the repayments can pay, with the amounts paid by the reposted
+		repayments added back to their outstanding amount."""
+		loan_demand = frappe.qb.DocType("Loan Demand")
+
+		query = (
+			get_demand_query()
+			.select(
+				loan_demand.disbursement_date,
+				loan_demand.repayment_schedule_detail,
+				loan_demand.creation,
+			)
+			.where(
+				(loan_demand.loan == self.loan)
+				& (loan_demand.docstatus == 1)
+				& (loan_demand.demand_date <= self.repayments[-1].value_date)
+			)
+			.for_update()
+		)
+
+		if self.repost.loan_disbursement:
+			query = query.where(loan_demand.loan_disbursement == self.repost.loan_disbursement)
+
+		for demand in query.run(as_dict=1):
+			demand.outstanding_amount = demand.stored_outstanding = flt(demand.outstanding_amount)
+			demand.partner_outstanding = demand.stored_partner_outstanding = flt(
+				demand.partner_outstanding
+			)
+			self.demands[demand.name] = demand
+
+		for repayment in self.repayments:
+			if repayment.name in self.unapplied:
+				continue
+
+			for detail in repayment.get("repayment_details"):
+				demand = self.demands.get(detail.loan_demand)
+				if not demand:
+					return False
+
+				demand.outstanding_amount += flt(detail.paid_amount)
+				demand.partner_outstanding += flt(detail.partner_share)
+
+		return True
+
+	def allocate(self):
+		demands = sorted(self.demands.values(), key=get_demand_sort_key)
+		principal_paid_after = self.get_principal_paid_after()
+		principal_change = 0
+
+		for repayment in self.repayments:
+			unapplied = repayment.name in self.unapplied
+
+			if not self.is_replayable_repayment(repayment, unapplied):
+				return False
+
+			value_date = getdate(repayment.value_date)
+			unpaid_demands = [
+				demand
+				for demand in demands
+				if getdate(demand.demand_date) <= value_date
+				and flt(demand.outstanding_amount, self.precision) > 0
+			]
+
+			updates = {}
+			for field, amount in get_payable_amounts(unpaid_demands, self.precision).items():
+				if flt(amount - flt(repayment.get(field)), self.precision):
+					updates[field] = amount
+
+			allocator = repayment.get_demand_allocator(unpaid_demands, status=self.loan_status)
+			pending_amount = allocator.allocate(
+				get_allocation_plan(repayment.get_collection_allocation_order(self.loan_status)),
+				flt(repayment.amount_paid),
+			)
+
+			if unapplied:
+				stored_details = []
+				stored_pending_amount = 0
+			else:
+				stored_details = repayment.get("repayment_details")
+				stored_pending_amount = flt(repayment.amount_paid) - sum(
+					flt(d.paid_amount) for d in stored_details
+				)
+
+			# What is left over goes to interest not demanded yet, principal or excess, which
+			# depend on more than the demands
+			if flt(pending_amount, self.precision) or flt(stored_pending_amount, self.precision):
+				return False
+
+			new_details = [frappe._dict(allocation) for allocation in allocator.allocations]
+			stored_totals = get_allocation_totals(stored_details, self.precision)
+			new_totals = get_allocation_totals(new_details, self.precision)
+
+			pending_principal_amount = flt(
+				repayment.pending_principal_amount
+				+ principal_paid_after.get(repayment.name, 0)
+				- principal_change,
+				self.precision,
+			)
+
+			# A repayment that pays off the principal closes the loan
+			if 0 < pending_principal_amount <= new_totals["principal_amount_paid"]:
+				return False
+
+			for allocation in allocator.allocations:
+				demand = self.demands[allocation["loan_demand"]]
+				demand.outstanding_amount -= flt(allocation["paid_amount"])
+				demand.partner_outstanding -= flt(allocation["partner_share"])
+
+			if flt(pending_principal_amount - repayment.pending_principal_amount, self.precision):
+				updates["pending_principal_amount"] = pending_principal_amount
+
+			if unapplied:
+				for field in LEFTOVER_FIELDS:
+					if flt(repayment.get(field), self.precision):
+						updates[field] = 0
+
+			if unapplied or self.get_detail_rows(new_details) != self.get_detail_rows(stored_details):
+				self.new_details[repayment.name] = new_details
+
+				for field in ALLOCATION_TOTAL_FIELDS:
+					# A repayment posted in bulk holds the totals it was validated with
+					if unapplied:
+						amount = new_totals[field]
+					else:
+						amount = flt(repayment.get(field)) - stored_totals[field] + new_totals[field]
+
+					if flt(amount - flt(repayment.get(field)), self.precision):
+						updates[field] = flt(amount, self.precision)
+
+				if unapplied or get_gl_components(new_details, self.precision) != get_gl_components(
+					stored_details, self.precision
+				):
+					self.gl_changed.add(repayment.name)
+
+				repayment_principal_change = flt(
+					new_totals["principal_amount_paid"] - stored_totals["principal_amount_paid"],
+					self.precision,
+				)
+				if repayment_principal_change:
+					self.principal_changes[repayment.name] = repayment_principal_change
+					principal_change += repayment_principal_change
+
+			if updates:
+				self.repayment_updates[repayment.name] = updates
+
+		return True
+
+	def get_principal_paid_after(self):
+		"""Principal paid by the applied repayments that come after each repayment posted in
+		bulk. The pending principal a bulk repayment was validated with already has it taken
+		off."""
+		principal_paid_after = {}
+		principal_paid = 0
+
+		for repayment in reversed(self.repayments):
+			if repayment.name in self.unapplied:
+				principal_paid_after[repayment.name] = principal_paid
+			else:
+				principal_paid += flt(repayment.principal_amount_paid)
+
+		return principal_paid_after
+
+	def is_replayable_repayment(self, repayment, unapplied=False):
+		if repayment.repayment_type not in REPLAY_REPAYMENT_TYPES or flt(repayment.shortfall_amount):
+			return False
+
+		# The leftover amounts of a repayment posted in bulk are worked out again
+		if unapplied:
+			return True
+
+		return (
+			not flt(repayment.excess_amount)
+			and not flt(repayment.unbooked_interest_paid)
+			and not flt(repayment.unbooked_penalty_paid)
+			and not (
+				repayment.pending_principal_amount > 0
+				and repayment.principal_amount_paid >= repayment.pending_principal_amount
+			)
+		)
+
+	def get_detail_rows(self, details):
+		return [
+			(d.loan_demand, flt(d.paid_amount, self.precision), flt(d.partner_share, self.precision))
+			for d in details
+		]
+
+	def persist(self):
+		self.update_repayment_details()
+		self.update_demands()
+		self.update_repayments()
+		self.update_paid_amounts()
+
+	def update_repayment_details(self):
+		if not self.new_details:
+			return
+
+		lr_detail = frappe.qb.DocType("Loan Repayment Detail")
+		frappe.qb.from_(lr_detail).delete().where(lr_detail.parent.isin(list(self.new_details))).run()
+
+		timestamp = now_datetime()
+		details = []
+
+		for repayment in self.repayments:
+			if repayment.name not in self.new_details:
+				continue
+
+			repayment.set("repayment_details", [])
+			for allocation in self.new_details[repayment.name]:
+				detail = repayment.append("repayment_details", allocation)
+				set_submitted_values(detail, timestamp)
+				details.append(detail)
+
+		set_names_in_bulk(details)
+		insert_docs_in_bulk(details)
+
+	def update_demands(self):
+		demand_updates = {}
+
+		for demand in self.demands.values():
+			paid_change = flt(demand.stored_outstanding - demand.outstanding_amount, self.precision)
+			partner_share_change = flt(
+				demand.stored_partner_outstanding - demand.partner_outstanding, self.precision
+			)
+
+			if paid_change or partner_share_change:
+				demand_updates[demand.name] = (paid_change, partner_share_change)
+
+		if not demand_updates:
+			return
+
+		loan_demand = frappe.qb.DocType("Loan Demand")
+		for name, (paid_change, partner_share_change) in demand_updates.items():
+			frappe.qb.update(loan_demand).set(
+				loan_demand.paid_amount, loan_demand.paid_amount + paid_change
+			).set(loan_demand.outstanding_amount, loan_demand.outstanding_amount - paid_change).set(
+				loan_demand.partner_share_allocated,
+				loan_demand.partner_share_allocated + partner_share_change,
+			).where(
+				loan_demand.name == name
+			).run()
+
+		invalidate_unpaid_demands([self.loan])
+		update_installment_counts(self.loan, loan_disbursement=self.repost.loan_disbursement)
+
+	def update_repayments(self):
+		# Repayments posted in bulk have no GL entries to reverse
+		reversed_repayments = [
+			repayment.name
+			for repayment in self.repayments
+			if repayment.name in self.gl_changed and repayment.name not in self.unapplied
+		]
+
+		if reversed_repayments:
+			if self.repost.delete_gl_entries:
+				gl_entry = frappe.qb.DocType("GL Entry")
+				frappe.qb.from_(gl_entry).delete().where(
+					(gl_entry.voucher_type == "Loan Repayment")
+					& (gl_entry.voucher_no.isin(reversed_repayments))
+				).run()
+			else:
+				make_reverse_gl_entries_in_bulk("Loan Repayment", reversed_repayments)
+
+		for repayment in self.repayments:
+			repayment.update(self.repayment_updates.get(repayment.name, {}))
+
+		if self.repayment_updates:
+			frappe.db.bulk_update("Loan Repayment", self.repayment_updates)
+
+		writer = BulkDocumentWriter(
+			"Loan Repayment", get_gl_map=get_repayment_gl_map, merge_gl_entries=True
+		)
+		writer.make_gl_entries(
+			[repayment for repayment in self.repayments if repayment.name in self.gl_changed],
+			now_datetime(),
+		)
+
+	def update_paid_amounts(self):
+		disbursement_wise_change = {}
+
+		for repayment in self.repayments:
+			if repayment.name in self.principal_changes:
+				disbursement_wise_change.setdefault(repayment.loan_disbursement, 0)
+				disbursement_wise_change[repayment.loan_disbursement] += self.principal_changes[
+					repayment.name
+				]
+
+		total_change = flt(sum(disbursement_wise_change.values()), self.precision)
+
+		# Repayments posted in bulk were never added to the amount paid on the loan
+		amount_paid = flt(
+			sum(
+				flt(repayment.amount_paid)
+				for repayment in self.repayments
+				if repayment.name in self.unapplied
+			),
+			self.precision,
+		)
+
+		if total_change or amount_paid:
+			loan = frappe.qb.DocType("Loan")
+			frappe.qb.update(loan).set(
+				loan.total_principal_paid, loan.total_principal_paid + total_change
+			).set(loan.total_amount_paid, loan.total_amount_paid + amount_paid).where(
+				loan.name == self.loan
+			).run()
+
+		loan_disbursement = frappe.qb.DocType("Loan Disbursement")
+		for disbursement, change in disbursement_wise_change.items():
+			if disbursement and flt(change, self.precision):
+				frappe.qb.update(loan_disbursement).set(
+					loan_disbursement.principal_amount_paid,
+					loan_disbursement.principal_amount_paid + change,
+				).where(loan_disbursement.name == disbursement).run()
+
+
+def accrues_penal_interest(loan):
+	penal_interest_rate = loan.penalty_charges_rate
+
+	if not penal_interest_rate:
+		loan_product_config = get_lending_config().get_loan_product(loan.loan_product)
+		penal_interest_rate = loan_product_config.penalty_interest_rate
+
+	return flt(penal_interest_rate, get_currency_precision()) > 0
+
+
+def get_repayment_gl_map(repayment):
+	return repayment.get_gl_map()
+
+
+def get_payable_amounts(demands, precision):
+	"""Amounts due on a repayment from the unpaid demands it is allocated against, worked out
+	the same way as in `process_amount_for_loan`."""
+	payable = dict.fromkeys(PAYABLE_FIELDS, 0)
+
+	for demand in demands:
+		if demand.demand_subtype == "Interest":
+			payable["interest_payable"] += demand.outstanding_amount
+		elif demand.demand_subtype == "Principal":
+			payable["payable_principal_amount"] += demand.outstanding_amount
+		elif demand.demand_subtype in ("Penalty", "Additional Interest"):
+			payable["penalty_amount"] += demand.outstanding_amount
+		elif demand.demand_type == "Charges":
+			payable["total_charges_payable"] += demand.outstanding_amount
+
+	payable["payable_amount"] = sum(
+		payable[field]
+		for field in (
+			"interest_payable",
+			"penalty_amount",
+			"payable_principal_amount",
+			"total_charges_payable",
+		)
+	)
+
+	return {field: flt(amount, precision) for field, amount in payable.items()}
+
+
+def get_allocation_totals(details, precision):
+	"""Repayment totals that come from the allocation against demands, worked out the same
+	way as in `LoanRepayment.allocate_amount_against_demands`."""
+	totals = dict.fromkeys(ALLOCATION_TOTAL_FIELDS, 0)
+
+	for payment in details:
+		if payment.demand_subtype == "Interest":
+			totals["total_interest_paid"] += flt(payment.paid_amount, precision)
+			totals["total_partner_interest_share"] += flt(payment.partner_share, precision)
+		elif payment.demand_subtype == "Principal":
+			totals["principal_amount_paid"] += flt(payment.paid_amount, precision)
+			totals["total_partner_principal_share"] += flt(payment.partner_share, precision)
+		elif payment.demand_type in ("Penalty", "Additional Interest"):
+			totals["total_penalty_paid"] += flt(payment.paid_amount, precision)
+		elif payment.demand_type == "Charges":
+			totals["total_charges_paid"] += flt(payment.paid_amount, precision)
+
+	return totals
+
+
+def get_gl_components(details, precision):
+	"""Amounts of an allocation that its GL entries are made from. Two allocations with the
+	same components post the same GL entries, whichever demands they paid."""
+	components = {}
+
+	for payment in details:
+		key = (payment.demand_type, payment.demand_subtype, payment.sales_invoice)
+		paid_amount, partner_share = components.get(key, (0, 0))
+		components[key] = (
+			paid_amount + flt(payment.paid_amount),
+			partner_share + flt(payment.partner_share),
+		)
+
+	return {
+		key: (flt(paid_amount, precision), flt(partner_share, precision))
+		for key, (paid_amount, partner_share) in components.items()
+	}
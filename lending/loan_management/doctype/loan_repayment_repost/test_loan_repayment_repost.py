@@ -1,11 +1,14 @@
 # Copyright (c) 2024, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
+from unittest.mock import patch
+
 import frappe
 from frappe.tests import IntegrationTestCase
-from frappe.utils import flt, get_datetime
+from frappe.utils import flt, get_datetime, getdate
 
 from lending.loan_management.doctype.loan_repayment.loan_repayment import calculate_amounts
+from lending.loan_management.doctype.loan_repayment_repost.replay_engine import RepaymentReplay
 from lending.loan_management.doctype.process_loan_demand.process_loan_demand import (
 	process_daily_loan_demands,
 )
@@ -125,3 +128,211 @@ class TestLoanRepaymentRepost(IntegrationTestCase):
 		)
 		for demand in demands:
 			self.assertEqual(demand.outstanding_amount, 0)
+
+	def test_repost_without_changes_is_replayed_in_place(self):
+		set_loan_accrual_frequency(loan_accrual_frequency="Daily")
+		loan = create_loan(
+			"_Test Customer 1",
+			"Term Loan Product 4",
+			10000,
+			"Repay Over Number of Periods",
+			2,
+			"Customer",
+			"2025-02-15",
+			"2025-01-25",
+			rate_of_interest=10,
+		)
+		loan.submit()
+
+		make_loan_disbursement_entry(
+			loan.name, loan.loan_amount, disbursement_date="2025-01-25", repayment_start_date="2025-02-15"
+		)
+		process_daily_loan_demands(posting_date="2025-02-15", loan=loan.name)
+
+		payable_amount = calculate_amounts(against_loan=loan.name, posting_date="2025-02-15")[
+			"payable_amount"
+		]
+
+		repayment = create_repayment_entry(loan.name, "2025-02-15", payable_amount)
+		repayment.submit()
+
+		details = frappe.get_all(
+			"Loan Repayment Detail",
+			{"parent": repayment.name},
+			["name", "loan_demand", "paid_amount"],
+			order_by="idx",
+		)
+		gl_entries = frappe.db.count(
+			"GL Entry", {"voucher_type": "Loan Repayment", "voucher_no": repayment.name}
+		)
+
+		frappe.get_doc(
+			{
+				"doctype": "Loan Repayment Repost",
+				"loan": loan.name,
+				"repost_date": "2025-02-15",
+			}
+		).submit()
+
+		# Nothing changed, so the stored allocation and GL entries are left as they were
+		self.assertEqual(
+			frappe.get_all(
+				"Loan Repayment Detail",
+				{"parent": repayment.name},
+				["name", "loan_demand", "paid_amount"],
+				order_by="idx",
+			),
+			details,
+		)
+		self.assertEqual(
+			frappe.db.count("GL Entry", {"voucher_type": "Loan Repayment", "voucher_no": repayment.name}),
+			gl_entries,
+		)
+
+		demands = frappe.db.get_all(
+			"Loan Demand",
+			{"loan": loan.name, "docstatus": 1},
+			["outstanding_amount"],
+		)
+		for demand in demands:
+			self.assertEqual(demand.outstanding_amount, 0)
+
+	def test_replayed_backdated_repost_matches_document_repost(self):
+		set_loan_accrual_frequency(loan_accrual_frequency="Daily")
+
+		def make_loan_with_backdated_repayment():
+			loan = create_loan(
+				"_Test Customer 1",
+				"Term Loan Product 4",
+				10000,
+				"Repay Over Number of Periods",
+				2,
+				"Customer",
+				"2025-02-15",
+				"2025-01-25",
+				rate_of_interest=10,
+			)
+			loan.submit()
+
+			make_loan_disbursement_entry(
+				loan.name, loan.loan_amount, disbursement_date="2025-01-25", repayment_start_date="2025-02-15"
+			)
+			process_daily_loan_demands(posting_date="2025-03-15", loan=loan.name)
+
+			create_repayment_entry(loan.name, "2025-03-16", 3000).submit()
+			march_demands = get_march_demands(loan.name)
+
+			# Backdated, so the repayments from its value date are reposted
+			create_repayment_entry(loan.name, "2025-02-20", 2000).submit()
+
+			return loan.name, march_demands
+
+		def get_march_demands(loan):
+			return frappe.get_all(
+				"Loan Demand",
+				{"loan": loan, "docstatus": 1, "demand_date": ("between", ["2025-03-01", "2025-03-31"])},
+				pluck="name",
+				order_by="name",
+			)
+
+		replayed_loan, march_demands = make_loan_with_backdated_repayment()
+		self.assertEqual(get_march_demands(replayed_loan), march_demands)
+
+		with patch.object(RepaymentReplay, "replay", return_value=False):
+			reposted_loan, march_demands = make_loan_with_backdated_repayment()
+		self.assertNotEqual(get_march_demands(reposted_loan), march_demands)
+
+		self.assertEqual(get_loan_state(replayed_loan), get_loan_state(reposted_loan))
+
+
+def get_loan_state(loan):
+	"""Amounts of a loan, its demands, repayments, accruals and repayment GL entries that do not
+	depend on document names"""
+	repayments = frappe.get_all(
+		"Loan Repayment",
+		{"against_loan": loan, "docstatus": 1},
+		[
+			"name",
+			"value_date",
+			"amount_paid",
+			"principal_amount_paid",
+			"total_interest_paid",
+			"total_penalty_paid",
+			"pending_principal_amount",
+		],
+		order_by="value_date",
+	)
+
+	return {
+		"loan": frappe.db.get_value(
+			"Loan", loan, ["status", "total_principal_paid", "total_amount_paid"], as_dict=1
+		),
+		"demands": sorted(
+			(
+				getdate(d.demand_date),
+				d.demand_type,
+				d.demand_subtype,
+				flt(d.demand_amount, 2),
+				flt(d.paid_amount, 2),
+				flt(d.outstanding_amount, 2),
+			)
+			for d in frappe.get_all(
+				"Loan Demand",
+				{"loan": loan, "docstatus": 1},
+				[
+					"demand_date",
+					"demand_type",
+					"demand_subtype",
+					"demand_amount",
+					"paid_amount",
+					"outstanding_amount",
+				],
+			)
+		),
+		"repayments": [
+			(
+				getdate(repayment.value_date),
+				*[
+					flt(repayment[fieldname], 2)
+					for fieldname in (
+						"amount_paid",
+						"principal_amount_paid",
+						"total_interest_paid",
+						"total_penalty_paid",
+						"pending_principal_amount",
+					)
+				],
+				sorted(
+					(d.demand_type, d.demand_subtype, flt(d.paid_amount, 2))
+					for d in frappe.get_all(
+						"Loan Repayment Detail",
+						{"parent": repayment.name},
+						["demand_type", "demand_subtype", "paid_amount"],
+					)
+				),
+			)
+			for repayment in repayments
+		],
+		"accruals": {
+			d.interest_type: flt(d.interest_amount, 2)
+			for d in frappe.get_all(
+				"Loan Interest Accrual",
+				{"loan": loan, "docstatus": 1},
+				["interest_type", "sum(interest_amount) as interest_amount"],
+				group_by="interest_type",
+			)
+		},
+		"gl_entries": {
+			d.account: flt(flt(d.debit) - flt(d.credit), 2)
+			for d in frappe.get_all(
+				"GL Entry",
+				{
+					"voucher_type": "Loan Repayment",
+					"voucher_no": ("in", [repayment.name for repayment in repayments]),
+					"is_cancelled": 0,
+				},
+				["account", "sum(debit) as debit", "sum(credit) as credit"],
+				group_by="account",
+			)
+		},
+	}
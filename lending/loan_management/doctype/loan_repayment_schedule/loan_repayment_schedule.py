@@ -1,34 +1,55 @@
 # Copyright (c) 2023, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
+import copy
+from functools import lru_cache
 
 import frappe
 from frappe import _
 from frappe.model.document import Document
-from frappe.utils import (
-	add_days,
-	add_months,
-	cint,
-	date_diff,
-	flt,
-	get_first_day,
-	get_last_day,
-	getdate,
-)
+from frappe.utils import add_days, add_months, cint, date_diff, flt, get_last_day, getdate
 
 from lending.loan_management.doctype.loan.loan import get_cyclic_date
-from lending.loan_management.doctype.loan_demand.loan_demand import create_loan_demand
+from lending.loan_management.doctype.loan_demand.loan_demand import make_loan_demands_in_bulk
 from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
 	get_accrual_frequency_breaks,
 )
+from lending.loan_management.doctype.loan_repayment_schedule.schedule_engine import (
+	RepaymentScheduleEngine,
+	get_colender_schedule_terms,
+	get_next_payment_date,
+	get_schedule_row,
+)
 from lending.loan_management.doctype.loan_repayment_schedule.utils import (
-	add_single_month,
-	get_amounts,
-	get_flat_monthly_repayment_amount,
+	get_frequency,
 	get_loan_partner_details,
 	get_monthly_repayment_amount,
 	set_demand,
 )
+from lending.loan_management.lending_config import get_currency_precision, get_lending_config
+
+# Largest what-if grid served in one call, 20 tenures x 10 rates
+MAX_SIMULATED_SCHEDULES = 200
+
+SIMULATION_TERMS = (
+	"loan_amount",
+	"rate_of_interest",
+	"repayment_periods",
+	"repayment_frequency",
+	"repayment_schedule_type",
+	"repayment_method",
+	"monthly_repayment_amount",
+	"posting_date",
+	"repayment_start_date",
+	"repayment_date_on",
+	"moratorium_tenure",
+	"moratorium_type",
+	"treatment_of_interest",
+	"bpi_recovery_method",
+	"partner_repayment_schedule_type",
+	"partner_loan_share_percentage",
+	"partner_rate_of_interest",
+)
 
 
 # nosemgrep
@@ -128,7 +149,7 @@ class LoanRepaymentSchedule(Document):
 		from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
 			get_interest_for_term,
 			get_last_accrual_date,
-			make_loan_interest_accrual_entry,
+			make_loan_interest_accruals_in_bulk,
 		)
 
 		advance_payment = ""
@@ -140,7 +161,7 @@ class LoanRepaymentSchedule(Document):
 				advance_payment = row
 				break
 
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 		principal_balance = 0
 
 		if self.restructure_type == "Advance Payment":
@@ -171,35 +192,42 @@ class LoanRepaymentSchedule(Document):
 			interest_amount = prepayment_details.adjusted_unaccrued_interest
 			paid_interest_amount = interest_amount
 
+		demands = []
+		repayment_schedule_detail = (
+			advance_payment.name if self.restructure_type == "Advance Payment" else None
+		)
+
 		if flt(interest_amount) > 0:
-			create_loan_demand(
-				self.loan,
-				self.posting_date,
-				"EMI",
-				"Interest",
-				interest_amount,
-				loan_repayment_schedule=self.name,
-				loan_disbursement=self.loan_disbursement,
-				repayment_schedule_detail=advance_payment.name
-				if self.restructure_type == "Advance Payment"
-				else None,
-				paid_amount=paid_interest_amount,
+			demands.append(
+				{
+					"loan": self.loan,
+					"demand_date": self.posting_date,
+					"demand_type": "EMI",
+					"demand_subtype": "Interest",
+					"demand_amount": interest_amount,
+					"loan_repayment_schedule": self.name,
+					"loan_disbursement": self.loan_disbursement,
+					"repayment_schedule_detail": repayment_schedule_detail,
+					"paid_amount": paid_interest_amount,
+				}
 			)
 
-		create_loan_demand(
-			self.loan,
-			self.posting_date,
-			"EMI",
-			"Principal",
-			principal_amount,
-			loan_repayment_schedule=self.name,
-			loan_disbursement=self.loan_disbursement,
-			repayment_schedule_detail=advance_payment.name
-			if self.restructure_type == "Advance Payment"
-			else None,
-			paid_amount=paid_principal_amount,
+		demands.append(
+			{
+				"loan": self.loan,
+				"demand_date": self.posting_date,
+				"demand_type": "EMI",
+				"demand_subtype": "Principal",
+				"demand_amount": principal_amount,
+				"loan_repayment_schedule": self.name,
+				"loan_disbursement": self.loan_disbursement,
+				"repayment_schedule_detail": repayment_schedule_detail,
+				"paid_amount": paid_principal_amount,
+			}
 		)
 
+		make_loan_demands_in_bulk(demands)
+
 		last_accrual_date = get_last_accrual_date(self.loan, self.posting_date, "Normal Interest")
 
 		payable_interest = get_interest_for_term(
@@ -226,21 +254,30 @@ class LoanRepaymentSchedule(Document):
 			total_no_of_days = date_diff(end_date, start_date) + 1
 
 			balance_amount = self.current_principal_amount - principal_balance
+			accruals = []
 			for posting_date in accrual_frequency_breaks:
 				no_of_days = date_diff(posting_date, current_last_accrual_date) + 1
-				make_loan_interest_accrual_entry(
-					self.loan,
-					balance_amount,
-					flt(payable_interest * (no_of_days / total_no_of_days), precision),
-					None,
-					current_last_accrual_date,
-					posting_date,
-					"Regular",
-					"Normal Interest",
-					self.rate_of_interest,
-					loan_repayment_schedule=self.name,
-				)
+				interest_amount = flt(payable_interest * (no_of_days / total_no_of_days), precision)
+
+				if interest_amount > 0:
+					accruals.append(
+						{
+							"loan": self.loan,
+							"base_amount": flt(balance_amount, precision),
+							"interest_amount": interest_amount,
+							"start_date": current_last_accrual_date,
+							"posting_date": posting_date,
+							"accrual_type": "Regular",
+							"interest_type": "Normal Interest",
+							"rate_of_interest": self.rate_of_interest,
+							"loan_repayment_schedule": self.name,
+							"loan_disbursement": self.loan_disbursement,
+						}
+					)
+
 				current_last_accrual_date = add_days(posting_date, 1)
+
+			make_loan_interest_accruals_in_bulk(accruals)
 		self.repayment_periods = self.number_of_rows - self.moratorium_tenure
 
 	def on_cancel(self):
@@ -249,7 +286,7 @@ class LoanRepaymentSchedule(Document):
 			reverse_loan_interest_accruals,
 		)
 
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		bpi_accrual = frappe.db.get_value(
 			"Loan Interest Accrual",
@@ -339,25 +376,18 @@ class LoanRepaymentSchedule(Document):
 
 		loan_partner_details = get_loan_partner_details(self.loan_partner)
 
-		if loan_partner_details.repayment_schedule_type == "EMI (PMT) based":
-			partner_loan_amount = (
-				self.current_principal_amount * flt(loan_partner_details.partner_loan_share_percentage) / 100
-			)
-			principal_share_percentage = 100
-			interest_share_percentage = 100
-			rate_of_interest = self.loan_partner_rate_of_interest
-		elif loan_partner_details.repayment_schedule_type == "Collection at partner's percentage":
-			partner_loan_amount = self.current_principal_amount
-			rate_of_interest = self.rate_of_interest
-			principal_share_percentage = flt(loan_partner_details.partner_loan_share_percentage)
-			interest_share_percentage = flt(loan_partner_details.partner_loan_share_percentage)
-		else:
-			partner_loan_amount = (
-				self.current_principal_amount * flt(loan_partner_details.partner_loan_share_percentage) / 100
-			)
-			rate_of_interest = self.loan_partner_rate_of_interest
-			principal_share_percentage = flt(loan_partner_details.partner_loan_share_percentage)
-			interest_share_percentage = 100
+		(
+			partner_loan_amount,
+			rate_of_interest,
+			principal_share_percentage,
+			interest_share_percentage,
+		) = get_colender_schedule_terms(
+			loan_partner_details.repayment_schedule_type,
+			loan_partner_details.partner_loan_share_percentage,
+			self.current_principal_amount,
+			self.rate_of_interest,
+			self.loan_partner_rate_of_interest,
+		)
 
 		self.make_repayment_schedule(
 			"colender_schedule",
@@ -383,169 +413,40 @@ class LoanRepaymentSchedule(Document):
 		interest_share_percentage,
 		partner_schedule_type=None,
 	):
-		payment_date = self.repayment_start_date
-		carry_forward_interest = self.adjusted_interest
-		moratorium_interest = 0
-		is_first_emi = True
-		row = 0
-
-		if self.repayment_schedule_type == "Flat Interest Rate":
-			monthly_repayment_amount = get_flat_monthly_repayment_amount(
-				balance_amount, rate_of_interest, self.repayment_periods, self.repayment_frequency
-			)
-		if not self.restructure_type and self.repayment_method != "Repay Fixed Amount per Period":
-			monthly_repayment_amount = get_monthly_repayment_amount(
-				balance_amount, rate_of_interest, self.repayment_periods, self.repayment_frequency
-			)
-		else:
-			monthly_repayment_amount = self.monthly_repayment_amount
-
-		payment_date = self.set_moratorium_end_date(payment_date)
-
-		tenure = self.get_applicable_tenure(payment_date)
-		additional_days = cint(self.broken_period_interest_days)
-
-		if len(self.get(schedule_field)) > 0:
-			self.broken_period_interest_days = 0
-
-		if additional_days < 0:
-			self.broken_period_interest_days = 0
+		loan_status = frappe.db.get_value("Loan", self.loan, "status")
+		customer_principal_amounts = None
 
-		bpi_recovery_method = frappe.db.get_value(
-			"Loan Product", self.loan_product, "bpi_recovery_method"
+		if (
+			schedule_field == "colender_schedule"
+			and partner_schedule_type == "POS reduction plus interest at partner ROI"
+		):
+			customer_principal_amounts = [row.principal_amount for row in self.get("repayment_schedule")]
+
+		loan_product_config = get_lending_config().get_loan_product(self.loan_product)
+		engine = RepaymentScheduleEngine(
+			self,
+			bpi_recovery_method=loan_product_config.bpi_recovery_method,
+			loan_status=loan_status,
+			prev_schedule_rows=self.get_active_schedule_rows() if loan_status == "Partially Disbursed" else 0,
 		)
 
-		amortized_bpi, first_emi_adjustment = self.apply_broken_period_interest_method(
-			bpi_recovery_method,
+		rows, monthly_repayment_amount = engine.make_rows(
 			balance_amount,
 			rate_of_interest,
-			payment_date,
-			schedule_field,
-			principal_share_percentage,
-			interest_share_percentage,
+			previous_interest_amount=previous_interest_amount,
+			additional_principal_amount=additional_principal_amount,
+			pending_prev_days=pending_prev_days,
+			principal_share_percentage=principal_share_percentage,
+			interest_share_percentage=interest_share_percentage,
+			existing_rows=len(self.get(schedule_field)),
+			customer_principal_amounts=customer_principal_amounts,
+			is_colender=schedule_field == "colender_schedule",
 		)
 
-		while balance_amount > 0:
-			if self.moratorium_tenure and self.repayment_frequency == "Monthly":
-				if getdate(payment_date) > getdate(self.moratorium_end_date):
-					if (
-						self.moratorium_type == "EMI"
-						and self.treatment_of_interest == "Capitalize"
-						and moratorium_interest
-					):
-						balance_amount = self.loan_amount + moratorium_interest
-						monthly_repayment_amount = get_monthly_repayment_amount(
-							balance_amount, rate_of_interest, self.repayment_periods, self.repayment_frequency
-						)
-						moratorium_interest = 0
-
-			prev_balance_amount = balance_amount
+		self.extend(schedule_field, rows)
 
-			payment_days, months = self.get_days_and_months(
-				payment_date,
-				additional_days,
-				balance_amount,
-				rate_of_interest,
-				schedule_field,
-				principal_share_percentage,
-				interest_share_percentage,
-			)
-
-			(
-				interest_amount,
-				principal_amount,
-				balance_amount,
-				total_payment,
-				days,
-				previous_interest_amount,
-			) = get_amounts(
-				balance_amount,
-				rate_of_interest,
-				payment_days,
-				months,
-				monthly_repayment_amount,
-				carry_forward_interest,
-				previous_interest_amount,
-				additional_principal_amount,
-				pending_prev_days,
-				flat_rate=True if self.repayment_schedule_type == "Flat Interest Rate" else False,
-				loan_amount=self.loan_amount,
-			)
-
-			if (
-				schedule_field == "colender_schedule"
-				and partner_schedule_type == "POS reduction plus interest at partner ROI"
-				and row <= len(self.get("repayment_schedule")) - 1
-			):
-				principal_amount = self.get("repayment_schedule")[row].principal_amount
-				balance_amount = prev_balance_amount - (principal_amount * principal_share_percentage / 100)
-				row = row + 1
-
-			if (
-				self.moratorium_end_date and self.moratorium_tenure and self.repayment_frequency == "Monthly"
-			):
-				if getdate(payment_date) <= getdate(self.moratorium_end_date):
-					principal_amount = 0
-					balance_amount = self.current_principal_amount
-					moratorium_interest += interest_amount
-
-					if self.moratorium_type == "EMI":
-						total_payment = 0
-						interest_amount = 0
-					else:
-						total_payment = interest_amount
-
-				elif (
-					self.moratorium_type == "EMI"
-					and self.treatment_of_interest == "Add to first repayment"
-					and moratorium_interest
-				):
-					interest_amount += moratorium_interest
-					total_payment = principal_amount + interest_amount
-					moratorium_interest = 0
-
-			if bpi_recovery_method == "Amortized Over Tenure":
-				interest_amount += amortized_bpi
-				total_payment += amortized_bpi
-			elif bpi_recovery_method == "Add to First EMI" and is_first_emi:
-				interest_amount += first_emi_adjustment
-				total_payment += first_emi_adjustment
-				is_first_emi = False
-
-			self.add_repayment_schedule_row(
-				payment_date,
-				principal_amount,
-				interest_amount,
-				total_payment,
-				balance_amount,
-				days,
-				repayment_schedule_field=schedule_field,
-				principal_share_percentage=principal_share_percentage,
-				interest_share_percentage=interest_share_percentage,
-			)
-
-			# All the residue amount is added to the last row for "Repay Over Number of Periods"
-			#
-			# Also, when such a Repayment Schedule is rescheduled, its repayment_method changes to Repay Fixed Amount per Period
-			# Here, the tenure shouldn't change. Thus, if this is a restructed repayment schedule, the last row is all the residue amount left.
-			# This is a special case.
-
-			if (
-				self.repayment_method == "Repay Over Number of Periods"
-				or (self.restructure_type and self.repayment_method == "Repay Fixed Amount per Period")
-			) and len(self.get(schedule_field)) >= tenure:
-				self.get(schedule_field)[-1].principal_amount += balance_amount
-				self.get(schedule_field)[-1].balance_loan_amount = 0
-				self.get(schedule_field)[-1].total_payment = (
-					self.get(schedule_field)[-1].interest_amount + self.get(schedule_field)[-1].principal_amount
-				)
-				balance_amount = 0
-
-			payment_date = self.get_next_payment_date(payment_date)
-			carry_forward_interest = 0
-			additional_days = 0
-			additional_principal_amount = 0
-			pending_prev_days = 0
+		if schedule_field != "colender_schedule":
+			self.number_of_rows += len(rows)
 
 		if schedule_field == "repayment_schedule" and not self.restructure_type:
 			if self.repayment_frequency == "One Time":
@@ -555,108 +456,16 @@ class LoanRepaymentSchedule(Document):
 		else:
 			self.repayment_periods = self.number_of_rows
 
-	def set_moratorium_end_date(self, payment_date):
-		if not self.restructure_type:
-			if (
-				self.moratorium_tenure
-				and self.repayment_frequency == "Monthly"
-				and self.repayment_schedule_type == "Monthly as per cycle date"
-			):
-				payment_date = self.repayment_start_date
-				self.moratorium_end_date = add_months(self.repayment_start_date, self.moratorium_tenure - 1)
-			elif self.moratorium_tenure and self.repayment_frequency == "Monthly":
-				self.moratorium_end_date = add_months(self.repayment_start_date, self.moratorium_tenure)
-				if self.repayment_schedule_type == "Pro-rated calendar months":
-					self.moratorium_end_date = add_days(self.moratorium_end_date, -1)
-
-		return payment_date
-
-	def apply_broken_period_interest_method(
-		self,
-		bpi_recovery_method,
-		balance_amount,
-		rate_of_interest,
-		payment_date,
-		schedule_field,
-		principal_share_percentage,
-		interest_share_percentage,
-	):
-		amortized_bpi = 0
-		first_emi_adjustment = 0
-
-		if bpi_recovery_method in ["Amortized Over Tenure", "Add to First EMI"]:
-			broken_period_interest = self.add_broken_period_interest(
-				balance_amount,
-				rate_of_interest,
-				self.broken_period_interest_days,
-				payment_date,
-				schedule_field,
-				principal_share_percentage,
-				interest_share_percentage,
-			)
-		if bpi_recovery_method == "Amortized Over Tenure":
-			amortized_bpi = flt(broken_period_interest) / self.repayment_periods
-		elif bpi_recovery_method == "Add to First EMI":
-			first_emi_adjustment = broken_period_interest
-
-		return amortized_bpi, first_emi_adjustment
+	def get_active_schedule_rows(self):
+		prev_schedule = frappe.db.get_value(
+			"Loan Repayment Schedule", {"loan": self.loan, "docstatus": 1, "status": "Active"}
+		)
+		return frappe.db.count("Repayment Schedule", {"parent": prev_schedule})
 
 	def get_next_payment_date(self, payment_date):
-		if (
-			self.repayment_schedule_type
-			in [
-				"Monthly as per repayment start date",
-				"Monthly as per cycle date",
-				"Line of Credit",
-				"Pro-rated calendar months",
-				"Flat Interest Rate",
-			]
-		) and self.repayment_frequency == "Monthly":
-			payment_date = add_single_month(payment_date)
-		elif self.repayment_frequency == "Bi-Weekly":
-			payment_date = add_days(payment_date, 14)
-		elif self.repayment_frequency == "Weekly":
-			payment_date = add_days(payment_date, 7)
-		elif self.repayment_frequency == "Daily":
-			payment_date = add_days(payment_date, 1)
-		elif self.repayment_frequency == "Quarterly":
-			payment_date = add_months(payment_date, 3)
-
-		return payment_date
-
-	def get_applicable_tenure(self, payment_date):
-		loan_status = frappe.db.get_value("Loan", self.loan, "status") or "Sanctioned"
-
-		if self.repayment_frequency == "Monthly" and (
-			loan_status == "Sanctioned" or self.repayment_schedule_type == "Line of Credit"
-		):
-			tenure = self.repayment_periods
-			if self.repayment_frequency == "Monthly" and self.moratorium_tenure:
-				tenure += cint(self.moratorium_tenure)
-		elif self.restructure_type in ("Advance Payment", "Pre Payment") and self.moratorium_tenure:
-			tenure = self.repayment_periods + self.moratorium_tenure
-		elif loan_status == "Partially Disbursed":
-			prev_schedule = frappe.db.get_value(
-				"Loan Repayment Schedule", {"loan": self.loan, "docstatus": 1, "status": "Active"}
-			)
-			tenure = frappe.db.count("Repayment Schedule", {"parent": prev_schedule})
-		else:
-			tenure = self.repayment_periods
-
-		if (
-			self.restructure_type != "Normal Restructure"
-			and self.repayment_frequency == "Monthly"
-			or (self.restructure_type == "Pre Payment" and self.repayment_frequency != "One Time")
-		):
-			self.broken_period_interest_days = date_diff(add_months(payment_date, -1), self.posting_date)
-			if (
-				self.broken_period_interest_days > 0
-				and not self.moratorium_tenure
-				and loan_status != "Partially Disbursed"
-			):
-				tenure += 1
-
-		return tenure
+		return get_next_payment_date(
+			payment_date, self.repayment_frequency, self.repayment_schedule_type
+		)
 
 	def add_rows_from_prev_disbursement(
 		self, schedule_field, principal_share_percentage, interest_share_percentage=100
@@ -922,115 +731,6 @@ class LoanRepaymentSchedule(Document):
 			if self.monthly_repayment_amount > self.loan_amount:
 				frappe.throw(_("Monthly Repayment Amount cannot be greater than Loan Amount"))
 
-	def get_days_and_months(
-		self,
-		payment_date,
-		additional_days,
-		balance_amount,
-		rate_of_interest,
-		schedule_field,
-		principal_share_percentage,
-		interest_share_percentage,
-	):
-		months = 365
-		if self.repayment_frequency == "Monthly":
-			expected_payment_date = get_last_day(payment_date)
-			if self.repayment_date_on == "Start of the next month":
-				expected_payment_date = add_days(expected_payment_date, 1)
-
-			if self.repayment_schedule_type in (
-				"Monthly as per cycle date",
-				"Line of Credit",
-				"Monthly as per repayment start date",
-				"Pro-rated calendar months",
-			):
-				days = date_diff(payment_date, add_months(payment_date, -1))
-				if (
-					additional_days < 0
-					or (additional_days > 0 and self.moratorium_tenure and not self.restructure_type)
-					or (additional_days > 0 and self.restructure_type == "Normal Restructure")
-				):
-					days = date_diff(payment_date, self.posting_date)
-					additional_days = 0
-
-				if additional_days and not self.moratorium_tenure and not self.restructure_type:
-					self.add_broken_period_interest(
-						balance_amount,
-						rate_of_interest,
-						additional_days,
-						payment_date,
-						schedule_field,
-						principal_share_percentage=principal_share_percentage,
-						interest_share_percentage=interest_share_percentage,
-					)
-					additional_days = 0
-			elif self.repayment_schedule_type == "Flat Interest Rate":
-				days = 1
-				months = self.repayment_periods
-			elif expected_payment_date == payment_date:
-				if self.repayment_schedule_type == "Pro-rated calendar months":
-					if payment_date == self.repayment_start_date:
-						days = date_diff(payment_date, self.posting_date)
-					elif self.repayment_date_on == "End of the current month":
-						days = date_diff(payment_date, get_first_day(payment_date)) + 1
-					else:
-						days = date_diff(get_last_day(payment_date), payment_date) + 1
-				else:
-					# using 30 days for calculating interest for all full months
-					days = 30
-			else:
-				if payment_date == self.repayment_start_date:
-					days = date_diff(payment_date, self.posting_date)
-				else:
-					days = date_diff(get_last_day(payment_date), payment_date)
-		else:
-			if payment_date == self.repayment_start_date:
-				days = date_diff(payment_date, self.posting_date)
-			elif self.repayment_frequency == "Bi-Weekly":
-				days = 14
-			elif self.repayment_frequency == "Weekly":
-				days = 7
-			elif self.repayment_frequency == "Daily":
-				days = 1
-			elif self.repayment_frequency == "Quarterly":
-				days = 3
-			elif self.repayment_frequency == "One Time":
-				days = date_diff(self.repayment_start_date, self.posting_date)
-
-		return days, months
-
-	def add_broken_period_interest(
-		self,
-		balance_amount,
-		rate_of_interest,
-		additional_days,
-		payment_date,
-		schedule_field,
-		principal_share_percentage,
-		interest_share_percentage,
-	):
-		interest_amount = flt(balance_amount * flt(rate_of_interest) * additional_days / (365 * 100))
-
-		bpi_recovery_method = frappe.db.get_value(
-			"Loan Product", self.loan_product, "bpi_recovery_method"
-		)
-
-		if bpi_recovery_method == "Upfront Deduction":
-			payment_date = add_months(payment_date, -1)
-			self.add_repayment_schedule_row(
-				payment_date,
-				0,
-				interest_amount,
-				interest_amount,
-				balance_amount,
-				additional_days,
-				repayment_schedule_field=schedule_field,
-				principal_share_percentage=principal_share_percentage,
-				interest_share_percentage=interest_share_percentage,
-			)
-		self.broken_period_interest = interest_amount
-		return interest_amount
-
 	def add_repayment_schedule_row(
 		self,
 		payment_date,
@@ -1044,38 +744,214 @@ class LoanRepaymentSchedule(Document):
 		principal_share_percentage=100,
 		interest_share_percentage=100,
 	):
-		if (
-			self.moratorium_type == "EMI"
-			and self.moratorium_end_date
-			and getdate(payment_date) <= getdate(self.moratorium_end_date)
-		):
-			demand_generated = 1
-
 		if not repayment_schedule_field:
 			repayment_schedule_field = "repayment_schedule"
 
-		interest_amount = interest_amount * interest_share_percentage / 100
-		principal_amount = principal_amount * principal_share_percentage / 100
-		total_payment = principal_amount + interest_amount
+		row = get_schedule_row(
+			self,
+			payment_date,
+			principal_amount,
+			interest_amount,
+			balance_loan_amount,
+			days,
+			demand_generated=demand_generated,
+			principal_share_percentage=principal_share_percentage,
+			interest_share_percentage=interest_share_percentage,
+		)
 
 		if repayment_schedule_field == "colender_schedule" and not self.partner_monthly_repayment_amount:
-			self.partner_monthly_repayment_amount = total_payment
+			self.partner_monthly_repayment_amount = row.total_payment
 
-		self.append(
-			repayment_schedule_field,
-			{
-				"number_of_days": days,
-				"payment_date": payment_date,
-				"principal_amount": principal_amount,
-				"interest_amount": interest_amount,
-				"total_payment": total_payment,
-				"balance_loan_amount": balance_loan_amount,
-				"demand_generated": demand_generated,
-			},
-		)
+		self.append(repayment_schedule_field, row)
 
 		if repayment_schedule_field != "colender_schedule":
-			self.increment_number_of_rows(payment_date)
+			self.number_of_rows += 1
+
+
+@frappe.whitelist()
+def simulate_repayment_schedule(terms):
+	"""Returns the repayment schedule for the given loan terms without saving anything.
+
+	`terms` takes the fields in `SIMULATION_TERMS`. Terms left out are taken from the
+	`loan_product` when one is passed, and `loan_partner` fills in the co-lender share.
+	"""
+	return copy.deepcopy(get_simulated_schedule(*get_simulation_key(terms)))
+
+
+@frappe.whitelist()
+def simulate_repayment_schedules(terms, tenures=None, rates_of_interest=None):
+	"""Returns a schedule for every combination of `tenures` and `rates_of_interest`"""
+	terms = frappe._dict(frappe.parse_json(terms))
+	tenures = frappe.parse_json(tenures) or [terms.repayment_periods]
+	rates_of_interest = frappe.parse_json(rates_of_interest) or [terms.rate_of_interest]
+
+	if len(tenures) * len(rates_of_interest) > MAX_SIMULATED_SCHEDULES:
+		frappe.throw(
+			_("Cannot simulate more than {0} schedules in one request").format(MAX_SIMULATED_SCHEDULES)
+		)
+
+	schedules = []
+	for repayment_periods in tenures:
+		for rate_of_interest in rates_of_interest:
+			key = get_simulation_key(
+				terms, repayment_periods=repayment_periods, rate_of_interest=rate_of_interest
+			)
+			schedules.append(copy.deepcopy(get_simulated_schedule(*key)))
+
+	return schedules
+
+
+def get_simulation_key(terms, **overrides):
+	terms = frappe._dict(frappe.parse_json(terms))
+	terms.update(overrides)
+
+	if terms.loan_product:
+		product = frappe.db.get_value(
+			"Loan Product",
+			terms.loan_product,
+			["rate_of_interest", "repayment_schedule_type", "repayment_date_on", "bpi_recovery_method"],
+			as_dict=True,
+			cache=True,
+		)
+		for field, value in product.items():
+			if terms.get(field) in (None, ""):
+				terms[field] = value
+
+	if terms.loan_partner:
+		partner = get_loan_partner_details(terms.loan_partner)
+		terms.partner_repayment_schedule_type = (
+			terms.partner_repayment_schedule_type or partner.repayment_schedule_type
+		)
+		terms.partner_loan_share_percentage = (
+			terms.partner_loan_share_percentage or partner.partner_loan_share_percentage
+		)
+
+	terms.loan_amount = flt(terms.loan_amount)
+	terms.rate_of_interest = flt(terms.rate_of_interest)
+	terms.repayment_periods = cint(terms.repayment_periods)
+	terms.moratorium_tenure = cint(terms.moratorium_tenure)
+	terms.monthly_repayment_amount = flt(terms.monthly_repayment_amount)
+	terms.partner_loan_share_percentage = flt(terms.partner_loan_share_percentage)
+	terms.partner_rate_of_interest = flt(terms.partner_rate_of_interest or terms.rate_of_interest)
+	terms.posting_date = getdate(terms.posting_date)
+	terms.repayment_frequency = terms.repayment_frequency or "Monthly"
+	terms.repayment_method = terms.repayment_method or "Repay Over Number of Periods"
+
+	# Same defaults as the schedule document and the disbursement that creates it
+	if terms.repayment_frequency == "One Time":
+		terms.repayment_method = "Repay Over Number of Periods"
+		terms.repayment_periods = 1
+
+	if terms.repayment_schedule_type == "Pro-rated calendar months":
+		terms.repayment_start_date = get_last_day(terms.posting_date)
+		if terms.repayment_date_on == "Start of the next month":
+			terms.repayment_start_date = add_days(terms.repayment_start_date, 1)
+	elif not terms.repayment_start_date and terms.repayment_frequency == "Monthly" and terms.loan_product:
+		terms.repayment_start_date = add_months(
+			get_cyclic_date(terms.loan_product, terms.posting_date), terms.moratorium_tenure
+		)
+
+	validate_simulation_terms(terms)
+	terms.repayment_start_date = getdate(terms.repayment_start_date)
+
+	precision = get_currency_precision()
+	return frappe.local.site, precision, tuple((field, terms.get(field)) for field in SIMULATION_TERMS)
+
+
+def validate_simulation_terms(terms):
+	if terms.loan_amount <= 0:
+		frappe.throw(_("Loan Amount must be greater than zero"))
+
+	if not terms.repayment_start_date:
+		frappe.throw(_("Repayment Start Date is mandatory for term loans"))
+
+	if terms.repayment_method == "Repay Over Number of Periods" and terms.repayment_periods <= 0:
+		frappe.throw(_("Please enter Repayment Periods"))
+
+	if terms.repayment_method == "Repay Fixed Amount per Period":
+		if not terms.monthly_repayment_amount:
+			frappe.throw(_("Please enter monthly repayment amount"))
+
+		# A repayment that does not cover the interest of a period never closes the loan
+		min_repayment_amount = (
+			terms.loan_amount
+			* terms.rate_of_interest
+			/ (get_frequency(terms.repayment_frequency) * 100)
+		)
+		if terms.monthly_repayment_amount <= min_repayment_amount:
+			frappe.throw(
+				_("Repayment Amount must be greater than {0}").format(flt(min_repayment_amount, 2))
+			)
+
+
+@lru_cache(maxsize=256)
+def get_simulated_schedule(site, precision, terms):
+	schedule = frappe._dict(terms)
+	schedule.current_principal_amount = schedule.loan_amount
+
+	engine = RepaymentScheduleEngine(
+		schedule, bpi_recovery_method=schedule.bpi_recovery_method, precision=precision
+	)
+	rows, monthly_repayment_amount = engine.make_rows(schedule.loan_amount, schedule.rate_of_interest)
+
+	if schedule.repayment_frequency == "One Time":
+		monthly_repayment_amount = rows[0].total_payment
+
+	# The co-lender schedule works out its own broken period interest on the same header
+	broken_period_interest = schedule.broken_period_interest
+	broken_period_interest_days = schedule.broken_period_interest_days
+
+	colender_rows = []
+	if schedule.partner_repayment_schedule_type and schedule.partner_loan_share_percentage:
+		(
+			partner_loan_amount,
+			rate_of_interest,
+			principal_share_percentage,
+			interest_share_percentage,
+		) = get_colender_schedule_terms(
+			schedule.partner_repayment_schedule_type,
+			schedule.partner_loan_share_percentage,
+			schedule.loan_amount,
+			schedule.rate_of_interest,
+			schedule.partner_rate_of_interest,
+		)
+
+		customer_principal_amounts = None
+		if schedule.partner_repayment_schedule_type == "POS reduction plus interest at partner ROI":
+			customer_principal_amounts = [row.principal_amount for row in rows]
+
+		colender_rows, _partner_repayment_amount = engine.make_rows(
+			partner_loan_amount,
+			rate_of_interest,
+			principal_share_percentage=principal_share_percentage,
+			interest_share_percentage=interest_share_percentage,
+			customer_principal_amounts=customer_principal_amounts,
+			is_colender=True,
+		)
 
-	def increment_number_of_rows(self, payment_date):
-		self.number_of_rows += 1
+	return {
+		"loan_amount": schedule.loan_amount,
+		"rate_of_interest": schedule.rate_of_interest,
+		"repayment_periods": len(rows),
+		"monthly_repayment_amount": flt(monthly_repayment_amount, precision),
+		"broken_period_interest": flt(broken_period_interest, precision),
+		"broken_period_interest_days": cint(broken_period_interest_days),
+		"moratorium_end_date": schedule.moratorium_end_date,
+		"maturity_date": getdate(rows[-1].payment_date),
+		"total_interest_payable": flt(sum(row.interest_amount for row in rows), precision),
+		"total_amount_payable": flt(sum(row.total_payment for row in rows), precision),
+		"partner_monthly_repayment_amount": flt(schedule.partner_monthly_repayment_amount, precision),
+		"repayment_schedule": [get_simulated_row(row, precision) for row in rows],
+		"colender_schedule": [get_simulated_row(row, precision) for row in colender_rows],
+	}
+
+
+def get_simulated_row(row, precision):
+	return {
+		"payment_date": getdate(row.payment_date),
+		"number_of_days": row.number_of_days,
+		"principal_amount": flt(row.principal_amount, precision),
+		"interest_amount": flt(row.interest_amount, precision),
+		"total_payment": flt(row.total_payment, precision),
+		"balance_loan_amount": flt(row.balance_loan_amount, precision),
+	}
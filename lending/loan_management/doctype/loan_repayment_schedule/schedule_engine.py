@@ -0,0 +1,467 @@
+import frappe
+from frappe.utils import add_days, add_months, cint, date_diff, flt, get_last_day, getdate
+
+from lending.loan_management.doctype.loan_repayment_schedule.utils import (
+	add_single_month,
+	get_amounts,
+	get_monthly_repayment_amount,
+)
+from lending.loan_management.lending_config import get_currency_precision
+
+MONTHLY_SCHEDULE_TYPES = (
+	"Monthly as per repayment start date",
+	"Monthly as per cycle date",
+	"Line of Credit",
+	"Pro-rated calendar months",
+	"Flat Interest Rate",
+)
+
+CALENDAR_MONTH_SCHEDULE_TYPES = (
+	"Monthly as per cycle date",
+	"Line of Credit",
+	"Monthly as per repayment start date",
+	"Pro-rated calendar months",
+)
+
+FIXED_PERIOD_DAYS = {
+	"Bi-Weekly": 14,
+	"Weekly": 7,
+	"Daily": 1,
+	"Quarterly": 3,
+}
+
+
+class RepaymentScheduleEngine:
+	"""Builds the rows of a repayment schedule in memory.
+
+	`schedule` holds the header values of the schedule. It can be the Loan Repayment
+	Schedule itself or a plain `frappe._dict`. Header values that are worked out while
+	building the rows (moratorium end date, broken period interest and its days, partner
+	repayment amount) are set back on it, same as the row by row build on the document did.
+
+	Values from other doctypes are passed in, so building the rows makes no queries and the
+	rows can be appended to the document or inserted in bulk as they are.
+	"""
+
+	def __init__(
+		self,
+		schedule,
+		bpi_recovery_method=None,
+		loan_status=None,
+		prev_schedule_rows=0,
+		precision=None,
+	):
+		self.schedule = schedule
+		self.bpi_recovery_method = bpi_recovery_method
+		self.loan_status = loan_status or "Sanctioned"
+		self.prev_schedule_rows = prev_schedule_rows
+		self.precision = precision or get_currency_precision()
+
+	def make_rows(
+		self,
+		balance_amount,
+		rate_of_interest,
+		previous_interest_amount=0,
+		additional_principal_amount=0,
+		pending_prev_days=0,
+		principal_share_percentage=100,
+		interest_share_percentage=100,
+		existing_rows=0,
+		customer_principal_amounts=None,
+		is_colender=False,
+	):
+		"""Returns the rows that follow the `existing_rows` rows already in the schedule and
+		the periodic repayment amount they were worked out with.
+
+		`customer_principal_amounts` are the principal amounts of the customer schedule, used
+		by co-lender schedules that reduce the partner POS along with the customer schedule.
+		"""
+		schedule = self.schedule
+		rows = []
+		shares = (principal_share_percentage, interest_share_percentage, is_colender)
+
+		self.repayment_start_date = getdate(schedule.repayment_start_date)
+		self.posting_date = getdate(schedule.posting_date)
+
+		carry_forward_interest = schedule.adjusted_interest
+		moratorium_interest = 0
+		is_first_emi = True
+		customer_row = 0
+		flat_rate = schedule.repayment_schedule_type == "Flat Interest Rate"
+
+		if not schedule.restructure_type and schedule.repayment_method != "Repay Fixed Amount per Period":
+			monthly_repayment_amount = get_monthly_repayment_amount(
+				balance_amount, rate_of_interest, schedule.repayment_periods, schedule.repayment_frequency
+			)
+		else:
+			monthly_repayment_amount = schedule.monthly_repayment_amount
+
+		self.set_moratorium_end_date()
+
+		payment_date = self.repayment_start_date
+		tenure = self.get_applicable_tenure(payment_date)
+		additional_days = cint(schedule.broken_period_interest_days)
+
+		if existing_rows or additional_days < 0:
+			schedule.broken_period_interest_days = 0
+
+		amortized_bpi, first_emi_adjustment = self.get_broken_period_interest_adjustments(
+			rows, balance_amount, rate_of_interest, payment_date, shares
+		)
+
+		has_moratorium = schedule.moratorium_tenure and schedule.repayment_frequency == "Monthly"
+		# getdate returns today for an empty date, which is what the capitalization check compared with
+		moratorium_end_date = getdate(schedule.moratorium_end_date)
+		fixed_tenure = schedule.repayment_method == "Repay Over Number of Periods" or (
+			schedule.restructure_type and schedule.repayment_method == "Repay Fixed Amount per Period"
+		)
+
+		payment_dates = iter_payment_dates(
+			payment_date, schedule.repayment_frequency, schedule.repayment_schedule_type
+		)
+
+		while balance_amount > 0:
+			payment_date = next(payment_dates)
+
+			if (
+				has_moratorium
+				and payment_date > moratorium_end_date
+				and schedule.moratorium_type == "EMI"
+				and schedule.treatment_of_interest == "Capitalize"
+				and moratorium_interest
+			):
+				balance_amount = schedule.loan_amount + moratorium_interest
+				monthly_repayment_amount = get_monthly_repayment_amount(
+					balance_amount, rate_of_interest, schedule.repayment_periods, schedule.repayment_frequency
+				)
+				moratorium_interest = 0
+
+			prev_balance_amount = balance_amount
+
+			payment_days, months = self.get_payment_days(
+				rows, payment_date, additional_days, balance_amount, rate_of_interest, shares
+			)
+
+			(
+				interest_amount,
+				principal_amount,
+				balance_amount,
+				_total_payment,
+				days,
+				previous_interest_amount,
+			) = get_amounts(
+				balance_amount,
+				rate_of_interest,
+				payment_days,
+				months,
+				monthly_repayment_amount,
+				carry_forward_interest,
+				previous_interest_amount,
+				additional_principal_amount,
+				pending_prev_days,
+				flat_rate=flat_rate,
+				loan_amount=schedule.loan_amount,
+				precision=self.precision,
+			)
+
+			if customer_principal_amounts is not None and customer_row < len(customer_principal_amounts):
+				principal_amount = customer_principal_amounts[customer_row]
+				balance_amount = prev_balance_amount - (principal_amount * principal_share_percentage / 100)
+				customer_row += 1
+
+			if has_moratorium and schedule.moratorium_end_date:
+				if payment_date <= moratorium_end_date:
+					principal_amount = 0
+					balance_amount = schedule.current_principal_amount
+					moratorium_interest += interest_amount
+
+					if schedule.moratorium_type == "EMI":
+						interest_amount = 0
+
+				elif (
+					schedule.moratorium_type == "EMI"
+					and schedule.treatment_of_interest == "Add to first repayment"
+					and moratorium_interest
+				):
+					interest_amount += moratorium_interest
+					moratorium_interest = 0
+
+			if self.bpi_recovery_method == "Amortized Over Tenure":
+				interest_amount += amortized_bpi
+			elif self.bpi_recovery_method == "Add to First EMI" and is_first_emi:
+				interest_amount += first_emi_adjustment
+				is_first_emi = False
+
+			self.add_row(
+				rows, payment_date, principal_amount, interest_amount, balance_amount, days, *shares
+			)
+
+			# All the residue amount is added to the last row for "Repay Over Number of Periods"
+			#
+			# Also, when such a Repayment Schedule is rescheduled, its repayment_method changes to Repay Fixed Amount per Period
+			# Here, the tenure shouldn't change. Thus, if this is a restructed repayment schedule, the last row is all the residue amount left.
+			# This is a special case.
+			if fixed_tenure and existing_rows + len(rows) >= tenure:
+				last_row = rows[-1]
+				last_row.principal_amount += balance_amount
+				last_row.balance_loan_amount = 0
+				last_row.total_payment = last_row.interest_amount + last_row.principal_amount
+				balance_amount = 0
+
+			carry_forward_interest = 0
+			additional_days = 0
+			additional_principal_amount = 0
+			pending_prev_days = 0
+
+		return rows, monthly_repayment_amount
+
+	def set_moratorium_end_date(self):
+		schedule = self.schedule
+
+		if (
+			schedule.restructure_type
+			or not schedule.moratorium_tenure
+			or schedule.repayment_frequency != "Monthly"
+		):
+			return
+
+		if schedule.repayment_schedule_type == "Monthly as per cycle date":
+			schedule.moratorium_end_date = add_months(
+				self.repayment_start_date, schedule.moratorium_tenure - 1
+			)
+		else:
+			schedule.moratorium_end_date = add_months(self.repayment_start_date, schedule.moratorium_tenure)
+			if schedule.repayment_schedule_type == "Pro-rated calendar months":
+				schedule.moratorium_end_date = add_days(schedule.moratorium_end_date, -1)
+
+	def get_applicable_tenure(self, payment_date):
+		schedule = self.schedule
+
+		if schedule.repayment_frequency == "Monthly" and (
+			self.loan_status == "Sanctioned" or schedule.repayment_schedule_type == "Line of Credit"
+		):
+			tenure = schedule.repayment_periods + cint(schedule.moratorium_tenure)
+		elif schedule.restructure_type in ("Advance Payment", "Pre Payment") and schedule.moratorium_tenure:
+			tenure = schedule.repayment_periods + schedule.moratorium_tenure
+		elif self.loan_status == "Partially Disbursed":
+			tenure = self.prev_schedule_rows
+		else:
+			tenure = schedule.repayment_periods
+
+		if (
+			schedule.restructure_type != "Normal Restructure"
+			and schedule.repayment_frequency == "Monthly"
+			or (schedule.restructure_type == "Pre Payment" and schedule.repayment_frequency != "One Time")
+		):
+			schedule.broken_period_interest_days = date_diff(add_months(payment_date, -1), self.posting_date)
+			if (
+				schedule.broken_period_interest_days > 0
+				and not schedule.moratorium_tenure
+				and self.loan_status != "Partially Disbursed"
+			):
+				tenure += 1
+
+		return tenure
+
+	def get_broken_period_interest_adjustments(
+		self, rows, balance_amount, rate_of_interest, payment_date, shares
+	):
+		if self.bpi_recovery_method not in ("Amortized Over Tenure", "Add to First EMI"):
+			return 0, 0
+
+		broken_period_interest = self.add_broken_period_interest(
+			rows,
+			balance_amount,
+			rate_of_interest,
+			cint(self.schedule.broken_period_interest_days),
+			payment_date,
+			shares,
+		)
+
+		if self.bpi_recovery_method == "Amortized Over Tenure":
+			return flt(broken_period_interest) / self.schedule.repayment_periods, 0
+
+		return 0, broken_period_interest
+
+	def add_broken_period_interest(
+		self, rows, balance_amount, rate_of_interest, additional_days, payment_date, shares
+	):
+		interest_amount = flt(balance_amount * flt(rate_of_interest) * additional_days / (365 * 100))
+
+		if self.bpi_recovery_method == "Upfront Deduction":
+			self.add_row(
+				rows,
+				add_months(payment_date, -1),
+				0,
+				interest_amount,
+				balance_amount,
+				additional_days,
+				*shares,
+			)
+
+		self.schedule.broken_period_interest = interest_amount
+		return interest_amount
+
+	def get_payment_days(
+		self, rows, payment_date, additional_days, balance_amount, rate_of_interest, shares
+	):
+		schedule = self.schedule
+		months = 365
+
+		if schedule.repayment_frequency != "Monthly":
+			if payment_date == self.repayment_start_date or schedule.repayment_frequency == "One Time":
+				days = date_diff(self.repayment_start_date, self.posting_date)
+			else:
+				days = FIXED_PERIOD_DAYS[schedule.repayment_frequency]
+
+			return days, months
+
+		if schedule.repayment_schedule_type in CALENDAR_MONTH_SCHEDULE_TYPES:
+			days = date_diff(payment_date, add_months(payment_date, -1))
+			if (
+				additional_days < 0
+				or (additional_days > 0 and schedule.moratorium_tenure and not schedule.restructure_type)
+				or (additional_days > 0 and schedule.restructure_type == "Normal Restructure")
+			):
+				days = date_diff(payment_date, self.posting_date)
+				additional_days = 0
+
+			if additional_days and not schedule.moratorium_tenure and not schedule.restructure_type:
+				self.add_broken_period_interest(
+					rows, balance_amount, rate_of_interest, additional_days, payment_date, shares
+				)
+		elif schedule.repayment_schedule_type == "Flat Interest Rate":
+			days = 1
+			months = schedule.repayment_periods
+		elif payment_date == get_expected_payment_date(payment_date, schedule.repayment_date_on):
+			# using 30 days for calculating interest for all full months
+			days = 30
+		elif payment_date == self.repayment_start_date:
+			days = date_diff(payment_date, self.posting_date)
+		else:
+			days = date_diff(get_last_day(payment_date), payment_date)
+
+		return days, months
+
+	def add_row(
+		self,
+		rows,
+		payment_date,
+		principal_amount,
+		interest_amount,
+		balance_loan_amount,
+		days,
+		principal_share_percentage=100,
+		interest_share_percentage=100,
+		is_colender=False,
+	):
+		row = get_schedule_row(
+			self.schedule,
+			payment_date,
+			principal_amount,
+			interest_amount,
+			balance_loan_amount,
+			days,
+			principal_share_percentage=principal_share_percentage,
+			interest_share_percentage=interest_share_percentage,
+		)
+
+		if is_colender and not self.schedule.partner_monthly_repayment_amount:
+			self.schedule.partner_monthly_repayment_amount = row.total_payment
+
+		rows.append(row)
+
+
+def get_colender_schedule_terms(
+	partner_schedule_type,
+	partner_loan_share_percentage,
+	principal_amount,
+	rate_of_interest,
+	partner_rate_of_interest,
+):
+	"""Returns the partner loan amount, rate of interest and the principal and interest share
+	percentages a co-lender schedule is built with"""
+	partner_loan_share_percentage = flt(partner_loan_share_percentage)
+
+	if partner_schedule_type == "EMI (PMT) based":
+		return principal_amount * partner_loan_share_percentage / 100, partner_rate_of_interest, 100, 100
+	elif partner_schedule_type == "Collection at partner's percentage":
+		return (
+			principal_amount,
+			rate_of_interest,
+			partner_loan_share_percentage,
+			partner_loan_share_percentage,
+		)
+	else:
+		return (
+			principal_amount * partner_loan_share_percentage / 100,
+			partner_rate_of_interest,
+			partner_loan_share_percentage,
+			100,
+		)
+
+
+def get_schedule_row(
+	schedule,
+	payment_date,
+	principal_amount,
+	interest_amount,
+	balance_loan_amount,
+	days,
+	demand_generated=0,
+	principal_share_percentage=100,
+	interest_share_percentage=100,
+):
+	if (
+		schedule.moratorium_type == "EMI"
+		and schedule.moratorium_end_date
+		and getdate(payment_date) <= getdate(schedule.moratorium_end_date)
+	):
+		demand_generated = 1
+
+	interest_amount = interest_amount * interest_share_percentage / 100
+	principal_amount = principal_amount * principal_share_percentage / 100
+
+	return frappe._dict(
+		{
+			"number_of_days": days,
+			"payment_date": payment_date,
+			"principal_amount": principal_amount,
+			"interest_amount": interest_amount,
+			"total_payment": principal_amount + interest_amount,
+			"balance_loan_amount": balance_loan_amount,
+			"demand_generated": demand_generated,
+		}
+	)
+
+
+def iter_payment_dates(payment_date, repayment_frequency, repayment_schedule_type):
+	"""Yields the payment dates of a schedule starting from `payment_date`"""
+	payment_date = getdate(payment_date)
+
+	while True:
+		yield payment_date
+		payment_date = get_next_payment_date(payment_date, repayment_frequency, repayment_schedule_type)
+
+
+def get_next_payment_date(payment_date, repayment_frequency, repayment_schedule_type):
+	if repayment_frequency == "Monthly" and repayment_schedule_type in MONTHLY_SCHEDULE_TYPES:
+		payment_date = add_single_month(payment_date)
+	elif repayment_frequency == "Bi-Weekly":
+		payment_date = add_days(payment_date, 14)
+	elif repayment_frequency == "Weekly":
+		payment_date = add_days(payment_date, 7)
+	elif repayment_frequency == "Daily":
+		payment_date = add_days(payment_date, 1)
+	elif repayment_frequency == "Quarterly":
+		payment_date = add_months(payment_date, 3)
+
+	return payment_date
+
+
+def get_expected_payment_date(payment_date, repayment_date_on):
+	expected_payment_date = get_last_day(payment_date)
+	if repayment_date_on == "Start of the next month":
+		expected_payment_date = add_days(expected_payment_date, 1)
+
+	return expected_payment_date
@@ -10,6 +10,13 @@ from frappe.utils import add_days, flt, getdate
 from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
 	get_interest_for_term,
 )
+from lending.loan_management.doctype.loan_repayment_schedule.loan_repayment_schedule import (
+	simulate_repayment_schedule,
+	simulate_repayment_schedules,
+)
+from lending.loan_management.doctype.loan_repayment_schedule.schedule_engine import (
+	RepaymentScheduleEngine,
+)
 from lending.loan_management.doctype.loan_repayment_schedule.utils import (
 	get_monthly_repayment_amount,
 )
@@ -246,3 +253,194 @@ class TestLoanRepaymentSchedule(IntegrationTestCase):
 		)
 
 		self.assertEqual(next_payment_date, getdate("2025-01-10"))
+
+	# The expected rows below were recorded from the row by row build on the document
+	def test_schedule_engine_with_upfront_broken_period_interest(self):
+		schedule, rows, monthly_repayment_amount = make_engine_schedule(
+			23, bpi_recovery_method="Upfront Deduction"
+		)
+
+		self.assertEqual(monthly_repayment_amount, 94077)
+		self.assertEqual(flt(schedule.broken_period_interest, 2), 10712.33)
+		self.assertEqual(
+			get_schedule_values(rows),
+			[
+				("2024-05-05", 0.0, 10712.33, 1000000.0),
+				("2024-06-05", 74542.75, 19534.25, 925457.25),
+				("2024-07-05", 76582.05, 17494.95, 848875.2),
+				("2024-08-05", 77494.86, 16582.14, 771380.34),
+				("2024-09-05", 79008.67, 15068.33, 692371.67),
+				("2024-10-05", 80988.33, 13088.67, 611383.34),
+				("2024-11-05", 82134.09, 11942.91, 529249.25),
+				("2024-12-05", 84072.01, 10004.99, 445177.24),
+				("2025-01-05", 85380.8, 8696.2, 359796.44),
+				("2025-02-05", 87048.65, 7028.35, 272747.79),
+				("2025-03-05", 89264.68, 4812.32, 183483.11),
+				("2025-04-05", 90492.8, 3584.2, 92990.31),
+				("2025-05-05", 92990.31, 1757.9, 0.0),
+			],
+		)
+
+	def test_schedule_engine_with_capitalized_moratorium(self):
+		schedule, rows, monthly_repayment_amount = make_engine_schedule(
+			18,
+			repayment_periods=6,
+			repayment_start_date="2024-05-05",
+			moratorium_tenure=2,
+			moratorium_type="EMI",
+			treatment_of_interest="Capitalize",
+		)
+
+		self.assertEqual(monthly_repayment_amount, 182277)
+		self.assertEqual(getdate(schedule.moratorium_end_date), getdate("2024-07-05"))
+		self.assertEqual([row.demand_generated for row in rows], [1, 1, 1, 0, 0, 0, 0, 0])
+		self.assertEqual(
+			get_schedule_values(rows),
+			[
+				("2024-05-05", 0.0, 0.0, 1000000.0),
+				("2024-06-05", 0.0, 0.0, 1000000.0),
+				("2024-07-05", 0.0, 0.0, 1000000.0),
+				("2024-08-05", 166401.28, 15875.72, 872064.47),
+				("2024-09-05", 168945.17, 13331.83, 703119.3),
+				("2024-10-05", 171874.69, 10402.31, 531244.61),
+				("2024-11-05", 174155.51, 8121.49, 357089.1),
+				("2024-12-05", 357089.1, 5282.96, 0.0),
+			],
+		)
+
+	def test_schedule_engine_for_pro_rated_and_weekly_schedules(self):
+		_schedule, rows, monthly_repayment_amount = make_engine_schedule(
+			12,
+			repayment_schedule_type="Pro-rated calendar months",
+			repayment_date_on="End of the current month",
+			repayment_start_date="2024-04-30",
+			repayment_periods=6,
+		)
+
+		self.assertEqual(monthly_repayment_amount, 172549)
+		self.assertEqual(
+			get_schedule_values(rows),
+			[
+				("2024-04-30", 168603.79, 3945.21, 831396.21),
+				("2024-05-31", 164075.59, 8473.41, 667320.62),
+				("2024-06-30", 165747.81, 6801.19, 501572.81),
+				("2024-07-31", 167437.08, 5111.92, 334135.73),
+				("2024-08-31", 169143.56, 3405.44, 164992.17),
+				("2024-09-30", 164992.17, 1681.56, 0.0),
+			],
+		)
+
+		_schedule, rows, monthly_repayment_amount = make_engine_schedule(
+			15, repayment_frequency="Weekly", repayment_periods=8, repayment_start_date="2024-04-25"
+		)
+
+		self.assertEqual(monthly_repayment_amount, 126629)
+		self.assertEqual(
+			get_schedule_values(rows),
+			[
+				("2024-04-25", 123752.29, 2876.71, 876247.71),
+				("2024-05-02", 124108.29, 2520.71, 752139.42),
+				("2024-05-09", 124465.31, 2163.69, 627674.11),
+				("2024-05-16", 124823.36, 1805.64, 502850.75),
+				("2024-05-23", 125182.44, 1446.56, 377668.31),
+				("2024-05-30", 125542.56, 1086.44, 252125.75),
+				("2024-06-06", 125903.71, 725.29, 126222.04),
+				("2024-06-13", 126222.04, 363.1, 0.0),
+			],
+		)
+
+	def test_schedule_engine_for_long_tenure_daily_schedule(self):
+		_schedule, rows, monthly_repayment_amount = make_engine_schedule(
+			9.5,
+			repayment_frequency="Daily",
+			repayment_periods=10950,
+			repayment_start_date="2024-04-19",
+			loan_amount=5000000,
+		)
+
+		self.assertEqual(monthly_repayment_amount, 1382)
+		self.assertEqual(len(rows), 10919)
+		self.assertEqual(getdate(rows[-1].payment_date), getdate("2054-03-11"))
+		self.assertEqual(flt(sum(row.principal_amount for row in rows), 2), 5000000)
+		self.assertEqual(flt(sum(row.interest_amount for row in rows), 2), 10089277.2)
+		self.assertEqual(
+			get_schedule_values([rows[0], rows[-1]]),
+			[("2024-04-19", 80.63, 1301.37, 4999919.37), ("2054-03-11", 601.04, 0.16, 0.0)],
+		)
+
+	def test_simulated_schedule_matches_disbursed_schedule(self):
+		loan = create_loan(
+			"_Test Customer 1",
+			"Term Loan Product 4",
+			1000000,
+			"Repay Over Number of Periods",
+			12,
+			repayment_start_date="2024-06-05",
+			posting_date="2024-04-18",
+			rate_of_interest=23,
+			applicant_type="Customer",
+		)
+		loan.submit()
+		make_loan_disbursement_entry(
+			loan.name, loan.loan_amount, disbursement_date="2024-04-18", repayment_start_date="2024-06-05"
+		)
+		schedule = frappe.get_doc("Loan Repayment Schedule", {"loan": loan.name, "docstatus": 1})
+		schedule_count = frappe.db.count("Loan Repayment Schedule")
+
+		terms = {
+			"loan_product": "Term Loan Product 4",
+			"loan_amount": 1000000,
+			"rate_of_interest": 23,
+			"repayment_periods": 12,
+			"posting_date": "2024-04-18",
+			"repayment_start_date": "2024-06-05",
+		}
+		simulated = simulate_repayment_schedule(terms)
+
+		self.assertEqual(frappe.db.count("Loan Repayment Schedule"), schedule_count)
+		self.assertEqual(simulated["monthly_repayment_amount"], schedule.monthly_repayment_amount)
+		self.assertEqual(
+			get_schedule_values([frappe._dict(row) for row in simulated["repayment_schedule"]]),
+			get_schedule_values(schedule.repayment_schedule),
+		)
+
+		grid = simulate_repayment_schedules(terms, tenures=[6, 12, 24], rates_of_interest=[12, 23])
+		self.assertEqual([row["rate_of_interest"] for row in grid], [12, 23] * 3)
+		self.assertLess(grid[0]["repayment_periods"], grid[2]["repayment_periods"])
+		self.assertLess(grid[2]["repayment_periods"], grid[4]["repayment_periods"])
+		self.assertEqual(grid[3]["repayment_schedule"], simulated["repayment_schedule"])
+
+
+def make_engine_schedule(rate_of_interest, bpi_recovery_method=None, **kwargs):
+	schedule = frappe._dict(
+		{
+			"repayment_frequency": "Monthly",
+			"repayment_schedule_type": "Monthly as per repayment start date",
+			"repayment_method": "Repay Over Number of Periods",
+			"repayment_periods": 12,
+			"posting_date": "2024-04-18",
+			"repayment_start_date": "2024-06-05",
+			"loan_amount": 1000000,
+		}
+	)
+	schedule.update(kwargs)
+	schedule.current_principal_amount = schedule.loan_amount
+
+	engine = RepaymentScheduleEngine(
+		schedule, bpi_recovery_method=bpi_recovery_method, loan_status="Sanctioned", precision=2
+	)
+	rows, monthly_repayment_amount = engine.make_rows(schedule.loan_amount, rate_of_interest)
+
+	return schedule, rows, monthly_repayment_amount
+
+
+def get_schedule_values(rows):
+	return [
+		(
+			str(getdate(row.payment_date)),
+			flt(row.principal_amount, 2),
+			flt(row.interest_amount, 2),
+			flt(row.balance_loan_amount, 2),
+		)
+		for row in rows
+	]
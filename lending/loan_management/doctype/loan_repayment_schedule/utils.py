@@ -1,7 +1,9 @@
 import math
 
 import frappe
-from frappe.utils import add_months, cint, flt, get_last_day, getdate
+from frappe.utils import add_months, flt, get_last_day, getdate
+
+from lending.loan_management.lending_config import get_currency_precision
 
 
 def add_single_month(date):
@@ -66,8 +68,10 @@ def get_amounts(
 	pending_prev_days=0,
 	flat_rate=False,
 	loan_amount=0,
+	precision=None,
 ):
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	if not precision:
+		precision = get_currency_precision()
 
 	if additional_principal_amount:
 		current_balance_amount = additional_principal_amount
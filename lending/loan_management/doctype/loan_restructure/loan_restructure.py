@@ -5,7 +5,7 @@ import frappe
 from frappe import _
 from frappe.query_builder import DocType
 from frappe.query_builder import functions as fn
-from frappe.utils import add_days, cint, flt, getdate
+from frappe.utils import add_days, flt, getdate
 
 from erpnext.controllers.accounts_controller import AccountsController
 
@@ -20,6 +20,7 @@ from lending.loan_management.doctype.loan_repayment.loan_repayment import calcul
 from lending.loan_management.doctype.loan_repayment_schedule.loan_repayment_schedule import (
 	get_monthly_repayment_amount,
 )
+from lending.loan_management.lending_config import get_currency_precision
 
 
 class LoanRestructure(AccountsController):
@@ -166,7 +167,7 @@ class LoanRestructure(AccountsController):
 				)
 
 	def calculate_balance_amounts(self):
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		self.balance_principal = flt(
 			flt(self.principal_overdue, precision) - flt(self.principal_adjusted, precision), precision
@@ -360,7 +361,7 @@ class LoanRestructure(AccountsController):
 				self.update_security_deposit_amount(cancel=1)
 
 	def update_overdue_amounts(self):
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 		amounts = calculate_amounts(
 			self.loan, self.restructure_date, loan_disbursement=self.loan_disbursement
 		)
@@ -28,6 +28,15 @@ class LoanSecurityPrice(Document):
 	def validate(self):
 		self.validate_dates()
 
+	def on_update(self):
+		from lending.loan_management.doctype.loan_security_shortfall.loan_security_shortfall import (
+			queue_shortfall_check_for_price_update,
+		)
+
+		# Only prices that are in force now change the security value of the loans
+		if get_datetime(self.valid_from) <= get_datetime() <= get_datetime(self.valid_upto):
+			queue_shortfall_check_for_price_update(self.loan_security)
+
 	def validate_dates(self):
 
 		if self.valid_from > self.valid_upto:
@@ -4,11 +4,19 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import flt, get_datetime
+from frappe.query_builder import DocType
+from frappe.query_builder.functions import Sum
+from frappe.utils import flt, get_datetime, now_datetime
 
-from lending.loan_management.doctype.loan_security_release.loan_security_release import (
-	get_pledged_security_qty,
-)
+from lending.loan_management.lending_config import get_currency_precision
+
+SHORTFALL_LOAN_STATUSES = ("Disbursed", "Partially Disbursed")
+
+# Cache key of the set of loan securities whose price changed since the last check
+PENDING_PRICE_UPDATES_KEY = "loan_securities_with_price_updates"
+
+# Cache key set while a check of the pending loan securities is queued
+PRICE_UPDATE_CHECK_QUEUED_KEY = "loan_security_price_update_check_queued"
 
 
 class LoanSecurityShortfall(Document):
@@ -82,8 +90,16 @@ def add_security(loan):
 	return loan_security_assignment.as_dict()
 
 
-def check_for_ltv_shortfall(process_loan_security_shortfall):
+def check_for_ltv_shortfall(process_loan_security_shortfall, loan_securities=None):
+	"""Check every secured loan for an LTV shortfall, as a set.
+
+	Pledged quantities and LTV ratios come from two grouped queries. New shortfalls are
+	inserted in bulk, pending shortfalls are only updated when their amounts change and
+	the ones that are covered again are completed with one update.
 
+	With `loan_securities`, only the loans that pledge one of them are checked.
+	"""
+	precision = get_currency_precision()
 	update_time = get_datetime()
 
 	loan_security_price_map = frappe._dict(
@@ -95,10 +111,21 @@ def check_for_ltv_shortfall(process_loan_security_shortfall):
 		)
 	)
 
+	loan_filters = {"status": ("in", SHORTFALL_LOAN_STATUSES), "is_secured_loan": 1}
+
+	if loan_securities:
+		pledging_loans = get_loans_pledging_securities(loan_securities)
+		if not pledging_loans:
+			return
+
+		loan_filters["name"] = ("in", pledging_loans)
+
 	loans = frappe.get_all(
 		"Loan",
 		fields=[
 			"name",
+			"applicant_type",
+			"applicant",
 			"loan_amount",
 			"total_principal_paid",
 			"total_payment",
@@ -106,15 +133,37 @@ def check_for_ltv_shortfall(process_loan_security_shortfall):
 			"disbursed_amount",
 			"status",
 		],
-		filters={"status": ("in", ["Disbursed", "Partially Disbursed"]), "is_secured_loan": 1},
+		filters=loan_filters,
 	)
 
-	loan_shortfall_map = frappe._dict(
-		frappe.get_all(
-			"Loan Security Shortfall", fields=["loan", "name"], filters={"status": "Pending"}, as_list=1
+	shortfall_filters = {"status": "Pending"}
+	if loan_securities:
+		shortfall_filters["loan"] = ("in", [loan.name for loan in loans])
+
+	pending_shortfalls = {
+		shortfall.loan: shortfall
+		for shortfall in frappe.get_all(
+			"Loan Security Shortfall",
+			fields=[
+				"name",
+				"loan",
+				"loan_amount",
+				"security_value",
+				"shortfall_amount",
+				"shortfall_percentage",
+			],
+			filters=shortfall_filters,
 		)
+	}
+
+	pledged_securities = get_pledged_securities_for_shortfall(
+		[loan.name for loan in loans] if loan_securities else None
 	)
 
+	new_shortfalls = []
+	shortfall_updates = {}
+	completed_shortfalls = []
+
 	for loan in loans:
 		if loan.status == "Disbursed":
 			outstanding_amount = (
@@ -125,59 +174,218 @@ def check_for_ltv_shortfall(process_loan_security_shortfall):
 				flt(loan.disbursed_amount) - flt(loan.total_interest_payable) - flt(loan.total_principal_paid)
 			)
 
-		pledged_securities = get_pledged_security_qty(loan.name)
 		ltv_ratio = 0.0
 		security_value = 0.0
 
-		for security, qty in pledged_securities.items():
+		for pledge in pledged_securities.get(loan.name, []):
 			if not ltv_ratio:
-				ltv_ratio = get_ltv_ratio(security)
-			security_value += flt(loan_security_price_map.get(security)) * flt(qty)
+				ltv_ratio = flt(pledge.loan_to_value_ratio)
+			security_value += flt(loan_security_price_map.get(pledge.loan_security)) * flt(pledge.qty)
 
 		current_ratio = (outstanding_amount / security_value) * 100 if security_value else 0
+		shortfall = pending_shortfalls.get(loan.name)
 
 		if flt(current_ratio, 6) > flt(ltv_ratio, 6):
-			shortfall_amount = outstanding_amount - ((security_value * ltv_ratio) / 100)
-			create_loan_security_shortfall(
-				loan.name,
-				outstanding_amount,
-				security_value,
-				shortfall_amount,
-				current_ratio,
-				process_loan_security_shortfall,
-			)
-		elif loan_shortfall_map.get(loan.name):
+			values = {
+				"loan_amount": outstanding_amount,
+				"security_value": security_value,
+				"shortfall_amount": outstanding_amount - ((security_value * ltv_ratio) / 100),
+				"shortfall_percentage": current_ratio,
+			}
+
+			if not shortfall:
+				new_shortfalls.append({"loan": loan, **values})
+			elif is_shortfall_changed(shortfall, values, precision):
+				shortfall_updates[shortfall.name] = {
+					**values,
+					"shortfall_time": update_time,
+					"process_loan_security_shortfall": process_loan_security_shortfall,
+				}
+		elif shortfall:
 			shortfall_amount = outstanding_amount - ((security_value * ltv_ratio) / 100)
 			if flt(shortfall_amount, 6) <= 0:
-				shortfall = loan_shortfall_map.get(loan.name)
-				update_pending_shortfall(shortfall)
-
-
-def create_loan_security_shortfall(
-	loan,
-	loan_amount,
-	security_value,
-	shortfall_amount,
-	shortfall_ratio,
-	process_loan_security_shortfall,
-):
-	existing_shortfall = frappe.db.get_value(
-		"Loan Security Shortfall", {"loan": loan, "status": "Pending"}, "name"
+				completed_shortfalls.append(shortfall.name)
+
+	make_loan_security_shortfalls(new_shortfalls, process_loan_security_shortfall, update_time)
+
+	if shortfall_updates:
+		frappe.db.bulk_update("Loan Security Shortfall", shortfall_updates)
+
+	update_pending_shortfall(completed_shortfalls)
+
+
+def is_shortfall_changed(shortfall, values, precision):
+	return any(
+		flt(shortfall.get(fieldname), 6 if fieldname == "shortfall_percentage" else precision)
+		!= flt(value, 6 if fieldname == "shortfall_percentage" else precision)
+		for fieldname, value in values.items()
 	)
 
-	if existing_shortfall:
-		ltv_shortfall = frappe.get_doc("Loan Security Shortfall", existing_shortfall)
-	else:
-		ltv_shortfall = frappe.new_doc("Loan Security Shortfall")
-		ltv_shortfall.loan = loan
 
-	ltv_shortfall.shortfall_time = get_datetime()
-	ltv_shortfall.loan_amount = loan_amount
-	ltv_shortfall.security_value = security_value
-	ltv_shortfall.shortfall_amount = shortfall_amount
-	ltv_shortfall.shortfall_percentage = shortfall_ratio
-	ltv_shortfall.process_loan_security_shortfall = process_loan_security_shortfall
-	ltv_shortfall.save()
+def get_pledged_securities_for_shortfall(loans=None):
+	"""Returns the net pledged quantity and LTV ratio of each security of the secured loans,
+	sorted by security for each loan."""
+	Loan = DocType("Loan")
+	LoanSecurityAssignment = DocType("Loan Security Assignment")
+	Pledge = DocType("Pledge")
+	LoanSecurity = DocType("Loan Security")
+	LoanSecurityType = DocType("Loan Security Type")
+	LoanSecurityRelease = DocType("Loan Security Release")
+	Unpledge = DocType("Unpledge")
+
+	loan_conditions = (Loan.status.isin(SHORTFALL_LOAN_STATUSES)) & (Loan.is_secured_loan == 1)
+	if loans:
+		loan_conditions &= Loan.name.isin(loans)
+
+	pledges = (
+		frappe.qb.from_(Pledge)
+		.inner_join(LoanSecurityAssignment)
+		.on(LoanSecurityAssignment.name == Pledge.parent)
+		.inner_join(Loan)
+		.on(Loan.name == LoanSecurityAssignment.loan)
+		.left_join(LoanSecurity)
+		.on(LoanSecurity.name == Pledge.loan_security)
+		.left_join(LoanSecurityType)
+		.on(LoanSecurityType.name == LoanSecurity.loan_security_type)
+		.select(
+			LoanSecurityAssignment.loan,
+			Pledge.loan_security,
+			Sum(Pledge.qty).as_("qty"),
+			LoanSecurityType.loan_to_value_ratio,
+		)
+		.where((LoanSecurityAssignment.status == "Pledged") & loan_conditions)
+		.groupby(
+			LoanSecurityAssignment.loan, Pledge.loan_security, LoanSecurityType.loan_to_value_ratio
+		)
+		.orderby(LoanSecurityAssignment.loan)
+		.orderby(Pledge.loan_security)
+	).run(as_dict=1)
+
+	unpledges = (
+		frappe.qb.from_(Unpledge)
+		.inner_join(LoanSecurityRelease)
+		.on(LoanSecurityRelease.name == Unpledge.parent)
+		.inner_join(Loan)
+		.on(Loan.name == LoanSecurityRelease.loan)
+		.select(LoanSecurityRelease.loan, Unpledge.loan_security, Sum(Unpledge.qty))
+		.where((LoanSecurityRelease.status == "Approved") & loan_conditions)
+		.groupby(LoanSecurityRelease.loan, Unpledge.loan_security)
+	).run()
+
+	unpledged_qty = {(loan, security): flt(qty) for loan, security, qty in unpledges}
+
+	pledged_securities = {}
+	for pledge in pledges:
+		pledge.qty = flt(pledge.qty) - unpledged_qty.get((pledge.loan, pledge.loan_security), 0.0)
+		pledged_securities.setdefault(pledge.loan, []).append(pledge)
+
+	return pledged_securities
+
+
+def get_loans_pledging_securities(loan_securities):
+	"""Returns the secured open loans with a pledge of any of the loan securities.
+
+	Looked up through the index on the loan security of the pledges, so the lookup stays
+	in step with every pledge without a separate map to maintain.
+	"""
+	Loan = DocType("Loan")
+	LoanSecurityAssignment = DocType("Loan Security Assignment")
+	Pledge = DocType("Pledge")
+
+	return (
+		frappe.qb.from_(Pledge)
+		.inner_join(LoanSecurityAssignment)
+		.on(LoanSecurityAssignment.name == Pledge.parent)
+		.inner_join(Loan)
+		.on(Loan.name == LoanSecurityAssignment.loan)
+		.select(LoanSecurityAssignment.loan)
+		.distinct()
+		.where(
+			(Pledge.loan_security.isin(list(loan_securities)))
+			& (Pledge.parenttype == "Loan Security Assignment")
+			& (LoanSecurityAssignment.status == "Pledged")
+			& (Loan.status.isin(SHORTFALL_LOAN_STATUSES))
+			& (Loan.is_secured_loan == 1)
+		)
+	).run(pluck=True)
+
+
+def queue_shortfall_check_for_price_update(loan_security):
+	"""Queue an LTV check of the loans that pledge a loan security after its price changes.
+
+	The security is added to a pending set and one job at a time is queued to check all the
+	pending securities, so a burst of price updates is checked once per security.
+	"""
+	frappe.cache.sadd(PENDING_PRICE_UPDATES_KEY, loan_security)
+	frappe.db.after_commit.add(enqueue_price_update_check)
+
+
+def enqueue_price_update_check():
+	# The queued job clears the key before it reads the pending set, so a security added
+	# after that is either read by the job or queues the next one
+	if not frappe.cache.set(
+		frappe.cache.make_key(PRICE_UPDATE_CHECK_QUEUED_KEY), 1, nx=True, ex=3600
+	):
+		return
+
+	frappe.enqueue(process_pending_price_updates, queue="short")
+
+
+def process_pending_price_updates():
+	from lending.loan_management.doctype.process_loan_security_shortfall.process_loan_security_shortfall import (
+		create_process_loan_security_shortfall,
+	)
+
+	frappe.cache.delete_value(PRICE_UPDATE_CHECK_QUEUED_KEY)
+
+	# Prices updated while a check runs are picked up by the next round
+	while loan_securities := frappe.cache.smembers(PENDING_PRICE_UPDATES_KEY):
+		frappe.cache.srem(PENDING_PRICE_UPDATES_KEY, *loan_securities)
+
+		try:
+			create_process_loan_security_shortfall(
+				loan_securities=[frappe.safe_decode(security) for security in loan_securities]
+			)
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(
+				title="Price Triggered Loan Security Shortfall Error", message=frappe.get_traceback()
+			)
+
+
+def make_loan_security_shortfalls(shortfalls, process_loan_security_shortfall, shortfall_time):
+	from lending.loan_management.bulk_writer import insert_docs_in_bulk, set_names_in_bulk
+
+	if not shortfalls:
+		return
+
+	user = frappe.session.user
+	timestamp = now_datetime()
+	docs = []
+
+	for shortfall in shortfalls:
+		loan = shortfall.pop("loan")
+		doc = frappe.new_doc("Loan Security Shortfall")
+		doc.update(shortfall)
+		doc.update(
+			{
+				"loan": loan.name,
+				"applicant_type": loan.applicant_type,
+				"applicant": loan.applicant,
+				"status": "Pending",
+				"shortfall_time": shortfall_time,
+				"process_loan_security_shortfall": process_loan_security_shortfall,
+				"owner": user,
+				"modified_by": user,
+				"creation": timestamp,
+				"modified": timestamp,
+			}
+		)
+		docs.append(doc)
+
+	set_names_in_bulk(docs)
+	insert_docs_in_bulk(docs)
 
 
 def get_ltv_ratio(loan_security):
@@ -186,10 +394,17 @@ def get_ltv_ratio(loan_security):
 	return ltv_ratio
 
 
-def update_pending_shortfall(shortfall):
-	# Get all pending loan security shortfall
-	frappe.db.set_value(
-		"Loan Security Shortfall",
-		shortfall,
-		{"status": "Completed", "shortfall_amount": 0, "shortfall_percentage": 0},
-	)
+def update_pending_shortfall(shortfalls):
+	if not shortfalls:
+		return
+
+	LoanSecurityShortfall = DocType("Loan Security Shortfall")
+	(
+		frappe.qb.update(LoanSecurityShortfall)
+		.set(LoanSecurityShortfall.status, "Completed")
+		.set(LoanSecurityShortfall.shortfall_amount, 0)
+		.set(LoanSecurityShortfall.shortfall_percentage, 0)
+		.set(LoanSecurityShortfall.modified, now_datetime())
+		.set(LoanSecurityShortfall.modified_by, frappe.session.user)
+		.where(LoanSecurityShortfall.name.isin(shortfalls))
+	).run()
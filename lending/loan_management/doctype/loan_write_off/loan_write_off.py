@@ -6,7 +6,7 @@ import frappe
 from frappe import _
 from frappe.query_builder import DocType
 from frappe.query_builder import functions as fn
-from frappe.utils import cint, flt, getdate
+from frappe.utils import flt, getdate
 
 import erpnext
 
@@ -14,6 +14,7 @@ from lending.loan_management.controllers.loan_controller import LoanController
 from lending.loan_management.doctype.loan_repayment.loan_repayment import (
 	get_pending_principal_amount,
 )
+from lending.loan_management.lending_config import get_currency_precision, get_lending_config
 from lending.loan_management.utils import loan_accounting_enabled
 
 
@@ -61,7 +62,7 @@ class LoanWriteOff(LoanController):
 			self.value_date = self.posting_date
 
 	def validate_write_off_amount(self):
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		loan_details = frappe.db.get_value(
 			"Loan",
@@ -136,7 +137,7 @@ class LoanWriteOff(LoanController):
 		unbooked_interest = get_unbooked_interest(
 			self.loan, self.value_date, last_demand_date=last_demand_date
 		)
-		precision = cint(frappe.db.get_default("currency_precision")) or 2
+		precision = get_currency_precision()
 
 		if flt(unbooked_interest) > 0:
 			create_loan_demand(
@@ -266,7 +267,7 @@ class LoanWriteOff(LoanController):
 		if not cancel:
 			pending_principal_amount = get_pending_principal_amount(loan)
 
-			precision = cint(frappe.db.get_default("currency_precision")) or 2
+			precision = get_currency_precision()
 
 			if flt(pending_principal_amount, precision) <= 0:
 				frappe.db.set_value("Loan", loan.name, "status", "Closed")
@@ -281,7 +282,7 @@ def make_loan_waivers(loan, posting_date):
 		create_loan_repayment,
 	)
 
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 
 	amounts = calculate_amounts(loan, posting_date, for_update=True)
 	if amounts.get("penalty_amount") > 0:
@@ -338,22 +339,7 @@ def write_off_suspense_entries(
 	if is_settled and not on_payment_allocation:
 		is_write_off = 1
 
-	accounts = frappe.db.get_value(
-		"Loan Product",
-		loan_product,
-		[
-			"suspense_interest_income",
-			"penalty_suspense_account",
-			"interest_waiver_account",
-			"penalty_waiver_account",
-			"interest_income_account",
-			"penalty_income_account",
-			"additional_interest_suspense",
-			"additional_interest_income",
-			"additional_interest_waiver",
-		],
-		as_dict=1,
-	)
+	accounts = get_lending_config().get_loan_product(loan_product)
 
 	GL = DocType("GL Entry")
 
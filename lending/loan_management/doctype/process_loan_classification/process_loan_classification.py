@@ -6,6 +6,11 @@ from frappe import _
 from frappe.model.document import Document
 from frappe.utils import add_days, getdate
 
+from lending.loan_management.doctype.loan_demand.utils import process_loans_with_prefetched_demands
+from lending.loan_management.doctype.loan_position_snapshot.loan_position_snapshot import (
+	make_loan_position_snapshot_batch,
+)
+
 
 class ProcessLoanClassification(Document):
 	# begin: auto-generated types
@@ -18,6 +23,7 @@ class ProcessLoanClassification(Document):
 
 		amended_from: DF.Link | None
 		force_update_dpd_in_loan: DF.Check
+		incremental: DF.Check
 		is_backdated: DF.Check
 		loan: DF.Link | None
 		loan_disbursement: DF.Link | None
@@ -73,6 +79,8 @@ class ProcessLoanClassification(Document):
 					payment_reference=self.payment_reference,
 					is_backdated=self.is_backdated,
 					force_update_dpd_in_loan=self.force_update_dpd_in_loan,
+					incremental=self.incremental,
+					make_snapshots=getdate(self.posting_date) == add_days(getdate(), -1),
 					queue="long",
 					enqueue_after_commit=True,
 				)
@@ -87,35 +95,55 @@ def process_loan_classification_batch(
 	payment_reference,
 	is_backdated,
 	force_update_dpd_in_loan=False,
+	incremental=False,
+	make_snapshots=False,
 ):
-	from lending.loan_management.doctype.loan.loan import update_days_past_due_in_loans
+	from lending.loan_management.doctype.loan.loan import (
+		update_days_past_due_in_bulk,
+		update_days_past_due_in_loans,
+	)
+
+	batch_loans = open_loans
 
-	for loan in open_loans:
+	if incremental and len(open_loans) > 1 and not payment_reference and not is_backdated:
 		try:
-			update_days_past_due_in_loans(
-				loan_name=loan,
-				posting_date=posting_date,
+			open_loans = update_days_past_due_in_bulk(
+				open_loans,
+				posting_date,
 				loan_product=loan_product,
 				process_loan_classification=classification_process,
 				loan_disbursement=loan_disbursement,
-				ignore_freeze=True if payment_reference else False,
-				is_backdated=is_backdated,
 				force_update_dpd_in_loan=force_update_dpd_in_loan,
 			)
+			frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(
+				title="Incremental Loan Classification Error", message=frappe.get_traceback()
+			)
 
-			if len(open_loans) > 1:
-				frappe.db.commit()
-		except Exception as e:
-			if len(open_loans) == 1:
-				raise e
-			else:
-				frappe.log_error(
-					title="Process Loan Classification Error",
-					message=frappe.get_traceback(),
-					reference_doctype="Loan",
-					reference_name=loan,
-				)
-				frappe.db.rollback()
+	def classify_loan(loan):
+		update_days_past_due_in_loans(
+			loan_name=loan,
+			posting_date=posting_date,
+			loan_product=loan_product,
+			process_loan_classification=classification_process,
+			loan_disbursement=loan_disbursement,
+			ignore_freeze=True if payment_reference else False,
+			is_backdated=is_backdated,
+			force_update_dpd_in_loan=force_update_dpd_in_loan,
+		)
+
+	if len(open_loans) == 1:
+		classify_loan(open_loans[0])
+	else:
+		process_loans_with_prefetched_demands(
+			open_loans, classify_loan, "Process Loan Classification Error"
+		)
+
+	# The daily run snapshots the loans of the batch once they are classified
+	if make_snapshots:
+		make_loan_position_snapshot_batch(batch_loans, posting_date)
 
 
 def get_batches(open_loans, batch_size):
@@ -131,6 +159,7 @@ def create_process_loan_classification(
 	payment_reference=None,
 	is_backdated=0,
 	force_update_dpd_in_loan=0,
+	incremental=0,
 ):
 	posting_date = posting_date or add_days(getdate(), -1)
 	process_loan_classification = frappe.new_doc("Process Loan Classification")
@@ -141,4 +170,5 @@ def create_process_loan_classification(
 	process_loan_classification.payment_reference = payment_reference
 	process_loan_classification.is_backdated = is_backdated
 	process_loan_classification.force_update_dpd_in_loan = force_update_dpd_in_loan
+	process_loan_classification.incremental = incremental
 	process_loan_classification.submit()
@@ -31,6 +31,19 @@ frappe.ui.form.on('Process Loan Interest Accrual', {
 	onload: function (frm) {
 		set_loan_filters(frm, active_loan_filters)
 	},
+	refresh: function (frm) {
+		if (frm.doc.docstatus == 1 && frm.doc.status && frm.doc.status != "Completed") {
+			frm.add_custom_button(__("Resume"), function () {
+				frappe.call({
+					"method": "resume",
+					"doc": frm.doc,
+					callback: function () {
+						frm.reload_doc();
+					}
+				});
+			});
+		}
+	},
 	loan_product: function (frm) {
 		if (frm.doc.loan_product) {
 			active_loan_filters["loan_product"] = frm.doc.loan_product
@@ -4,13 +4,22 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import add_days, nowdate
+from frappe.query_builder import DocType
+from frappe.utils import add_days, cint, now_datetime, nowdate, time_diff_in_seconds
+from frappe.utils.background_jobs import is_job_enqueued
 
 from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
 	get_loan_accrual_frequency,
+	get_open_loans_for_accrual,
 	is_posting_date_accrual_day,
 	make_accrual_interest_entry_for_loans,
+	process_interest_accrual_batch,
 )
+from lending.loan_management.doctype.loan_interest_accrual.utils import (
+	post_summarized_accrual_entries,
+)
+
+DEFAULT_SHARD_SIZE = 3000
 
 
 class ProcessLoanInterestAccrual(Document):
@@ -22,15 +31,24 @@ class ProcessLoanInterestAccrual(Document):
 	if TYPE_CHECKING:
 		from frappe.types import DF
 
+		from lending.loan_management.doctype.loan_interest_accrual_shard.loan_interest_accrual_shard import (
+			LoanInterestAccrualShard,
+		)
+
 		accrual_type: DF.Literal[
 			"Regular", "Repayment", "Disbursement", "Credit Adjustment", "Debit Adjustment", "Refund"
 		]
 		amended_from: DF.Link | None
 		company: DF.Link | None
+		from_demand: DF.Check
 		loan: DF.Link | None
 		loan_disbursement: DF.Link | None
 		loan_product: DF.Link | None
+		max_parallel_shards: DF.Int
 		posting_date: DF.Date
+		shard_size: DF.Int
+		shards: DF.Table[LoanInterestAccrualShard]
+		status: DF.Literal["", "Queued", "In Progress", "Completed", "Partially Failed"]
 	# end: auto-generated types
 
 	def on_submit(self):
@@ -42,10 +60,229 @@ class ProcessLoanInterestAccrual(Document):
 			accrual_type=self.accrual_type,
 			accrual_date=self.posting_date,
 			company=self.company,
-			from_demand=self.flags.from_demand,
+			from_demand=self.from_demand,
 			loan_disbursement=self.loan_disbursement,
 		)
 
+	@frappe.whitelist()
+	def resume(self):
+		frappe.has_permission(self.doctype, "write", doc=self, throw=True)
+		resume_accrual_shards(self.name)
+
+
+def enqueue_accrual_shards(process_loan_interest, open_loans, bulk=False):
+	"""Split the loans into shards of `shard_size` loans, record them on the process
+	document and enqueue them, at most `max_parallel_shards` at a time.
+
+	Loans are sorted by name and cut into contiguous ranges, so a loan is in exactly one
+	shard and a shard is only ever queued once.
+	"""
+	process = frappe.get_doc("Process Loan Interest Accrual", process_loan_interest)
+	shard_size = cint(process.shard_size) or DEFAULT_SHARD_SIZE
+	loans = sorted({loan.name for loan in open_loans})
+
+	for shard, start in enumerate(range(0, len(loans), shard_size), start=1):
+		shard_loans = loans[start : start + shard_size]
+		process.append(
+			"shards",
+			{
+				"shard": shard,
+				"status": "Pending",
+				"docstatus": process.docstatus,
+				"loan_count": len(shard_loans),
+				"loans": "\n".join(shard_loans),
+			},
+		).db_insert()
+
+	process.db_set("status", "Queued" if process.shards else "Completed")
+	enqueue_pending_shards(process.name, bulk=bulk)
+
+
+def enqueue_pending_shards(process_loan_interest, bulk=False):
+	max_parallel_shards = cint(
+		frappe.db.get_value(
+			"Process Loan Interest Accrual", process_loan_interest, "max_parallel_shards"
+		)
+	)
+
+	LoanInterestAccrualShard = DocType("Loan Interest Accrual Shard")
+	shards = (
+		frappe.qb.from_(LoanInterestAccrualShard)
+		.select(LoanInterestAccrualShard.name, LoanInterestAccrualShard.status)
+		.where(
+			(LoanInterestAccrualShard.parent == process_loan_interest)
+			& (LoanInterestAccrualShard.status.isin(["Pending", "Queued", "In Progress"]))
+		)
+		.orderby(LoanInterestAccrualShard.idx)
+		.for_update()
+		.run(as_dict=True)
+	)
+
+	pending_shards = [shard.name for shard in shards if shard.status == "Pending"]
+
+	if max_parallel_shards:
+		running_shards = len(shards) - len(pending_shards)
+		pending_shards = pending_shards[: max(max_parallel_shards - running_shards, 0)]
+
+	for shard in pending_shards:
+		frappe.db.set_value(
+			"Loan Interest Accrual Shard", shard, "status", "Queued", update_modified=False
+		)
+		frappe.enqueue(
+			process_accrual_shard,
+			process_loan_interest=process_loan_interest,
+			shard=shard,
+			bulk=bulk,
+			queue="long",
+			job_id=get_shard_job_id(shard),
+			deduplicate=True,
+			enqueue_after_commit=True,
+		)
+
+
+def process_accrual_shard(process_loan_interest, shard, bulk=False):
+	"""Run one shard and record its status, timings and failed loans.
+
+	A shard that is run again only processes the loans that failed the last time.
+	"""
+	started_on = now_datetime()
+	shard_details = frappe.db.get_value(
+		"Loan Interest Accrual Shard", shard, ["loans", "failed_loans"], as_dict=1
+	)
+	loans = [loan for loan in (shard_details.failed_loans or shard_details.loans or "").split("\n") if loan]
+
+	frappe.db.set_value(
+		"Loan Interest Accrual Shard",
+		shard,
+		{"status": "In Progress", "started_on": started_on, "completed_on": None, "duration": 0},
+		update_modified=False,
+	)
+	update_process_status(process_loan_interest)
+	frappe.db.commit()
+
+	process = frappe.db.get_value(
+		"Process Loan Interest Accrual",
+		process_loan_interest,
+		["posting_date", "accrual_type", "loan_disbursement", "from_demand"],
+		as_dict=1,
+	)
+
+	try:
+		failed_loans = process_interest_accrual_batch(
+			get_open_loans_for_accrual(loans=loans),
+			process.posting_date,
+			process_loan_interest,
+			process.accrual_type,
+			process.posting_date,
+			from_demand=process.from_demand,
+			loan_disbursement=process.loan_disbursement,
+			bulk=bulk,
+		)
+		status = "Partially Failed" if failed_loans else "Completed"
+	except Exception:
+		frappe.db.rollback()
+		frappe.log_error(
+			title="Loan Interest Accrual Shard Error",
+			message=frappe.get_traceback(),
+			reference_doctype="Process Loan Interest Accrual",
+			reference_name=process_loan_interest,
+		)
+		failed_loans = loans
+		status = "Failed"
+
+	completed_on = now_datetime()
+	frappe.db.set_value(
+		"Loan Interest Accrual Shard",
+		shard,
+		{
+			"status": status,
+			"failed_count": len(failed_loans),
+			"failed_loans": "\n".join(failed_loans),
+			"completed_on": completed_on,
+			"duration": time_diff_in_seconds(completed_on, started_on),
+		},
+		update_modified=False,
+	)
+	frappe.db.commit()
+
+	update_process_status(process_loan_interest)
+	enqueue_pending_shards(process_loan_interest, bulk=bulk)
+	frappe.db.commit()
+
+
+def update_process_status(process_loan_interest):
+	# Lock the process so that shards finishing together do not both read stale statuses
+	ProcessLoanInterestAccrual = DocType("Process Loan Interest Accrual")
+	(
+		frappe.qb.from_(ProcessLoanInterestAccrual)
+		.select(ProcessLoanInterestAccrual.name)
+		.where(ProcessLoanInterestAccrual.name == process_loan_interest)
+		.for_update()
+		.run()
+	)
+
+	statuses = set(
+		frappe.get_all(
+			"Loan Interest Accrual Shard",
+			filters={"parent": process_loan_interest, "parenttype": "Process Loan Interest Accrual"},
+			pluck="status",
+		)
+	)
+
+	if statuses & {"Pending", "Queued", "In Progress"}:
+		status = "In Progress" if statuses - {"Pending", "Queued"} else "Queued"
+	elif statuses & {"Partially Failed", "Failed"}:
+		status = "Partially Failed"
+	else:
+		status = "Completed"
+
+	frappe.db.set_value(
+		"Process Loan Interest Accrual", process_loan_interest, "status", status, update_modified=False
+	)
+
+	if status not in ("Completed", "Partially Failed"):
+		return
+
+	if frappe.db.exists("Company", {"summarize_accrual_gl_entries": 1}):
+		frappe.enqueue(
+			post_summarized_accrual_entries,
+			queue="long",
+			job_id="post_summarized_accrual_entries",
+			deduplicate=True,
+			enqueue_after_commit=True,
+		)
+
+
+def resume_accrual_shards(process_loan_interest):
+	"""Queue the failed shards again, along with shards whose job was lost, for the
+	loans that failed or were not processed.
+	"""
+	for shard in frappe.get_all(
+		"Loan Interest Accrual Shard",
+		filters={
+			"parent": process_loan_interest,
+			"parenttype": "Process Loan Interest Accrual",
+			"status": ("!=", "Completed"),
+		},
+		fields=["name", "status"],
+	):
+		if shard.status in ("Queued", "In Progress") and is_job_enqueued(get_shard_job_id(shard.name)):
+			continue
+
+		frappe.db.set_value(
+			"Loan Interest Accrual Shard", shard.name, "status", "Pending", update_modified=False
+		)
+
+	company = frappe.db.get_value("Process Loan Interest Accrual", process_loan_interest, "company")
+	bulk = bool(company and frappe.get_cached_value("Company", company, "enable_bulk_interest_accrual"))
+
+	update_process_status(process_loan_interest)
+	enqueue_pending_shards(process_loan_interest, bulk=bulk)
+
+
+def get_shard_job_id(shard):
+	return f"process_loan_interest_accrual_shard::{shard}"
+
 
 def schedule_accrual():
 	for company in frappe.get_all("Company", {"is_group": 0}, pluck="name"):
@@ -72,7 +309,7 @@ def process_loan_interest_accrual_for_loans(
 	loan_process.loan_disbursement = loan_disbursement
 	loan_process.accrual_type = accrual_type
 	loan_process.company = company
-	loan_process.flags.from_demand = from_demand
+	loan_process.from_demand = from_demand
 	loan_process.submit()
 
 	return loan_process.name
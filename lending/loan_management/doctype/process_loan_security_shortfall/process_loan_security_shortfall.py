@@ -28,13 +28,14 @@ class ProcessLoanSecurityShortfall(Document):
 		self.set_onload("update_time", get_datetime())
 
 	def on_submit(self):
-		check_for_ltv_shortfall(self.name)
+		check_for_ltv_shortfall(self.name, loan_securities=self.flags.loan_securities)
 
 
-def create_process_loan_security_shortfall():
+def create_process_loan_security_shortfall(loan_securities=None):
 	if check_for_secured_loans():
 		process = frappe.new_doc("Process Loan Security Shortfall")
 		process.update_time = get_datetime()
+		process.flags.loan_securities = loan_securities
 		process.submit()
 
 
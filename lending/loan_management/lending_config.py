@@ -0,0 +1,122 @@
+from dataclasses import dataclass, fields
+
+import frappe
+from frappe.utils import cint
+
+
+@dataclass(frozen=True)
+class CompanyConfig:
+	name: str | None = None
+	modified: object = None
+	loan_accrual_frequency: str | None = None
+	interest_day_count_convention: str | None = None
+	aggregate_penal_interest_entries: int = 0
+	summarize_accrual_gl_entries: int = 0
+	collection_offset_sequence_for_standard_asset: str | None = None
+	collection_offset_sequence_for_sub_standard_asset: str | None = None
+	collection_offset_sequence_for_written_off_asset: str | None = None
+	collection_offset_sequence_for_settlement_collection: str | None = None
+
+
+@dataclass(frozen=True)
+class LoanProductConfig:
+	name: str | None = None
+	modified: object = None
+	grace_period_in_days: int = 0
+	penalty_interest_rate: float = 0
+	bpi_recovery_method: str | None = None
+	collection_offset_sequence_for_standard_asset: str | None = None
+	collection_offset_sequence_for_sub_standard_asset: str | None = None
+	collection_offset_sequence_for_written_off_asset: str | None = None
+	collection_offset_sequence_for_settlement_collection: str | None = None
+	broken_period_interest_recovery_account: str | None = None
+	interest_income_account: str | None = None
+	interest_receivable_account: str | None = None
+	interest_waiver_account: str | None = None
+	suspense_interest_income: str | None = None
+	penalty_income_account: str | None = None
+	penalty_receivable_account: str | None = None
+	penalty_waiver_account: str | None = None
+	penalty_suspense_account: str | None = None
+	additional_interest_income: str | None = None
+	additional_interest_receivable: str | None = None
+	additional_interest_waiver: str | None = None
+	additional_interest_suspense: str | None = None
+
+
+CONFIG_CLASSES = {
+	"Company": CompanyConfig,
+	"Loan Product": LoanProductConfig,
+}
+
+# Settings loaded in this process, by site, doctype and name. A worker can serve more than
+# one site. An entry is used as long as the document has not been modified since.
+_settings_cache = {}
+
+
+class LendingConfig:
+	"""Company and Loan Product settings read on the hot paths of loan processing.
+
+	One snapshot is built per job or request and kept in `frappe.flags`. Each company and
+	loan product is looked up at most once per snapshot, and its settings are only read
+	again when its `modified` timestamp has changed.
+	"""
+
+	def __init__(self):
+		self.precision = cint(frappe.db.get_default("currency_precision")) or 2
+		self.settings = {}
+
+	def get_company(self, company) -> CompanyConfig:
+		return self.get_settings("Company", company)
+
+	def get_loan_product(self, loan_product) -> LoanProductConfig:
+		return self.get_settings("Loan Product", loan_product)
+
+	def get_offset_sequence(self, loan_product, company, offset_field):
+		return getattr(self.get_loan_product(loan_product), offset_field) or getattr(
+			self.get_company(company), offset_field
+		)
+
+	def get_settings(self, doctype, name):
+		if (doctype, name) not in self.settings:
+			self.settings[(doctype, name)] = load_settings(doctype, name)
+
+		return self.settings[(doctype, name)]
+
+
+def load_settings(doctype, name):
+	config_class = CONFIG_CLASSES[doctype]
+
+	if not name:
+		return config_class()
+
+	modified = frappe.db.get_value(doctype, name, "modified")
+	key = (frappe.local.site, doctype, name)
+	settings = _settings_cache.get(key)
+
+	if not settings or settings.modified != modified:
+		values = frappe.db.get_value(
+			doctype, name, [field.name for field in fields(config_class)], as_dict=1
+		)
+		settings = config_class(**values) if values else config_class(name=name)
+		_settings_cache[key] = settings
+
+	return settings
+
+
+def get_lending_config() -> LendingConfig:
+	if not frappe.flags.lending_config:
+		frappe.flags.lending_config = LendingConfig()
+
+	return frappe.flags.lending_config
+
+
+def get_currency_precision():
+	return get_lending_config().precision
+
+
+def clear_lending_config(doc=None, method=None):
+	frappe.flags.lending_config = None
+
+	if doc and doc.doctype in CONFIG_CLASSES:
+		_settings_cache.pop((frappe.local.site, doc.doctype, doc.name), None)
@@ -18,5 +18,10 @@ frappe.query_reports["ALM Audit Report"] = {
 			"reqd": 1,
 			"default": frappe.datetime.get_today()
 		},
+		{
+			"fieldname":"portfolio_totals",
+			"label": __("Portfolio Totals Only"),
+			"fieldtype": "Check",
+		},
 	]
 };
@@ -3,8 +3,23 @@
 
 import frappe
 from frappe import _
-from frappe.query_builder.functions import Sum
-from frappe.utils import date_diff, flt
+from frappe.query_builder import Case
+from frappe.query_builder.functions import Min, Sum
+from frappe.utils import add_days, flt, getdate
+
+OVERDUE_BUCKET = "Overdue"
+
+# Upper bound in days from the as on date, and the bucket of the payment dates up to it
+FUTURE_BUCKETS = (
+	(31, "1 day to 30/31 days (one month)"),
+	(60, "1 to 2 Months"),
+	(90, "Over 2 Months upto 3 Months"),
+	(180, "Over 3 Months to 6 Months"),
+	(365, "Over 6 Months to 1 Year"),
+	(1095, "1 to 3 Years"),
+	(1825, "3 to 5 Years"),
+	(100000, "Over 5 Years"),
+)
 
 
 def execute(filters=None):
@@ -62,38 +77,20 @@ def get_columns():
 	return columns
 
 
-def get_ageing_map():
-	ageing_map = {
-		"0-0": "Overdue",
-		"0-31": "1 day to 30/31 days (one month)",
-		"32-60": "1 to 2 Months",
-		"61-90": "Over 2 Months upto 3 Months",
-		"91-180": "Over 3 Months to 6 Months",
-		"181-365": "Over 6 Months to 1 Year",
-		"365-1095": "1 to 3 Years",
-		"1096-1825": "3 to 5 Years",
-		"1826-100000": "Over 5 Years",
-	}
-
-	return ageing_map
-
-
 def get_data(filters):
 	data = []
 
-	filter_obj = {
-		"status": ("!=", "Closed"),
-		"docstatus": 1,
-	}
-	if filters.get("company"):
-		filter_obj.update({"company": filters.get("company")})
-
 	demand_details = get_overdue_details(filters.get("as_on_date"), filters.get("company"))
 
 	future_details_map, loans, loan_product_map = get_future_interest_details(
 		filters.get("as_on_date"), filters.get("company")
 	)
 
+	if filters.get("portfolio_totals"):
+		return get_portfolio_totals(
+			[demand_details[loan] for loan in loans if loan in demand_details], future_details_map
+		)
+
 	for loan in loans:
 		amounts = demand_details.get(loan, {})
 		future_details = future_details_map.get(loan, {})
@@ -108,7 +105,7 @@ def get_data(filters):
 		if total_over_due > 0:
 			child_data = [
 				{
-					"ageing": "Overdue",
+					"ageing": OVERDUE_BUCKET,
 					"accrued_principal": amounts.get("total_pending_principal", 0),
 					"accrued_interest": amounts.get("total_pending_interest", 0),
 					"penalty_amount": amounts.get("total_pending_penalty", 0),
@@ -142,13 +139,59 @@ def get_data(filters):
 	return data
 
 
-def get_ageing_bucket(as_on_date, payment_date):
-	ageing_map = get_ageing_map()
-	ageing_days = date_diff(as_on_date, payment_date)
-	for key, value in ageing_map.items():
-		start, end = key.split("-")
-		if int(start) <= ageing_days <= int(end):
-			return value
+def get_portfolio_totals(demand_details, future_details_map):
+	"""Bucket wise totals of the whole portfolio, without a row per loan"""
+	totals = {}
+
+	def add(bucket, principal_amount, interest_amount, penalty_amount):
+		row = totals.setdefault(
+			bucket,
+			{
+				"ageing": bucket,
+				"accrued_principal": 0.0,
+				"accrued_interest": 0.0,
+				"penalty_amount": 0.0,
+				"total": 0.0,
+			},
+		)
+		row["accrued_principal"] += flt(principal_amount)
+		row["accrued_interest"] += flt(interest_amount)
+		row["penalty_amount"] += flt(penalty_amount)
+		row["total"] += flt(principal_amount) + flt(interest_amount) + flt(penalty_amount)
+
+	for amounts in demand_details:
+		add(
+			OVERDUE_BUCKET,
+			amounts["total_pending_principal"],
+			amounts["total_pending_interest"],
+			amounts["total_pending_penalty"],
+		)
+
+	for future_details in future_details_map.values():
+		for bucket, entry in future_details.items():
+			add(bucket, entry.principal_amount, entry.interest_amount, 0)
+
+	bucket_order = [OVERDUE_BUCKET] + [bucket for _days, bucket in FUTURE_BUCKETS]
+	return sorted(
+		totals.values(),
+		key=lambda row: bucket_order.index(row["ageing"])
+		if row["ageing"] in bucket_order
+		else len(bucket_order),
+	)
+
+
+def get_ageing_bucket_case(payment_date, as_on_date):
+	"""CASE expression that puts a future payment date in its ageing bucket.
+
+	The day boundaries are turned into dates once, so the database only compares dates.
+	"""
+	as_on_date = getdate(as_on_date)
+	case = Case()
+
+	for days, bucket in FUTURE_BUCKETS:
+		case = case.when(payment_date <= add_days(as_on_date, days), bucket)
+
+	return case
 
 
 def get_future_interest_details(as_on_date, company):
@@ -179,34 +222,41 @@ def get_future_interest_details(as_on_date, company):
 
 	repayment_schedules = [key for key, value in loan_repayment_schedules.items()]
 
-	future_emis = frappe.db.get_all(
-		"Repayment Schedule",
-		filters={
-			"parent": ("in", repayment_schedules),
-			"payment_date": (">", as_on_date),
-		},
-		fields=["parent", "payment_date", "interest_amount", "principal_amount"],
-		order_by="payment_date",
-	)
-
 	future_details = {}
+
+	if not repayment_schedules:
+		return future_details, loans, loan_product_map
+
+	# Bucketed and summed in the query, one row per schedule and bucket
+	repayment_schedule = frappe.qb.DocType("Repayment Schedule")
+	ageing_bucket = get_ageing_bucket_case(repayment_schedule.payment_date, as_on_date)
+
+	future_emis = (
+		frappe.qb.from_(repayment_schedule)
+		.select(
+			repayment_schedule.parent,
+			ageing_bucket.as_("ageing_bucket"),
+			Sum(repayment_schedule.interest_amount).as_("interest_amount"),
+			Sum(repayment_schedule.principal_amount).as_("principal_amount"),
+			Min(repayment_schedule.payment_date).as_("payment_date"),
+		)
+		.where(
+			(repayment_schedule.parent.isin(repayment_schedules))
+			& (repayment_schedule.payment_date > as_on_date)
+		)
+		.groupby(repayment_schedule.parent, ageing_bucket)
+		.orderby(Min(repayment_schedule.payment_date))
+	).run(as_dict=True)
+
 	for emi in future_emis:
 		loan = loan_repayment_schedules.get(emi.parent)
-		future_details.setdefault(loan, frappe._dict())
-		bucket_wise_details = future_details.get(loan)
-		age_bucket = get_ageing_bucket(emi.payment_date, as_on_date)
-		bucket_wise_details.setdefault(
-			age_bucket,
-			frappe._dict(
-				{
-					"interest_amount": 0.0,
-					"principal_amount": 0.0,
-				}
-			),
+		bucket_wise_details = future_details.setdefault(loan, frappe._dict())
+		bucket = bucket_wise_details.setdefault(
+			emi.ageing_bucket, frappe._dict({"interest_amount": 0.0, "principal_amount": 0.0})
 		)
 
-		bucket_wise_details[age_bucket]["interest_amount"] += emi.interest_amount
-		bucket_wise_details[age_bucket]["principal_amount"] += emi.principal_amount
+		bucket.interest_amount += flt(emi.interest_amount)
+		bucket.principal_amount += flt(emi.principal_amount)
 
 	return future_details, loans, loan_product_map
 
@@ -0,0 +1,113 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+from pypika.terms import ValueWrapper
+
+import frappe
+from frappe.tests import IntegrationTestCase
+from frappe.utils import add_days, date_diff, flt
+
+from lending.loan_management.doctype.process_loan_demand.process_loan_demand import (
+	process_daily_loan_demands,
+)
+from lending.loan_management.report.alm_audit_report.alm_audit_report import (
+	FUTURE_BUCKETS,
+	get_ageing_bucket_case,
+	get_data,
+)
+from lending.tests.test_utils import (
+	create_loan,
+	init_customers,
+	init_loan_products,
+	make_loan_disbursement_entry,
+	master_init,
+)
+
+# Day ranges the report used before the buckets moved into the query
+AGEING_RANGES = (
+	(0, 31, "1 day to 30/31 days (one month)"),
+	(32, 60, "1 to 2 Months"),
+	(61, 90, "Over 2 Months upto 3 Months"),
+	(91, 180, "Over 3 Months to 6 Months"),
+	(181, 365, "Over 6 Months to 1 Year"),
+	(365, 1095, "1 to 3 Years"),
+	(1096, 1825, "3 to 5 Years"),
+	(1826, 100000, "Over 5 Years"),
+)
+
+
+def get_expected_bucket(payment_date, as_on_date):
+	ageing_days = date_diff(payment_date, as_on_date)
+	for start, end, bucket in AGEING_RANGES:
+		if start <= ageing_days <= end:
+			return bucket
+
+
+class TestALMAuditReport(IntegrationTestCase):
+	def setUp(self):
+		master_init()
+		init_loan_products()
+		init_customers()
+
+	def test_ageing_bucket_edges(self):
+		as_on_date = "2024-12-05"
+
+		for days, _bucket in FUTURE_BUCKETS[:-1]:
+			for ageing_days in (days - 1, days, days + 1):
+				payment_date = add_days(as_on_date, ageing_days)
+				bucket = frappe.qb.select(
+					get_ageing_bucket_case(ValueWrapper(payment_date), as_on_date)
+				).run()[0][0]
+
+				self.assertEqual(
+					bucket, get_expected_bucket(payment_date, as_on_date), msg=f"{ageing_days} days"
+				)
+
+	def test_portfolio_totals_match_loan_rows(self):
+		applicant = frappe.db.get_value("Customer", {"name": "_Test Loan Customer"}, "name")
+
+		for loan_amount in (100000, 250000):
+			loan = create_loan(
+				applicant,
+				"Term Loan Product 4",
+				loan_amount,
+				"Repay Over Number of Periods",
+				72,
+				"Customer",
+				repayment_start_date="2024-11-05",
+				posting_date="2024-10-05",
+				rate_of_interest=12,
+			)
+			loan.submit()
+			make_loan_disbursement_entry(
+				loan.name,
+				loan.loan_amount,
+				disbursement_date="2024-10-05",
+				repayment_start_date="2024-11-05",
+			)
+			process_daily_loan_demands(posting_date="2024-12-05", loan=loan.name)
+
+		filters = frappe._dict({"company": "_Test Company", "as_on_date": "2024-12-05"})
+
+		expected = {}
+		for row in get_data(filters):
+			bucket = expected.setdefault(row["ageing"], [0.0, 0.0, 0.0, 0.0])
+			bucket[0] += flt(row["accrued_principal"])
+			bucket[1] += flt(row["accrued_interest"])
+			bucket[2] += flt(row["penalty_amount"])
+			bucket[3] += flt(row["total"])
+
+		totals = get_data(frappe._dict({**filters, "portfolio_totals": 1}))
+
+		self.assertIn("Overdue", expected)
+		self.assertIn("Over 5 Years", expected)
+		self.assertCountEqual([row["ageing"] for row in totals], list(expected))
+		for row in totals:
+			self.assertEqual(
+				[
+					flt(row[fieldname], 2)
+					for fieldname in ("accrued_principal", "accrued_interest", "penalty_amount", "total")
+				],
+				[flt(amount, 2) for amount in expected[row["ageing"]]],
+				msg=row["ageing"],
+			)
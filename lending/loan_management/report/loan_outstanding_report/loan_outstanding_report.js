@@ -116,5 +116,48 @@ frappe.query_reports["Loan Outstanding Report"] = {
 				};
 			},
 		},
+		{
+			"fieldname": "page_length",
+			"label": __("Rows Per Page"),
+			"fieldtype": "Select",
+			"options": ["", "500", "1000", "5000"],
+			"description": __("Leave empty to show all rows"),
+		},
+		{
+			"fieldname": "page",
+			"label": __("Page"),
+			"fieldtype": "Int",
+			"default": 1,
+			"depends_on": "eval:doc.page_length",
+		},
 	],
+	onload: function(report) {
+		report.page.add_inner_button(__("Export in Background"), function() {
+			frappe.prompt(
+				{
+					"fieldname": "file_format",
+					"label": __("File Format"),
+					"fieldtype": "Select",
+					"options": ["CSV", "Excel"],
+					"default": "CSV",
+					"reqd": 1
+				},
+				(values) => {
+					frappe.call({
+						method: "lending.loan_management.report.loan_outstanding_report.loan_outstanding_report.export_report",
+						args: {
+							filters: report.get_values(),
+							file_format: values.file_format,
+						},
+						callback: function(r) {
+							if (r.message) {
+								frappe.show_alert({ message: r.message, indicator: "blue" });
+							}
+						},
+					});
+				},
+				__("Export Loan Outstanding Report")
+			);
+		});
+	},
 };
@@ -1,30 +1,125 @@
+import csv
+
 import frappe
 from frappe import _
-from frappe.query_builder import DocType
+from frappe.query_builder import Case, DocType
 from frappe.query_builder import functions as fn
-from frappe.utils import flt
+from frappe.utils import cint, flt
+
+REPORT_NAME = "Loan Outstanding Report"
+
+# Disbursements loaded and summarised at a time
+REPORT_CHUNK_SIZE = 1000
+
+EXPORT_FORMATS = ("CSV", "Excel")
 
 
 def execute(filters=None):
+	filters = frappe._dict(filters or {})
+
 	columns = get_columns()
-	data = get_data(filters)
-	chart = get_chart_data(data)
+	page_length = cint(filters.page_length)
+	chart_totals = get_portfolio_totals(filters) if page_length else ChartTotals()
+	data = []
+
+	for row in iter_data(filters, page=cint(filters.page), page_length=page_length):
+		if not page_length:
+			chart_totals.add(row)
+		data.append(row)
+
+	return columns, data, None, get_chart_data(chart_totals)
+
+
+class ChartTotals:
+	"""Totals for the chart, added up row by row as the rows are streamed"""
+
+	def __init__(self):
+		self.total_principal_outstanding = 0
+		self.total_principal_overdue = 0
+		self.total_interest_overdue = 0
 
-	return columns, data, None, chart
+	def add(self, row):
+		self.total_principal_outstanding += row.get("pending_principal_amount", 0)
+		self.total_principal_overdue += row.get("principal_overdue", 0)
+		self.total_interest_overdue += row.get("interest_overdue", 0)
 
 
-def get_chart_data(data):
-	total_principal_outstanding = sum(row.get("pending_principal_amount", 0) for row in data)
-	total_principal_overdue = sum(row.get("principal_overdue", 0) for row in data)
-	total_interest_overdue = sum(row.get("interest_overdue", 0) for row in data)
+def get_portfolio_totals(filters):
+	"""Chart totals of every row of the report, added up in the database for when only a
+	page of the rows is loaded. Worked out the same way as the rows in `get_report_rows`."""
+	Loan = DocType("Loan")
+	LoanDisbursement = DocType("Loan Disbursement")
+	LoanDemand = DocType("Loan Demand")
+
+	pending_principal = (
+		Case()
+		.when(
+			Loan.repayment_schedule_type == "Line of Credit",
+			LoanDisbursement.disbursed_amount - LoanDisbursement.principal_amount_paid,
+		)
+		.when(
+			Loan.status.isin(["Disbursed", "Closed", "Active", "Written Off", "Settled"]),
+			Loan.total_payment
+			+ Loan.debit_adjustment_amount
+			- Loan.credit_adjustment_amount
+			- Loan.total_principal_paid
+			- Loan.total_interest_payable,
+		)
+		.else_(
+			Loan.disbursed_amount
+			+ Loan.debit_adjustment_amount
+			- Loan.credit_adjustment_amount
+			- Loan.total_principal_paid
+		)
+	)
+
+	chart_totals = ChartTotals()
+	chart_totals.total_principal_outstanding = flt(
+		get_loan_disbursement_query(filters, fields=[fn.Sum(pending_principal)]).run()[0][0]
+	)
 
+	overdue_query = (
+		get_loan_disbursement_query(
+			filters,
+			fields=[
+				fn.Sum(
+					Case()
+					.when(LoanDemand.demand_subtype == "Principal", LoanDemand.outstanding_amount)
+					.else_(0)
+				),
+				fn.Sum(
+					Case()
+					.when(LoanDemand.demand_subtype == "Interest", LoanDemand.outstanding_amount)
+					.else_(0)
+				),
+			],
+		)
+		.inner_join(LoanDemand)
+		.on(
+			(LoanDemand.loan_disbursement == LoanDisbursement.name) & (LoanDemand.loan == Loan.name)
+		)
+		.where(LoanDemand.docstatus == 1)
+	)
+
+	principal_overdue, interest_overdue = overdue_query.run()[0]
+	chart_totals.total_principal_overdue = flt(principal_overdue)
+	chart_totals.total_interest_overdue = flt(interest_overdue)
+
+	return chart_totals
+
+
+def get_chart_data(chart_totals):
 	chart = {
 		"data": {
 			"labels": ["Total Principal Outstanding", "Total Principal Overdue", "Total Interest Overdue"],
 			"datasets": [
 				{
 					"name": _("Amounts"),
-					"values": [total_principal_outstanding, total_principal_overdue, total_interest_overdue],
+					"values": [
+						chart_totals.total_principal_outstanding,
+						chart_totals.total_principal_overdue,
+						chart_totals.total_interest_overdue,
+					],
 				},
 			],
 		},
@@ -143,6 +238,43 @@ def get_columns():
 
 
 def get_data(filters):
+	return list(iter_data(filters))
+
+
+def iter_data(filters, page=0, page_length=0, chunk_size=REPORT_CHUNK_SIZE):
+	"""Yield the report rows, loading and summarising the disbursements a chunk at a time.
+
+	The disbursements are paged on their name so that every chunk is an index range scan.
+	With `page_length`, only the rows of that page (starting at 1) are yielded.
+	"""
+	LoanDisbursement = DocType("Loan Disbursement")
+	loan_disbursement_query = get_loan_disbursement_query(filters).orderby(LoanDisbursement.name)
+
+	if page_length:
+		page_query = loan_disbursement_query.limit(page_length).offset(
+			(max(page, 1) - 1) * page_length
+		)
+		yield from get_report_rows(page_query.run(as_dict=True))
+		return
+
+	last_disbursement = None
+
+	while True:
+		chunk_query = loan_disbursement_query.limit(chunk_size)
+		if last_disbursement:
+			chunk_query = chunk_query.where(LoanDisbursement.name > last_disbursement)
+
+		disbursement_records = chunk_query.run(as_dict=True)
+
+		yield from get_report_rows(disbursement_records)
+
+		if len(disbursement_records) < chunk_size:
+			return
+
+		last_disbursement = disbursement_records[-1]["loan_disbursement"]
+
+
+def get_loan_disbursement_query(filters, fields=None):
 	Loan = DocType("Loan")
 	LoanDisbursement = DocType("Loan Disbursement")
 
@@ -150,27 +282,7 @@ def get_data(filters):
 		frappe.qb.from_(LoanDisbursement)
 		.inner_join(Loan)
 		.on(Loan.name == LoanDisbursement.against_loan)
-		.select(
-			LoanDisbursement.name.as_("loan_disbursement"),
-			LoanDisbursement.disbursement_date,
-			LoanDisbursement.disbursed_amount,
-			LoanDisbursement.principal_amount_paid.as_("disbursement_principal_paid"),
-			Loan.name.as_("loan"),
-			Loan.applicant,
-			Loan.loan_product,
-			Loan.posting_date,
-			Loan.loan_amount,
-			Loan.status,
-			Loan.rate_of_interest,
-			Loan.repayment_schedule_type,
-			Loan.days_past_due,
-			Loan.total_payment,
-			Loan.debit_adjustment_amount,
-			Loan.credit_adjustment_amount,
-			Loan.total_principal_paid,
-			Loan.total_interest_payable,
-			Loan.disbursed_amount.as_("loan_disbursed_amount"),
-		)
+		.select(*(fields or get_loan_disbursement_fields(Loan, LoanDisbursement)))
 		.where((Loan.docstatus == 1) & (Loan.status != "Closed"))
 	)
 
@@ -193,7 +305,34 @@ def get_data(filters):
 			LoanDisbursement.name == filters["loan_disbursement"]
 		)
 
-	disbursement_records = loan_disbursement_query.run(as_dict=True)
+	return loan_disbursement_query
+
+
+def get_loan_disbursement_fields(Loan, LoanDisbursement):
+	return [
+		LoanDisbursement.name.as_("loan_disbursement"),
+		LoanDisbursement.disbursement_date,
+		LoanDisbursement.disbursed_amount,
+		LoanDisbursement.principal_amount_paid.as_("disbursement_principal_paid"),
+		Loan.name.as_("loan"),
+		Loan.applicant,
+		Loan.loan_product,
+		Loan.posting_date,
+		Loan.loan_amount,
+		Loan.status,
+		Loan.rate_of_interest,
+		Loan.repayment_schedule_type,
+		Loan.days_past_due,
+		Loan.total_payment,
+		Loan.debit_adjustment_amount,
+		Loan.credit_adjustment_amount,
+		Loan.total_principal_paid,
+		Loan.total_interest_payable,
+		Loan.disbursed_amount.as_("loan_disbursed_amount"),
+	]
+
+
+def get_report_rows(disbursement_records):
 	if not disbursement_records:
 		return []
 
@@ -255,6 +394,97 @@ def get_data(filters):
 	return report_rows
 
 
+@frappe.whitelist()
+def export_report(filters, file_format="CSV"):
+	"""Export the report in a background job, a chunk of rows at a time."""
+	if not frappe.get_cached_doc("Report", REPORT_NAME).is_permitted():
+		frappe.throw(_("Not permitted to export {0}").format(REPORT_NAME), frappe.PermissionError)
+
+	if file_format not in EXPORT_FORMATS:
+		frappe.throw(_("File format should be one of {0}").format(", ".join(EXPORT_FORMATS)))
+
+	filters = frappe._dict(frappe.parse_json(filters) or {})
+	filters.pop("page", None)
+	filters.pop("page_length", None)
+
+	frappe.enqueue(
+		make_report_export,
+		filters=filters,
+		file_format=file_format,
+		queue="long",
+		timeout=7200,
+	)
+
+	return _("The report is being exported, you will be notified once the file is ready")
+
+
+def make_report_export(filters, file_format):
+	columns = get_columns()
+	extension = "xlsx" if file_format == "Excel" else "csv"
+	file_name = "{0}-{1}.{2}".format(
+		frappe.scrub(REPORT_NAME), frappe.generate_hash(length=8), extension
+	)
+	file_path = frappe.get_site_path("private", "files", file_name)
+
+	try:
+		if file_format == "Excel":
+			write_xlsx_export(file_path, columns, filters)
+		else:
+			write_csv_export(file_path, columns, filters)
+
+		file = frappe.get_doc(
+			{
+				"doctype": "File",
+				"file_name": file_name,
+				"file_url": "/private/files/" + file_name,
+				"is_private": 1,
+			}
+		).insert(ignore_permissions=True)
+		frappe.db.commit()
+	except Exception:
+		frappe.db.rollback()
+		frappe.log_error(title=f"{REPORT_NAME} Export Error", message=frappe.get_traceback())
+		frappe.publish_realtime(
+			"msgprint", _("Export of {0} failed").format(REPORT_NAME), user=frappe.session.user
+		)
+		return
+
+	frappe.publish_realtime(
+		"msgprint",
+		_("{0} is ready: {1}").format(
+			REPORT_NAME, f'<a href="{file.file_url}" target="_blank">{file.file_name}</a>'
+		),
+		user=frappe.session.user,
+	)
+
+
+def get_export_row(columns, row):
+	return [row.get(column["fieldname"]) for column in columns]
+
+
+def write_csv_export(file_path, columns, filters):
+	with open(file_path, "w", newline="", encoding="utf-8") as f:
+		writer = csv.writer(f)
+		writer.writerow([column["label"] for column in columns])
+
+		for row in iter_data(filters):
+			writer.writerow(get_export_row(columns, row))
+
+
+def write_xlsx_export(file_path, columns, filters):
+	from openpyxl import Workbook
+
+	# A write only workbook streams the rows to the file instead of holding them
+	workbook = Workbook(write_only=True)
+	worksheet = workbook.create_sheet(REPORT_NAME[:31])
+	worksheet.append([column["label"] for column in columns])
+
+	for row in iter_data(filters):
+		worksheet.append(get_export_row(columns, row))
+
+	workbook.save(file_path)
+
+
 def get_bulk_repayment_details(loan_disbursement_keys, repayment_type_by_loan):
 	Repayment = DocType("Loan Repayment")
 	loans = list({loan for loan, _ in loan_disbursement_keys})
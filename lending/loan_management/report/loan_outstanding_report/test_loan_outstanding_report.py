@@ -0,0 +1,108 @@
+# Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import csv
+import os
+
+import frappe
+from frappe.tests import IntegrationTestCase
+from frappe.utils import flt
+
+from lending.loan_management.doctype.process_loan_demand.process_loan_demand import (
+	process_daily_loan_demands,
+)
+from lending.loan_management.report.loan_outstanding_report.loan_outstanding_report import (
+	execute,
+	get_columns,
+	get_data,
+	iter_data,
+	write_csv_export,
+)
+from lending.tests.test_utils import (
+	create_loan,
+	init_customers,
+	init_loan_products,
+	make_loan_disbursement_entry,
+	master_init,
+)
+
+
+class TestLoanOutstandingReport(IntegrationTestCase):
+	def setUp(self):
+		master_init()
+		init_loan_products()
+		init_customers()
+		self.applicant = frappe.db.get_value("Customer", {"name": "_Test Loan Customer"}, "name")
+
+		for loan_amount in (100000, 200000, 300000):
+			loan = create_loan(
+				self.applicant,
+				"Term Loan Product 4",
+				loan_amount,
+				"Repay Over Number of Periods",
+				12,
+				"Customer",
+				repayment_start_date="2024-11-05",
+				posting_date="2024-10-05",
+				rate_of_interest=12,
+			)
+			loan.submit()
+			make_loan_disbursement_entry(
+				loan.name,
+				loan.loan_amount,
+				disbursement_date="2024-10-05",
+				repayment_start_date="2024-11-05",
+			)
+			process_daily_loan_demands(posting_date="2024-12-05", loan=loan.name)
+
+		self.filters = frappe._dict(
+			{"company": "_Test Company", "applicant_type": "Customer", "applicant": self.applicant}
+		)
+
+	def test_chunks_and_pages_match_full_data(self):
+		data = get_data(self.filters)
+		self.assertGreaterEqual(len(data), 3)
+
+		# Chunk sizes on, around and past the number of rows
+		for chunk_size in (1, 2, len(data) - 1, len(data), len(data) + 1):
+			self.assertEqual(list(iter_data(self.filters, chunk_size=chunk_size)), data)
+
+		pages = []
+		page = 1
+		while True:
+			rows = list(iter_data(self.filters, page=page, page_length=2))
+			if not rows:
+				break
+
+			pages.extend(rows)
+			page += 1
+
+		self.assertEqual(pages, data)
+
+	def test_paged_chart_shows_portfolio_totals(self):
+		data = get_data(self.filters)
+		chart = execute({**self.filters, "page": 1, "page_length": 1})[3]
+
+		self.assertEqual(
+			[flt(value, 2) for value in chart["data"]["datasets"][0]["values"]],
+			[
+				flt(sum(row["pending_principal_amount"] for row in data), 2),
+				flt(sum(row["principal_overdue"] for row in data), 2),
+				flt(sum(row["interest_overdue"] for row in data), 2),
+			],
+		)
+
+	def test_csv_export_matches_report(self):
+		columns = get_columns()
+		file_path = frappe.get_site_path("private", "files", "test-loan-outstanding-report.csv")
+		self.addCleanup(os.remove, file_path)
+
+		write_csv_export(file_path, columns, self.filters)
+
+		with open(file_path, newline="", encoding="utf-8") as f:
+			rows = list(csv.reader(f))
+
+		self.assertEqual(rows[0], [column["label"] for column in columns])
+		self.assertEqual(
+			[row[0] for row in rows[1:]], [row["loan"] for row in get_data(self.filters)]
+		)
@@ -2,13 +2,15 @@ import json
 
 import frappe
 from frappe import _
-from frappe.utils import cint, flt
+from frappe.utils import flt
 
 from erpnext.accounts.general_ledger import make_gl_entries
 
+from lending.loan_management.doctype.loan_demand.utils import invalidate_unpaid_demands
 from lending.loan_management.doctype.loan_interest_accrual.loan_interest_accrual import (
 	create_loan_demand,
 )
+from lending.loan_management.lending_config import get_currency_precision
 from lending.loan_management.utils import loan_accounting_enabled
 
 
@@ -44,7 +46,7 @@ def update_waived_amount_in_demand(self, method=None):
 	if loan_status not in ["Active", "Disbursed"]:
 		return
 
-	precision = cint(frappe.db.get_default("currency_precision")) or 2
+	precision = get_currency_precision()
 
 	if self.get("is_return") and not self.get("loan_repayment"):
 		for item in self.get("items"):
@@ -88,6 +90,8 @@ def update_waived_amount_in_demand(self, method=None):
 					loan_demand.name == demand_details.name
 				).run()
 
+				invalidate_unpaid_demands([self.loan])
+
 
 def make_partner_charge_gl_entries(doc, method):
 	if doc.get("loan_partner"):
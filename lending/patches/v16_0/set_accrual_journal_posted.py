@@ -0,0 +1,20 @@
+import frappe
+from frappe.query_builder import DocType
+
+
+def execute():
+	LoanInterestAccrual = DocType("Loan Interest Accrual")
+
+	(
+		frappe.qb.update(LoanInterestAccrual)
+		.set(LoanInterestAccrual.accrual_journal_posted, 1)
+		.where(LoanInterestAccrual.accrual_journal_entry.isnotnull())
+		.where(LoanInterestAccrual.accrual_journal_entry != "")
+	).run()
+
+	# Accruals that netted to zero were linked to a placeholder in place of a journal
+	(
+		frappe.qb.update(LoanInterestAccrual)
+		.set(LoanInterestAccrual.accrual_journal_entry, None)
+		.where(LoanInterestAccrual.accrual_journal_entry == "Netted Off")
+	).run()
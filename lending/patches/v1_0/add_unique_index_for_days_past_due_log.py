@@ -0,0 +1,36 @@
+import frappe
+from frappe.query_builder import DocType
+from frappe.query_builder.functions import Count
+
+
+def execute():
+	DaysPastDueLog = DocType("Days Past Due Log")
+
+	duplicates = (
+		frappe.qb.from_(DaysPastDueLog)
+		.select(DaysPastDueLog.loan, DaysPastDueLog.loan_disbursement, DaysPastDueLog.posting_date)
+		.where(DaysPastDueLog.loan_disbursement.isnotnull())
+		.groupby(DaysPastDueLog.loan, DaysPastDueLog.loan_disbursement, DaysPastDueLog.posting_date)
+		.having(Count(DaysPastDueLog.name) > 1)
+	).run(as_dict=True)
+
+	for row in duplicates:
+		# Keep the log that was written last
+		logs = frappe.get_all(
+			"Days Past Due Log",
+			filters={
+				"loan": row.loan,
+				"loan_disbursement": row.loan_disbursement,
+				"posting_date": row.posting_date,
+			},
+			pluck="name",
+			order_by="modified desc",
+		)
+
+		frappe.db.delete("Days Past Due Log", {"name": ("in", logs[1:])})
+
+	frappe.db.add_unique(
+		"Days Past Due Log",
+		["loan", "loan_disbursement", "posting_date"],
+		constraint_name="unique_loan_disbursement_posting_date",
+	)
@@ -0,0 +1,100 @@
+"""Times `get_days_past_due_series` against a day by day scan of the unpaid demands, the
+way Days Past Due Logs used to be reposted, on a synthetic long tenure loan.
+
+	bench --site <site> execute lending.tests.benchmark_days_past_due.execute --kwargs "{'years': 20}"
+"""
+
+import time
+
+import frappe
+from frappe.utils import add_days, date_diff, getdate
+
+from lending.loan_management.doctype.loan.loan import get_days_past_due_series
+from lending.utils import daterange
+
+START_DATE = "2005-01-05"
+
+
+def make_long_tenure_loan_events(years=20):
+	"""Monthly demands with irregular payments, every fifth month is left unpaid.
+
+	Returns the demands and the payments sorted by date, along with the last date.
+	"""
+	demands = []
+	payments = {}
+
+	for month in range(years * 12):
+		demand_date = add_days(START_DATE, 30 * month)
+		demands.append(
+			frappe._dict(demand_date=demand_date, demand_subtype="Interest", demand_amount=500 + month % 7)
+		)
+		demands.append(
+			frappe._dict(demand_date=demand_date, demand_subtype="Principal", demand_amount=1000)
+		)
+
+		if month % 5:
+			payments[add_days(demand_date, month % 45)] = frappe._dict(
+				value_date=add_days(demand_date, month % 45),
+				total_interest_paid=450 + month % 11 * 10,
+				total_principal_paid=1100 if month % 3 else 800,
+			)
+
+	payments = sorted(payments.values(), key=lambda payment: payment.value_date)
+
+	return demands, payments, add_days(START_DATE, 365 * years)
+
+
+def get_days_past_due_series_by_scan(demands, payments, to_date):
+	"""Allocates each payment across all the demands, then scans all of them again for
+	every day till the next payment.
+	"""
+	unpaid = {(demand.demand_date, demand.demand_subtype): demand.demand_amount for demand in demands}
+	demand_keys = sorted(unpaid)
+	series = []
+
+	for idx, payment in enumerate(payments):
+		for subtype, paid in (
+			("Interest", payment.total_interest_paid),
+			("Principal", payment.total_principal_paid),
+		):
+			for key in demand_keys:
+				if key[1] == subtype and key[0] <= payment.value_date and paid > 0:
+					allocated = min(paid, unpaid[key])
+					unpaid[key] -= allocated
+					paid -= allocated
+
+		end_date = payments[idx + 1].value_date if idx + 1 < len(payments) else to_date
+		for current_date in daterange(getdate(payment.value_date), getdate(end_date)):
+			due = [key[0] for key in demand_keys if key[0] <= current_date and unpaid[key] > 0]
+			series.append((current_date, date_diff(current_date, due[0]) + 1 if due else 0))
+
+	return series
+
+
+def execute(years=20, runs=3):
+	demands, payments, to_date = make_long_tenure_loan_events(years)
+	timings = {}
+	results = {}
+
+	for label, get_series in (
+		("Day by day scan", lambda d, p: get_days_past_due_series_by_scan(d, p, to_date)),
+		("Sweep", lambda d, p: get_days_past_due_series(d, p, START_DATE, to_date, 2)[0]),
+	):
+		timings[label] = []
+		for _run in range(runs):
+			# The sweep allocates payments on the demands it is given
+			run_demands = [frappe._dict(demand) for demand in demands]
+			run_payments = [frappe._dict(payment) for payment in payments]
+
+			started_on = time.perf_counter()
+			results[label] = get_series(run_demands, run_payments)
+			timings[label].append(time.perf_counter() - started_on)
+
+	if results["Sweep"] != results["Day by day scan"]:
+		frappe.throw("The sweep and the day by day scan give different DPD series")
+
+	print(f"{years} year loan, {len(demands)} demands, {len(payments)} payment dates")
+	for label, seconds in timings.items():
+		print(f"{label}: best of {runs} runs {min(seconds):.4f}s")
+
+	return {label: min(seconds) for label, seconds in timings.items()}
@@ -544,6 +544,40 @@ def make_loan_disbursement_entry(
 	return loan_disbursement_entry
 
 
+def create_disbursed_loan(
+	applicant,
+	loan_amount,
+	repayment_periods,
+	posting_date,
+	repayment_start_date,
+	loan_product="Term Loan Product 4",
+	rate_of_interest=None,
+	penalty_charges_rate=None,
+):
+	loan = create_loan(
+		applicant,
+		loan_product,
+		loan_amount,
+		"Repay Over Number of Periods",
+		repayment_periods,
+		applicant_type="Customer",
+		repayment_start_date=repayment_start_date,
+		posting_date=posting_date,
+		rate_of_interest=rate_of_interest,
+		penalty_charges_rate=penalty_charges_rate,
+	)
+	loan.submit()
+
+	disbursement = make_loan_disbursement_entry(
+		loan.name,
+		loan.loan_amount,
+		disbursement_date=posting_date,
+		repayment_start_date=repayment_start_date,
+	)
+
+	return loan, disbursement
+
+
 def create_loan_security_price(loan_security, loan_security_price, uom, from_date, to_date):
 	if not frappe.db.get_value(
 		"Loan Security Price",